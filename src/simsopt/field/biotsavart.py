@@ -15,9 +15,37 @@ class BiotSavart(sopp.BiotSavart, MagneticField):
 
     where :math:`\mu_0=4\pi 10^{-7}` is the magnetic constant.
 
+    For large numbers of evaluation points, ``B`` and ``dB_by_dX`` can be
+    computed using a treecode: the coil quadrature points are sorted into an
+    octree and clusters of points that are far away from a target (relative to
+    their size) are replaced by a multipole expansion up to second order. This
+    reduces the cost from :math:`O(N M)` to :math:`O(N \log M)` for :math:`N`
+    targets and :math:`M` quadrature points.
+
+    Args:
+        coils: a list of :obj:`~simsopt.geo.curve.Curve` objects.
+        coil_currents: a list of floats containing the currents in the coils.
+        treecode_theta: the opening angle of the treecode. A cluster of
+            radius :math:`r` at distance :math:`R` from the target is
+            approximated if :math:`r/R < \theta`. Smaller values are more
+            accurate (the relative error behaves like :math:`\theta^3`),
+            ``0`` disables the treecode.
+        treecode_threshold: the treecode is only used if the number of
+            evaluation points times the total number of coil quadrature points
+            is at least this value; below it the direct sum is faster.
+        precision: ``"double"`` or ``"float"``. In single precision, ``B`` and
+            ``dB_by_dX`` are computed with a relative error of about
+            :math:`10^{-6}`, but about twice as fast. This is usually
+            sufficient e.g. for Poincare plots or to estimate loss fractions.
+        store_coil_fields: if ``True``, the field of every coil is stored when
+            ``B`` and its derivatives are computed, so that e.g.
+            ``dB_by_dcoilcurrents`` is available without further cost. For
+            many coils and evaluation points this needs a lot of memory (see
+            ``estimate_memory``); with ``False`` only the total field is
+            stored and the per coil quantities are computed on demand.
     """
 
-    def __init__(self, coils, coil_currents):
+    def __init__(self, coils, coil_currents, treecode_theta=0., treecode_threshold=10**8, precision="double", store_coil_fields=True):
         assert len(coils) == len(coil_currents)
         assert all(isinstance(item, Curve) for item in coils)
         assert all(isinstance(item, float) for item in coil_currents)
@@ -27,6 +55,12 @@ class BiotSavart(sopp.BiotSavart, MagneticField):
         self.coil_currents = coil_currents
         MagneticField.__init__(self)
         sopp.BiotSavart.__init__(self, self.coils_optim)
+        if treecode_theta > 0:
+            self.set_treecode(treecode_theta, treecode_threshold)
+        if precision != "double":
+            self.set_precision(precision)
+        if not store_coil_fields:
+            self.set_store_coil_fields(False)
 
     def compute_A(self, compute_derivatives=0):
         r"""
@@ -39,68 +73,18 @@ class BiotSavart(sopp.BiotSavart, MagneticField):
         as well as the derivatives of `A` if requested.
         """
         assert compute_derivatives <= 2
+        sopp.BiotSavart.compute_A(self, compute_derivatives)
+        return self
 
+    def dA_by_dcoilcurrents(self, compute_derivatives=0):
         points = self.get_points_cart_ref()
         npoints = len(points)
         ncoils = len(self.coils)
-
+        if any([not self.fieldcache_get_status(f'A_{i}') for i in range(ncoils)]):
+            assert compute_derivatives >= 0
+            self.compute_A_coil_fields(compute_derivatives)
         self._dA_by_dcoilcurrents = [self.fieldcache_get_or_create(f'A_{i}', [npoints, 3]) for i in range(ncoils)]
-        if compute_derivatives >= 1:
-            self._d2A_by_dXdcoilcurrents = [self.fieldcache_get_or_create(f'dA_{i}', [npoints, 3, 3]) for i in range(ncoils)]
-        if compute_derivatives >= 2:
-            self._d3A_by_dXdXdcoilcurrents = [self.fieldcache_get_or_create(f'ddA_{i}', [npoints, 3, 3, 3]) for i in range(ncoils)]
-
-        gammas = [coil.gamma() for coil in self.coils]
-        dgamma_by_dphis = [coil.gammadash() for coil in self.coils]
-        for l in range(ncoils):
-            coil = self.coils[l]
-            current = self.coil_currents[l]
-            gamma = gammas[l]
-            dgamma_by_dphi = dgamma_by_dphis[l] 
-            num_coil_quadrature_points = gamma.shape[0]
-            for i, point in enumerate(points):
-                diff = point-gamma
-                dist = np.linalg.norm(diff, axis=1)
-                self._dA_by_dcoilcurrents[l][i, :] += np.sum((1./dist)[:, None] * dgamma_by_dphi, axis=0)
-
-                if compute_derivatives >= 1:
-                    for j in range(3):
-                        self._d2A_by_dXdcoilcurrents[l][i, j, :] = np.sum(-(diff[:, j]/dist**3)[:, None] * dgamma_by_dphi, axis=0)
-
-                if compute_derivatives >= 2:
-                    for j1 in range(3):
-                        for j2 in range(3):
-                            term1 = 3 * (diff[:, j1] * diff[:, j2]/dist**5)[:, None] * dgamma_by_dphi
-                            if j1 == j2:
-                                term2 = - (1./dist**3)[:, None] * dgamma_by_dphi
-                            else:
-                                term2 = 0
-                            self._d3A_by_dXdXdcoilcurrents[l][i, j1, j2, :] = np.sum(term1 + term2, axis=0)
-
-            self._dA_by_dcoilcurrents[l] *= (1e-7/num_coil_quadrature_points)
-            if compute_derivatives >= 1:
-                self._d2A_by_dXdcoilcurrents[l] *= (1e-7/num_coil_quadrature_points)
-            if compute_derivatives >= 2:
-                self._d3A_by_dXdXdcoilcurrents[l] *= (1e-7/num_coil_quadrature_points)
-
-        self._A = sum(self.coil_currents[i] * self._dA_by_dcoilcurrents[i] for i in range(len(self.coil_currents)))
-        if compute_derivatives >= 1:
-            self._dA = sum(self.coil_currents[i] * self._d2A_by_dXdcoilcurrents[i] for i in range(len(self.coil_currents)))
-        if compute_derivatives >= 2:
-            self._ddA = sum(self.coil_currents[i] * self._d3A_by_dXdXdcoilcurrents[i] for i in range(len(self.coil_currents)))
-        return self
-
-    def _A_impl(self, A):
-        self.compute_A(compute_derivatives=0)
-        A[:] = self._A
-
-    def _dA_by_dX_impl(self, dA_by_dX):
-        self.compute_A(compute_derivatives=1)
-        dA_by_dX[:] = self._dA
-
-    def _d2A_by_dXdX_impl(self, d2A_by_dXdX):
-        self.compute_A(compute_derivatives=2)
-        d2A_by_dXdX[:] = self._ddA
+        return self._dA_by_dcoilcurrents
 
     def dB_by_dcoilcurrents(self, compute_derivatives=0):
         points = self.get_points_cart_ref()
@@ -108,7 +92,7 @@ class BiotSavart(sopp.BiotSavart, MagneticField):
         ncoils = len(self.coils)
         if any([not self.fieldcache_get_status(f'B_{i}') for i in range(ncoils)]):
             assert compute_derivatives >= 0
-            self.compute(compute_derivatives)
+            self.compute_coil_fields(compute_derivatives)
         self._dB_by_dcoilcurrents = [self.fieldcache_get_or_create(f'B_{i}', [npoints, 3]) for i in range(ncoils)]
         return self._dB_by_dcoilcurrents
 
@@ -118,7 +102,7 @@ class BiotSavart(sopp.BiotSavart, MagneticField):
         ncoils = len(self.coils)
         if any([not self.fieldcache_get_status(f'dB_{i}') for i in range(ncoils)]):
             assert compute_derivatives >= 1
-            self.compute(compute_derivatives)
+            self.compute_coil_fields(compute_derivatives)
         self._d2B_by_dXdcoilcurrents = [self.fieldcache_get_or_create(f'dB_{i}', [npoints, 3, 3]) for i in range(ncoils)]
         return self._d2B_by_dXdcoilcurrents
 
@@ -128,7 +112,7 @@ class BiotSavart(sopp.BiotSavart, MagneticField):
         ncoils = len(self.coils)
         if any([not self.fieldcache_get_status(f'ddB_{i}') for i in range(ncoils)]):
             assert compute_derivatives >= 2
-            self.compute(compute_derivatives)
+            self.compute_coil_fields(compute_derivatives)
         self._d3B_by_dXdXdcoilcurrents = [self.fieldcache_get_or_create(f'ddB_{i}', [npoints, 3, 3, 3]) for i in range(ncoils)]
         return self._d3B_by_dXdXdcoilcurrents
 
@@ -176,3 +160,120 @@ class BiotSavart(sopp.BiotSavart, MagneticField):
         res_dB = [np.zeros((coils[i].num_dofs(), )) for i in range(n)]
         sopp.biot_savart_vjp(self.get_points_cart_ref(), gammas, dgamma_by_dphis, currents, v, vgrad, dgamma_by_dcoeffs, d2gamma_by_dphidcoeffs, res_B, res_dB)
         return (res_B, res_dB)
+
+    def B_and_vjp(self, v, vgrad=None):
+        r"""
+        Computes the field and the vector Jacobian product
+        :obj:`~simsopt.field.biotsavart.BiotSavart.B_vjp` (or, if ``vgrad``
+        is given, also :math:`\nabla B` and
+        :obj:`~simsopt.field.biotsavart.BiotSavart.B_and_dB_vjp`) in a single
+        pass over all pairs of evaluation points and coil quadrature points.
+        This is useful whenever the adjoint ``v`` is known before the field,
+        and costs about as much as the vector Jacobian product alone. The
+        field is stored in the cache, so a subsequent call to ``B()`` (or
+        ``dB_by_dX()``) is free.
+
+        Returns ``(B, res_B)``, or ``(B, dB_by_dX, res_B, res_dB)`` if
+        ``vgrad`` is given.
+        """
+        dgamma_by_dcoeffs = [coil.dgamma_by_dcoeff() for coil in self.coils]
+        d2gamma_by_dphidcoeffs = [coil.dgammadash_by_dcoeff() for coil in self.coils]
+        res_B = [np.zeros((coil.num_dofs(), )) for coil in self.coils]
+        if vgrad is None:
+            self.compute_and_vjp(v, np.zeros((0, 3, 3)), dgamma_by_dcoeffs, d2gamma_by_dphidcoeffs, res_B, [])
+            return (self.B(), res_B)
+        res_dB = [np.zeros((coil.num_dofs(), )) for coil in self.coils]
+        self.compute_and_vjp(v, vgrad, dgamma_by_dcoeffs, d2gamma_by_dphidcoeffs, res_B, res_dB)
+        return (self.B(), self.dB_by_dX(), res_B, res_dB)
+
+
+class SymmetricBiotSavart(BiotSavart):
+    r"""
+    The field of the coils of a :obj:`~simsopt.geo.coilcollection.CoilCollection`,
+    computed from the base coils only. Instead of evaluating all
+    ``nfp * (1 + stellsym)`` rotated (and flipped) copies of the coils, the
+    field is computed as
+
+    .. math::
+
+        B(\mathbf{x}) = \sum_{g} s_g S_g B_\mathrm{base}(S_g^T \mathbf{x}),
+
+    where :math:`S_g` are the rotations that generate the copies of the coils
+    and :math:`s_g=\pm 1` the signs of their currents. This needs the memory
+    for the base coils only, and the coils' gamma and its derivatives are only
+    computed once. The per coil quantities, e.g. ``dB_by_dcoilcurrents``, are
+    returned for the base coils (and include all their copies), and the vector
+    Jacobian products are accumulated directly into the dofs of the base
+    coils.
+
+    Args:
+        coils: a list of :obj:`~simsopt.geo.curve.Curve` objects, the base coils.
+        coil_currents: a list of floats containing the currents in the base coils.
+        nfp: the number of field periods.
+        stellarator_symmetry: whether the coils are stellarator symmetric.
+
+    The remaining arguments are passed on to :obj:`BiotSavart`.
+    """
+
+    def __init__(self, coils, coil_currents, nfp, stellarator_symmetry, **kwargs):
+        BiotSavart.__init__(self, coils, coil_currents, **kwargs)
+        self.nfp = nfp
+        self.stellarator_symmetry = stellarator_symmetry
+        # the same order of the copies and the same rotations as in
+        # `CoilCollection` and `RotatedCurve`.
+        flip_list = [False, True] if stellarator_symmetry else [False]
+        self.rotations = []
+        self.signs = []
+        for k in range(nfp):
+            for flip in flip_list:
+                theta = 2*np.pi*k/nfp
+                rotmat = np.asarray(
+                    [[np.cos(theta), -np.sin(theta), 0],
+                     [np.sin(theta), np.cos(theta), 0],
+                     [0, 0, 1]]).T
+                if flip:
+                    rotmat = rotmat @ np.diag([1., -1., -1.])
+                self.rotations.append(rotmat.T)
+                self.signs.append(-1. if flip else 1.)
+        self.set_symmetries([S.flatten() for S in self.rotations], self.signs)
+
+    def _stacked_points(self):
+        points = self.get_points_cart_ref()
+        return np.concatenate([points @ S for S in self.rotations])
+
+    def B_vjp(self, v):
+        r"""
+        See :obj:`simsopt.field.biotsavart.BiotSavart.B_vjp`. The product is
+        returned for the dofs of the base coils. Since
+        :math:`\mathbf{v}\cdot s S B_\mathrm{base}(S^T\mathbf{x}) = s (S^T\mathbf{v})\cdot B_\mathrm{base}(S^T\mathbf{x})`,
+        this is a single vector Jacobian product for the base coils at the
+        transformed points.
+        """
+        v = np.asarray(v)
+        vs = np.concatenate([s * (v @ S) for S, s in zip(self.rotations, self.signs)])
+        return self._vjp(vs, [])[0]
+
+    def B_and_dB_vjp(self, v, vgrad):
+        r"""
+        Same as :obj:`SymmetricBiotSavart.B_vjp` but returns the vector
+        Jacobian product for :math:`B` and :math:`\nabla B`, see
+        :obj:`simsopt.field.biotsavart.BiotSavart.B_and_dB_vjp`.
+        """
+        v = np.asarray(v)
+        vgrad = np.asarray(vgrad)
+        vs = np.concatenate([s * (v @ S) for S, s in zip(self.rotations, self.signs)])
+        vgrads = np.concatenate([s * np.einsum('jk,ijl,lm->ikm', S, vgrad, S) for S, s in zip(self.rotations, self.signs)])
+        return self._vjp(vs, vgrads)
+
+    def _vjp(self, vs, vgrads):
+        gammas = [coil.gamma() for coil in self.coils]
+        dgamma_by_dphis = [coil.gammadash() for coil in self.coils]
+        currents = self.coil_currents
+        dgamma_by_dcoeffs = [coil.dgamma_by_dcoeff() for coil in self.coils]
+        d2gamma_by_dphidcoeffs = [coil.dgammadash_by_dcoeff() for coil in self.coils]
+        n = len(self.coils)
+        coils = self.coils
+        res_B = [np.zeros((coils[i].num_dofs(), )) for i in range(n)]
+        res_dB = [np.zeros((coils[i].num_dofs(), )) for i in range(n)] if len(vgrads) > 0 else []
+        sopp.biot_savart_vjp(self._stacked_points(), gammas, dgamma_by_dphis, currents, vs, vgrads, dgamma_by_dcoeffs, d2gamma_by_dphidcoeffs, res_B, res_dB)
+        return (res_B, res_dB)
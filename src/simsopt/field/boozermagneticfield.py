@@ -0,0 +1,88 @@
+import numpy as np
+import simsoptpp as sopp
+
+
+class BoozerSpectralField(sopp.BoozerSpectralField):
+    r"""
+    The field strength :math:`|B|` of an equilibrium in Boozer coordinates
+    :math:`(s, \theta, \zeta)`, where :math:`s` is the normalized toroidal
+    flux, together with the profiles :math:`G(s)`, :math:`I(s)` and
+    :math:`\iota(s)`. On each surface, :math:`|B|` is represented by its
+    Fourier series
+
+    .. math::
+
+        |B|(s, \theta, \zeta) = \sum_j B_j(s) \cos(m_j\theta - n_j\zeta),
+
+    and all quantities are interpolated radially with cubic splines. This is
+    all that is needed to trace guiding centers in Boozer coordinates, see
+    :obj:`simsopt.field.tracing.trace_particles_boozer`.
+
+    Args:
+        s: the values of the normalized toroidal flux of the surfaces, sorted
+           and positive.
+        xm: the poloidal mode numbers.
+        xn: the toroidal mode numbers, including the factor ``nfp``.
+        bmnc: the Fourier coefficients of :math:`|B|`, an array of shape
+              ``(len(xm), len(s))``.
+        G: the covariant toroidal component of the field on the surfaces.
+        I: the covariant poloidal component of the field on the surfaces.
+        iota: the rotational transform on the surfaces.
+        psi0: the toroidal flux through the boundary divided by :math:`2\pi`.
+        nfp: the number of field periods.
+    """
+
+    def __init__(self, s, xm, xn, bmnc, G, I, iota, psi0, nfp):
+        bmnc = np.asarray(bmnc, dtype=float)
+        sopp.BoozerSpectralField.__init__(
+            self, np.asarray(s, dtype=float), np.asarray(xm, dtype=int), np.asarray(xn, dtype=int),
+            [b for b in bmnc], np.asarray(G, dtype=float), np.asarray(I, dtype=float),
+            np.asarray(iota, dtype=float), float(psi0), int(nfp))
+
+    @classmethod
+    def from_boozer(cls, boozer, psi0=None):
+        r"""
+        Create the field from the result of the Boozer transformation.
+
+        Args:
+            boozer: either a :obj:`simsopt.mhd.boozer.Boozer` object, which is
+                    run first, or a ``booz_xform.Booz_xform`` object on which
+                    the transformation has been carried out. At least two
+                    surfaces are needed, and the radial interpolation is only
+                    accurate if the transformation was computed on many
+                    surfaces.
+            psi0: the toroidal flux through the boundary divided by
+                  :math:`2\pi`. By default it is taken from the VMEC
+                  equilibrium of the ``Boozer`` object or from the
+                  ``toroidal_flux`` of the ``Booz_xform`` object.
+        """
+        if hasattr(boozer, 'bx'):
+            boozer.run()
+            bx = boozer.bx
+            if psi0 is None and hasattr(boozer.equil, 'wout'):
+                psi0 = boozer.equil.wout.phi[-1]/(2*np.pi)
+        else:
+            bx = boozer
+        if psi0 is None:
+            psi0 = bx.toroidal_flux/(2*np.pi)
+        if bx.asym:
+            raise NotImplementedError("Only stellarator symmetric equilibria are supported.")
+        compute_surfs = np.asarray(bx.compute_surfs, dtype=int)
+        return cls(bx.s_b, bx.xm_b, bx.xn_b, bx.bmnc_b, bx.Boozer_G, bx.Boozer_I,
+                   np.asarray(bx.iota)[compute_surfs], psi0, bx.nfp)
+
+    def modB(self, stz):
+        r"""
+        Returns an array of shape ``(n, 4)`` containing :math:`|B|` and its
+        derivatives with respect to :math:`s`, :math:`\theta` and
+        :math:`\zeta` at the points ``stz`` (shape ``(n, 3)``).
+        """
+        return np.asarray(sopp.BoozerSpectralField.modB(self, np.asarray(stz, dtype=float)))
+
+    def profiles(self, s):
+        r"""
+        Returns an array of shape ``(n, 5)`` containing :math:`G`,
+        :math:`dG/ds`, :math:`I`, :math:`dI/ds` and :math:`\iota` at the
+        values ``s``.
+        """
+        return np.asarray(sopp.BoozerSpectralField.profiles(self, np.asarray(s, dtype=float)))
@@ -1,3 +1,5 @@
+import os
+import hashlib
 import numpy as np
 from scipy.special import ellipk, ellipe
 from simsopt.field.magneticfield import MagneticField
@@ -13,11 +15,13 @@ except ImportError:
 logger = logging.getLogger(__name__)
 
 
-class ToroidalField(MagneticField):
+class ToroidalField(sopp.ToroidalField, MagneticField):
     """
     Magnetic field purely in the toroidal direction, that is, in the phi
     direction with (R,phi,Z) the standard cylindrical coordinates.
     Its modulus is given by B = B0*R0/R where R0 is the first input and B0 the second input to the function.
+    B and its gradient are computed in C++ (which allows the tracers to
+    evaluate the field without going through the cache).
 
     Args:
         B0:  modulus of the magnetic field at R0
@@ -26,36 +30,10 @@ class ToroidalField(MagneticField):
 
     def __init__(self, R0, B0):
         MagneticField.__init__(self)
+        sopp.ToroidalField.__init__(self, R0, B0)
         self.R0 = R0
         self.B0 = B0
 
-    def _B_impl(self, B):
-        points = self.get_points_cart_ref()
-        phi = np.arctan2(points[:, 1], points[:, 0])
-        R = np.sqrt(np.square(points[:, 0]) + np.square(points[:, 1]))
-        phiUnitVectorOverR = np.vstack((np.divide(-np.sin(phi), R), np.divide(np.cos(phi), R), np.zeros(len(phi)))).T
-        B[:] = np.multiply(self.B0*self.R0, phiUnitVectorOverR)
-
-    def _dB_by_dX_impl(self, dB):
-        points = self.get_points_cart_ref()
-        phi = np.arctan2(points[:, 1], points[:, 0])
-        R = np.sqrt(np.square(points[:, 0]) + np.square(points[:, 1]))
-
-        x = points[:, 0]
-        y = points[:, 1]
-
-        dB_by_dX1 = np.vstack((
-            np.multiply(np.divide(self.B0*self.R0, R**4), 2*np.multiply(x, y)),
-            np.multiply(np.divide(self.B0*self.R0, R**4), y**2-x**2),
-            0*R))
-        dB_by_dX2 = np.vstack((
-            np.multiply(np.divide(self.B0*self.R0, R**4), y**2-x**2),
-            np.multiply(np.divide(self.B0*self.R0, R**4), -2*np.multiply(x, y)),
-            0*R))
-        dB_by_dX3 = np.vstack((0*R, 0*R, 0*R))
-
-        dB[:] = np.array([dB_by_dX1, dB_by_dX2, dB_by_dX3]).T
-
     def _d2B_by_dXdX_impl(self, ddB):
         points = self.get_points_cart_ref()
         x = points[:, 0]
@@ -381,12 +359,12 @@ class CircularCoil(MagneticField):
             np.array([-points[:, 1], points[:, 0], 0])).T)
 
 
-class Dommaschk(MagneticField):
+class Dommaschk(sopp.Dommaschk, MagneticField):
     """
     Vacuum magnetic field created by an explicit representation of the magnetic
     field scalar potential as proposed by W. Dommaschk (1986), Computer Physics
     Communications 40, 203-218. As inputs, it takes the arrays for the harmonics
-    m, n and its corresponding coefficients.
+    m, n and its corresponding coefficients. The field is computed in C++.
 
     Args:
         m: first harmonic array
@@ -399,21 +377,10 @@ class Dommaschk(MagneticField):
         self.m = np.array(mn, dtype=np.int16)[:, 0]
         self.n = np.array(mn, dtype=np.int16)[:, 1]
         self.coeffs = coeffs
-        self.Btor = ToroidalField(1, 1)
-
-    def _set_points_cb(self):
-        self.Btor.set_points_cart(self.get_points_cart_ref())
+        sopp.Dommaschk.__init__(self, self.m.tolist(), self.n.tolist(), np.asarray(coeffs, dtype=float).tolist())
 
-    def _B_impl(self, B):
-        points = self.get_points_cart_ref()
-        B[:] = np.add.reduce(sopp.DommaschkB(self.m, self.n, self.coeffs, points))+self.Btor.B()
 
-    def _dB_by_dX_impl(self, dB):
-        points = self.get_points_cart_ref()
-        dB[:] = np.add.reduce(sopp.DommaschkdB(self.m, self.n, self.coeffs, points))+self.Btor.dB_by_dX()
-
-
-class Reiman(MagneticField):
+class Reiman(sopp.Reiman, MagneticField):
     '''
     Magnetic field model in section 5 of Reiman and Greenside, Computer Physics Communications 43 (1986) 157—167.
     This field allows for an analytical expression of the magnetic island width
@@ -426,24 +393,19 @@ class Reiman(MagneticField):
         k: integer array specifying the Fourier modes used
         epsilonk: coefficient of the Fourier modes
         m0: toroidal symmetry parameter (normally m0=1)
+
+    The field is computed in C++.
     '''
 
     def __init__(self, iota0=0.15, iota1=0.38, k=[6], epsilonk=[0.01], m0=1):
         MagneticField.__init__(self)
+        sopp.Reiman.__init__(self, iota0, iota1, np.asarray(k, dtype=float).tolist(), np.asarray(epsilonk, dtype=float).tolist(), m0)
         self.iota0 = iota0
         self.iota1 = iota1
         self.k = k
         self.epsilonk = epsilonk
         self.m0 = m0
 
-    def _B_impl(self, B):
-        points = self.get_points_cart_ref()
-        B[:] = sopp.ReimanB(self.iota0, self.iota1, self.k, self.epsilonk, self.m0, points)
-
-    def _dB_by_dX_impl(self, dB):
-        points = self.get_points_cart_ref()
-        dB[:] = sopp.ReimandB(self.iota0, self.iota1, self.k, self.epsilonk, self.m0, points)
-
 
 class UniformInterpolationRule(sopp.UniformInterpolationRule):
     pass
@@ -459,7 +421,8 @@ class InterpolatedField(sopp.InterpolatedField, MagneticField):
     This resulting interpolant can then be evaluated very quickly.
     """
 
-    def __init__(self, field, degree, rrange, phirange, zrange, extrapolate=True, nfp=1, stellsym=False):
+    def __init__(self, field, degree, rrange, phirange, zrange, extrapolate=True, nfp=1, stellsym=False, cache_dir=None, comm=None,
+                 adaptive_tol=None, adaptive_max_level=3, skip=None, precision="double"):
         r"""
         Args:
             field: the underlying :mod:`simsopt.field.magneticfield.MagneticField` to be interpolated.
@@ -477,6 +440,39 @@ class InterpolatedField(sopp.InterpolatedField, MagneticField):
             stellsym: Whether to exploit stellarator symmetry. In this case
                       ``z`` is always mapped to be positive, hence it makes sense to use
                       ``zmin=0``.
+            cache_dir: if not ``None``, the interpolation tables are stored in
+                       this directory and are reused (via a read only memory
+                       mapping) by any later ``InterpolatedField`` with the same
+                       grid, interpolation rule and symmetries for the same
+                       underlying field. This avoids rebuilding the tables in
+                       every run and lets all processes on a node share one copy
+                       of the tables in memory.
+            comm: if not ``None``, the interpolation nodes are split across
+                  this MPI communicator and the interpolant is built right away,
+                  with every rank evaluating the underlying field on its part of
+                  the nodes. Otherwise the interpolant is built on first use,
+                  using several threads if the underlying field supports it
+                  (e.g. :obj:`~simsopt.field.biotsavart.BiotSavart`).
+            adaptive_tol: if not ``None``, cells of the grid are refined (up to
+                          ``adaptive_max_level`` times) until the estimated
+                          interpolation error on each cell is below this
+                          tolerance. This gives high resolution e.g. close to
+                          coils without paying for it everywhere in the domain.
+            adaptive_max_level: maximum number of refinements of each cell.
+            skip: a function that takes lists ``(rs, phis, zs)`` of points
+                  and returns a list of booleans indicating which points lie
+                  outside of the region of interest. Cells for which all
+                  corners are outside are neither interpolated nor stored;
+                  evaluating the field in such a cell raises an error. For a
+                  :obj:`~simsopt.geo.surface.SurfaceClassifier` ``sc``, use e.g.
+                  ``lambda rs, phis, zs: list(sc.evaluate_rphiz(np.stack((rs, phis, zs), axis=1))[:, 0] < -0.1)``.
+            precision: ``"double"`` or ``"float"``. For ``"float"``, the
+                       interpolant is built from a copy of ``field`` that is
+                       evaluated in single precision (see
+                       :obj:`~simsopt.field.biotsavart.BiotSavart`); ``field``
+                       itself is not modified. The rounding error of about
+                       :math:`10^{-6}` is usually well below the
+                       interpolation error.
         """
         MagneticField.__init__(self)
         if stellsym and zrange[0] != 0:
@@ -484,7 +480,81 @@ class InterpolatedField(sopp.InterpolatedField, MagneticField):
         if nfp > 1 and abs(phirange[1] - 2*np.pi/nfp) > 1e-14:
             logger.warning(fr"Sure about phirange[1]={phirange[1]}? When exploiting rotational symmetry, the interpolant is never evaluated for phi>2\pi/nfp.")
 
+        if precision != "double":
+            if not isinstance(field, sopp.BiotSavart):
+                raise ValueError("Only BiotSavart fields can be evaluated in reduced precision.")
+            field = field.clone()
+            field.set_precision(precision)
         sopp.InterpolatedField.__init__(self, field, degree, rrange, phirange, zrange, extrapolate, nfp, stellsym)
+        if adaptive_tol is not None:
+            if cache_dir is not None or comm is not None:
+                raise ValueError("cache_dir and comm are not supported for adaptive interpolants.")
+            self.set_adaptive(adaptive_tol, adaptive_max_level, skip)
+        elif skip is not None:
+            self.set_skip(skip)
+        if cache_dir is not None:
+            key = self._cache_key(field, degree, rrange, phirange, zrange, nfp, stellsym)
+            filename_B = os.path.join(cache_dir, f"interpolant_{key}_B.bin")
+            filename_GradAbsB = os.path.join(cache_dir, f"interpolant_{key}_GradAbsB.bin")
+            if self.load(filename_B, filename_GradAbsB, key):
+                return
+        if comm is not None:
+            self._interpolate_mpi(field, comm)
+        if cache_dir is not None:
+            if comm is None or comm.rank == 0:
+                os.makedirs(cache_dir, exist_ok=True)
+                self.save(filename_B, filename_GradAbsB, key)
+                logger.info(f"Stored interpolation tables in {filename_B} and {filename_GradAbsB}")
+            if comm is not None:
+                comm.Barrier()
+            # Switch to the memory mapped tables so that the memory is
+            # shared with other processes using the same files.
+            self.load(filename_B, filename_GradAbsB, key)
+
+    def _interpolate_mpi(self, field, comm):
+        """
+        Evaluate the underlying field on a contiguous part of the interpolation
+        nodes on each rank of ``comm`` and then gather the values on all ranks.
+        """
+        nodes = self.interpolation_nodes()
+        n = nodes.shape[0]
+        first, last = (comm.rank * n) // comm.size, ((comm.rank + 1) * n) // comm.size
+        B = np.zeros((0, 3))
+        GradAbsB = np.zeros((0, 3))
+        if last > first:
+            old_points = field.get_points_cart()
+            field.set_points_cyl(np.ascontiguousarray(nodes[first:last, :]))
+            B = field.B_cyl().copy()
+            GradAbsB = field.GradAbsB_cyl().copy()
+            field.set_points_cart(old_points)
+        B = np.ascontiguousarray(np.concatenate(comm.allgather(B)))
+        GradAbsB = np.ascontiguousarray(np.concatenate(comm.allgather(GradAbsB)))
+        self.set_interpolation_values(B, GradAbsB)
+
+    @staticmethod
+    def _cache_key(field, degree, rrange, phirange, zrange, nfp, stellsym):
+        """
+        Compute a hash that identifies the interpolation tables. It depends on
+        the grid, the interpolation rule, the symmetries and on the values of
+        the underlying field at a few points inside the domain.
+        """
+        rule = degree if isinstance(degree, sopp.InterpolationRule) else sopp.UniformInterpolationRule(degree)
+        s = np.asarray([1/6, 1/2, 5/6])
+        rs = rrange[0] + s * (rrange[1]-rrange[0])
+        phis = phirange[0] + s * (phirange[1]-phirange[0])
+        zs = zrange[0] + s * (zrange[1]-zrange[0])
+        probes = np.ascontiguousarray(np.stack(np.meshgrid(rs, phis, zs, indexing='ij'), axis=-1).reshape((-1, 3)))
+        old_points = field.get_points_cart()
+        field.set_points_cyl(probes)
+        B = field.B_cyl()
+        GradAbsB = field.GradAbsB_cyl()
+        field.set_points_cart(old_points)
+
+        h = hashlib.sha256()
+        h.update(f"{type(rule).__name__}, {rule.degree}, {tuple(rrange)}, {tuple(phirange)}, {tuple(zrange)}, {nfp}, {stellsym}\n".encode())
+        for val in np.concatenate((B.flatten(), GradAbsB.flatten())):
+            h.update(f"{val:.10e}\n".encode())
+        return h.hexdigest()
 
     def to_vtk(self, filename, h=0.1):
         """Export the field evaluated on a regular grid for visualisation with e.g. Paraview."""
@@ -73,15 +73,213 @@ def parallel_loop_bounds(comm, n):
         return idxs[comm.rank], idxs[comm.rank+1]
 
 
+class TrajectorySink():
+    """
+    Base class for the destinations of the trajectories computed by
+    :obj:`trace_particles`, :obj:`trace_particles_boozer` and
+    :obj:`compute_fieldlines`. Every trajectory is passed to the sink on the
+    MPI rank that computed it, via ``add(idx, res_ty, res_hits)``, where
+    ``idx`` is the global index of the particle (or field line). The
+    trajectories on each rank are computed in chunks of ``chunk_size``, so
+    that only one chunk has to be kept in memory at a time (``None`` means
+    all trajectories of a rank at once).
+
+    After tracing, the total number of trajectories and the number of those
+    that were stopped before ``tmax`` (i.e. lost particles) are available as
+    ``ntrajectories`` and ``nlost`` on rank 0, and are ``None`` on all other
+    ranks.
+    """
+
+    def __init__(self, chunk_size=None):
+        assert chunk_size is None or chunk_size > 0
+        self.chunk_size = chunk_size
+        self.ntrajectories = None
+        self.nlost = None
+
+    def begin(self, comm):
+        """
+        Called before the first trajectory is added.
+        """
+        pass
+
+    def add(self, idx, res_ty, res_hits):
+        raise NotImplementedError
+
+    def finalize(self, comm):
+        """
+        Called after the last trajectory was added. The return value is
+        returned by the tracing function.
+        """
+        return None
+
+
+class MemorySink(TrajectorySink):
+    """
+    Keeps all trajectories in memory. If ``gather=True``, the trajectories of
+    all ranks are gathered on every rank. ``finalize`` returns the lists
+    ``res_tys`` and ``res_hits``.
+    """
+
+    def __init__(self, gather=True, chunk_size=None):
+        TrajectorySink.__init__(self, chunk_size=chunk_size)
+        self.gather = gather
+
+    def begin(self, comm):
+        self.res_tys = []
+        self.res_hits = []
+
+    def add(self, idx, res_ty, res_hits):
+        self.res_tys.append(res_ty)
+        self.res_hits.append(res_hits)
+
+    def finalize(self, comm):
+        if comm is not None and self.gather:
+            self.res_tys = [i for o in comm.allgather(self.res_tys) for i in o]
+            self.res_hits = [i for o in comm.allgather(self.res_hits) for i in o]
+        return self.res_tys, self.res_hits
+
+
+class CallbackSink(TrajectorySink):
+    """
+    Calls ``callback(idx, res_ty, res_hits)`` for every trajectory, on the
+    rank that computed it.
+    """
+
+    def __init__(self, callback, chunk_size=None):
+        TrajectorySink.__init__(self, chunk_size=chunk_size)
+        self.callback = callback
+
+    def add(self, idx, res_ty, res_hits):
+        self.callback(idx, res_ty, res_hits)
+
+
+class NpzSink(TrajectorySink):
+    """
+    Writes the trajectories of every chunk to the file
+    ``{prefix}_rank{rank}_chunk{k}.npz``, with the arrays ``ty_{idx}`` and
+    ``hits_{idx}`` for each trajectory. For ``chunk_size=None``, all
+    trajectories of a rank are written to a single file in ``finalize``.
+    ``finalize`` returns the list of files written by this rank.
+    """
+
+    def __init__(self, prefix, chunk_size=1000):
+        TrajectorySink.__init__(self, chunk_size=chunk_size)
+        self.prefix = prefix
+
+    def begin(self, comm):
+        self.rank = 0 if comm is None else comm.rank
+        self.filenames = []
+        self.buffer = {}
+
+    def add(self, idx, res_ty, res_hits):
+        self.buffer[f'ty_{idx}'] = res_ty
+        self.buffer[f'hits_{idx}'] = res_hits
+        if self.chunk_size is not None and len(self.buffer) >= 2*self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if len(self.buffer) == 0:
+            return
+        filename = f'{self.prefix}_rank{self.rank}_chunk{len(self.filenames)}.npz'
+        np.savez(filename, **self.buffer)
+        self.filenames.append(filename)
+        self.buffer = {}
+
+    def finalize(self, comm):
+        self.flush()
+        return self.filenames
+
+
+class HDF5Sink(TrajectorySink):
+    """
+    Writes the trajectories to the file ``{prefix}_rank{rank}.h5``, with the
+    datasets ``ty/{idx}`` and ``hits/{idx}`` for each trajectory. The file is
+    flushed after every chunk, or only when it is closed in ``finalize`` for
+    ``chunk_size=None``. ``finalize`` returns the name of the file.
+    Requires ``h5py``.
+    """
+
+    def __init__(self, prefix, chunk_size=1000):
+        TrajectorySink.__init__(self, chunk_size=chunk_size)
+        self.prefix = prefix
+
+    def begin(self, comm):
+        import h5py
+        rank = 0 if comm is None else comm.rank
+        self.filename = f'{self.prefix}_rank{rank}.h5'
+        self.file = h5py.File(self.filename, 'w')
+        self.nadded = 0
+
+    def add(self, idx, res_ty, res_hits):
+        self.file.create_dataset(f'ty/{idx}', data=res_ty)
+        self.file.create_dataset(f'hits/{idx}', data=res_hits)
+        self.nadded += 1
+        if self.chunk_size is not None and self.nadded % self.chunk_size == 0:
+            self.file.flush()
+
+    def finalize(self, comm):
+        self.file.close()
+        return self.filename
+
+
+def trace_to_sink(trace, ntrajectories, tmax, comm, sink):
+    """
+    Computes the trajectories on this rank in chunks and passes them to the
+    sink. ``trace(first, last)`` has to return the results of the C++ tracing
+    functions for the trajectories ``first, ..., last-1``. Returns the result
+    of ``sink.finalize``.
+    """
+    first, last = parallel_loop_bounds(comm, ntrajectories)
+    chunk_size = sink.chunk_size if sink.chunk_size is not None else max(last-first, 1)
+    sink.begin(comm)
+    loss_ctr = 0
+    for start in range(first, last, chunk_size):
+        stop = min(start + chunk_size, last)
+        for i, (res_ty, res_hits) in zip(range(start, stop), trace(start, stop)):
+            res_ty = np.asarray(res_ty)
+            logger.debug(f"{i+1:3d}/{ntrajectories}, t_final={res_ty[-1][0]}")
+            if res_ty[-1][0] < tmax - 1e-15:
+                loss_ctr += 1
+            sink.add(i, res_ty, np.asarray(res_hits))
+    if comm is not None:
+        loss_ctr = comm.reduce(loss_ctr, root=0)
+    if comm is None or comm.rank == 0:
+        sink.ntrajectories = ntrajectories
+        sink.nlost = loss_ctr
+        logger.debug(f'Lost {loss_ctr}/{ntrajectories}={(100*loss_ctr)//max(ntrajectories, 1):d}%')
+    return sink.finalize(comm)
+
+
+def check_stopping_criteria(stopping_criteria, boozer):
+    r"""
+    Raises a ``ValueError`` if one of the ``stopping_criteria`` is evaluated
+    in the wrong coordinates. The criteria get the cartesian position
+    :math:`(x, y, z)` from :obj:`trace_particles` and
+    :obj:`compute_fieldlines`, but the Boozer coordinates
+    :math:`(s, \theta, \zeta)` from :obj:`trace_particles_boozer`
+    (``boozer=True``).
+    """
+    if boozer:
+        wrong = (sopp.LevelsetStoppingCriterion, )
+    else:
+        wrong = (sopp.MinToroidalFluxStoppingCriterion, sopp.MaxToroidalFluxStoppingCriterion)
+    for criterion in stopping_criteria:
+        if isinstance(criterion, wrong):
+            raise ValueError(
+                f"{type(criterion).__name__} can't be used for the tracing in "
+                + ("Boozer" if boozer else "cartesian") + " coordinates.")
+
+
 def trace_particles(field: MagneticField, xyz_inits: NDArray[Float],
                     parallel_speeds: NDArray[Float], tmax=1e-4,
                     mass=ALPHA_PARTICLE_MASS, charge=ALPHA_PARTICLE_CHARGE, Ekin=FUSION_ALPHA_PARTICLE_ENERGY,
                     tol=1e-9, comm=None, phis=[], stopping_criteria=[], mode='gc_vac', forget_exact_path=False,
-                    phase_angle=0):
+                    phase_angle=0, packet_size=1, steps_per_gyroperiod=32, record_every=1, record_interval=0,
+                    sink=None):
     r"""
     Follow particles in a magnetic field.
 
-    In the case of ``mod='full'`` we solve
+    In the case of ``mod='full'`` and ``mode='full_boris'`` we solve
 
     .. math::
 
@@ -117,20 +315,50 @@ def trace_particles(field: MagneticField, xyz_inits: NDArray[Float],
         mode: how to trace the particles. options are
             `gc`: general guiding center equations,
             `gc_vac`: simplified guiding center equations for the case :math:`\nabla p=0`,
-            `full`: full orbit calculation (slow!)
+            `full`: full orbit calculation (slow!),
+            `full_boris`: full orbit calculation with the Boris pusher, a fixed
+            step method that conserves the energy exactly
         forget_exact_path: return only the first and last position of each
                            particle for the ``res_tys``. To be used when only res_phi_hits is of
-                           interest or one wants to reduce memory usage.
+                           interest or one wants to reduce memory usage. Takes
+                           precedence over ``record_every`` and ``record_interval``.
         phase_angle: the phase angle to use in the case of full orbit calculations
-
-    Returns: 2 element tuple containing
+        packet_size: for the guiding center modes, the number of particles that
+                     each thread advances in lockstep. For ``packet_size > 1``
+                     the field is evaluated for all particles in a packet at
+                     once, which is much faster for fields that vectorize over
+                     the evaluation points (e.g. ``BiotSavart`` or
+                     ``InterpolatedField``).
+        steps_per_gyroperiod: for ``mode='full_boris'``, the number of time
+                              steps per gyro period. The time step of each
+                              particle is fixed and determined from the field
+                              strength at its initial position; it is not
+                              adapted along the orbit (which would spoil the
+                              long time accuracy of the pusher), so choose it
+                              large enough for the strongest field the
+                              particles reach. ``tol`` is not used in this
+                              mode.
+        record_every: store only every ``record_every``-th step of the
+                      trajectories. ``0`` stores only the first and last state,
+                      which is the same as ``forget_exact_path=True``. The
+                      phi hits and stopping criteria are always stored.
+        record_interval: if positive, store the states at the times
+                         ``record_interval``, ``2*record_interval``, ...
+                         (interpolated using the dense output of the ode
+                         solver) instead of the steps of the solver.
+        sink: a :obj:`TrajectorySink` that receives the trajectories on the
+              rank that computed them, e.g. to write them to disk instead of
+              keeping them in memory. Defaults to a :obj:`MemorySink` that
+              gathers all trajectories on all ranks.
+
+    Returns: the result of ``sink.finalize``. For the default sink, a 2 element tuple containing
         - ``res_tys``:
             A list of numpy arrays (one for each particle) describing the
             solution over time. The numpy array is of shape (ntimesteps, M)
             with M depending on the ``mode``.  Each row contains the time and
             the state.  So for `mode='gc'` and `mode='gc_vac'` the state
             consists of the xyz position and the parallel speed, hence
-            each row contains `[t, x, y, z, v_par]`.  For `mode='full'`, the
+            each row contains `[t, x, y, z, v_par]`.  For `mode='full'` and `mode='full_boris'`, the
             state consists of position and velocity vector, i.e. each row
             contains `[t, x, y, z, vx, vy, vz]`.
 
@@ -147,42 +375,39 @@ def trace_particles(field: MagneticField, xyz_inits: NDArray[Float],
     assert xyz_inits.shape[0] == len(parallel_speeds)
     speed_par = parallel_speeds
     mode = mode.lower()
-    assert mode in ['gc', 'gc_vac', 'full']
+    assert mode in ['gc', 'gc_vac', 'full', 'full_boris']
+    check_stopping_criteria(stopping_criteria, boozer=False)
     m = mass
     speed_total = sqrt(2*Ekin/m)  # Ekin = 0.5 * m * v^2 <=> v = sqrt(2*Ekin/m)
 
-    if mode == 'full':
+    if 'full' in mode:
         xyz_inits, v_inits, _ = gc_to_fullorbit_initial_guesses(field, xyz_inits, speed_par, speed_total, m, charge, eta=phase_angle)
-    res_tys = []
-    res_phi_hits = []
-    loss_ctr = 0
-    first, last = parallel_loop_bounds(comm, nparticles)
-    for i in range(first, last):
+    if forget_exact_path:
+        record = sopp.RecordOptions(0, 0.)
+    else:
+        record = sopp.RecordOptions(record_every, record_interval)
+
+    def trace(first, last):
         if 'gc' in mode:
-            res_ty, res_phi_hit = sopp.particle_guiding_center_tracing(
-                field, xyz_inits[i, :],
-                m, charge, speed_total, speed_par[i], tmax, tol,
-                vacuum=(mode == 'gc_vac'), phis=phis, stopping_criteria=stopping_criteria)
+            # trace all guiding centers of the chunk at once, the C++ code
+            # parallelises over the particles using OpenMP
+            return sopp.particle_guiding_center_tracing_batch(
+                field, np.ascontiguousarray(xyz_inits[first:last, :]),
+                m, charge, speed_total, np.asarray(speed_par[first:last], dtype=float), tmax, tol,
+                vacuum=(mode == 'gc_vac'), phis=phis, stopping_criteria=stopping_criteria,
+                packet_size=packet_size, record=record)
+        elif mode == 'full_boris':
+            return sopp.particle_fullorbit_boris_tracing_batch(
+                field, np.ascontiguousarray(xyz_inits[first:last, :]), np.ascontiguousarray(v_inits[first:last, :]),
+                m, charge, tmax, steps_per_gyroperiod, phis=phis, stopping_criteria=stopping_criteria,
+                record=record)
         else:
-            res_ty, res_phi_hit = sopp.particle_fullorbit_tracing(
+            return [sopp.particle_fullorbit_tracing(
                 field, xyz_inits[i, :], v_inits[i, :],
-                m, charge, tmax, tol, phis=phis, stopping_criteria=stopping_criteria)
-        if not forget_exact_path:
-            res_tys.append(np.asarray(res_ty))
-        else:
-            res_tys.append(np.asarray([res_ty[0], res_ty[-1]]))
-        res_phi_hits.append(np.asarray(res_phi_hit))
-        dtavg = res_ty[-1][0]/len(res_ty)
-        logger.debug(f"{i+1:3d}/{nparticles}, t_final={res_ty[-1][0]}, average timestep {1000*dtavg:.10f}ms")
-        if res_ty[-1][0] < tmax - 1e-15:
-            loss_ctr += 1
-    if comm is not None:
-        loss_ctr = comm.allreduce(loss_ctr)
-    if comm is not None:
-        res_tys = [i for o in comm.allgather(res_tys) for i in o]
-        res_phi_hits = [i for o in comm.allgather(res_phi_hits) for i in o]
-    logger.debug(f'Particles lost {loss_ctr}/{nparticles}={(100*loss_ctr)//nparticles:d}%')
-    return res_tys, res_phi_hits
+                m, charge, tmax, tol, phis=phis, stopping_criteria=stopping_criteria,
+                record=record) for i in range(first, last)]
+
+    return trace_to_sink(trace, nparticles, tmax, comm, MemorySink() if sink is None else sink)
 
 
 def trace_particles_starting_on_curve(curve, field, nparticles, tmax=1e-4,
@@ -190,7 +415,8 @@ def trace_particles_starting_on_curve(curve, field, nparticles, tmax=1e-4,
                                       Ekin=FUSION_ALPHA_PARTICLE_ENERGY,
                                       tol=1e-9, comm=None, seed=1, umin=-1, umax=+1,
                                       phis=[], stopping_criteria=[], mode='gc_vac', forget_exact_path=False,
-                                      phase_angle=0):
+                                      phase_angle=0, packet_size=1, steps_per_gyroperiod=32,
+                                      record_every=1, record_interval=0, sink=None):
     r"""
     Follows particles spawned at random locations on the magnetic axis with random pitch angle.
     See :mod:`simsopt.field.tracing.trace_particles` for the governing equations.
@@ -219,11 +445,19 @@ def trace_particles_starting_on_curve(curve, field, nparticles, tmax=1e-4,
         mode: how to trace the particles. options are
             `gc`: general guiding center equations,
             `gc_vac`: simplified guiding center equations for the case :math:`\nabla p=0`,
-            `full`: full orbit calculation (slow!)
+            `full`: full orbit calculation (slow!),
+            `full_boris`: full orbit calculation with the Boris pusher, a fixed
+            step method that conserves the energy exactly
         forget_exact_path: return only the first and last position of each
                            particle for the ``res_tys``. To be used when only res_phi_hits is of
-                           interest or one wants to reduce memory usage.
+                           interest or one wants to reduce memory usage. Takes
+                           precedence over ``record_every`` and ``record_interval``.
         phase_angle: the phase angle to use in the case of full orbit calculations
+        packet_size: see :mod:`simsopt.field.tracing.trace_particles`
+        steps_per_gyroperiod: see :mod:`simsopt.field.tracing.trace_particles`
+        record_every: see :mod:`simsopt.field.tracing.trace_particles`
+        record_interval: see :mod:`simsopt.field.tracing.trace_particles`
+        sink: see :mod:`simsopt.field.tracing.trace_particles`
 
     Returns: see :mod:`simsopt.field.tracing.trace_particles`
     """
@@ -237,7 +471,8 @@ def trace_particles_starting_on_curve(curve, field, nparticles, tmax=1e-4,
         field, xyz, speed_par, tmax=tmax, mass=mass, charge=charge,
         Ekin=Ekin, tol=tol, comm=comm, phis=phis,
         stopping_criteria=stopping_criteria, mode=mode, forget_exact_path=forget_exact_path,
-        phase_angle=phase_angle)
+        phase_angle=phase_angle, packet_size=packet_size, steps_per_gyroperiod=steps_per_gyroperiod,
+        record_every=record_every, record_interval=record_interval, sink=sink)
 
 
 def trace_particles_starting_on_surface(surface, field, nparticles, tmax=1e-4,
@@ -245,7 +480,8 @@ def trace_particles_starting_on_surface(surface, field, nparticles, tmax=1e-4,
                                         Ekin=FUSION_ALPHA_PARTICLE_ENERGY,
                                         tol=1e-9, comm=None, seed=1, umin=-1, umax=+1,
                                         phis=[], stopping_criteria=[], mode='gc_vac', forget_exact_path=False,
-                                        phase_angle=0):
+                                        phase_angle=0, packet_size=1, steps_per_gyroperiod=32,
+                                        record_every=1, record_interval=0, sink=None):
     r"""
     Follows particles spawned at random locations on the magnetic axis with random pitch angle.
     See :mod:`simsopt.field.tracing.trace_particles` for the governing equations.
@@ -275,11 +511,19 @@ def trace_particles_starting_on_surface(surface, field, nparticles, tmax=1e-4,
         mode: how to trace the particles. options are
             `gc`: general guiding center equations,
             `gc_vac`: simplified guiding center equations for the case :math:`\nabla p=0`,
-            `full`: full orbit calculation (slow!)
+            `full`: full orbit calculation (slow!),
+            `full_boris`: full orbit calculation with the Boris pusher, a fixed
+            step method that conserves the energy exactly
         forget_exact_path: return only the first and last position of each
                            particle for the ``res_tys``. To be used when only res_phi_hits is of
-                           interest or one wants to reduce memory usage.
+                           interest or one wants to reduce memory usage. Takes
+                           precedence over ``record_every`` and ``record_interval``.
         phase_angle: the phase angle to use in the case of full orbit calculations
+        packet_size: see :mod:`simsopt.field.tracing.trace_particles`
+        steps_per_gyroperiod: see :mod:`simsopt.field.tracing.trace_particles`
+        record_every: see :mod:`simsopt.field.tracing.trace_particles`
+        record_interval: see :mod:`simsopt.field.tracing.trace_particles`
+        sink: see :mod:`simsopt.field.tracing.trace_particles`
 
     Returns: see :mod:`simsopt.field.tracing.trace_particles`
     """
@@ -293,10 +537,98 @@ def trace_particles_starting_on_surface(surface, field, nparticles, tmax=1e-4,
         field, xyz, speed_par, tmax=tmax, mass=mass, charge=charge,
         Ekin=Ekin, tol=tol, comm=comm, phis=phis,
         stopping_criteria=stopping_criteria, mode=mode, forget_exact_path=forget_exact_path,
-        phase_angle=phase_angle)
+        phase_angle=phase_angle, packet_size=packet_size, steps_per_gyroperiod=steps_per_gyroperiod,
+        record_every=record_every, record_interval=record_interval, sink=sink)
+
+
+def trace_particles_boozer(field, stz_inits: NDArray[Float],
+                           parallel_speeds: NDArray[Float], tmax=1e-4,
+                           mass=ALPHA_PARTICLE_MASS, charge=ALPHA_PARTICLE_CHARGE, Ekin=FUSION_ALPHA_PARTICLE_ENERGY,
+                           tol=1e-9, comm=None, s_surfaces=[], stopping_criteria=[], forget_exact_path=False,
+                           record_every=1, record_interval=0, sink=None):
+    r"""
+    Follow the guiding centers of particles in Boozer coordinates
+    :math:`(s, \theta, \zeta)`. Compared to :obj:`trace_particles`, this only
+    requires :math:`|B|` on each surface and the profiles :math:`G`, :math:`I`
+    and :math:`\iota`, which are much cheaper to evaluate than a field in
+    cartesian coordinates. With :math:`\psi=\psi_0 s`,
+    :math:`\rho = m v_{||}/|B|` and the Hamiltonian :math:`H = \rho^2|B|^2/(2m) + m\mu|B|`
+    we solve
+
+    .. math::
+
+        \dot\psi   &= -(G H_\theta - I H_\zeta)/D\\
+        \dot\theta &= (G H_\psi - C H_\rho)/D\\
+        \dot\zeta  &= (A H_\rho - I H_\psi)/D\\
+        \dot\rho   &= -(A H_\zeta - C H_\theta)/D
+
+    where :math:`A = q + \rho I'(\psi)`, :math:`C = \rho G'(\psi) - q\iota`
+    and :math:`D = AG - IC`, see e.g. [The Theory of Toroidally Confined
+    Plasmas, R.B. White]. The radial covariant component of the field is
+    neglected.
+
+    Args:
+        field: The :obj:`simsopt.field.boozermagneticfield.BoozerSpectralField`.
+        stz_inits: A (nparticles, 3) array with the initial positions of the particles in Boozer coordinates.
+        parallel_speeds: A (nparticles, ) array containing the speed in direction of the B field
+                         for each particle.
+        tmax: integration time
+        mass: particle mass in kg, defaults to the mass of an alpha particle
+        charge: charge in Coulomb, defaults to the charge of an alpha particle
+        Ekin: kinetic energy in Joule, defaults to 3.52MeV
+        tol: tolerance for the adaptive ode solver
+        comm: MPI communicator to parallelize over
+        s_surfaces: list of values of ``s`` for which the crossings of the
+                    particles with the corresponding surface should be computed
+        stopping_criteria: list of stopping criteria, evaluated at
+                           :math:`(s, \theta, \zeta)`, e.g.
+                           :obj:`MaxToroidalFluxStoppingCriterion` to detect
+                           particles that are lost through the boundary
+                           ``s=1`` and :obj:`MinToroidalFluxStoppingCriterion`
+                           to stop particles that get too close to the axis.
+        forget_exact_path: return only the first and last position of each
+                           particle for the ``res_tys``. Takes precedence over
+                           ``record_every`` and ``record_interval``.
+        record_every: see :obj:`trace_particles`
+        record_interval: see :obj:`trace_particles`
+        sink: see :obj:`trace_particles`
 
+    Returns: the result of ``sink.finalize``. For the default sink, a 2 element tuple containing
+        - ``res_tys``:
+            A list of numpy arrays (one for each particle), each row contains
+            `[t, s, theta, zeta, v_par]`.
+        - ``res_s_hits``:
+            A list of numpy arrays (one for each particle) containing
+            information on each time the particle crosses one of the surfaces
+            or satisfies one of the stopping criteria. Each row of the array
+            contains `[time] + [idx] + state`. If `idx>=0`, then
+            `s_surfaces[int(idx)]` was crossed. If `idx<0`, then
+            `stopping_criteria[int(-idx)-1]` was hit, so for a
+            ``MaxToroidalFluxStoppingCriterion`` the time of that row is the
+            loss time of the particle.
+    """
+    nparticles = stz_inits.shape[0]
+    assert stz_inits.shape[0] == len(parallel_speeds)
+    check_stopping_criteria(stopping_criteria, boozer=True)
+    m = mass
+    speed_total = sqrt(2*Ekin/m)  # Ekin = 0.5 * m * v^2 <=> v = sqrt(2*Ekin/m)
 
-def compute_fieldlines(field, R0, Z0, tmax=200, tol=1e-7, phis=[], stopping_criteria=[], comm=None):
+    if forget_exact_path:
+        record = sopp.RecordOptions(0, 0.)
+    else:
+        record = sopp.RecordOptions(record_every, record_interval)
+
+    def trace(first, last):
+        return sopp.particle_guiding_center_boozer_tracing_batch(
+            field, np.ascontiguousarray(stz_inits[first:last, :]), m, charge, speed_total,
+            np.asarray(parallel_speeds[first:last], dtype=float), tmax, tol,
+            s_surfaces=s_surfaces, stopping_criteria=stopping_criteria, record=record)
+
+    return trace_to_sink(trace, nparticles, tmax, comm, MemorySink() if sink is None else sink)
+
+
+def compute_fieldlines(field, R0, Z0, tmax=200, tol=1e-7, phis=[], stopping_criteria=[], comm=None, packet_size=1,
+                       record_every=1, record_interval=0, sink=None):
     r"""
     Compute magnetic field lines by solving
 
@@ -315,8 +647,14 @@ def compute_fieldlines(field, R0, Z0, tmax=200, tol=1e-7, phis=[], stopping_crit
         stopping_criteria: list of stopping criteria, mostly used in
                            combination with the ``LevelsetStoppingCriterion``
                            accessed via :obj:`simsopt.field.tracing.SurfaceClassifier`.
+        comm: MPI communicator to parallelize over
+        packet_size: the number of field lines that each thread advances in
+                     lockstep, see :obj:`trace_particles`.
+        record_every: see :obj:`trace_particles`
+        record_interval: see :obj:`trace_particles`
+        sink: see :obj:`trace_particles`
 
-    Returns: 2 element tuple containing
+    Returns: the result of ``sink.finalize``. For the default sink, a 2 element tuple containing
         - ``res_tys``:
             A list of numpy arrays (one for each particle) describing the
             solution over time. The numpy array is of shape (ntimesteps, 4).
@@ -331,25 +669,20 @@ def compute_fieldlines(field, R0, Z0, tmax=200, tol=1e-7, phis=[], stopping_crit
             was hit. If `idx<0`, then `stopping_criteria[int(-idx)-1]` was hit.
     """
     assert len(R0) == len(Z0)
+    check_stopping_criteria(stopping_criteria, boozer=False)
     nlines = len(R0)
     xyz_inits = np.zeros((nlines, 3))
     xyz_inits[:, 0] = np.asarray(R0)
     xyz_inits[:, 2] = np.asarray(Z0)
-    res_tys = []
-    res_phi_hits = []
-    first, last = parallel_loop_bounds(comm, nlines)
-    for i in range(first, last):
-        res_ty, res_phi_hit = sopp.fieldline_tracing(
-            field, xyz_inits[i, :],
-            tmax, tol, phis=phis, stopping_criteria=stopping_criteria)
-        res_tys.append(np.asarray(res_ty))
-        res_phi_hits.append(np.asarray(res_phi_hit))
-        dtavg = res_ty[-1][0]/len(res_ty)
-        logger.debug(f"{i+1:3d}/{nlines}, t_final={res_ty[-1][0]}, average timestep {dtavg:.10f}s")
-    if comm is not None:
-        res_tys = [i for o in comm.allgather(res_tys) for i in o]
-        res_phi_hits = [i for o in comm.allgather(res_phi_hits) for i in o]
-    return res_tys, res_phi_hits
+    record = sopp.RecordOptions(record_every, record_interval)
+
+    def trace(first, last):
+        return sopp.fieldline_tracing_batch(
+            field, xyz_inits[first:last, :],
+            tmax, tol, phis=phis, stopping_criteria=stopping_criteria, packet_size=packet_size,
+            record=record)
+
+    return trace_to_sink(trace, nlines, tmax, comm, MemorySink() if sink is None else sink)
 
 
 def particles_to_vtk(res_tys, filename):
@@ -376,7 +709,7 @@ class LevelsetStoppingCriterion(sopp.LevelsetStoppingCriterion):
 
     def __init__(self, classifier):
         assert isinstance(classifier, SurfaceClassifier) \
-            or isinstance(classifier, sopp.RegularGridInterpolant3D)
+            or isinstance(classifier, sopp.Interpolant3D)
         if isinstance(classifier, SurfaceClassifier):
             sopp.LevelsetStoppingCriterion.__init__(self, classifier.dist)
         else:
@@ -390,6 +723,23 @@ class IterationStoppingCriterion(sopp.IterationStoppingCriterion):
     pass
 
 
+class MinToroidalFluxStoppingCriterion(sopp.MinToroidalFluxStoppingCriterion):
+    """
+    For tracing in Boozer coordinates, stop the iteration once the normalized
+    toroidal flux ``s`` drops below the given value.
+    """
+    pass
+
+
+class MaxToroidalFluxStoppingCriterion(sopp.MaxToroidalFluxStoppingCriterion):
+    """
+    For tracing in Boozer coordinates, stop the iteration once the normalized
+    toroidal flux ``s`` reaches the given value, e.g. ``s=1`` to detect lost
+    particles.
+    """
+    pass
+
+
 def plot_poincare_data(fieldlines_phi_hits, phis, filename, mark_lost=False, aspect='equal', dpi=300):
     """
     Create a poincare plot. Usage:
@@ -1,6 +1,104 @@
 from scipy.optimize import minimize, least_squares
+from scipy.sparse.linalg import LinearOperator, gmres
+from scipy.linalg import lu_factor, lu_solve
 import numpy as np
-from simsopt.geo.surfaceobjectives import boozer_surface_residual
+from simsopt.geo.surfaceobjectives import boozer_surface_residual, boozer_surface_residual_operators
+
+
+class BoozerNewtonState():
+    r"""
+    State of the Newton solvers of :obj:`BoozerSurface` that is kept across
+    iterations and across calls. It stores the matrix of the last Newton
+    system that was assembled, its LU factorization, and the last solution.
+
+    The factorization is computed once per matrix and used for the iterative
+    refinement of the Newton steps. If the solvers are called with
+    ``reuse_factorization=True``, the factorization is also reused for the
+    following Newton steps (chord method) and for subsequent calls, e.g. when
+    the Boozer surface is recomputed from the previous solution in every
+    iteration of a coil optimization. The matrix is only assembled and
+    factorized again after ``max_chord_steps`` steps, or when the norm of the
+    residual decreases by less than a factor ``stall_ratio`` in a step
+    (Shamanskii method). A step with a matrix of an earlier iterate that
+    increases the residual is discarded and repeated with the matrix at the
+    previous iterate.
+
+    Newton steps may be regularized by adding ``shift`` times the identity to
+    the matrix (``stab`` in :mod:`BoozerSurface.minimize_boozer_penalty_constraints_newton`).
+    The stored matrix never contains the shift, and ``matrix_x`` is the
+    iterate at which it was assembled.
+
+    Adjoint systems with the (unshifted) matrix at the last solution ``x``
+    can be solved using :mod:`solve_adjoint`. The stored factorization is
+    used if the matrix was assembled at ``x``, otherwise the matrix is
+    assembled and factorized at ``x`` first. This has to happen before the
+    field or the problem changes, e.g. before the coils of an outer
+    optimization are updated.
+    """
+
+    def __init__(self, max_chord_steps=5, stall_ratio=0.25):
+        self.max_chord_steps = max_chord_steps
+        self.stall_ratio = stall_ratio
+        self.key = None
+        self.matrix = None
+        self.matrix_x = None
+        self.shift = 0.
+        self.lu = None
+        self.lu_adjoint = None
+        self.x = None
+        self.assemble = None
+        self.nfactorizations = 0
+
+    def matches(self, key, n):
+        """
+        Whether the stored matrix belongs to the problem ``key`` with ``n`` unknowns.
+        """
+        return self.matrix is not None and self.key == key and self.matrix.shape[0] == n
+
+    def update(self, key, A, x, shift=0.):
+        """
+        Store the matrix ``A`` of the problem ``key``, assembled at the iterate
+        ``x``. ``A + shift*I`` is factorized on the first solve.
+        """
+        self.key = key
+        self.matrix = A
+        self.matrix_x = x.copy()
+        self.shift = shift
+        self.lu = None
+        self.lu_adjoint = None
+
+    def factorization(self):
+        if self.lu is None:
+            self.lu = lu_factor(self.matrix + self.shift*np.identity(self.matrix.shape[0]))
+            self.nfactorizations += 1
+        return self.lu
+
+    def solve(self, b, refine=False):
+        """
+        Solve ``(A + shift*I) x = b`` for the stored matrix ``A``, optionally
+        followed by one step of iterative refinement for higher accuracy.
+        """
+        lu = self.factorization()
+        x = lu_solve(lu, b)
+        if refine:
+            x += lu_solve(lu, b - self.matrix @ x - self.shift*x)
+        return x
+
+    def solve_adjoint(self, b):
+        """
+        Solve ``A^T y = b`` for the matrix ``A`` at the last solution ``x``
+        (without the shift).
+        """
+        if not np.array_equal(self.matrix_x, self.x):
+            self.update(self.key, self.assemble(self.x), self.x, self.shift)
+        if self.shift == 0:
+            lu = self.factorization()
+        else:
+            if self.lu_adjoint is None:
+                self.lu_adjoint = lu_factor(self.matrix)
+                self.nfactorizations += 1
+            lu = self.lu_adjoint
+        return lu_solve(lu, b, trans=1)
 
 
 class BoozerSurface():
@@ -24,9 +122,10 @@ class BoozerSurface():
 
         #. :mod:`minimize_boozer_penalty_constraints_LBFGS`
         #. :mod:`minimize_boozer_penalty_constraints_newton`
+        #. :mod:`minimize_boozer_penalty_constraints_newton_krylov`
         #. :mod:`minimize_boozer_penalty_constraints_ls`
 
-    where LBFGS, Newton, or :mod:`scipy.optimize.least_squares` optimizers are used, respectively.
+    where LBFGS, Newton, Newton-Krylov, or :mod:`scipy.optimize.least_squares` optimizers are used, respectively.
     Alternatively, the exactly constrained least squares optimization problem can be solved.
     This is done in
 
@@ -40,6 +139,7 @@ class BoozerSurface():
         self.surface = surface
         self.label = label
         self.targetlabel = targetlabel
+        self.newton_state = BoozerNewtonState()
 
     def boozer_penalty_constraints(self, x, derivatives=0, constraint_weight=1., scalarize=True, optimize_G=False):
         r"""
@@ -79,7 +179,7 @@ class BoozerSurface():
 
         s.set_dofs(sdofs)
 
-        boozer = boozer_surface_residual(s, iota, G, bs, derivatives=derivatives)
+        boozer = boozer_surface_residual(s, iota, G, bs, derivatives=derivatives, contract_hessian=True)
 
         r = boozer[0]
 
@@ -119,16 +219,62 @@ class BoozerSurface():
         if not scalarize:
             raise NotImplementedError('Can only return Hessian for scalarized version.')
 
-        H = boozer[2]
+        # the Hessian of the boozer residuals, already contracted with the residuals
+        rH = boozer[2]
 
         d2l = np.zeros((x.shape[0], x.shape[0]))
         d2l[:nsurfdofs, :nsurfdofs] = self.label.d2J_by_dsurfacecoefficientsdsurfacecoefficients()
 
-        H = np.concatenate((
-            H,
-            np.sqrt(constraint_weight) * d2l[None, :, :],
-            np.zeros(d2l[None, :, :].shape)), axis=0)
-        d2val = J.T @ J + np.sum(r[:, None, None] * H, axis=0)
+        # the second derivatives of rz vanish since the surface is linear in its dofs
+        d2val = J.T @ J + rH + r[-2] * np.sqrt(constraint_weight) * d2l
+        return val, dval, d2val
+
+    def boozer_penalty_constraints_operators(self, x, constraint_weight=1., optimize_G=False):
+        r"""
+        Matrix free version of :mod:`boozer_penalty_constraints` with
+        ``derivatives=2``. Returns :math:`J(x)`, its gradient, and its Hessian
+        as a ``scipy.sparse.linalg.LinearOperator``. The Hessian vector
+        products are computed by :obj:`simsopt.geo.surfaceobjectives.boozer_surface_residual_operators`,
+        so neither the Jacobian of the Boozer residual nor the Hessian is formed.
+        """
+        if optimize_G:
+            sdofs = x[:-2]
+            iota = x[-2]
+            G = x[-1]
+        else:
+            sdofs = x[:-1]
+            iota = x[-1]
+            G = None
+
+        nsurfdofs = sdofs.size
+        s = self.surface
+        s.set_dofs(sdofs)
+
+        r, J, rH = boozer_surface_residual_operators(s, iota, G, self.bs)
+
+        rl = self.label.J() - self.targetlabel
+        rz = s.gamma()[0, 0, 2] - 0.
+        val = 0.5 * np.sum(r**2) + 0.5 * constraint_weight * (rl**2 + rz**2)
+
+        dl = np.zeros(x.shape)
+        drz = np.zeros(x.shape)
+        dl[:nsurfdofs] = self.label.dJ_by_dsurfacecoefficients()
+        e = np.zeros(s.gamma().shape)
+        e[0, 0, 2] = 1.
+        drz[:nsurfdofs] = s.dgamma_by_dcoeff_vjp(e)
+        dval = J.rmatvec(r) + constraint_weight * (rl * dl + rz * drz)
+
+        d2l = self.label.d2J_by_dsurfacecoefficientsdsurfacecoefficients()
+
+        def matvec(v):
+            v = v.reshape((-1, ))
+            res = J.rmatvec(J.matvec(v)) + rH.matvec(v) \
+                + constraint_weight * (dl * (dl @ v) + drz * (drz @ v))
+            # the second derivatives of rz vanish since the surface is linear in its dofs
+            res[:nsurfdofs] += constraint_weight * rl * (d2l @ v[:nsurfdofs])
+            return res
+
+        d2val = LinearOperator((x.size, x.size), matvec=matvec, rmatvec=matvec, dtype=np.float64)
         return val, dval, d2val
 
     def boozer_exact_constraints(self, xl, derivatives=0, optimize_G=True):
@@ -164,7 +310,7 @@ class BoozerSurface():
         s.set_dofs(sdofs)
         nsurfdofs = sdofs.size
 
-        boozer = boozer_surface_residual(s, iota, G, bs, derivatives=derivatives+1)
+        boozer = boozer_surface_residual(s, iota, G, bs, derivatives=derivatives+1, contract_hessian=True)
         r, J = boozer[0:2]
 
         dl = np.zeros((xl.shape[0]-2,))
@@ -183,13 +329,13 @@ class BoozerSurface():
         if derivatives == 0:
             return res
 
-        H = boozer[2]
+        rH = boozer[2]
 
         d2l = np.zeros((xl.shape[0]-2, xl.shape[0]-2))
         d2l[:nsurfdofs, :nsurfdofs] = self.label.d2J_by_dsurfacecoefficientsdsurfacecoefficients()
 
         dres = np.zeros((xl.shape[0], xl.shape[0]))
-        dres[:-2, :-2] = J.T @ J + np.sum(r[:, None, None] * H, axis=0) - lm[-2]*d2l
+        dres[:-2, :-2] = J.T @ J + rH - lm[-2]*d2l
         dres[:-2, -2] = -dl
         dres[:-2, -1] = -drz
 
@@ -237,10 +383,74 @@ class BoozerSurface():
 
         return resdict
 
-    def minimize_boozer_penalty_constraints_newton(self, tol=1e-12, maxiter=10, constraint_weight=1., iota=0., G=None, stab=0.):
+    def minimize_boozer_penalty_constraints_newton(self, tol=1e-12, maxiter=10, constraint_weight=1., iota=0., G=None, stab=0.,
+                                                   reuse_factorization=False):
         """
         This function does the same as :mod:`minimize_boozer_penalty_constraints_LBFGS`, but instead of LBFGS it uses
-        Newton's method.
+        Newton's method. For ``reuse_factorization=True``, the factorization of the
+        Hessian is reused across Newton steps and calls, see :obj:`BoozerNewtonState`.
+        In that case, the returned ``"hessian"`` is the last Hessian that was
+        assembled, which may belong to an earlier iterate, or None if the
+        factorization of a previous call was used throughout.
+        """
+        s = self.surface
+        if G is None:
+            x = np.concatenate((s.get_dofs(), [iota]))
+        else:
+            x = np.concatenate((s.get_dofs(), [iota, G]))
+        last = {}
+
+        def fun(x, derivatives):
+            if not derivatives:
+                return self.boozer_penalty_constraints(
+                    x, derivatives=1, constraint_weight=constraint_weight, optimize_G=G is not None)[1], None
+            val, dval, d2val = self.boozer_penalty_constraints(
+                x, derivatives=2, constraint_weight=constraint_weight, optimize_G=G is not None)
+            last['hessian'] = d2val
+            return dval, d2val
+
+        key = ('penalty', G is not None, constraint_weight, stab)
+        x, dval, i, norm = self._newton(key, x, fun, slice(None), tol, maxiter, reuse_factorization, shift=stab)
+
+        r = self.boozer_penalty_constraints(
+            x, derivatives=0, constraint_weight=constraint_weight, scalarize=False, optimize_G=G is not None)
+        res = {
+            "residual": r, "jacobian": dval, "hessian": last.get('hessian', None), "iter": i, "success": norm <= tol, "G": None,
+        }
+        if G is None:
+            s.set_dofs(x[:-1])
+            iota = x[-1]
+        else:
+            s.set_dofs(x[:-2])
+            iota = x[-2]
+            G = x[-1]
+            res['G'] = G
+        res['s'] = s
+        res['iota'] = iota
+        return res
+
+    def minimize_boozer_penalty_constraints_newton_krylov(self, tol=1e-12, maxiter=10, constraint_weight=1., iota=0., G=None, stab=0., krylov_maxiter=100):
+        r"""
+        This function does the same as :mod:`minimize_boozer_penalty_constraints_newton`, but the Newton
+        systems are solved with GMRES using the Hessian vector products from
+        :mod:`boozer_penalty_constraints_operators`, so that the Hessian is
+        never formed. This reduces the memory needed from
+        ``O(nphi*ntheta*ndofs**2)`` to ``O(nphi*ntheta*ndofs)`` and allows
+        for surfaces with many dofs. See
+        :obj:`simsopt.geo.surfaceobjectives.boozer_surface_residual_operators`
+        for which surfaces avoid the dense derivatives with respect to the
+        surface dofs.
+
+        GMRES is preconditioned by the Gauss-Newton approximation
+        :math:`\nabla \mathbf r^T \nabla \mathbf r` of the Hessian at the
+        initial guess, which is factorized once. This is a good
+        preconditioner when the initial guess is close to the solution, e.g.
+        when it was obtained from a solve using :mod:`minimize_boozer_penalty_constraints_LBFGS` or
+        a solve on a surface with lower resolution. ``krylov_maxiter`` is the
+        maximum number of GMRES iterations per Newton step. If GMRES does not
+        reach its tolerance within these iterations, the step is not applied
+        and the iteration stops with ``"success": False``; the returned
+        ``"gmres_info"`` is the ``info`` of the last GMRES solve.
         """
         s = self.surface
         if G is None:
@@ -248,25 +458,37 @@ class BoozerSurface():
         else:
             x = np.concatenate((s.get_dofs(), [iota, G]))
         i = 0
+        info = 0
+
+        r, J = self.boozer_penalty_constraints(
+            x, derivatives=1, constraint_weight=constraint_weight, scalarize=False, optimize_G=G is not None)
+        lu = lu_factor(J.T @ J + stab*np.identity(x.size))
+        del J
+        precond = LinearOperator((x.size, x.size), matvec=lambda v: lu_solve(lu, v), dtype=np.float64)
 
-        val, dval, d2val = self.boozer_penalty_constraints(
-            x, derivatives=2, constraint_weight=constraint_weight, optimize_G=G is not None)
+        val, dval, d2val = self.boozer_penalty_constraints_operators(
+            x, constraint_weight=constraint_weight, optimize_G=G is not None)
         norm = np.linalg.norm(dval)
         while i < maxiter and norm > tol:
-            d2val += stab*np.identity(d2val.shape[0])
-            dx = np.linalg.solve(d2val, dval)
-            if norm < 1e-9:
-                dx += np.linalg.solve(d2val, dval - d2val@dx)
+            A = d2val
+            if stab > 0:
+                A = d2val + stab * LinearOperator((x.size, x.size), matvec=lambda v: v, dtype=np.float64)
+            # solve inexactly far away from the solution, and more accurately as we converge
+            dx, info = gmres(A, dval, M=precond, atol=min(0.1, np.sqrt(norm)) * norm,
+                             restart=krylov_maxiter, maxiter=1)
+            if info != 0:
+                # the Krylov solve failed, so dx need not be a descent direction
+                break
             x = x - dx
-            val, dval, d2val = self.boozer_penalty_constraints(
-                x, derivatives=2, constraint_weight=constraint_weight, optimize_G=G is not None)
+            val, dval, d2val = self.boozer_penalty_constraints_operators(
+                x, constraint_weight=constraint_weight, optimize_G=G is not None)
             norm = np.linalg.norm(dval)
             i = i+1
 
         r = self.boozer_penalty_constraints(
             x, derivatives=0, constraint_weight=constraint_weight, scalarize=False, optimize_G=G is not None)
         res = {
-            "residual": r, "jacobian": dval, "hessian": d2val, "iter": i, "success": norm <= tol, "G": None,
+            "residual": r, "jacobian": dval, "iter": i, "success": norm <= tol, "G": None, "gmres_info": info,
         }
         if G is None:
             s.set_dofs(x[:-1])
@@ -345,7 +567,7 @@ class BoozerSurface():
         resdict['iota'] = iota
         return resdict
 
-    def minimize_boozer_exact_constraints_newton(self, tol=1e-12, maxiter=10, iota=0., G=None, lm=[0., 0.]):
+    def minimize_boozer_exact_constraints_newton(self, tol=1e-12, maxiter=10, iota=0., G=None, lm=[0., 0.], reuse_factorization=False):
         r"""
         This function solves the constrained optimization problem
 
@@ -364,31 +586,32 @@ class BoozerSurface():
 
         The final constraint is not necessary for stellarator symmetric surfaces as it is automatically
         satisfied by the stellarator symmetric surface parametrization.
+
+        For ``reuse_factorization=True``, the factorization of the Jacobian of
+        the optimality conditions is reused across Newton steps and calls, see
+        :obj:`BoozerNewtonState`. In that case, the returned ``"jacobian"`` is
+        the last Jacobian that was assembled, which may belong to an earlier
+        iterate, or None if the factorization of a previous call was used
+        throughout.
         """
         s = self.surface
         if G is not None:
             xl = np.concatenate((s.get_dofs(), [iota, G], lm))
         else:
             xl = np.concatenate((s.get_dofs(), [iota], lm))
-        val, dval = self.boozer_exact_constraints(xl, derivatives=1, optimize_G=G is not None)
-        norm = np.linalg.norm(val)
-        i = 0
-        while i < maxiter and norm > tol:
-            if s.stellsym:
-                A = dval[:-1, :-1]
-                b = val[:-1]
-                dx = np.linalg.solve(A, b)
-                if norm < 1e-9:  # iterative refinement for higher accuracy. TODO: cache LU factorisation
-                    dx += np.linalg.solve(A, b-A@dx)
-                xl[:-1] = xl[:-1] - dx
-            else:
-                dx = np.linalg.solve(dval, val)
-                if norm < 1e-9:  # iterative refinement for higher accuracy. TODO: cache LU factorisation
-                    dx += np.linalg.solve(dval, val-dval@dx)
-                xl = xl - dx
+        # the constraint z(0, 0) = 0 is satisfied automatically for stellsym surfaces
+        idx = slice(None, -1) if s.stellsym else slice(None)
+        last = {}
+
+        def fun(xl, derivatives):
+            if not derivatives:
+                return self.boozer_exact_constraints(xl, derivatives=0, optimize_G=G is not None), None
             val, dval = self.boozer_exact_constraints(xl, derivatives=1, optimize_G=G is not None)
-            norm = np.linalg.norm(val)
-            i = i + 1
+            last['jacobian'] = dval
+            return val, dval[idx, idx]
+
+        key = ('exact', G is not None, s.stellsym)
+        xl, val, i, norm = self._newton(key, xl, fun, idx, tol, maxiter, reuse_factorization)
 
         if s.stellsym:
             lm = xl[-2]
@@ -396,7 +619,7 @@ class BoozerSurface():
             lm = xl[-2:]
 
         res = {
-            "residual": val, "jacobian": dval, "iter": i, "success": norm <= tol, "lm": lm, "G": None,
+            "residual": val, "jacobian": last.get('jacobian', None), "iter": i, "success": norm <= tol, "lm": lm, "G": None,
         }
         if G is not None:
             s.set_dofs(xl[:-4])
@@ -410,6 +633,55 @@ class BoozerSurface():
         res['iota'] = iota
         return res
 
+    def _newton(self, key, x, fun, idx, tol, maxiter, reuse_factorization, shift=0.):
+        """
+        Newton's method for ``F(x) = 0``, where ``fun(x, derivatives)`` returns
+        ``F(x)`` and, if ``derivatives`` is true, the derivative of ``F(x)[idx]``
+        with respect to ``x[idx]`` (and None otherwise). The steps solve with
+        the derivative plus ``shift`` times the identity. Only ``x[idx]`` is
+        updated. Returns the solution, ``F`` at the solution, the number of
+        iterations and the norm of ``F``.
+
+        A step with a matrix of an earlier iterate (or call) that increases the
+        norm of ``F`` is discarded, and the step is repeated with the matrix
+        at the previous iterate.
+        """
+        state = self.newton_state
+        state.assemble = lambda x: fun(x, True)[1]
+        x = x.copy()
+        if reuse_factorization and state.matches(key, x[idx].size):
+            F, _ = fun(x, False)
+        else:
+            F, A = fun(x, True)
+            state.update(key, A, x, shift)
+        norm = np.linalg.norm(F)
+        i = 0
+        nchord = 0
+        while i < maxiter and norm > tol:
+            x_old, F_old, norm_old = x.copy(), F, norm
+            # iterative refinement for higher accuracy
+            x[idx] = x[idx] - state.solve(F[idx], refine=norm < 1e-9)
+            i += 1
+            nchord += 1
+            if reuse_factorization:
+                F, _ = fun(x, False)
+                norm = np.linalg.norm(F)
+                if norm > norm_old and not np.array_equal(state.matrix_x, x_old):
+                    x, F, norm = x_old, F_old, norm_old
+                    _, A = fun(x, True)
+                    state.update(key, A, x, shift)
+                    nchord = 0
+                elif norm > tol and (norm > state.stall_ratio * norm_old or nchord >= state.max_chord_steps):
+                    F, A = fun(x, True)
+                    state.update(key, A, x, shift)
+                    nchord = 0
+            else:
+                F, A = fun(x, True)
+                state.update(key, A, x, shift)
+                norm = np.linalg.norm(F)
+        state.x = x.copy()
+        return x, F, i, norm
+
     def solve_residual_equation_exactly_newton(self, tol=1e-10, maxiter=10, iota=0., G=None):
         """
         This function solves the Boozer Surface residual equation exactly.  For
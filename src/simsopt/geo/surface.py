@@ -274,31 +274,35 @@ class Surface(Optimizable):
         return AR
 
 
+def surface_distance(surface):
+    """
+    Construct a :obj:`simsoptpp.SurfaceDistance` object, which computes the
+    exact signed distance to ``surface``. The surface is sampled on a grid
+    that covers the whole torus and is fine enough to resolve all its Fourier
+    modes, so that the parametric surface is represented exactly. Surfaces
+    that can't be evaluated at arbitrary points are converted with
+    ``to_RZFourier`` first.
+    """
+    if not all(hasattr(surface, attr) for attr in ["gamma_lin", "mpol", "ntor", "nfp"]):
+        surface = surface.to_RZFourier()
+    # The cylindrical angle adds one toroidal mode to the cartesian
+    # coordinates. Beyond that, the grid is refined so that the closest point
+    # on its triangulation is a good initial guess for Newton's method.
+    nphi = max(4 * (surface.nfp * surface.ntor + 2), 128)
+    ntheta = max(4 * (surface.mpol + 1), 64)
+    phis, thetas = np.meshgrid(np.linspace(0, 1, nphi, endpoint=False),
+                               np.linspace(0, 1, ntheta, endpoint=False), indexing="ij")
+    gamma = np.zeros((nphi*ntheta, 3))
+    surface.gamma_lin(gamma, phis.flatten(), thetas.flatten())
+    return sopp.SurfaceDistance(gamma.reshape((nphi, ntheta, 3)))
+
+
 def signed_distance_from_surface(xyz, surface):
     """
     Compute the signed distances from points ``xyz`` to a surface.  The sign is
     positive for points inside the volume surrounded by the surface.
     """
-    gammas = surface.gamma().reshape((-1, 3))
-    from scipy.spatial import KDTree
-    tree = KDTree(gammas)
-    _, mins = tree.query(xyz, k=1)  # find closest points on the surface
-
-    n = surface.unitnormal().reshape((-1, 3))
-    nmins = n[mins]
-    gammamins = gammas[mins]
-
-    # Now that we have found the closest node, we approximate the surface with
-    # a plane through that node with the appropriate normal and then compute
-    # the distance from the point to that plane
-    # https://stackoverflow.com/questions/55189333/how-to-get-distance-from-point-to-plane-in-3d
-    mindist = np.sum((xyz-gammamins) * nmins, axis=1)
-
-    a_point_in_the_surface = np.mean(surface.gamma()[0, :, :], axis=0)
-    sign_of_interiorpoint = np.sign(np.sum((a_point_in_the_surface-gammas[0, :])*n[0, :]))
-
-    signed_dists = mindist * sign_of_interiorpoint
-    return signed_dists
+    return surface_distance(surface).signed_distance(np.asarray(xyz, dtype=np.float64))
 
 
 class SurfaceClassifier():
@@ -306,14 +310,23 @@ class SurfaceClassifier():
     Takes in a toroidal surface and constructs an interpolant of the signed distance function
     :math:`f:R^3\to R` that is positive inside the volume contained by the surface,
     (approximately) zero on the surface, and negative outisde the volume contained by the surface.
+    The signed distance at the interpolation nodes is computed exactly (see
+    :obj:`surface_distance`), in C++ and in parallel across threads.
     """
 
-    def __init__(self, surface, p=1, h=0.05):
+    def __init__(self, surface, p=1, h=0.05, comm=None, skip=None):
         """
         Args:
             surface: the surface to contruct the distance from.
             p: degree of the interpolant
             h: grid resolution of the interpolant
+            comm: if not ``None``, the evaluation of the distance at the
+                  interpolation nodes is split across this MPI communicator.
+            skip: if not ``None``, a function that takes lists ``(rs, phis, zs)``
+                  of points and returns a list of booleans indicating which
+                  points are of no interest. Cells for which all corners are
+                  flagged are not interpolated, and the distance can't be
+                  evaluated there.
         """
         gammas = surface.gamma()
         r = np.linalg.norm(gammas[:, :, :2], axis=2)
@@ -330,24 +343,32 @@ class SurfaceClassifier():
         nphi = int(2*np.pi/h)
         nz = int((self.zrange[1]-self.zrange[0])/h)
 
-        def fbatch(rs, phis, zs):
-            xyz = np.zeros((len(rs), 3))
-            xyz[:, 0] = rs * np.cos(phis)
-            xyz[:, 1] = rs * np.sin(phis)
-            xyz[:, 2] = zs
-            return list(signed_distance_from_surface(xyz, surface))
-
+        sdist = surface_distance(surface)
         rule = sopp.UniformInterpolationRule(p)
         self.dist = sopp.RegularGridInterpolant3D(
             rule, [rmin, rmax, nr], [0., 2*np.pi, nphi], [zmin, zmax, nz], 1, True)
-        self.dist.interpolate_batch(fbatch)
+        if skip is not None:
+            self.dist.skip_cells(skip)
+        if comm is None:
+            sdist.interpolate(self.dist)
+        else:
+            rs, phis, zs = self.dist.interpolation_nodes()
+            n = len(rs)
+            first, last = (comm.rank * n) // comm.size, ((comm.rank + 1) * n) // comm.size
+            vals = sdist.signed_distance_cyl(rs[first:last], phis[first:last], zs[first:last])
+            self.dist.set_values([v for vs in comm.allgather(vals) for v in vs])
 
     def evaluate(self, xyz):
         rphiz = np.zeros_like(xyz)
         rphiz[:, 0] = np.linalg.norm(xyz[:, :2], axis=1)
         rphiz[:, 1] = np.mod(np.arctan2(xyz[:, 1], xyz[:, 0]), 2*np.pi)
         rphiz[:, 2] = xyz[:, 2]
-        d = np.zeros((xyz.shape[0], 1))
+        return self.evaluate_rphiz(rphiz)
+
+    def evaluate_rphiz(self, rphiz):
+        rphiz = np.array(rphiz, dtype=np.float64)
+        rphiz[:, 1] = np.mod(rphiz[:, 1], 2*np.pi)
+        d = np.zeros((rphiz.shape[0], 1))
         self.dist.evaluate_batch(rphiz, d)
         return d
 
@@ -1,4 +1,5 @@
 import numpy as np
+from scipy.sparse.linalg import LinearOperator
 import simsoptpp as sopp
 
 
@@ -131,7 +132,7 @@ class ToroidalFlux(object):
         return out
 
 
-def boozer_surface_residual(surface, iota, G, biotsavart, derivatives=0):
+def boozer_surface_residual(surface, iota, G, biotsavart, derivatives=0, contract_hessian=False):
     r"""
     For a given surface, this function computes the
     residual
@@ -146,6 +147,15 @@ def boozer_surface_residual(surface, iota, G, biotsavart, derivatives=0):
 
     :math:`G` is known for exact boozer surfaces, so if ``G=None`` is passed, then that
     value is used instead.
+
+    For ``derivatives=2`` the Hessian of the residual has shape
+    ``(nphi*ntheta*3, ndofs, ndofs)``. Usually only its contraction with a
+    vector is needed, e.g. ``np.sum(r[:, None, None] * H, axis=0)`` for the
+    Hessian of :math:`\frac{1}{2}\|\mathbf r\|^2`. If ``contract_hessian=True``,
+    this contraction with the residual is returned instead of the Hessian. It
+    is accumulated over the quadrature points in C++, see
+    ``boozer_residual.h``, without forming any array with a
+    ``(nphi, ntheta, ..., ndofs, ndofs)`` shape.
     """
 
     user_provided_G = G is not None
@@ -199,8 +209,14 @@ def boozer_surface_residual(surface, iota, G, biotsavart, derivatives=0):
         return r, J
 
     d2B_by_dXdX = biotsavart.d2B_by_dXdX().reshape((nphi, ntheta, 3, 3, 3))
-    d2B_dcdc = np.einsum('ijkpl,ijpn,ijkm->ijlmn', d2B_by_dXdX, dx_dc, dx_dc)
+    if contract_hessian:
+        H = sopp.boozer_residual_hessian_contracted(
+            residual, G, iota, B, dB_by_dX, d2B_by_dXdX, xphi, xtheta, np.ascontiguousarray(dx_dc),
+            np.ascontiguousarray(dxphi_dc), np.ascontiguousarray(dxtheta_dc), user_provided_G)
+        return r, J, H
+
     dB2_dc = 2. * np.einsum('ijl,ijlm->ijm', B, dB_dc)
+    d2B_dcdc = np.einsum('ijkpl,ijpn,ijkm->ijlmn', d2B_by_dXdX, dx_dc, dx_dc)
 
     term1 = np.einsum('ijlm,ijln->ijmn', dB_dc, dB_dc)
     term2 = np.einsum('ijlmn,ijl->ijmn', d2B_dcdc, B)
@@ -246,6 +262,115 @@ def boozer_surface_residual(surface, iota, G, biotsavart, derivatives=0):
     return r, J, H
 
 
+def boozer_surface_residual_operators(surface, iota, G, biotsavart):
+    r"""
+    Matrix free version of :obj:`boozer_surface_residual` with
+    ``derivatives=2, contract_hessian=True``. Returns the residual
+    :math:`\mathbf r` and two ``scipy.sparse.linalg.LinearOperator`` objects:
+    the Jacobian :math:`J` of the residual with respect to the surface dofs,
+    iota, and G (if G is provided), and the Hessian of the residual contracted
+    with the residual, :math:`\sum_i r_i \nabla^2 r_i`.
+
+    The operators only use the products with the derivatives of the surface
+    with respect to its dofs, ``dgamma*_by_dcoeff_matvec`` and
+    ``dgamma*_by_dcoeff_vjp``, and the field and its derivatives on the
+    quadrature points. No array with more than ``O(nphi*ntheta)`` entries
+    is formed, so that the memory needed does not grow with the number of
+    dofs squared. This only holds for surfaces that override these products,
+    currently :obj:`SurfaceRZFourier` and :obj:`SurfaceXYZFourier`; for other
+    surfaces the products fall back to the dense ``dgamma*_by_dcoeff``
+    arrays of size ``O(nphi*ntheta*ndofs)``.
+
+    The contractions with the field and its derivatives are NumPy einsums on
+    arrays of size ``O(nphi*ntheta)``, and are evaluated once per product.
+    """
+
+    user_provided_G = G is not None
+    if not user_provided_G:
+        G = 2. * np.pi * np.sum(np.abs(biotsavart.coil_currents)) * (4 * np.pi * 10**(-7) / (2 * np.pi))
+
+    x = surface.gamma()
+    xphi = surface.gammadash1()
+    xtheta = surface.gammadash2()
+    nphi = x.shape[0]
+    ntheta = x.shape[1]
+    nsurfdofs = surface.get_dofs().size
+    ndofs = nsurfdofs + (2 if user_provided_G else 1)
+
+    biotsavart.set_points(x.reshape((x.size//3, 3)).copy())
+    biotsavart.compute(2)
+    B = biotsavart.B().reshape((nphi, ntheta, 3))
+    dB_by_dX = biotsavart.dB_by_dX().reshape((nphi, ntheta, 3, 3))
+    d2B_by_dXdX = biotsavart.d2B_by_dXdX().reshape((nphi, ntheta, 3, 3, 3))
+
+    tang = xphi + iota * xtheta
+    B2 = np.sum(B**2, axis=2)
+    residual = G*B - B2[..., None] * tang
+    r = residual.reshape((nphi*ntheta*3, ))
+
+    # the second derivatives of the field contracted with the residual, see
+    # boozer_residual.h
+    rtang = np.sum(residual * tang, axis=2)
+    rxtheta = np.sum(residual * xtheta, axis=2)
+    M = np.einsum('ijkpl,ijl->ijkp', d2B_by_dXdX, G * residual - 2 * rtang[..., None] * B)
+
+    def dB_matvec(dx):
+        return np.einsum('ijkl,ijk->ijl', dB_by_dX, dx)
+
+    def dB_vjp(v):
+        return np.einsum('ijkl,ijl->ijk', dB_by_dX, v)
+
+    def jac_matvec(v):
+        v = v.reshape((-1, ))
+        vc = v[:nsurfdofs]
+        dB = dB_matvec(surface.dgamma_by_dcoeff_matvec(vc))
+        dB2 = 2 * np.sum(B * dB, axis=2)
+        dtang = surface.dgammadash1_by_dcoeff_matvec(vc) + iota * surface.dgammadash2_by_dcoeff_matvec(vc)
+        res = G * dB - dB2[..., None] * tang - B2[..., None] * (dtang + v[nsurfdofs] * xtheta)
+        if user_provided_G:
+            res += v[nsurfdofs+1] * B
+        return res.reshape((-1, ))
+
+    def jac_rmatvec(w):
+        w = w.reshape((nphi, ntheta, 3))
+        wtang = np.sum(w * tang, axis=2)
+        res = np.zeros((ndofs, ))
+        res[:nsurfdofs] = surface.dgamma_by_dcoeff_vjp(dB_vjp(G * w - 2 * wtang[..., None] * B)) \
+            + surface.dgammadash1_by_dcoeff_vjp(-B2[..., None] * w) \
+            + surface.dgammadash2_by_dcoeff_vjp(-iota * B2[..., None] * w)
+        res[nsurfdofs] = -np.sum(B2[..., None] * w * xtheta)
+        if user_provided_G:
+            res[nsurfdofs+1] = np.sum(w * B)
+        return res
+
+    def hess_matvec(v):
+        v = v.reshape((-1, ))
+        vc = v[:nsurfdofs]
+        viota = v[nsurfdofs]
+        dx = surface.dgamma_by_dcoeff_matvec(vc)
+        dxtheta = surface.dgammadash2_by_dcoeff_matvec(vc)
+        dtang = surface.dgammadash1_by_dcoeff_matvec(vc) + iota * dxtheta
+        dB = dB_matvec(dx)
+        dB2 = 2 * np.sum(B * dB, axis=2)
+        rdtang = np.sum(residual * dtang, axis=2)
+
+        y = -2 * rtang[..., None] * dB - 2 * (rdtang + viota * rxtheta)[..., None] * B
+        if user_provided_G:
+            y += v[nsurfdofs+1] * residual
+        res = np.zeros((ndofs, ))
+        res[:nsurfdofs] = surface.dgamma_by_dcoeff_vjp(np.einsum('ijkp,ijp->ijk', M, dx) + dB_vjp(y)) \
+            + surface.dgammadash1_by_dcoeff_vjp(-dB2[..., None] * residual) \
+            + surface.dgammadash2_by_dcoeff_vjp(-(iota * dB2 + viota * B2)[..., None] * residual)
+        res[nsurfdofs] = -np.sum(rxtheta * dB2) - np.sum(B2[..., None] * residual * dxtheta)
+        if user_provided_G:
+            res[nsurfdofs+1] = np.sum(residual * dB)
+        return res
+
+    J = LinearOperator((r.size, ndofs), matvec=jac_matvec, rmatvec=jac_rmatvec, dtype=np.float64)
+    rH = LinearOperator((ndofs, ndofs), matvec=hess_matvec, rmatvec=hess_matvec, dtype=np.float64)
+    return r, J, rH
+
+
 class QfmResidual(object):
     r"""
     For a given surface :math:`S`, this class computes the residual
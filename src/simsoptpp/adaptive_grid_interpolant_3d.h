@@ -0,0 +1,99 @@
+#pragma once
+
+#include "regular_grid_interpolant_3d.h"
+
+// Interpolates a (vector valued) function on an adaptively refined grid. The
+// grid starts out as a uniform grid of nx*ny*nz cells, as used by
+// `RegularGridInterpolant3D`. On each cell the function is interpolated by a
+// polynomial of the given degree and compared to the function at a few sample
+// points inside the cell; if the error is larger than `tol`, the cell is split
+// into eight children (an octree), up to `max_level` times. In addition, cells
+// for which all corners are flagged by the `skip` function (e.g. because they
+// lie outside of the plasma) are not interpolated at all.
+//
+// Note that, unlike the interpolant on the regular grid, the interpolant is
+// not continuous across the boundary between cells of different size. The
+// jump is of the order of the tolerance.
+template<class Array>
+class AdaptiveGridInterpolant3D : public Interpolant3D<Array> {
+    private:
+        struct Cell {
+            int children;  // index of the first of the eight children, -1 for leaves
+            int vals_idx;  // index of the values of a leaf, -1 if the cell was skipped
+        };
+
+        const int nx, ny, nz;
+        const double xmin, ymin, zmin;
+        const double xmax, ymax, zmax;
+        double hx, hy, hz;
+        const int value_size;
+        int padded_value_size;
+        int local_vals_size;
+        const double tol;
+        const int max_level;
+        static const int simdcount = xsimd::simd_type<double>::size;
+        const InterpolationRule rule;
+        // The first nx*ny*nz cells are the cells of the uniform grid, all
+        // further cells are the result of refinement.
+        std::vector<Cell> cells;
+        AlignedVec all_local_vals;
+        int nskipped_cells = 0;
+
+        inline int idx_cell(int i, int j, int k){
+            return i*ny*nz + j*nz + k;
+        }
+
+        inline int idx_dof_local(int i, int j, int k){
+            int degree = rule.degree;
+            return i*(degree+1)*(degree+1) + j*(degree+1) + k;
+        }
+
+        // Returns the leaf that contains (x, y, z) and overwrites (x, y, z)
+        // with the local coordinates in that leaf.
+        int find_leaf(double& x, double& y, double& z);
+
+    public:
+        bool extrapolate;
+
+        AdaptiveGridInterpolant3D(InterpolationRule rule, RangeTriplet xrange, RangeTriplet yrange, RangeTriplet zrange, int value_size, bool extrapolate, double tol, int max_level) :
+            rule(rule),
+            xmin(std::get<0>(xrange)), xmax(std::get<1>(xrange)), nx(std::get<2>(xrange)),
+            ymin(std::get<0>(yrange)), ymax(std::get<1>(yrange)), ny(std::get<2>(yrange)),
+            zmin(std::get<0>(zrange)), zmax(std::get<1>(zrange)), nz(std::get<2>(zrange)),
+            value_size(value_size), extrapolate(extrapolate), tol(tol), max_level(max_level)
+        {
+            if(tol <= 0)
+                throw std::logic_error("The tolerance of the adaptive interpolant has to be positive.");
+            if(max_level < 0 || max_level > 20)
+                throw std::logic_error("The maximum refinement level has to lie in [0, 20].");
+            int degree = rule.degree;
+            hx = (xmax-xmin)/nx;
+            hy = (ymax-ymin)/ny;
+            hz = (zmax-zmin)/nz;
+            padded_value_size = (value_size + simdcount) - (value_size % simdcount);
+            local_vals_size = (degree+1)*(degree+1)*(degree+1)*padded_value_size;
+        }
+
+        // Build the interpolant. `f` is evaluated at all nodes of all cells of
+        // one refinement level at once. If `skip` is given, it is called with
+        // the corners of the cells of each level and returns for each point
+        // whether it lies outside of the region of interest.
+        void interpolate_batch(std::function<Vec(Vec, Vec, Vec)> &f, std::function<std::vector<bool>(Vec, Vec, Vec)> &skip);
+        void interpolate_batch(std::function<Vec(Vec, Vec, Vec)> &f) {
+            std::function<std::vector<bool>(Vec, Vec, Vec)> noskip;
+            interpolate_batch(f, noskip);
+        }
+
+        void evaluate_batch(Array& xyz, Array& fxyz) override;
+        Vec evaluate(double x, double y, double z) override;
+        void evaluate_inplace(double x, double y, double z, double* res) override;
+        // Estimates the error at randomly sampled points, ignoring points in
+        // cells that were skipped.
+        std::pair<double, double> estimate_error(std::function<Vec(Vec, Vec, Vec)> &f, int samples) override;
+        bool is_skipped(double x, double y, double z) override;
+
+        // Number of cells on which the function is interpolated.
+        int ncells() { return all_local_vals.size()/local_vals_size; }
+        // Number of cells that were skipped.
+        int nskipped() { return nskipped_cells; }
+};
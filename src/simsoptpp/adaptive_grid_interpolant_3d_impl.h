@@ -0,0 +1,242 @@
+#include "adaptive_grid_interpolant_3d.h"
+#include <xtensor/xarray.hpp>
+#include "xtensor/xlayout.hpp"
+#include <cmath>
+
+#define _ADAPTIVE_EPS_ 1e-13
+
+template<class Array>
+const int AdaptiveGridInterpolant3D<Array>::simdcount;
+
+template<class Array>
+void AdaptiveGridInterpolant3D<Array>::interpolate_batch(std::function<Vec(Vec, Vec, Vec)> &f, std::function<std::vector<bool>(Vec, Vec, Vec)> &skip) {
+    struct Box {
+        int cell;
+        double x, y, z; // lower corner of the cell
+    };
+    int degree = rule.degree;
+    int nnodes_local = (degree+1)*(degree+1)*(degree+1);
+    // the error is checked at the tensor product of the two point Gauss
+    // Legendre rule, which doesn't coincide with the interpolation nodes.
+    const double gauss[2] = {0.5-0.5/std::sqrt(3.), 0.5+0.5/std::sqrt(3.)};
+    const int nsamples = 8;
+
+    cells = std::vector<Cell>(nx*ny*nz, Cell{-1, -1});
+    all_local_vals = AlignedVec();
+    nskipped_cells = 0;
+    std::vector<Box> boxes;
+    for (int i = 0; i < nx; ++i) {
+        for (int j = 0; j < ny; ++j) {
+            for (int k = 0; k < nz; ++k) {
+                boxes.push_back({idx_cell(i, j, k), xmin + i*hx, ymin + j*hy, zmin + k*hz});
+            }
+        }
+    }
+
+    for (int level = 0; level <= max_level && boxes.size() > 0; ++level) {
+        double scale = std::pow(0.5, level);
+        double hxl = scale*hx, hyl = scale*hy, hzl = scale*hz;
+
+        if(skip) {
+            int nboxes = boxes.size();
+            Vec cx(8*nboxes), cy(8*nboxes), cz(8*nboxes);
+            for (int b = 0; b < nboxes; ++b) {
+                for (int o = 0; o < 8; ++o) {
+                    cx[8*b+o] = boxes[b].x + ((o >> 2) & 1)*hxl;
+                    cy[8*b+o] = boxes[b].y + ((o >> 1) & 1)*hyl;
+                    cz[8*b+o] = boxes[b].z + (o & 1)*hzl;
+                }
+            }
+            std::vector<bool> outside = skip(cx, cy, cz);
+            if(outside.size() != 8*nboxes)
+                throw std::runtime_error(fmt::format("The skip function returned {} values for {} points.", outside.size(), 8*nboxes));
+            std::vector<Box> kept;
+            for (int b = 0; b < nboxes; ++b) {
+                bool all_outside = true;
+                for (int o = 0; o < 8; ++o)
+                    all_outside = all_outside && outside[8*b+o];
+                if(all_outside)
+                    nskipped_cells++;
+                else
+                    kept.push_back(boxes[b]);
+            }
+            boxes = kept;
+            if(boxes.size() == 0)
+                break;
+        }
+
+        int nboxes = boxes.size();
+        bool check = level < max_level;
+        int npoints_per_box = nnodes_local + (check ? nsamples : 0);
+        Vec px(npoints_per_box*nboxes), py(npoints_per_box*nboxes), pz(npoints_per_box*nboxes);
+        for (int b = 0; b < nboxes; ++b) {
+            int offset = b*npoints_per_box;
+            for (int i = 0; i < degree+1; ++i) {
+                for (int j = 0; j < degree+1; ++j) {
+                    for (int k = 0; k < degree+1; ++k) {
+                        int idx = offset + idx_dof_local(i, j, k);
+                        px[idx] = boxes[b].x + rule.nodes[i]*hxl;
+                        py[idx] = boxes[b].y + rule.nodes[j]*hyl;
+                        pz[idx] = boxes[b].z + rule.nodes[k]*hzl;
+                    }
+                }
+            }
+            if(check) {
+                for (int s = 0; s < nsamples; ++s) {
+                    int idx = offset + nnodes_local + s;
+                    px[idx] = boxes[b].x + gauss[(s >> 2) & 1]*hxl;
+                    py[idx] = boxes[b].y + gauss[(s >> 1) & 1]*hyl;
+                    pz[idx] = boxes[b].z + gauss[s & 1]*hzl;
+                }
+            }
+        }
+        Vec fxyz = f(px, py, pz);
+        if(fxyz.size() != value_size*npoints_per_box*nboxes)
+            throw std::runtime_error(fmt::format("The function returned {} values for {} points and value size {}.", fxyz.size(), npoints_per_box*nboxes, value_size));
+
+        std::vector<Box> refine;
+        Vec res(value_size, 0.);
+        for (int b = 0; b < nboxes; ++b) {
+            int offset = b*npoints_per_box;
+            int vals_idx = all_local_vals.size()/local_vals_size;
+            all_local_vals.resize((vals_idx+1)*local_vals_size, 0.);
+            double* vals_local = all_local_vals.data() + vals_idx*local_vals_size;
+            for (int n = 0; n < nnodes_local; ++n)
+                for (int l = 0; l < value_size; ++l)
+                    vals_local[n*padded_value_size + l] = fxyz[(offset+n)*value_size + l];
+            double err = 0.;
+            if(check) {
+                for (int s = 0; s < nsamples; ++s) {
+                    evaluate_local_vals(rule, value_size, padded_value_size, vals_local,
+                            gauss[(s >> 2) & 1], gauss[(s >> 1) & 1], gauss[s & 1], res.data());
+                    for (int l = 0; l < value_size; ++l)
+                        err = std::max(err, std::abs(res[l] - fxyz[(offset+nnodes_local+s)*value_size + l]));
+                }
+            }
+            if(err > tol) {
+                all_local_vals.resize(vals_idx*local_vals_size);
+                int children = cells.size();
+                cells[boxes[b].cell].children = children;
+                for (int o = 0; o < 8; ++o) {
+                    cells.push_back({-1, -1});
+                    refine.push_back({children + o,
+                            boxes[b].x + ((o >> 2) & 1)*0.5*hxl,
+                            boxes[b].y + ((o >> 1) & 1)*0.5*hyl,
+                            boxes[b].z + (o & 1)*0.5*hzl});
+                }
+            } else {
+                cells[boxes[b].cell].vals_idx = vals_idx;
+            }
+        }
+        boxes = refine;
+    }
+    all_local_vals.shrink_to_fit();
+}
+
+template<class Array>
+int AdaptiveGridInterpolant3D<Array>::find_leaf(double& x, double& y, double& z) {
+    int xidx = std::min(std::max(int(nx*(x-xmin)/(xmax-xmin)), 0), nx-1);
+    int yidx = std::min(std::max(int(ny*(y-ymin)/(ymax-ymin)), 0), ny-1);
+    int zidx = std::min(std::max(int(nz*(z-zmin)/(zmax-zmin)), 0), nz-1);
+    x = (x-xmin)/hx - xidx;
+    y = (y-ymin)/hy - yidx;
+    z = (z-zmin)/hz - zidx;
+    int cell = idx_cell(xidx, yidx, zidx);
+    while(cells[cell].children >= 0) {
+        int o = 0;
+        if(x >= 0.5) { o += 4; x = 2*x-1; } else { x = 2*x; }
+        if(y >= 0.5) { o += 2; y = 2*y-1; } else { y = 2*y; }
+        if(z >= 0.5) { o += 1; z = 2*z-1; } else { z = 2*z; }
+        cell = cells[cell].children + o;
+    }
+    return cell;
+}
+
+template<class Array>
+void AdaptiveGridInterpolant3D<Array>::evaluate_inplace(double x, double y, double z, double* res){
+    if(cells.size() == 0)
+        throw std::runtime_error("The interpolant needs to be built before it can be evaluated.");
+    if(this->extrapolate){
+        x = std::max(std::min(x, xmax-_ADAPTIVE_EPS_), xmin+_ADAPTIVE_EPS_);
+        y = std::max(std::min(y, ymax-_ADAPTIVE_EPS_), ymin+_ADAPTIVE_EPS_);
+        z = std::max(std::min(z, zmax-_ADAPTIVE_EPS_), zmin+_ADAPTIVE_EPS_);
+    } else {
+        if(x < xmin || x >= xmax)
+            throw std::runtime_error(fmt::format("x={} not within [{}, {}]", x, xmin, xmax));
+        if(y < ymin || y >= ymax)
+            throw std::runtime_error(fmt::format("y={} not within [{}, {}]", y, ymin, ymax));
+        if(z < zmin || z >= zmax)
+            throw std::runtime_error(fmt::format("z={} not within [{}, {}]", z, zmin, zmax));
+    }
+    double xlocal = x, ylocal = y, zlocal = z;
+    int cell = find_leaf(xlocal, ylocal, zlocal);
+    int vals_idx = cells[cell].vals_idx;
+    if(vals_idx < 0)
+        throw std::runtime_error(fmt::format("({}, {}, {}) lies in a cell that was skipped when building the interpolant.", x, y, z));
+    evaluate_local_vals(rule, value_size, padded_value_size, all_local_vals.data() + vals_idx*local_vals_size, xlocal, ylocal, zlocal, res);
+}
+
+template<class Array>
+bool AdaptiveGridInterpolant3D<Array>::is_skipped(double x, double y, double z){
+    if(cells.size() == 0)
+        return false;
+    x = std::max(std::min(x, xmax-_ADAPTIVE_EPS_), xmin+_ADAPTIVE_EPS_);
+    y = std::max(std::min(y, ymax-_ADAPTIVE_EPS_), ymin+_ADAPTIVE_EPS_);
+    z = std::max(std::min(z, zmax-_ADAPTIVE_EPS_), zmin+_ADAPTIVE_EPS_);
+    return cells[find_leaf(x, y, z)].vals_idx < 0;
+}
+
+template<class Array>
+void AdaptiveGridInterpolant3D<Array>::evaluate_batch(Array& xyz, Array& fxyz){
+    if(fxyz.layout() != xt::layout_type::row_major)
+          throw std::runtime_error("fxyz needs to be in row-major storage order");
+    int npoints = xyz.shape(0);
+    for (int i = 0; i < npoints; ++i) {
+        evaluate_inplace(xyz(i, 0), xyz(i, 1), xyz(i, 2), fxyz.data() + value_size*i);
+    }
+}
+
+template<class Array>
+Vec AdaptiveGridInterpolant3D<Array>::evaluate(double x, double y, double z){
+    Vec fxyz(value_size, 0.);
+    evaluate_inplace(x, y, z, fxyz.data());
+    return fxyz;
+}
+
+template<class Array>
+std::pair<double, double> AdaptiveGridInterpolant3D<Array>::estimate_error(std::function<Vec(Vec, Vec, Vec)> &f, int samples) {
+    std::default_random_engine generator;
+    std::uniform_real_distribution<double> distribution(0.0, +1.0);
+    Vec xs, ys, zs;
+    for (int i = 0; i < samples; ++i) {
+        double x = xmin + distribution(generator)*(xmax-xmin);
+        double y = ymin + distribution(generator)*(ymax-ymin);
+        double z = zmin + distribution(generator)*(zmax-zmin);
+        double xlocal = x, ylocal = y, zlocal = z;
+        if(cells[find_leaf(xlocal, ylocal, zlocal)].vals_idx < 0)
+            continue;
+        xs.push_back(x);
+        ys.push_back(y);
+        zs.push_back(z);
+    }
+    int n = xs.size();
+    if(n < 2)
+        throw std::runtime_error("Not enough samples in cells that were not skipped.");
+    Vec fx = f(xs, ys, zs);
+    Vec fhx(value_size, 0.);
+    double err = 0;
+    double errsq = 0;
+    for (int i = 0; i < n; ++i) {
+        evaluate_inplace(xs[i], ys[i], zs[i], fhx.data());
+        double diff = 0.;
+        for (int l = 0; l < value_size; ++l) {
+            diff += std::pow(fx[value_size*i+l]-fhx[l], 2);
+        }
+        diff = std::sqrt(diff);
+        err += diff;
+        errsq += diff*diff;
+    }
+    double mean = err/n;
+    double std = std::sqrt((errsq - err*err/n)/(n-1)/n);
+    return std::make_pair(mean-std, mean+std);
+}
@@ -1,5 +1,11 @@
 #pragma once
 #include "simdhelpers.h"
 
-template<class T, int derivs>
-void biot_savart_kernel(vector_type& pointsx, vector_type& pointsy, vector_type& pointsz, T& gamma, T& dgamma_by_dphi, T& B, T& dB_by_dX, T& d2B_by_dXdX);
+template<class T, int derivs, class S>
+void biot_savart_kernel(vector_type& pointsx, vector_type& pointsy, vector_type& pointsz, T& gamma, T& dgamma_by_dphi, S& B, S& dB_by_dX, S& d2B_by_dXdX, int start, int end);
+
+template<class T, int derivs, class S>
+void biot_savart_kernel_A(vector_type& pointsx, vector_type& pointsy, vector_type& pointsz, T& gamma, T& dgamma_by_dphi, S& A, S& dA_by_dX, S& d2A_by_dXdX, int start, int end);
+
+template<class T, int derivs, class S>
+void biot_savart_kernel_float(vector_type& pointsx, vector_type& pointsy, vector_type& pointsz, T& gamma, T& dgamma_by_dphi, S& B, S& dB_by_dX, int start, int end);
@@ -1,6 +1,7 @@
 #include "simdhelpers.h"
 #include "vec3dsimd.h"
 #include <stdexcept>
+#include <algorithm>
 #include "xtensor/xlayout.hpp"
 
 
@@ -17,13 +18,33 @@
 #endif
 
 
-template<class T, int derivs>
-void biot_savart_kernel(vector_type& pointsx, vector_type& pointsy, vector_type& pointsz, T& gamma, T& dgamma_by_dphi, T& B, T& dB_by_dX, T& d2B_by_dXdX) {
+// Number of targets per block when the work for `ncoils` coils and `npoints`
+// targets is split into tiles of one coil and one block of targets. We aim for
+// about four tiles per thread to balance the load, but don't use blocks of
+// less than 64 targets since then the overhead per tile dominates. Blocks are
+// a multiple of 16 targets long, so that they start at a multiple of the simd
+// width (also for floats with AVX512).
+inline int biot_savart_block_size(int ncoils, int npoints, int nthreads) {
+    const int align = 16;
+    const int min_block_size = 64;
+    int nblocks = std::max(1, (4*nthreads + ncoils - 1)/std::max(ncoils, 1));
+    int block_size = std::max((npoints + nblocks - 1)/nblocks, min_block_size);
+    return ((block_size + align - 1)/align)*align;
+}
+
+// Only the points with indices in [start, end) are computed (end = -1 means
+// up to the last point), which allows to split the targets of a coil into
+// blocks, see `BiotSavart::compute`. `start` has to be a multiple of the simd
+// width. The outputs may be of a different array type than the curve, e.g.
+// plain xtensor scratch arrays, see `BiotSavart::compute_accumulated`. The
+// same holds for `biot_savart_kernel_A` and `biot_savart_kernel_float`.
+template<class T, int derivs, class S=T>
+void biot_savart_kernel(vector_type& pointsx, vector_type& pointsy, vector_type& pointsz, T& gamma, T& dgamma_by_dphi, S& B, S& dB_by_dX, S& d2B_by_dXdX, int start=0, int end=-1) {
     if(gamma.layout() != xt::layout_type::row_major)
           throw std::runtime_error("gamma needs to be in row-major storage order");
     if(dgamma_by_dphi.layout() != xt::layout_type::row_major)
           throw std::runtime_error("dgamma_by_dphi needs to be in row-major storage order");
-    int num_points         = pointsx.size();
+    int num_points         = end < 0 ? pointsx.size() : end;
     int num_quad_points    = gamma.shape(0);
     constexpr int simd_size = xsimd::simd_type<double>::size;
     auto dB_dX_i = vector<Vec3dSimd, xs::aligned_allocator<Vec3dSimd, XSIMD_DEFAULT_ALIGNMENT>>();
@@ -45,7 +66,7 @@ void biot_savart_kernel(vector_type& pointsx, vector_type& pointsy, vector_type&
     double* dgamma_j_by_dphi_ptr = &(dgamma_by_dphi(0, 0));
     // out vectors pointsx, pointsy, and pointsz are added and aligned, so we
     // don't have to worry about going out of bounds here
-    for(int i = 0; i < num_points; i += simd_size) {
+    for(int i = start; i < num_points; i += simd_size) {
         auto point_i = Vec3dSimd(&(pointsx[i]), &(pointsy[i]), &(pointsz[i]));
         auto B_i   = Vec3dSimd();
         MYIF(derivs > 0) {
@@ -160,3 +181,278 @@ void biot_savart_kernel(vector_type& pointsx, vector_type& pointsy, vector_type&
         }
     }
 }
+
+// Computes the vector potential
+//
+//     A(x) = 1e-7/N \sum_j \Gamma'(\phi_j) / |x - \Gamma(\phi_j)|
+//
+// and its first and second derivatives for a single coil with unit current.
+// The layout matches the one of `biot_savart_kernel`, i.e. dA_by_dX(i, j, l)
+// contains \partial_j A_l(x_i) and d2A_by_dXdX(i, j, k, l) contains
+// \partial_j\partial_k A_l(x_i).
+template<class T, int derivs, class S=T>
+void biot_savart_kernel_A(vector_type& pointsx, vector_type& pointsy, vector_type& pointsz, T& gamma, T& dgamma_by_dphi, S& A, S& dA_by_dX, S& d2A_by_dXdX, int start=0, int end=-1) {
+    if(gamma.layout() != xt::layout_type::row_major)
+          throw std::runtime_error("gamma needs to be in row-major storage order");
+    if(dgamma_by_dphi.layout() != xt::layout_type::row_major)
+          throw std::runtime_error("dgamma_by_dphi needs to be in row-major storage order");
+    int num_points         = end < 0 ? pointsx.size() : end;
+    int num_quad_points    = gamma.shape(0);
+    constexpr int simd_size = xsimd::simd_type<double>::size;
+    // all derivatives of A are scalar multiples of \Gamma'(\phi_j); by
+    // symmetry only six of the nine second derivatives need to be computed.
+    Vec3dSimd dA_dX_i[3];
+    Vec3dSimd d2A_dXdX_i[6];
+    double fak = (1e-7/num_quad_points);
+    double* gamma_j_ptr = &(gamma(0, 0));
+    double* dgamma_j_by_dphi_ptr = &(dgamma_by_dphi(0, 0));
+    for(int i = start; i < num_points; i += simd_size) {
+        auto point_i = Vec3dSimd(&(pointsx[i]), &(pointsy[i]), &(pointsz[i]));
+        auto A_i   = Vec3dSimd();
+        MYIF(derivs > 0) {
+            dA_dX_i[0] *= 0.; dA_dX_i[1] *= 0.; dA_dX_i[2] *= 0.;
+        }
+        MYIF(derivs > 1) {
+            d2A_dXdX_i[0] *= 0.; d2A_dXdX_i[1] *= 0.; d2A_dXdX_i[2] *= 0.;
+            d2A_dXdX_i[3] *= 0.; d2A_dXdX_i[4] *= 0.; d2A_dXdX_i[5] *= 0.;
+        }
+        for (int j = 0; j < num_quad_points; ++j) {
+            auto diff = point_i - Vec3dSimd(gamma_j_ptr[3*j+0], gamma_j_ptr[3*j+1], gamma_j_ptr[3*j+2]);
+            auto norm_diff_2     = normsq(diff);
+            auto norm_diff_inv   = rsqrt(norm_diff_2);
+            auto dgamma_by_dphi_j_simd = Vec3dSimd(dgamma_j_by_dphi_ptr[3*j+0], dgamma_j_by_dphi_ptr[3*j+1], dgamma_j_by_dphi_ptr[3*j+2]);
+
+            A_i.x = xsimd::fma(dgamma_by_dphi_j_simd.x, norm_diff_inv, A_i.x);
+            A_i.y = xsimd::fma(dgamma_by_dphi_j_simd.y, norm_diff_inv, A_i.y);
+            A_i.z = xsimd::fma(dgamma_by_dphi_j_simd.z, norm_diff_inv, A_i.z);
+
+            MYIF(derivs > 0) {
+                auto norm_diff_3_inv = norm_diff_inv*norm_diff_inv*norm_diff_inv;
+#pragma unroll
+                for(int k=0; k<3; k++) {
+                    auto w = -diff[k]*norm_diff_3_inv;
+                    dA_dX_i[k].x = xsimd::fma(w, dgamma_by_dphi_j_simd.x, dA_dX_i[k].x);
+                    dA_dX_i[k].y = xsimd::fma(w, dgamma_by_dphi_j_simd.y, dA_dX_i[k].y);
+                    dA_dX_i[k].z = xsimd::fma(w, dgamma_by_dphi_j_simd.z, dA_dX_i[k].z);
+                }
+                MYIF(derivs > 1) {
+                    auto norm_diff_5_inv_3 = norm_diff_3_inv*norm_diff_inv*norm_diff_inv*3.;
+                    int idx = 0;
+#pragma unroll
+                    for(int k1=0; k1<3; k1++) {
+#pragma unroll
+                        for(int k2=0; k2<=k1; k2++) {
+                            auto w = diff[k1]*diff[k2]*norm_diff_5_inv_3;
+                            if(k1 == k2)
+                                w -= norm_diff_3_inv;
+                            d2A_dXdX_i[idx].x = xsimd::fma(w, dgamma_by_dphi_j_simd.x, d2A_dXdX_i[idx].x);
+                            d2A_dXdX_i[idx].y = xsimd::fma(w, dgamma_by_dphi_j_simd.y, d2A_dXdX_i[idx].y);
+                            d2A_dXdX_i[idx].z = xsimd::fma(w, dgamma_by_dphi_j_simd.z, d2A_dXdX_i[idx].z);
+                            idx++;
+                        }
+                    }
+                }
+            }
+        }
+        // discard the entries beyond num_points, see `biot_savart_kernel`.
+        int jlimit = std::min(simd_size, num_points-i);
+        for(int j=0; j<jlimit; j++){
+            A(i+j, 0) = fak * A_i.x[j];
+            A(i+j, 1) = fak * A_i.y[j];
+            A(i+j, 2) = fak * A_i.z[j];
+            MYIF(derivs > 0) {
+                for(int k=0; k<3; k++) {
+                    dA_by_dX(i+j, k, 0) = fak*dA_dX_i[k].x[j];
+                    dA_by_dX(i+j, k, 1) = fak*dA_dX_i[k].y[j];
+                    dA_by_dX(i+j, k, 2) = fak*dA_dX_i[k].z[j];
+                }
+            }
+            MYIF(derivs > 1) {
+                int idx = 0;
+                for(int k1=0; k1<3; k1++) {
+                    for(int k2=0; k2<=k1; k2++) {
+                        d2A_by_dXdX(i+j, k1, k2, 0) = fak*d2A_dXdX_i[idx].x[j];
+                        d2A_by_dXdX(i+j, k1, k2, 1) = fak*d2A_dXdX_i[idx].y[j];
+                        d2A_by_dXdX(i+j, k1, k2, 2) = fak*d2A_dXdX_i[idx].z[j];
+                        if(k2 < k1){
+                            d2A_by_dXdX(i+j, k2, k1, 0) = fak*d2A_dXdX_i[idx].x[j];
+                            d2A_by_dXdX(i+j, k2, k1, 1) = fak*d2A_dXdX_i[idx].y[j];
+                            d2A_by_dXdX(i+j, k2, k1, 2) = fak*d2A_dXdX_i[idx].z[j];
+                        }
+                        idx++;
+                    }
+                }
+            }
+        }
+    }
+}
+
+// Single precision version of `biot_savart_kernel` for B and \nabla B. The
+// contributions of the quadrature points are computed in float, which doubles
+// the number of points handled per simd vector, and are accumulated in float
+// for blocks of `block_size` quadrature points. The block sums are then added
+// up in double, so that the rounding error does not grow with the number of
+// quadrature points. The relative error is of the order of 1e-6.
+template<class T, int derivs, class S=T>
+void biot_savart_kernel_float(vector_type& pointsx, vector_type& pointsy, vector_type& pointsz, T& gamma, T& dgamma_by_dphi, S& B, S& dB_by_dX, int start=0, int end=-1) {
+    static_assert(derivs <= 1, "The single precision kernel only computes B and its first derivative.");
+    using simd_f = xs::simd_type<float>;
+    using vector_type_f = vector<float, aligned_padded_allocator<float, XSIMD_DEFAULT_ALIGNMENT>>;
+    constexpr int simd_size = simd_f::size;
+    constexpr int block_size = 64;
+    if(gamma.layout() != xt::layout_type::row_major)
+          throw std::runtime_error("gamma needs to be in row-major storage order");
+    if(dgamma_by_dphi.layout() != xt::layout_type::row_major)
+          throw std::runtime_error("dgamma_by_dphi needs to be in row-major storage order");
+    int num_points         = end < 0 ? pointsx.size() : end;
+    int num_quad_points    = gamma.shape(0);
+    // only the points in [start, num_points) are converted, so the point
+    // with index i is stored at index i-start.
+    auto pointsx_f = vector_type_f(num_points-start, 0.f);
+    auto pointsy_f = vector_type_f(num_points-start, 0.f);
+    auto pointsz_f = vector_type_f(num_points-start, 0.f);
+    for (int i = start; i < num_points; ++i) {
+        pointsx_f[i-start] = pointsx[i];
+        pointsy_f[i-start] = pointsy[i];
+        pointsz_f[i-start] = pointsz[i];
+    }
+    auto gamma_f = vector<float>(3*num_quad_points);
+    auto dgamma_by_dphi_f = vector<float>(3*num_quad_points);
+    double* gamma_j_ptr = &(gamma(0, 0));
+    double* dgamma_j_by_dphi_ptr = &(dgamma_by_dphi(0, 0));
+    for (int j = 0; j < 3*num_quad_points; ++j) {
+        gamma_f[j] = gamma_j_ptr[j];
+        dgamma_by_dphi_f[j] = dgamma_j_by_dphi_ptr[j];
+    }
+    // entries 0-2 hold B, entries 3+3*k+l hold \partial_k B_l
+    constexpr int nout = derivs > 0 ? 12 : 3;
+    simd_f acc_f[12];
+    alignas(XSIMD_DEFAULT_ALIGNMENT) float block_sum[simd_size];
+    double acc[12][simd_size];
+    double fak = (1e-7/num_quad_points);
+    for(int i = start; i < num_points; i += simd_size) {
+        simd_f px = xs::load_aligned(&(pointsx_f[i-start]));
+        simd_f py = xs::load_aligned(&(pointsy_f[i-start]));
+        simd_f pz = xs::load_aligned(&(pointsz_f[i-start]));
+        for (int o = 0; o < nout; ++o)
+            for (int s = 0; s < simd_size; ++s)
+                acc[o][s] = 0.;
+        for (int jstart = 0; jstart < num_quad_points; jstart += block_size) {
+            for (int o = 0; o < nout; ++o)
+                acc_f[o] = simd_f(0.f);
+            int jend = std::min(jstart + block_size, num_quad_points);
+            for (int j = jstart; j < jend; ++j) {
+                simd_f dx = px - simd_f(gamma_f[3*j+0]);
+                simd_f dy = py - simd_f(gamma_f[3*j+1]);
+                simd_f dz = pz - simd_f(gamma_f[3*j+2]);
+                simd_f norm_diff_2 = dx*dx + dy*dy + dz*dz;
+                simd_f norm_diff_inv = simd_f(1.f)/xs::sqrt(norm_diff_2);
+                simd_f norm_diff_3_inv = norm_diff_inv*norm_diff_inv*norm_diff_inv;
+                simd_f gdx = simd_f(dgamma_by_dphi_f[3*j+0]);
+                simd_f gdy = simd_f(dgamma_by_dphi_f[3*j+1]);
+                simd_f gdz = simd_f(dgamma_by_dphi_f[3*j+2]);
+                simd_f cx = gdy*dz - gdz*dy;
+                simd_f cy = gdz*dx - gdx*dz;
+                simd_f cz = gdx*dy - gdy*dx;
+                acc_f[0] = xs::fma(cx, norm_diff_3_inv, acc_f[0]);
+                acc_f[1] = xs::fma(cy, norm_diff_3_inv, acc_f[1]);
+                acc_f[2] = xs::fma(cz, norm_diff_3_inv, acc_f[2]);
+                MYIF(derivs > 0) {
+                    // \partial_k B = \Gamma' \times e_k / |d|^3 - 3 (\Gamma' \times d) d_k / |d|^5
+                    simd_f norm_diff_5_inv_3 = norm_diff_3_inv*norm_diff_inv*norm_diff_inv*simd_f(3.f);
+                    simd_f d[3] = {dx, dy, dz};
+                    simd_f zero(0.f);
+                    simd_f gd_cross_ek[3][3] = {
+                        {zero, gdz, -gdy},
+                        {-gdz, zero, gdx},
+                        {gdy, -gdx, zero}
+                    };
+#pragma unroll
+                    for(int k=0; k<3; k++) {
+                        simd_f w = d[k]*norm_diff_5_inv_3;
+                        acc_f[3+3*k+0] += xs::fnma(cx, w, gd_cross_ek[k][0]*norm_diff_3_inv);
+                        acc_f[3+3*k+1] += xs::fnma(cy, w, gd_cross_ek[k][1]*norm_diff_3_inv);
+                        acc_f[3+3*k+2] += xs::fnma(cz, w, gd_cross_ek[k][2]*norm_diff_3_inv);
+                    }
+                }
+            }
+            for (int o = 0; o < nout; ++o) {
+                acc_f[o].store_aligned(block_sum);
+                for (int s = 0; s < simd_size; ++s)
+                    acc[o][s] += block_sum[s];
+            }
+        }
+        // discard the entries beyond num_points, see `biot_savart_kernel`.
+        int jlimit = std::min(simd_size, num_points-i);
+        for(int j=0; j<jlimit; j++){
+            B(i+j, 0) = fak * acc[0][j];
+            B(i+j, 1) = fak * acc[1][j];
+            B(i+j, 2) = fak * acc[2][j];
+            MYIF(derivs > 0) {
+                for(int k=0; k<3; k++) {
+                    dB_by_dX(i+j, k, 0) = fak*acc[3+3*k+0][j];
+                    dB_by_dX(i+j, k, 1) = fak*acc[3+3*k+1][j];
+                    dB_by_dX(i+j, k, 2) = fak*acc[3+3*k+2][j];
+                }
+            }
+        }
+    }
+}
+
+// Adds `weight` times the field of a single coil with unit current (as
+// computed by `biot_savart_kernel`) at the single point (x, y, z) to `B` and,
+// unless `dB_by_dX` is a nullptr, its gradient to `dB_by_dX`, where
+// dB_by_dX[3*j+l] = \partial_j B_l. With only one target there is nothing to
+// vectorize over, so this is a plain loop over the quadrature points. Used
+// for `BiotSavart::evaluate_point`.
+template<class T>
+void biot_savart_kernel_point(double x, double y, double z, T& gamma, T& dgamma_by_dphi, double weight, double* B, double* dB_by_dX) {
+    if(gamma.layout() != xt::layout_type::row_major)
+          throw std::runtime_error("gamma needs to be in row-major storage order");
+    if(dgamma_by_dphi.layout() != xt::layout_type::row_major)
+          throw std::runtime_error("dgamma_by_dphi needs to be in row-major storage order");
+    int num_quad_points = gamma.shape(0);
+    double* gamma_j_ptr = &(gamma(0, 0));
+    double* dgamma_j_by_dphi_ptr = &(dgamma_by_dphi(0, 0));
+    double B_i[3] = {0., 0., 0.};
+    double dB_dX_i[9] = {0., 0., 0., 0., 0., 0., 0., 0., 0.};
+    for (int j = 0; j < num_quad_points; ++j) {
+        double dx = x - gamma_j_ptr[3*j+0];
+        double dy = y - gamma_j_ptr[3*j+1];
+        double dz = z - gamma_j_ptr[3*j+2];
+        double norm_diff_inv = 1./std::sqrt(dx*dx + dy*dy + dz*dz);
+        double norm_diff_3_inv = norm_diff_inv*norm_diff_inv*norm_diff_inv;
+        double gdx = dgamma_j_by_dphi_ptr[3*j+0];
+        double gdy = dgamma_j_by_dphi_ptr[3*j+1];
+        double gdz = dgamma_j_by_dphi_ptr[3*j+2];
+        double cx = gdy*dz - gdz*dy;
+        double cy = gdz*dx - gdx*dz;
+        double cz = gdx*dy - gdy*dx;
+        B_i[0] += cx*norm_diff_3_inv;
+        B_i[1] += cy*norm_diff_3_inv;
+        B_i[2] += cz*norm_diff_3_inv;
+        if(dB_by_dX) {
+            // \partial_k B = \Gamma' \times e_k / |d|^3 - 3 (\Gamma' \times d) d_k / |d|^5
+            double norm_diff_5_inv_3 = 3.*norm_diff_3_inv*norm_diff_inv*norm_diff_inv;
+            double d[3] = {dx, dy, dz};
+            double gd_cross_ek[3][3] = {
+                {0., gdz, -gdy},
+                {-gdz, 0., gdx},
+                {gdy, -gdx, 0.}
+            };
+            for (int k = 0; k < 3; ++k) {
+                double w = d[k]*norm_diff_5_inv_3;
+                dB_dX_i[3*k+0] += gd_cross_ek[k][0]*norm_diff_3_inv - cx*w;
+                dB_dX_i[3*k+1] += gd_cross_ek[k][1]*norm_diff_3_inv - cy*w;
+                dB_dX_i[3*k+2] += gd_cross_ek[k][2]*norm_diff_3_inv - cz*w;
+            }
+        }
+    }
+    double fak = weight*(1e-7/num_quad_points);
+    for (int l = 0; l < 3; ++l)
+        B[l] += fak*B_i[l];
+    if(dB_by_dX) {
+        for (int l = 0; l < 9; ++l)
+            dB_by_dX[l] += fak*dB_dX_i[l];
+    }
+}
@@ -0,0 +1,248 @@
+#include "biot_savart_treecode.h"
+#include <cmath>
+#include <numeric>
+#include <algorithm>
+#include <stdexcept>
+
+#define TREECODE_MAX_DEPTH 40
+
+BiotSavartTreecode::BiotSavartTreecode(const vector<double>& y, const vector<double>& w, double theta, int leaf_size) :
+    theta(theta), leaf_size(leaf_size) {
+    if(y.size() != w.size() || y.size() % 3 != 0)
+        throw std::logic_error("Sources and current elements need to be arrays of size 3*nsources.");
+    if(theta <= 0. || theta >= 1.)
+        throw std::logic_error("The opening angle theta of the treecode has to lie in (0, 1).");
+    int n = y.size()/3;
+    ys = vector<double>(3*n, 0.);
+    ws = vector<double>(3*n, 0.);
+    if(n == 0)
+        return;
+    double lo[3] = {y[0], y[1], y[2]};
+    double hi[3] = {y[0], y[1], y[2]};
+    for (int j = 0; j < n; ++j) {
+        for (int d = 0; d < 3; ++d) {
+            lo[d] = std::min(lo[d], y[3*j+d]);
+            hi[d] = std::max(hi[d], y[3*j+d]);
+        }
+    }
+    vector<int> idxs(n);
+    std::iota(idxs.begin(), idxs.end(), 0);
+    nodes.reserve(2*(n/std::max(leaf_size, 1)+1));
+    build(idxs, 0, n, lo, hi, y, w, 0);
+}
+
+int BiotSavartTreecode::build(vector<int>& idxs, int first, int count, const double* lo, const double* hi, const vector<double>& y, const vector<double>& w, int depth) {
+    int node_idx = nodes.size();
+    nodes.push_back(TreecodeNode());
+    TreecodeNode node = {};
+    node.first = first;
+    node.count = count;
+    node.nchildren = 0;
+
+    // center of the node is the centroid of the sources
+    for (int j = first; j < first+count; ++j)
+        for (int d = 0; d < 3; ++d)
+            node.center[d] += y[3*idxs[j]+d];
+    for (int d = 0; d < 3; ++d)
+        node.center[d] /= count;
+
+    node.radius = 0.;
+    for (int j = first; j < first+count; ++j) {
+        double delta[3];
+        double dist2 = 0.;
+        for (int d = 0; d < 3; ++d) {
+            delta[d] = y[3*idxs[j]+d] - node.center[d];
+            dist2 += delta[d]*delta[d];
+        }
+        node.radius = std::max(node.radius, std::sqrt(dist2));
+        const double* wj = &(w[3*idxs[j]]);
+        for (int m = 0; m < 3; ++m) {
+            node.M0[m] += wj[m];
+            for (int a = 0; a < 3; ++a) {
+                node.M1[m][a] += wj[m]*delta[a];
+                for (int b = 0; b < 3; ++b)
+                    node.M2[m][a][b] += 0.5*wj[m]*delta[a]*delta[b];
+            }
+        }
+    }
+
+    if(count <= leaf_size || depth >= TREECODE_MAX_DEPTH || node.radius == 0.) {
+        // leaf: copy the sources into their final position
+        for (int j = first; j < first+count; ++j) {
+            for (int d = 0; d < 3; ++d) {
+                ys[3*j+d] = y[3*idxs[j]+d];
+                ws[3*j+d] = w[3*idxs[j]+d];
+            }
+        }
+        nodes[node_idx] = node;
+        return node_idx;
+    }
+
+    // split the bounding box into octants and sort the sources accordingly
+    double mid[3];
+    for (int d = 0; d < 3; ++d)
+        mid[d] = 0.5*(lo[d] + hi[d]);
+    auto octant = [&](int j) {
+        const double* yj = &(y[3*j]);
+        return (yj[0] >= mid[0] ? 1 : 0) + (yj[1] >= mid[1] ? 2 : 0) + (yj[2] >= mid[2] ? 4 : 0);
+    };
+    std::stable_sort(idxs.begin()+first, idxs.begin()+first+count, [&](int a, int b) { return octant(a) < octant(b); });
+    int start = first;
+    for (int o = 0; o < 8; ++o) {
+        int end = start;
+        while(end < first+count && octant(idxs[end]) == o)
+            end++;
+        if(end > start) {
+            double clo[3], chi[3];
+            for (int d = 0; d < 3; ++d) {
+                bool upper = (o >> d) & 1;
+                clo[d] = upper ? mid[d] : lo[d];
+                chi[d] = upper ? hi[d] : mid[d];
+            }
+            int child = build(idxs, start, end-start, clo, chi, y, w, depth+1);
+            node.children[node.nchildren++] = child;
+        }
+        start = end;
+    }
+    nodes[node_idx] = node;
+    return node_idx;
+}
+
+// Derivatives of \phi(R) = 1/|R|. We need up to the third derivative for B and
+// up to the fourth derivative for \nabla B.
+static inline void inverse_distance_derivatives(const double* R, double* D1, double* D2, double* D3, double* D4, bool fourth) {
+    double r2 = R[0]*R[0] + R[1]*R[1] + R[2]*R[2];
+    double rinv = 1./std::sqrt(r2);
+    double rinv2 = rinv*rinv;
+    double rinv3 = rinv2*rinv;
+    double rinv5 = rinv3*rinv2;
+    double rinv7 = rinv5*rinv2;
+    double rinv9 = rinv7*rinv2;
+    for (int a = 0; a < 3; ++a) {
+        D1[a] = -R[a]*rinv3;
+        for (int b = 0; b < 3; ++b) {
+            double dab = a == b ? 1. : 0.;
+            D2[3*a+b] = 3*R[a]*R[b]*rinv5 - dab*rinv3;
+            for (int c = 0; c < 3; ++c) {
+                double dac = a == c ? 1. : 0.;
+                double dbc = b == c ? 1. : 0.;
+                D3[9*a+3*b+c] = -15*R[a]*R[b]*R[c]*rinv7 + 3*(dab*R[c] + dac*R[b] + dbc*R[a])*rinv5;
+                if(!fourth)
+                    continue;
+                for (int d = 0; d < 3; ++d) {
+                    double dad = a == d ? 1. : 0.;
+                    double dbd = b == d ? 1. : 0.;
+                    double dcd = c == d ? 1. : 0.;
+                    D4[27*a+9*b+3*c+d] = 105*R[a]*R[b]*R[c]*R[d]*rinv9
+                        - 15*(dab*R[c]*R[d] + dac*R[b]*R[d] + dad*R[b]*R[c] + dbc*R[a]*R[d] + dbd*R[a]*R[c] + dcd*R[a]*R[b])*rinv7
+                        + 3*(dab*dcd + dac*dbd + dad*dbc)*rinv5;
+                }
+            }
+        }
+    }
+}
+
+void BiotSavartTreecode::evaluate(const double* points, int npoints, double* B, double* dB, int derivatives) const {
+    if(derivatives > 1)
+        throw std::logic_error("The treecode only implements B and its first derivative.");
+    if(nodes.size() == 0){
+        std::fill(B, B+3*npoints, 0.);
+        if(derivatives > 0)
+            std::fill(dB, dB+9*npoints, 0.);
+        return;
+    }
+    double theta2 = theta*theta;
+#pragma omp parallel for schedule(dynamic, 64)
+    for (int i = 0; i < npoints; ++i) {
+        const double* x = &(points[3*i]);
+        double Bi[3] = {0., 0., 0.};
+        double dBi[9] = {0., 0., 0., 0., 0., 0., 0., 0., 0.};
+        double D1[3], D2[9], D3[27], D4[81];
+        int stack[8*TREECODE_MAX_DEPTH+8];
+        int stacksize = 0;
+        stack[stacksize++] = 0;
+        while(stacksize > 0) {
+            const TreecodeNode& node = nodes[stack[--stacksize]];
+            double R[3] = {x[0]-node.center[0], x[1]-node.center[1], x[2]-node.center[2]};
+            double R2 = R[0]*R[0] + R[1]*R[1] + R[2]*R[2];
+            if(node.radius*node.radius < theta2*R2) {
+                // far field: use the multipole expansion about the node center,
+                //   T_mn  = -M0_m \phi_n  + M1_ma \phi_an  - M2_mab \phi_abn
+                //   U_mnl = -M0_m \phi_nl + M1_ma \phi_anl - M2_mab \phi_abnl
+                // and then B_i = eps_imn T_mn, \partial_l B_i = eps_imn U_mnl.
+                inverse_distance_derivatives(R, D1, D2, D3, D4, derivatives > 0);
+                double T[9];
+                for (int m = 0; m < 3; ++m) {
+                    for (int n = 0; n < 3; ++n) {
+                        double t = -node.M0[m]*D1[n];
+                        for (int a = 0; a < 3; ++a) {
+                            t += node.M1[m][a]*D2[3*a+n];
+                            for (int b = 0; b < 3; ++b)
+                                t -= node.M2[m][a][b]*D3[9*a+3*b+n];
+                        }
+                        T[3*m+n] = t;
+                    }
+                }
+                Bi[0] += T[3*1+2] - T[3*2+1];
+                Bi[1] += T[3*2+0] - T[3*0+2];
+                Bi[2] += T[3*0+1] - T[3*1+0];
+                if(derivatives > 0) {
+                    for (int l = 0; l < 3; ++l) {
+                        double U[9];
+                        for (int m = 0; m < 3; ++m) {
+                            for (int n = 0; n < 3; ++n) {
+                                double u = -node.M0[m]*D2[3*n+l];
+                                for (int a = 0; a < 3; ++a) {
+                                    u += node.M1[m][a]*D3[9*a+3*n+l];
+                                    for (int b = 0; b < 3; ++b)
+                                        u -= node.M2[m][a][b]*D4[27*a+9*b+3*n+l];
+                                }
+                                U[3*m+n] = u;
+                            }
+                        }
+                        dBi[3*l+0] += U[3*1+2] - U[3*2+1];
+                        dBi[3*l+1] += U[3*2+0] - U[3*0+2];
+                        dBi[3*l+2] += U[3*0+1] - U[3*1+0];
+                    }
+                }
+            } else if(node.nchildren == 0) {
+                // near field leaf: sum directly over the sources
+                for (int j = node.first; j < node.first + node.count; ++j) {
+                    const double* y = &(ys[3*j]);
+                    const double* w = &(ws[3*j]);
+                    double diff[3] = {x[0]-y[0], x[1]-y[1], x[2]-y[2]};
+                    double norm_diff_2 = diff[0]*diff[0] + diff[1]*diff[1] + diff[2]*diff[2];
+                    double norm_diff_inv = 1./std::sqrt(norm_diff_2);
+                    double norm_diff_3_inv = norm_diff_inv*norm_diff_inv*norm_diff_inv;
+                    double w_cross_diff[3] = {
+                        w[1]*diff[2] - w[2]*diff[1],
+                        w[2]*diff[0] - w[0]*diff[2],
+                        w[0]*diff[1] - w[1]*diff[0]
+                    };
+                    for (int d = 0; d < 3; ++d)
+                        Bi[d] += w_cross_diff[d]*norm_diff_3_inv;
+                    if(derivatives > 0) {
+                        double norm_diff_5_inv_times_3 = 3.*norm_diff_3_inv*norm_diff_inv*norm_diff_inv;
+                        // w \times e_l
+                        double w_cross_e[3][3] = {
+                            {0., w[2], -w[1]},
+                            {-w[2], 0., w[0]},
+                            {w[1], -w[0], 0.}
+                        };
+                        for (int l = 0; l < 3; ++l)
+                            for (int d = 0; d < 3; ++d)
+                                dBi[3*l+d] += w_cross_e[l][d]*norm_diff_3_inv - w_cross_diff[d]*diff[l]*norm_diff_5_inv_times_3;
+                    }
+                }
+            } else {
+                for (int c = 0; c < node.nchildren; ++c)
+                    stack[stacksize++] = node.children[c];
+            }
+        }
+        for (int d = 0; d < 3; ++d)
+            B[3*i+d] = Bi[d];
+        if(derivatives > 0)
+            for (int d = 0; d < 9; ++d)
+                dB[9*i+d] = dBi[d];
+    }
+}
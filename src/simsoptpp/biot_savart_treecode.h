@@ -0,0 +1,59 @@
+#pragma once
+
+#include <vector>
+#include <array>
+
+using std::vector;
+using std::array;
+
+// A Barnes-Hut type treecode for the Biot-Savart law. The coils are
+// discretised into (quadrature point, current element) pairs
+//
+//   B(x) = \sum_j w_j \times (x-y_j)/|x-y_j|^3
+//
+// with w_j = I_k * 1e-7/nquad_k * \Gamma_k'(\phi_j) and y_j = \Gamma_k(\phi_j).
+// These sources are sorted into an octree, and for each node we store the
+// moments of the current elements up to second order about the centroid of
+// the node. When evaluating the field at a target x, a node of radius r whose
+// center is at distance R from x is approximated by its multipole expansion
+// if r/R < theta, otherwise we descend into its children (or sum directly over
+// the sources if the node is a leaf). The cost of evaluating B and \nabla B at
+// N targets is hence O(N log M) instead of O(N M) for M sources.
+
+struct TreecodeNode {
+    double center[3];
+    double radius;
+    double M0[3];      // \sum_j w_j
+    double M1[3][3];   // \sum_j w_j \otimes \delta_j
+    double M2[3][3][3];// 1/2 \sum_j w_j \otimes \delta_j \otimes \delta_j
+    int first;         // index of first source in the reordered source arrays
+    int count;         // number of sources in this node
+    int children[8];
+    int nchildren;
+};
+
+class BiotSavartTreecode {
+    private:
+        vector<TreecodeNode> nodes;
+        vector<double> ys; // source locations, reordered, size 3*nsources
+        vector<double> ws; // current elements, reordered, size 3*nsources
+        const double theta;
+        const int leaf_size;
+
+        int build(vector<int>& idxs, int first, int count, const double* lo, const double* hi, const vector<double>& y, const vector<double>& w, int depth);
+
+    public:
+        // `y` and `w` are arrays of size `3*nsources` containing the locations
+        // of the sources and the current elements (scaled by the current and
+        // the quadrature weight).
+        BiotSavartTreecode(const vector<double>& y, const vector<double>& w, double theta, int leaf_size=32);
+
+        int nsources() const { return ys.size()/3; }
+        int nnodes() const { return nodes.size(); }
+
+        // Evaluate B (and \nabla B if `derivatives > 0`) at `npoints` targets.
+        // `points` is row major of shape (npoints, 3), `B` of shape
+        // (npoints, 3) and `dB` of shape (npoints, 3, 3) where dB[i, j, l]
+        // contains \partial_j B_l(x_i).
+        void evaluate(const double* points, int npoints, double* B, double* dB, int derivatives) const;
+};
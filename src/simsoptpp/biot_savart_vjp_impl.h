@@ -15,8 +15,34 @@
 #endif
 
 #include <iostream>
-template<class T, int derivs>
-void biot_savart_vjp_kernel(vector_type& pointsx, vector_type& pointsy, vector_type& pointsz, T& gamma, T& dgamma_by_dphi, T& v, T& res_gamma, T& res_dgamma_by_dphi, T& vgrad, T& res_grad_gamma, T& res_grad_dgamma_by_dphi) {
+#include <algorithm>
+
+// Length of the blocks when `npoints` targets are split into `nblocks`
+// blocks, rounded up to a multiple of 16 so that every block starts at a
+// multiple of the simd width.
+inline int biot_savart_vjp_block_size(int npoints, int nblocks) {
+    const int align = 16;
+    int block_size = std::max((npoints + nblocks - 1)/nblocks, 1);
+    return ((block_size + align - 1)/align)*align;
+}
+
+// The block size that `biot_savart_vjp` uses for `npoints` targets. It only
+// depends on the number of targets and not on the number of threads, so that
+// the vector Jacobian product is bitwise reproducible.
+inline int biot_savart_vjp_block_size(int npoints) {
+    int nblocks = std::min(64, std::max(1, npoints/256));
+    return biot_savart_vjp_block_size(npoints, nblocks);
+}
+
+// Only the points with indices in [start, end) contribute (end = -1 means up
+// to the last point); `start` has to be a multiple of the simd width.
+//
+// If `forward` is true, the kernel also computes the field B (and \nabla B if
+// derivs > 0) of the coil for unit current at the targets, in the same layout
+// as `biot_savart_kernel`. This reuses the distances and cross products that
+// are needed for the vector Jacobian product anyway.
+template<class T, int derivs, bool forward>
+void biot_savart_vjp_kernel_impl(vector_type& pointsx, vector_type& pointsy, vector_type& pointsz, T& gamma, T& dgamma_by_dphi, T& v, T& res_gamma, T& res_dgamma_by_dphi, T& vgrad, T& res_grad_gamma, T& res_grad_dgamma_by_dphi, T* B, T* dB_by_dX, int start, int end) {
     if(gamma.layout() != xt::layout_type::row_major)
           throw std::runtime_error("gamma needs to be in row-major storage order");
     if(dgamma_by_dphi.layout() != xt::layout_type::row_major)
@@ -29,7 +55,7 @@ void biot_savart_vjp_kernel(vector_type& pointsx, vector_type& pointsy, vector_t
           throw std::runtime_error("res_grad_gamma needs to be in row-major storage order");
     if(res_grad_dgamma_by_dphi.layout() != xt::layout_type::row_major)
           throw std::runtime_error("res_grad_dgamma_by_dphi needs to be in row-major storage order");
-    int num_points         = pointsx.size();
+    int num_points         = end < 0 ? pointsx.size() : end;
     int num_quad_points    = gamma.shape(0);
     constexpr int simd_size = xsimd::simd_type<double>::size;
     double* gamma_j_ptr = &(gamma(0, 0));
@@ -38,7 +64,9 @@ void biot_savart_vjp_kernel(vector_type& pointsx, vector_type& pointsy, vector_t
     double* res_gamma_ptr = &(res_gamma(0, 0));
     double* res_grad_dgamma_by_dphi_ptr = &(res_grad_dgamma_by_dphi(0, 0));
     double* res_grad_gamma_ptr = &(res_grad_gamma(0, 0));
-    for(int i = 0; i < num_points-num_points%simd_size; i += simd_size) {
+    int simd_end = num_points - (num_points-start)%simd_size;
+    double fak = 1e-7/num_quad_points;
+    for(int i = start; i < simd_end; i += simd_size) {
         Vec3dSimd point_i = Vec3dSimd(&(pointsx[i]), &(pointsy[i]), &(pointsz[i]));
         auto v_i   = Vec3dSimd();
         auto vgrad_i = vector<Vec3dSimd, xs::aligned_allocator<Vec3dSimd, XSIMD_DEFAULT_ALIGNMENT>>{
@@ -57,6 +85,9 @@ void biot_savart_vjp_kernel(vector_type& pointsx, vector_type& pointsy, vector_t
             }
         }
 
+        auto B_i = Vec3dSimd();
+        Vec3dSimd dB_dX_i[3] = {Vec3dSimd(), Vec3dSimd(), Vec3dSimd()};
+
         for (int j = 0; j < num_quad_points; ++j) {
             auto dgamma_j_by_dphi = Vec3d{ dgamma_j_by_dphi_ptr[3*j+0], dgamma_j_by_dphi_ptr[3*j+1], dgamma_j_by_dphi_ptr[3*j+2] };
             auto diff = point_i - Vec3dSimd(gamma_j_ptr[3*j+0], gamma_j_ptr[3*j+1], gamma_j_ptr[3*j+2]);
@@ -79,6 +110,18 @@ void biot_savart_vjp_kernel(vector_type& pointsx, vector_type& pointsy, vector_t
             res_gamma_ptr[3*j+1] += xsimd::hadd(res_gamma_add.y);
             res_gamma_ptr[3*j+2] += xsimd::hadd(res_gamma_add.z);
 
+            MYIF(forward) {
+                B_i += cross_dgamma_j_by_dphi_diff * norm_diff_3_inv;
+                MYIF(derivs>0) {
+                    auto dgamma_j_by_dphi_simd = Vec3dSimd(dgamma_j_by_dphi);
+#pragma unroll
+                    for(int k=0; k<3; k++){
+                        dB_dX_i[k] += cross(dgamma_j_by_dphi_simd, k) * norm_diff_3_inv;
+                        dB_dX_i[k] -= cross_dgamma_j_by_dphi_diff * (diff[k] * norm_diff_5_inv_times_3);
+                    }
+                }
+            }
+
             MYIF(derivs>0) {
                 auto norm_diff_7_inv = norm_diff_5_inv*norm_diff_2_inv;
                 auto res_grad_dgamma_by_dphi_add = Vec3dSimd();
@@ -106,8 +149,19 @@ void biot_savart_vjp_kernel(vector_type& pointsx, vector_type& pointsy, vector_t
                 res_grad_gamma_ptr[3*j+2] += xsimd::hadd(res_grad_gamma_add.z);
             }
         }
+        MYIF(forward) {
+            for(int k=0; k<simd_size; k++){
+                for (int d = 0; d < 3; ++d) {
+                    (*B)(i+k, d) = fak * B_i[d][k];
+                    MYIF(derivs>0) {
+                        for (int dd = 0; dd < 3; ++dd)
+                            (*dB_by_dX)(i+k, dd, d) = fak * dB_dX_i[dd][d][k];
+                    }
+                }
+            }
+        }
     }
-    for (int i = num_points - num_points % simd_size; i < num_points; ++i) {
+    for (int i = simd_end; i < num_points; ++i) {
         auto point_i = Vec3d{pointsx[i], pointsy[i], pointsz[i]};
         Vec3d v_i   = Vec3d::Zero();
         auto vgrad_i = vector<Vec3d>{
@@ -122,6 +176,8 @@ void biot_savart_vjp_kernel(vector_type& pointsx, vector_type& pointsy, vector_t
                 }
             }
         }
+        Vec3d B_i = Vec3d::Zero();
+        Vec3d dB_dX_i[3] = {Vec3d::Zero(), Vec3d::Zero(), Vec3d::Zero()};
         for (int j = 0; j < num_quad_points; ++j) {
             Vec3d diff = point_i - Vec3d{gamma_j_ptr[3*j+0], gamma_j_ptr[3*j+1], gamma_j_ptr[3*j+2]};
             Vec3d dgamma_j_by_dphi = Vec3d{dgamma_j_by_dphi_ptr[3*j+0], dgamma_j_by_dphi_ptr[3*j+1], dgamma_j_by_dphi_ptr[3*j+2]};
@@ -144,6 +200,16 @@ void biot_savart_vjp_kernel(vector_type& pointsx, vector_type& pointsy, vector_t
             res_gamma(j, 1) += res_gamma_add.coeff(1);
             res_gamma(j, 2) += res_gamma_add.coeff(2);
 
+            MYIF(forward) {
+                B_i += cross_dgamma_j_by_dphi_diff * norm_diff_3_inv;
+                MYIF(derivs>0) {
+                    for(int k=0; k<3; k++){
+                        dB_dX_i[k] += cross(dgamma_j_by_dphi, k) * norm_diff_3_inv;
+                        dB_dX_i[k] -= cross_dgamma_j_by_dphi_diff * (diff[k] * norm_diff_5_inv_times_3);
+                    }
+                }
+            }
+
             MYIF(derivs>0) {
                 double norm_diff_7_inv = norm_diff_5_inv*norm_diff_2_inv;
                 Vec3d res_grad_dgamma_by_dphi_add = Vec3d::Zero();
@@ -169,8 +235,86 @@ void biot_savart_vjp_kernel(vector_type& pointsx, vector_type& pointsy, vector_t
                 res_grad_gamma(j, 2) += res_grad_gamma_add.coeff(2);
             }
         }
+        MYIF(forward) {
+            for (int d = 0; d < 3; ++d) {
+                (*B)(i, d) = fak * B_i[d];
+                MYIF(derivs>0) {
+                    for (int dd = 0; dd < 3; ++dd)
+                        (*dB_by_dX)(i, dd, d) = fak * dB_dX_i[dd][d];
+                }
+            }
+        }
     }
 }
 
+template<class T, int derivs>
+void biot_savart_vjp_kernel(vector_type& pointsx, vector_type& pointsy, vector_type& pointsz, T& gamma, T& dgamma_by_dphi, T& v, T& res_gamma, T& res_dgamma_by_dphi, T& vgrad, T& res_grad_gamma, T& res_grad_dgamma_by_dphi, int start=0, int end=-1) {
+    biot_savart_vjp_kernel_impl<T, derivs, false>(pointsx, pointsy, pointsz, gamma, dgamma_by_dphi, v, res_gamma, res_dgamma_by_dphi,
+            vgrad, res_grad_gamma, res_grad_dgamma_by_dphi, nullptr, nullptr, start, end);
+}
+
+// Computes the field B (and \nabla B if derivs > 0) of a coil with unit
+// current and the vector Jacobian product with v (and vgrad) in a single pass
+// over the targets and quadrature points, see `biot_savart_vjp_kernel_impl`.
+template<class T, int derivs>
+void biot_savart_B_vjp_kernel(vector_type& pointsx, vector_type& pointsy, vector_type& pointsz, T& gamma, T& dgamma_by_dphi, T& B, T& dB_by_dX, T& v, T& res_gamma, T& res_dgamma_by_dphi, T& vgrad, T& res_grad_gamma, T& res_grad_dgamma_by_dphi, int start=0, int end=-1) {
+    biot_savart_vjp_kernel_impl<T, derivs, true>(pointsx, pointsy, pointsz, gamma, dgamma_by_dphi, v, res_gamma, res_dgamma_by_dphi,
+            vgrad, res_grad_gamma, res_grad_dgamma_by_dphi, &B, &dB_by_dX, start, end);
+}
+
+
+
 
+// Sums the contributions of the `nblocks` blocks of targets of each coil in a
+// fixed order and contracts them with the derivatives of the coils with
+// respect to their dofs. The tiles of coil i are i*nblocks, ...,
+// (i+1)*nblocks-1, and the sums are stored in the arrays of the first tile.
+// The arrays for \nabla B are only used if `res_dB` is not empty.
+template<class T>
+void biot_savart_vjp_reduce(int nblocks, vector<int>& num_quad_points, vector<double>& currents,
+        vector<T>& res_gamma, vector<T>& res_dgamma_by_dphi, vector<T>& res_grad_gamma, vector<T>& res_grad_dgamma_by_dphi,
+        vector<T>& dgamma_by_dcoeffs, vector<T>& d2gamma_by_dphidcoeffs, vector<T>& res_B, vector<T>& res_dB) {
+    int num_coils = num_quad_points.size();
+    bool compute_dB = res_dB.size() > 0;
+    T dummy = T();
+    #pragma omp parallel for
+    for(int i=0; i<num_coils; i++) {
+        // sum the contributions of all blocks into the arrays of the first one
+        T& res_gamma_i = res_gamma[i*nblocks];
+        T& res_dgamma_by_dphi_i = res_dgamma_by_dphi[i*nblocks];
+        T& res_grad_gamma_i = compute_dB ? res_grad_gamma[i*nblocks] : dummy;
+        T& res_grad_dgamma_by_dphi_i = compute_dB ? res_grad_dgamma_by_dphi[i*nblocks] : dummy;
+        int size = 3*num_quad_points[i];
+        for (int b = 1; b < nblocks; ++b) {
+            int tile = i*nblocks + b;
+            for (int k = 0; k < size; ++k) {
+                res_gamma_i.data()[k] += res_gamma[tile].data()[k];
+                res_dgamma_by_dphi_i.data()[k] += res_dgamma_by_dphi[tile].data()[k];
+                if(compute_dB) {
+                    res_grad_gamma_i.data()[k] += res_grad_gamma[tile].data()[k];
+                    res_grad_dgamma_by_dphi_i.data()[k] += res_grad_dgamma_by_dphi[tile].data()[k];
+                }
+            }
+        }
+        int numcoeff = dgamma_by_dcoeffs[i].shape(2);
+        for (int j = 0; j < dgamma_by_dcoeffs[i].shape(0); ++j) {
+            for (int l = 0; l < 3; ++l) {
+                auto t1 = res_gamma_i(j, l);
+                auto t2 = res_dgamma_by_dphi_i(j, l);
+                for (int k = 0; k < numcoeff; ++k)
+                    res_B[i](k) += dgamma_by_dcoeffs[i](j, l, k) * t1 + d2gamma_by_dphidcoeffs[i](j, l, k) * t2;
 
+                if(compute_dB) {
+                    auto t3 = res_grad_gamma_i(j, l);
+                    auto t4 = res_grad_dgamma_by_dphi_i(j, l);
+                    for (int k = 0; k < numcoeff; ++k)
+                        res_dB[i](k) += dgamma_by_dcoeffs[i](j, l, k) * t3 + d2gamma_by_dphidcoeffs[i](j, l, k) * t4;
+                }
+            }
+        }
+        double fak = (currents[i] * 1e-7/num_quad_points[i]);
+        res_B[i] *= fak;
+        if(compute_dB)
+            res_dB[i] *= fak;
+    }
+}
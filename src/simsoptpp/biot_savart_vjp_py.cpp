@@ -12,53 +12,53 @@ void biot_savart_vjp(Array& points, vector<Array>& gammas, vector<Array>& dgamma
     }
 
     int num_coils  = gammas.size();
+    int num_targets = points.shape(0);
 
-    auto res_gamma = std::vector<Array>(num_coils, Array());
-    auto res_dgamma_by_dphi = std::vector<Array>(num_coils, Array());
-    auto res_grad_gamma = std::vector<Array>(num_coils, Array());
-    auto res_grad_dgamma_by_dphi = std::vector<Array>(num_coils, Array());
+    // The work is split into tiles of one coil and one block of targets, so
+    // that all threads are busy even if there are only a few coils. Each tile
+    // accumulates into its own arrays, which are then summed up over the
+    // blocks in a fixed order. The blocks only depend on the number of
+    // targets and not on the number of threads, so the result is bitwise
+    // reproducible.
+    int block_size = biot_savart_vjp_block_size(num_targets);
+    int nblocks = std::max(1, (num_targets + block_size - 1)/block_size);
+    int num_tiles = num_coils*nblocks;
+
+    auto res_gamma = std::vector<Array>(num_tiles, Array());
+    auto res_dgamma_by_dphi = std::vector<Array>(num_tiles, Array());
+    auto res_grad_gamma = std::vector<Array>(num_tiles, Array());
+    auto res_grad_dgamma_by_dphi = std::vector<Array>(num_tiles, Array());
 
     bool compute_dB = res_dB.size() > 0;
     // Don't understand why, but in parallel this loop segfaults...
-    for(int i=0; i<num_coils; i++) {
-        int num_points = gammas[i].shape(0);
-        res_gamma[i] = xt::zeros<double>({num_points, 3});
-        res_dgamma_by_dphi[i] = xt::zeros<double>({num_points, 3});
+    for(int tile=0; tile<num_tiles; tile++) {
+        int num_points = gammas[tile / nblocks].shape(0);
+        res_gamma[tile] = xt::zeros<double>({num_points, 3});
+        res_dgamma_by_dphi[tile] = xt::zeros<double>({num_points, 3});
         if(compute_dB) {
-            res_grad_gamma[i] = xt::zeros<double>({num_points, 3});
-            res_grad_dgamma_by_dphi[i] = xt::zeros<double>({num_points, 3});
+            res_grad_gamma[tile] = xt::zeros<double>({num_points, 3});
+            res_grad_dgamma_by_dphi[tile] = xt::zeros<double>({num_points, 3});
         }
     }
     Array dummy = Array();
 
-    #pragma omp parallel for
-    for(int i=0; i<num_coils; i++) {
+    #pragma omp parallel for schedule(dynamic)
+    for(int tile=0; tile<num_tiles; tile++) {
+        int i = tile / nblocks;
+        int start = (tile % nblocks)*block_size;
+        int end = std::min(start + block_size, num_targets);
         if(compute_dB)
             biot_savart_vjp_kernel<Array, 1>(pointsx, pointsy, pointsz, gammas[i], dgamma_by_dphis[i],
-                    v, res_gamma[i], res_dgamma_by_dphi[i],
-                    vgrad, res_grad_gamma[i], res_grad_dgamma_by_dphi[i]);
+                    v, res_gamma[tile], res_dgamma_by_dphi[tile],
+                    vgrad, res_grad_gamma[tile], res_grad_dgamma_by_dphi[tile], start, end);
         else
             biot_savart_vjp_kernel<Array, 0>(pointsx, pointsy, pointsz, gammas[i], dgamma_by_dphis[i],
-                    v, res_gamma[i], res_dgamma_by_dphi[i], dummy, dummy, dummy);
-        int numcoeff = dgamma_by_dcoeffs[i].shape(2);
-        for (int j = 0; j < dgamma_by_dcoeffs[i].shape(0); ++j) {
-            for (int l = 0; l < 3; ++l) {
-                auto t1 = res_gamma[i](j, l);
-                auto t2 = res_dgamma_by_dphi[i](j, l);
-                for (int k = 0; k < numcoeff; ++k)
-                    res_B[i](k) += dgamma_by_dcoeffs[i](j, l, k) * t1 + d2gamma_by_dphidcoeffs[i](j, l, k) * t2;
-
-                if(compute_dB) {
-                    auto t3 = res_grad_gamma[i](j, l);
-                    auto t4 = res_grad_dgamma_by_dphi[i](j, l);
-                    for (int k = 0; k < numcoeff; ++k)
-                        res_dB[i](k) += dgamma_by_dcoeffs[i](j, l, k) * t3 + d2gamma_by_dphidcoeffs[i](j, l, k) * t4;
-                }
-            }
-        }
-        double fak = (currents[i] * 1e-7/gammas[i].shape(0));
-        res_B[i] *= fak;
-        if(compute_dB)
-            res_dB[i] *= fak;
+                    v, res_gamma[tile], res_dgamma_by_dphi[tile], dummy, dummy, dummy, start, end);
     }
+
+    vector<int> num_quad_points(num_coils);
+    for (int i = 0; i < num_coils; ++i)
+        num_quad_points[i] = gammas[i].shape(0);
+    biot_savart_vjp_reduce(nblocks, num_quad_points, currents, res_gamma, res_dgamma_by_dphi, res_grad_gamma, res_grad_dgamma_by_dphi,
+            dgamma_by_dcoeffs, d2gamma_by_dphidcoeffs, res_B, res_dB);
 }
@@ -0,0 +1,174 @@
+#include "boozer_field.h"
+#include <cmath>
+#include <algorithm>
+#include <fmt/core.h>
+
+Vec BoozerSpectralField::spline_second_derivatives(const Vec& x, const double* y) {
+    // Second derivatives of the natural cubic spline through (x_i, y_i),
+    // obtained by solving the tridiagonal system with the Thomas algorithm.
+    int n = x.size();
+    Vec M(n, 0.);
+    if(n < 3)
+        return M;
+    Vec diag(n, 1.), upper(n, 0.), rhs(n, 0.);
+    for (int i = 1; i < n-1; ++i) {
+        double hl = x[i]-x[i-1];
+        double hr = x[i+1]-x[i];
+        diag[i] = 2*(hl+hr);
+        upper[i] = hr;
+        rhs[i] = 6*((y[i+1]-y[i])/hr - (y[i]-y[i-1])/hl);
+        // eliminate the lower diagonal entry hl
+        double lower = (i == 1) ? 0. : hl;
+        double fak = lower/diag[i-1];
+        diag[i] -= fak*upper[i-1];
+        rhs[i] -= fak*rhs[i-1];
+    }
+    for (int i = n-2; i >= 1; --i)
+        M[i] = (rhs[i] - upper[i]*M[i+1])/diag[i];
+    return M;
+}
+
+BoozerSpectralField::BoozerSpectralField(Vec s, vector<int> xm, vector<int> xn, vector<Vec> bmnc,
+        Vec G, Vec I, Vec iota, double psi0, int nfp) :
+    s_grid(s), nmodes(xm.size()), xm(xm), xn(xn), nfp(nfp), psi0(psi0) {
+    int ns = s.size();
+    if(ns < 2)
+        throw std::logic_error("Need at least two surfaces to interpolate radially.");
+    if(s[0] <= 0)
+        throw std::logic_error("The surfaces need to satisfy s > 0.");
+    for (int i = 1; i < ns; ++i)
+        if(s[i] <= s[i-1])
+            throw std::logic_error("The surfaces need to be sorted by increasing s.");
+    if(xn.size() != nmodes || bmnc.size() != nmodes)
+        throw std::logic_error(fmt::format("xm, xn and bmnc need to have the same number of modes, but got {}, {} and {}.", nmodes, xn.size(), bmnc.size()));
+    if(G.size() != ns || I.size() != ns || iota.size() != ns)
+        throw std::logic_error("G, I and iota need to be given on all surfaces.");
+    if(nfp < 1)
+        throw std::logic_error("nfp needs to be positive.");
+    if(psi0 == 0)
+        throw std::logic_error("The toroidal flux psi0 must not vanish.");
+
+    mmax = 0;
+    nmax = 0;
+    b_values = Vec(nmodes*ns, 0.);
+    for (int j = 0; j < nmodes; ++j) {
+        if(bmnc[j].size() != ns)
+            throw std::logic_error(fmt::format("bmnc needs to have shape ({}, {}).", nmodes, ns));
+        if(xm[j] < 0 || xn[j] % nfp != 0)
+            throw std::logic_error(fmt::format("Invalid mode (m, n) = ({}, {}).", xm[j], xn[j]));
+        mmax = std::max(mmax, xm[j]);
+        nmax = std::max(nmax, std::abs(xn[j]/nfp));
+        for (int i = 0; i < ns; ++i)
+            b_values[j*ns+i] = bmnc[j][i]/std::pow(s[i], 0.5*xm[j]);
+    }
+    b_second = Vec(nmodes*ns, 0.);
+    for (int j = 0; j < nmodes; ++j) {
+        Vec M = spline_second_derivatives(s_grid, &b_values[j*ns]);
+        std::copy(M.begin(), M.end(), b_second.begin() + j*ns);
+    }
+    profile_values = Vec(3*ns, 0.);
+    std::copy(G.begin(), G.end(), profile_values.begin());
+    std::copy(I.begin(), I.end(), profile_values.begin() + ns);
+    std::copy(iota.begin(), iota.end(), profile_values.begin() + 2*ns);
+    profile_second = Vec(3*ns, 0.);
+    for (int j = 0; j < 3; ++j) {
+        Vec M = spline_second_derivatives(s_grid, &profile_values[j*ns]);
+        std::copy(M.begin(), M.end(), profile_second.begin() + j*ns);
+    }
+}
+
+BoozerSpectralField::Workspace BoozerSpectralField::workspace() const {
+    Workspace ws;
+    ws.cosm = Vec(mmax+1, 0.);
+    ws.sinm = Vec(mmax+1, 0.);
+    ws.cosn = Vec(nmax+1, 0.);
+    ws.sinn = Vec(nmax+1, 0.);
+    return ws;
+}
+
+// Fill c[k] = cos(k*x) and s[k] = sin(k*x) using the angle addition formulas.
+static void trig_table(double x, Vec& c, Vec& s) {
+    double c1 = std::cos(x);
+    double s1 = std::sin(x);
+    c[0] = 1.;
+    s[0] = 0.;
+    for (int k = 1; k < c.size(); ++k) {
+        c[k] = c[k-1]*c1 - s[k-1]*s1;
+        s[k] = s[k-1]*c1 + c[k-1]*s1;
+    }
+}
+
+void BoozerSpectralField::evaluate(Workspace& ws, double s, double theta, double zeta, Point& p) const {
+    int ns = s_grid.size();
+    // find the interval of the spline, outside of the grid we extrapolate
+    // with the first or last piece
+    int k = std::upper_bound(s_grid.begin(), s_grid.end(), s) - s_grid.begin() - 1;
+    k = std::max(0, std::min(k, ns-2));
+    double h = s_grid[k+1]-s_grid[k];
+    double A = (s_grid[k+1]-s)/h;
+    double B = 1-A;
+    double cA = (A*A*A-A)*h*h/6;
+    double cB = (B*B*B-B)*h*h/6;
+    double dA = -(3*A*A-1)*h/6;
+    double dB = (3*B*B-1)*h/6;
+    auto spline = [&](const double* y, const double* M, double& val, double& deriv) {
+        val = A*y[k] + B*y[k+1] + cA*M[k] + cB*M[k+1];
+        deriv = (y[k+1]-y[k])/h + dA*M[k] + dB*M[k+1];
+    };
+
+    trig_table(theta, ws.cosm, ws.sinm);
+    trig_table(nfp*zeta, ws.cosn, ws.sinn);
+
+    // the radial factor s^(m/2) is singular at the axis, so we stay away from s=0
+    double sc = std::max(s, 1e-12);
+    double sqrts = std::sqrt(sc);
+    double modB = 0., dmodBds = 0., dmodBdtheta = 0., dmodBdzeta = 0.;
+    for (int j = 0; j < nmodes; ++j) {
+        int m = xm[j];
+        int n = xn[j]/nfp;
+        double f, df;
+        spline(&b_values[j*ns], &b_second[j*ns], f, df);
+        double fak = m == 0 ? 1. : std::pow(sqrts, m);
+        double b = fak*f;
+        double dbds = fak*df + (m == 0 ? 0. : 0.5*m*b/sc);
+        // cos(m theta - n nfp zeta) and sin(m theta - n nfp zeta) from the tables
+        double cn = ws.cosn[std::abs(n)];
+        double sn = n < 0 ? -ws.sinn[-n] : ws.sinn[n];
+        double cosj = ws.cosm[m]*cn + ws.sinm[m]*sn;
+        double sinj = ws.sinm[m]*cn - ws.cosm[m]*sn;
+        modB += b*cosj;
+        dmodBds += dbds*cosj;
+        dmodBdtheta -= m*b*sinj;
+        dmodBdzeta += xn[j]*b*sinj;
+    }
+    p.modB = modB;
+    p.dmodBds = dmodBds;
+    p.dmodBdtheta = dmodBdtheta;
+    p.dmodBdzeta = dmodBdzeta;
+    double diota;
+    spline(&profile_values[0], &profile_second[0], p.G, p.dGds);
+    spline(&profile_values[ns], &profile_second[ns], p.I, p.dIds);
+    spline(&profile_values[2*ns], &profile_second[2*ns], p.iota, diota);
+}
+
+vector<array<double, 4>> BoozerSpectralField::modB(const vector<array<double, 3>>& stz) const {
+    Workspace ws = workspace();
+    Point p;
+    vector<array<double, 4>> res(stz.size());
+    for (int i = 0; i < stz.size(); ++i) {
+        evaluate(ws, stz[i][0], stz[i][1], stz[i][2], p);
+        res[i] = {p.modB, p.dmodBds, p.dmodBdtheta, p.dmodBdzeta};
+    }
+    return res;
+}
+
+vector<array<double, 5>> BoozerSpectralField::profiles(const Vec& s) const {
+    Workspace ws = workspace();
+    Point p;
+    vector<array<double, 5>> res(s.size());
+    for (int i = 0; i < s.size(); ++i) {
+        evaluate(ws, s[i], 0., 0., p);
+        res[i] = {p.G, p.dGds, p.I, p.dIds, p.iota};
+    }
+    return res;
+}
@@ -0,0 +1,76 @@
+#pragma once
+
+#include <vector>
+#include <array>
+#include <stdexcept>
+
+using std::vector;
+using std::array;
+using Vec = std::vector<double>;
+
+/*
+ * Magnetic field strength and profiles of an equilibrium in Boozer
+ * coordinates (s, theta, zeta), where s is the normalized toroidal flux.
+ *
+ * The field strength on each surface is given by its (stellarator symmetric)
+ * Fourier series
+ *
+ *   |B|(s, theta, zeta) = \sum_j bmnc_j(s) cos(xm_j theta - xn_j zeta),
+ *
+ * and the covariant components G(s), I(s) of the field, B = G \nabla zeta + I \nabla theta + ...,
+ * as well as the rotational transform iota(s) are given on the same surfaces.
+ * All of these are interpolated radially with natural cubic splines. Close
+ * to the magnetic axis bmnc_j behaves like s^(xm_j/2), so we interpolate
+ * bmnc_j/s^(xm_j/2) instead of bmnc_j.
+ *
+ * All evaluations are const and take a `Workspace` that holds the tables of
+ * cos(m theta), sin(m theta), cos(n zeta) and sin(n zeta), so that one
+ * object can be shared across threads with one workspace per thread.
+ */
+class BoozerSpectralField {
+    private:
+        // natural cubic splines on the grid s_grid, stored as values and
+        // second derivatives for each function
+        Vec s_grid;
+        int nmodes, mmax, nmax;
+        vector<int> xm, xn;
+        Vec b_values, b_second;  // (nmodes, ns)
+        Vec profile_values, profile_second;  // (3, ns) for G, I and iota
+
+        static Vec spline_second_derivatives(const Vec& x, const double* y);
+
+    public:
+        const int nfp;
+        // toroidal flux through the boundary divided by 2 pi, so that psi = psi0*s
+        const double psi0;
+
+        struct Workspace {
+            Vec cosm, sinm, cosn, sinn;
+        };
+
+        // Result of an evaluation, derivatives are taken with respect to s,
+        // theta and zeta.
+        struct Point {
+            double modB, dmodBds, dmodBdtheta, dmodBdzeta;
+            double G, dGds, I, dIds, iota;
+        };
+
+        // `bmnc` has shape (nmodes, ns) and contains the Fourier coefficients
+        // of |B| on the surfaces `s`, `xn` includes the factor `nfp`.
+        BoozerSpectralField(Vec s, vector<int> xm, vector<int> xn, vector<Vec> bmnc,
+                Vec G, Vec I, Vec iota, double psi0, int nfp);
+
+        Workspace workspace() const;
+        void evaluate(Workspace& ws, double s, double theta, double zeta, Point& p) const;
+
+        int num_modes() const { return nmodes; }
+        double smin() const { return s_grid.front(); }
+        double smax() const { return s_grid.back(); }
+
+        // Evaluate the field strength and its derivatives at the points
+        // `stz` (shape (n, 3)), returns an array of shape (n, 4) with
+        // |B|, d|B|/ds, d|B|/dtheta, d|B|/dzeta in each row.
+        vector<array<double, 4>> modB(const vector<array<double, 3>>& stz) const;
+        // Returns G, dG/ds, I, dI/ds and iota at the given values of s.
+        vector<array<double, 5>> profiles(const Vec& s) const;
+};
@@ -0,0 +1,142 @@
+#include "boozer_residual.h"
+#include <Eigen/Dense>
+#include <vector>
+#include <algorithm>
+#include <fmt/core.h>
+#include "xtensor/xarray.hpp"
+
+#ifdef _OPENMP
+#include <omp.h>
+#endif
+
+typedef Eigen::Matrix<double, Eigen::Dynamic, Eigen::Dynamic> Mat;
+
+// number of quadrature points whose outer products are accumulated at once
+#define BOOZER_HESSIAN_CHUNK 32
+
+template<class Array>
+Array boozer_residual_hessian_contracted(Array& w, double G, double iota, Array& B, Array& dB_by_dX, Array& d2B_by_dXdX,
+        Array& xphi, Array& xtheta, Array& dx_dc, Array& dxphi_dc, Array& dxtheta_dc, bool user_provided_G) {
+    // the derivatives with respect to the surface dofs are read through raw
+    // pointers along their last axis
+    if(dx_dc.layout() != xt::layout_type::row_major)
+          throw std::runtime_error("dx_dc needs to be in row-major storage order");
+    if(dxphi_dc.layout() != xt::layout_type::row_major)
+          throw std::runtime_error("dxphi_dc needs to be in row-major storage order");
+    if(dxtheta_dc.layout() != xt::layout_type::row_major)
+          throw std::runtime_error("dxtheta_dc needs to be in row-major storage order");
+    if(dx_dc.dimension() != 4 || dx_dc.shape(2) != 3)
+        throw std::logic_error("dx_dc needs to have shape (nphi, ntheta, 3, ndofs).");
+    int nphi = dx_dc.shape(0);
+    int ntheta = dx_dc.shape(1);
+    int ndofs = dx_dc.shape(3);
+    int npoints = nphi*ntheta;
+    auto check_shape = [&](Array& a, std::vector<int> shape, const char* name) {
+        bool ok = a.dimension() == shape.size();
+        for (int i = 0; ok && i < shape.size(); ++i)
+            ok = a.shape(i) == shape[i];
+        if(!ok)
+            throw std::logic_error(fmt::format("{} has the wrong shape.", name));
+    };
+    check_shape(w, {nphi, ntheta, 3}, "w");
+    check_shape(B, {nphi, ntheta, 3}, "B");
+    check_shape(dB_by_dX, {nphi, ntheta, 3, 3}, "dB_by_dX");
+    check_shape(d2B_by_dXdX, {nphi, ntheta, 3, 3, 3}, "d2B_by_dXdX");
+    check_shape(xphi, {nphi, ntheta, 3}, "xphi");
+    check_shape(xtheta, {nphi, ntheta, 3}, "xtheta");
+    check_shape(dxphi_dc, {nphi, ntheta, 3, ndofs}, "dxphi_dc");
+    check_shape(dxtheta_dc, {nphi, ntheta, 3, ndofs}, "dxtheta_dc");
+
+    int nextra = user_provided_G ? 2 : 1;
+    Mat Hcc = Mat::Zero(ndofs, ndofs);
+    Eigen::VectorXd Hciota = Eigen::VectorXd::Zero(ndofs);
+    Eigen::VectorXd HcG = Eigen::VectorXd::Zero(ndofs);
+
+    #pragma omp parallel
+    {
+        Mat Hcc_local = Mat::Zero(ndofs, ndofs);
+        Eigen::VectorXd Hciota_local = Eigen::VectorXd::Zero(ndofs);
+        Eigen::VectorXd HcG_local = Eigen::VectorXd::Zero(ndofs);
+        // Hcc += U*V^T, with eight columns of U and V per quadrature point
+        Mat U(ndofs, 8*BOOZER_HESSIAN_CHUNK);
+        Mat V(ndofs, 8*BOOZER_HESSIAN_CHUNK);
+
+        #pragma omp for schedule(static)
+        for (int chunk = 0; chunk < npoints; chunk += BOOZER_HESSIAN_CHUNK) {
+            int nchunk = std::min(BOOZER_HESSIAN_CHUNK, npoints - chunk);
+            for (int c = 0; c < nchunk; ++c) {
+                int i = (chunk + c) / ntheta;
+                int j = (chunk + c) % ntheta;
+                double Bij[3], wij[3], tang[3];
+                double B2 = 0., wtang = 0., wxtheta = 0.;
+                for (int l = 0; l < 3; ++l) {
+                    Bij[l] = B(i, j, l);
+                    wij[l] = w(i, j, l);
+                    tang[l] = xphi(i, j, l) + iota*xtheta(i, j, l);
+                    B2 += Bij[l]*Bij[l];
+                    wtang += wij[l]*tang[l];
+                    wxtheta += wij[l]*xtheta(i, j, l);
+                }
+                double M[3][3];
+                for (int k = 0; k < 3; ++k) {
+                    for (int p = 0; p < 3; ++p) {
+                        M[k][p] = 0.;
+                        for (int l = 0; l < 3; ++l)
+                            M[k][p] += d2B_by_dXdX(i, j, k, p, l)*(G*wij[l] - 2*wtang*Bij[l]);
+                    }
+                }
+                const double* dx[3] = {&dx_dc(i, j, 0, 0), &dx_dc(i, j, 1, 0), &dx_dc(i, j, 2, 0)};
+                const double* dxphi[3] = {&dxphi_dc(i, j, 0, 0), &dxphi_dc(i, j, 1, 0), &dxphi_dc(i, j, 2, 0)};
+                const double* dxtheta[3] = {&dxtheta_dc(i, j, 0, 0), &dxtheta_dc(i, j, 1, 0), &dxtheta_dc(i, j, 2, 0)};
+                for (int m = 0; m < ndofs; ++m) {
+                    double dBm[3] = {0., 0., 0.};
+                    double wdtang = 0., wdxtheta = 0.;
+                    for (int k = 0; k < 3; ++k) {
+                        for (int l = 0; l < 3; ++l)
+                            dBm[l] += dB_by_dX(i, j, k, l)*dx[k][m];
+                        wdtang += wij[k]*(dxphi[k][m] + iota*dxtheta[k][m]);
+                        wdxtheta += wij[k]*dxtheta[k][m];
+                    }
+                    double dB2 = 2*(Bij[0]*dBm[0] + Bij[1]*dBm[1] + Bij[2]*dBm[2]);
+                    for (int k = 0; k < 3; ++k) {
+                        U(m, 8*c+k) = dx[k][m];
+                        V(m, 8*c+k) = M[k][0]*dx[0][m] + M[k][1]*dx[1][m] + M[k][2]*dx[2][m];
+                        U(m, 8*c+3+k) = dBm[k];
+                        V(m, 8*c+3+k) = -2*wtang*dBm[k];
+                    }
+                    U(m, 8*c+6) = wdtang;
+                    V(m, 8*c+6) = -dB2;
+                    U(m, 8*c+7) = dB2;
+                    V(m, 8*c+7) = -wdtang;
+                    Hciota_local[m] -= wxtheta*dB2 + B2*wdxtheta;
+                    HcG_local[m] += wij[0]*dBm[0] + wij[1]*dBm[1] + wij[2]*dBm[2];
+                }
+            }
+            Hcc_local.noalias() += U.leftCols(8*nchunk) * V.leftCols(8*nchunk).transpose();
+        }
+        #pragma omp critical
+        {
+            Hcc += Hcc_local;
+            Hciota += Hciota_local;
+            HcG += HcG_local;
+        }
+    }
+
+    Array H = xt::zeros<double>({ndofs + nextra, ndofs + nextra});
+    for (int m = 0; m < ndofs; ++m) {
+        for (int n = 0; n < ndofs; ++n)
+            H(m, n) = Hcc(m, n);
+        H(m, ndofs) = Hciota[m];
+        H(ndofs, m) = Hciota[m];
+        if(user_provided_G) {
+            H(m, ndofs+1) = HcG[m];
+            H(ndofs+1, m) = HcG[m];
+        }
+    }
+    return H;
+}
+
+#include "xtensor-python/pyarray.hpp"     // Numpy bindings
+typedef xt::pyarray<double> Array;
+template Array boozer_residual_hessian_contracted<Array>(Array& w, double G, double iota, Array& B, Array& dB_by_dX, Array& d2B_by_dXdX,
+        Array& xphi, Array& xtheta, Array& dx_dc, Array& dxphi_dc, Array& dxtheta_dc, bool user_provided_G);
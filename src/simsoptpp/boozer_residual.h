@@ -0,0 +1,35 @@
+#pragma once
+
+#include <stdexcept>
+
+/*
+ * Second derivatives of the Boozer residual
+ *
+ *   r = G B(x) - |B(x)|^2 (x_phi + iota x_theta)
+ *
+ * at the quadrature points of a surface with respect to the surface dofs,
+ * iota and G, contracted with weights w of shape (nphi, ntheta, 3), i.e.
+ *
+ *   \sum_{i, j, l} w_{ijl} \nabla^2 r_{ijl}.
+ *
+ * This is the part of the Hessian of 0.5*|r|^2 (for w = r) that is not
+ * given by J^T J. Writing t = x_phi + iota x_theta, the block with respect to
+ * the surface dofs is
+ *
+ *   \sum_{ij} x_{,m}^T M x_{,n} - 2 (w.t) B_{,m}.B_{,n} - (w.t_{,m}) (B^2)_{,n} - (w.t_{,n}) (B^2)_{,m}
+ *
+ * where M_{kp} = \sum_l \partial_k \partial_p B_l (G w_l - 2 (w.t) B_l). For
+ * each quadrature point this is a sum of eight outer products of vectors of
+ * length ndofs, which are accumulated for chunks of quadrature points with a
+ * matrix-matrix product. The loop over the quadrature points is parallelized
+ * with OpenMP, and no array with more than ndofs*ndofs entries per thread is
+ * formed.
+ *
+ * dB_by_dX has shape (nphi, ntheta, 3, 3) with dB_by_dX(i, j, k, l) = dB_l/dx_k,
+ * d2B_by_dXdX has shape (nphi, ntheta, 3, 3, 3), the derivatives of the surface
+ * have shape (nphi, ntheta, 3, ndofs). The result has shape (ndofs+2, ndofs+2)
+ * if G is a variable and (ndofs+1, ndofs+1) otherwise.
+ */
+template<class Array>
+Array boozer_residual_hessian_contracted(Array& w, double G, double iota, Array& B, Array& dB_by_dX, Array& d2B_by_dXdX,
+        Array& xphi, Array& xtheta, Array& dx_dc, Array& dxphi_dc, Array& dxtheta_dc, bool user_provided_G);
@@ -2,6 +2,8 @@
 
 #include <string>
 #include <vector>
+#include <map>
+#include <functional>
 #include <xtensor/xarray.hpp>
 #include <fmt/core.h>
 #include <fmt/format.h>
@@ -12,10 +14,165 @@
 using std::string;
 using std::vector;
 
+// `create` sets `view` to an array of shape `dims` that uses the first
+// entries of `buffer`, which has at least as many entries. For array types
+// that don't support views, `enabled` is false and the cache only reuses
+// buffers of exactly the requested size. See `cache_pyarray.h` for numpy
+// arrays.
+template<class Array>
+struct CacheView {
+    static const bool enabled = false;
+    static void create(Array& buffer, const vector<int>& dims, Array& view) {}
+};
+
+// A keyed cache of arrays.
+//
+// When the array of a key changes its shape, or when a key is evicted, its
+// buffer is returned to a pool that is shared by all keys. New arrays are
+// taken from the smallest buffer in the pool that is large enough, so that a
+// field that is evaluated alternately on a surface and on a set of tracing
+// points, or on point sets of different sizes, does not reallocate its
+// arrays.
+//
+// If a byte budget is set and the total size of all buffers exceeds it,
+// the cache releases, in least recently used order, first the buffers in the
+// pool, then the arrays that are no longer valid, and then the valid arrays.
+// Arrays that were requested since the last call to `release` (or
+// `set_budget`) are never evicted, since the caller may still hold references
+// to them.
 template<class Array>
 class Cache {
     private:
-        std::map<string, CachedArray<Array>> cache;
+        struct Entry {
+            Array data;
+            // if `data` is a view, the buffer that owns its memory
+            Array buffer;
+            bool has_data = false;
+            bool is_view = false;
+            bool status = false;
+            long last_used = 0;
+        };
+        struct PoolBuffer {
+            Array buffer;
+            long last_used;
+        };
+        std::map<string, Entry> cache;
+        vector<PoolBuffer> pool;
+        long budget = -1;  // in bytes, negative means no budget
+        long tick = 0;
+        long pinned_since = 0;
+        long hits = 0;
+        long misses = 0;
+        long allocations = 0;
+        long reuses = 0;
+        long evictions = 0;
+
+        static bool same_shape(const Array& a, const vector<int>& dims) {
+            if(a.dimension() != dims.size())
+                return false;
+            for (int i = 0; i < dims.size(); ++i)
+                if(a.shape(i) != dims[i])
+                    return false;
+            return true;
+        }
+
+        static long entry_bytes(const Entry& entry) {
+            if(!entry.has_data)
+                return 0;
+            return (entry.is_view ? entry.buffer.size() : entry.data.size())*sizeof(double);
+        }
+
+        // Moves the buffer of the entry to the pool.
+        void release_entry(Entry& entry) {
+            if(!entry.has_data)
+                return;
+            pool.push_back({std::move(entry.is_view ? entry.buffer : entry.data), entry.last_used});
+            entry.has_data = false;
+            entry.is_view = false;
+            entry.status = false;
+        }
+
+        // Make sure that the array of the entry has the given shape, taking
+        // the smallest buffer of the pool that fits, or allocating a new one.
+        void reshape_entry(Entry& entry, vector<int> dims) {
+            if(entry.has_data && same_shape(entry.data, dims))
+                return;
+            release_entry(entry);
+            size_t size = 1;
+            for (int d : dims)
+                size *= d;
+            int best = -1;
+            for (int k = 0; k < pool.size(); ++k) {
+                size_t s = pool[k].buffer.size();
+                if(s < size || (s > size && !CacheView<Array>::enabled))
+                    continue;
+                if(best < 0 || s < pool[best].buffer.size())
+                    best = k;
+            }
+            entry.has_data = true;
+            if(best < 0) {
+                entry.data = xt::zeros<double>(dims);
+                allocations++;
+                return;
+            }
+            Array buffer = std::move(pool[best].buffer);
+            pool.erase(pool.begin() + best);
+            if(buffer.size() == size) {
+                entry.data = std::move(buffer);
+                entry.data.reshape(std::vector<size_t>(dims.begin(), dims.end()));
+            } else {
+                CacheView<Array>::create(buffer, dims, entry.data);
+                entry.buffer = std::move(buffer);
+                entry.is_view = true;
+            }
+            reuses++;
+        }
+
+        typename std::map<string, Entry>::iterator find_or_insert(const string& key, vector<int> dims) {
+            tick++;
+            auto loc = cache.find(key);
+            if(loc == cache.end())
+                loc = cache.insert(std::make_pair(key, Entry())).first;
+            reshape_entry(loc->second, dims);
+            if(loc->second.status)
+                hits++;
+            else
+                misses++;
+            loc->second.last_used = tick;
+            return loc;
+        }
+
+        void enforce_budget() {
+            if(budget < 0)
+                return;
+            long total = nbytes();
+            while(total > budget && pool.size() > 0) {
+                auto lru = pool.begin();
+                for (auto it = pool.begin(); it != pool.end(); ++it)
+                    if(it->last_used < lru->last_used)
+                        lru = it;
+                total -= lru->buffer.size()*sizeof(double);
+                pool.erase(lru);
+                evictions++;
+            }
+            while(total > budget) {
+                // the least recently used entry that isn't pinned, preferring
+                // arrays that are no longer valid
+                auto lru = cache.end();
+                for (auto it = cache.begin(); it != cache.end(); ++it) {
+                    if(it->second.last_used > pinned_since)
+                        continue;
+                    if(lru == cache.end() || std::make_pair(it->second.status, it->second.last_used) < std::make_pair(lru->second.status, lru->second.last_used))
+                        lru = it;
+                }
+                if(lru == cache.end())
+                    return;
+                total -= entry_bytes(lru->second);
+                cache.erase(lru);
+                evictions++;
+            }
+        }
+
     public:
         bool get_status(string key) const {
             auto loc = cache.find(key);
@@ -27,35 +184,21 @@ class Cache {
             }
             return true;
         }
+
         Array& get_or_create(string key, vector<int> dims){
-            auto loc = cache.find(key);
-            if(loc == cache.end()){ // Key not found --> allocate array
-                loc = cache.insert(std::make_pair(key, CachedArray<Array>(xt::zeros<double>(dims)))).first; 
-                //fmt::print("Create a new array for key {} of size [{}] at {}\n", key, fmt::join(dims, ", "), fmt::ptr(loc->second.data.data()));
-            } else if(loc->second.data.shape(0) != dims[0]) { // key found but not the right number of points
-                loc->second = CachedArray<Array>(xt::zeros<double>(dims));
-                //fmt::print("Create a new array for key {} of size [{}] at {}\n", key, fmt::join(dims, ", "), fmt::ptr(loc->second.data.data()));
-            } else {
-                //fmt::print("Existing array found for key {} of size [{}] at {}\n", key, fmt::join(dims, ", "), fmt::ptr(loc->second.data.data()));
-            }
+            auto loc = find_or_insert(key, dims);
             loc->second.status = true;
+            enforce_budget();
             return loc->second.data;
         }
 
         Array& get_or_create_and_fill(string key, vector<int> dims, std::function<void(Array&)> impl) {
-            auto loc = cache.find(key);
-            if(loc == cache.end()){ // Key not found --> allocate array
-                loc = cache.insert(std::make_pair(key, CachedArray<Array>(xt::zeros<double>(dims)))).first; 
-                //fmt::print("Create a new array for key {} of size [{}] at {}\n", key, fmt::join(dims, ", "), fmt::ptr(loc->second.data.data()));
-            } else if(loc->second.data.shape(0) != dims[0]) { // key found but not the right number of points
-                loc->second = CachedArray<Array>(xt::zeros<double>(dims));
-                //fmt::print("Create a new array for key {} of size [{}] at {}\n", key, fmt::join(dims, ", "), fmt::ptr(loc->second.data.data()));
-            }
+            auto loc = find_or_insert(key, dims);
             if(!(loc->second.status)){ // needs recomputing
-                //fmt::print("Fill array for key {} of size [{}] at {}\n", key, fmt::join(dims, ", "), fmt::ptr(loc->second.data.data()));
                 impl(loc->second.data);
                 loc->second.status = true;
             }
+            enforce_budget();
             return loc->second.data;
         }
 
@@ -64,4 +207,42 @@ class Cache {
                 it->second.status = false;
             }
         }
+
+        // Called when the owner of the cache no longer holds references to
+        // any of its arrays, e.g. at the start of a computation. From then on,
+        // all arrays that were requested before may be evicted.
+        void release() {
+            pinned_since = tick;
+            enforce_budget();
+        }
+
+        // Limit the memory of the cache to `bytes` (negative for no limit).
+        // Like `release`, this must not be called while references to arrays
+        // of the cache are in use.
+        void set_budget(long bytes) {
+            budget = bytes;
+            release();
+        }
+
+        long get_budget() const { return budget; }
+
+        // Total size in bytes of all buffers held by the cache.
+        long nbytes() const {
+            long res = 0;
+            for (auto it = cache.begin(); it != cache.end(); ++it)
+                res += entry_bytes(it->second);
+            for (auto& p : pool)
+                res += p.buffer.size()*sizeof(double);
+            return res;
+        }
+
+        // Lookups that found a valid array (hits) or not (misses), arrays
+        // that were allocated, buffers of the pool that were reused instead,
+        // and arrays or buffers that were released to stay within the budget.
+        std::map<string, long> statistics() const {
+            return {
+                {"hits", hits}, {"misses", misses}, {"allocations", allocations},
+                {"reuses", reuses}, {"evictions", evictions}, {"bytes", nbytes()}
+            };
+        }
 };
@@ -0,0 +1,20 @@
+#pragma once
+
+#include "pybind11/pybind11.h"
+#include "pybind11/numpy.h"
+#include "xtensor-python/pyarray.hpp"
+#include "cache.h"
+
+// Views of the first entries of a numpy array, so that the cache can reuse
+// buffers that are larger than the requested array, see `Cache`. Include
+// this before `Cache<xt::pyarray<double>>` is used.
+template<>
+struct CacheView<xt::pyarray<double>> {
+    static const bool enabled = true;
+    static void create(xt::pyarray<double>& buffer, const vector<int>& dims, xt::pyarray<double>& view) {
+        // the view keeps a reference to the buffer, so its memory stays valid
+        // even after the cache has released the buffer.
+        pybind11::array_t<double> res(dims, buffer.data(), buffer);
+        view = xt::pyarray<double>(res);
+    }
+};
@@ -1,6 +1,9 @@
 #pragma once
 
 #include <vector>
+#include <map>
+#include <string>
+#include <functional>
 #include "xtensor/xarray.hpp"
 #include "xtensor/xlayout.hpp"
 
@@ -14,6 +17,7 @@ class CachedTensor {
         T data = {};
         bool status;
         array<int, rank> dims;
+        long hits = 0, misses = 0, allocations = 0, evictions = 0;
     public:
         using Shape = std::array<int, rank>;
 
@@ -29,6 +33,7 @@ class CachedTensor {
         inline T& get_or_create(const Shape& new_dims){
             if(dims != new_dims){
                 data = xt::zeros<double>(new_dims);
+                allocations++;
                 //fmt::print("Dims ({} != {}) don't match, create a new Tensor.\n", dims, new_dims);
                 dims = new_dims;
             }
@@ -41,10 +46,14 @@ class CachedTensor {
         }
 
         inline T& get_or_create_and_fill(const Shape& new_dims, const std::function<void(T&)>& impl){
-            if(status)
+            if(status) {
+                hits++;
                 return data;
+            }
+            misses++;
             if(dims != new_dims){
                 data = xt::zeros<double>(new_dims);
+                allocations++;
                 //fmt::print("Dims ({} != {}) don't match, create a new Tensor.\n", dims, new_dims);
                 dims = new_dims;
             }
@@ -57,4 +66,29 @@ class CachedTensor {
             status = false;
         }
 
+        // Frees the memory of the data. It is allocated again when needed.
+        void release() {
+            status = false;
+            if(data.size() <= 1)
+                return;
+            dims.fill(1);
+            data = xt::zeros<double>(dims);
+            evictions++;
+        }
+
+        long nbytes() const {
+            return data.size()*sizeof(double);
+        }
+
+        // Adds the number of lookups that found valid data (hits) or not
+        // (misses), the number of allocations and releases and the size of
+        // the data in bytes to `stats`.
+        void add_statistics(std::map<std::string, long>& stats) const {
+            stats["hits"] += hits;
+            stats["misses"] += misses;
+            stats["allocations"] += allocations;
+            stats["evictions"] += evictions;
+            stats["bytes"] += nbytes();
+        }
+
 };
@@ -464,6 +464,29 @@ double dZBphi(int m, int n, double R, double Z, double phi, double coeff1, doubl
 	return y;
 }
 
+void DommaschkBdB_point(int m, int n, double coeff1, double coeff2, double x, double y, double z, double* B, double* dB){
+    double R      = sqrt(x*x+y*y);
+    double phi    = atan2(y,x);
+    double cosphi = x/R;
+    double sinphi = y/R;
+    if(B) {
+        B[0] += BR(m,n,R,z,phi,coeff1,coeff2)*cosphi-Bphi(m,n,R,z,phi,coeff1,coeff2)*sinphi;
+        B[1] += BR(m,n,R,z,phi,coeff1,coeff2)*sinphi+Bphi(m,n,R,z,phi,coeff1,coeff2)*cosphi;
+        B[2] += BZ(m,n,R,z,phi,coeff1,coeff2);
+    }
+    if(dB) {
+        dB[0] += dRBR(m,n,R,z,phi,coeff1,coeff2)*cosphi*cosphi-(dphiBR(m,n,R,z,phi,coeff1,coeff2)-Bphi(m,n,R,z,phi,coeff1,coeff2)+dRBphi(m,n,R,z,phi,coeff1,coeff2)*R)*cosphi*sinphi/R+sinphi*sinphi*(dphiBphi(m,n,R,z,phi,coeff1,coeff2)+BR(m,n,R,z,phi,coeff1,coeff2))/R;
+        dB[1] += sinphi*cosphi*(dRBR(m,n,R,z,phi,coeff1,coeff2)*R-dphiBphi(m,n,R,z,phi,coeff1,coeff2)-BR(m,n,R,z,phi,coeff1,coeff2))/R+sinphi*sinphi*(Bphi(m,n,R,z,phi,coeff1,coeff2)-dphiBR(m,n,R,z,phi,coeff1,coeff2))/R+cosphi*cosphi*dRBphi(m,n,R,z,phi,coeff1,coeff2);
+        dB[2] += dRBZ(m,n,R,z,phi,coeff1,coeff2)*cosphi-dphiBZ(m,n,R,z,phi,coeff1,coeff2)*sinphi/R;
+        dB[3] += sinphi*cosphi*(dRBR(m,n,R,z,phi,coeff1,coeff2)*R-dphiBphi(m,n,R,z,phi,coeff1,coeff2)-BR(m,n,R,z,phi,coeff1,coeff2))/R+cosphi*cosphi*(dphiBR(m,n,R,z,phi,coeff1,coeff2)-Bphi(m,n,R,z,phi,coeff1,coeff2))/R-sinphi*sinphi*dRBphi(m,n,R,z,phi,coeff1,coeff2);
+        dB[4] += dRBR(m,n,R,z,phi,coeff1,coeff2)*sinphi*sinphi+(dphiBR(m,n,R,z,phi,coeff1,coeff2)-Bphi(m,n,R,z,phi,coeff1,coeff2)+dRBphi(m,n,R,z,phi,coeff1,coeff2)*R)*cosphi*sinphi/R+cosphi*cosphi*(dphiBphi(m,n,R,z,phi,coeff1,coeff2)+BR(m,n,R,z,phi,coeff1,coeff2))/R;
+        dB[5] += dRBZ(m,n,R,z,phi,coeff1,coeff2)*sinphi+dphiBZ(m,n,R,z,phi,coeff1,coeff2)*cosphi/R;
+        dB[6] += dZBR(m,n,R,z,phi,coeff1,coeff2)*cosphi-dZBphi(m,n,R,z,phi,coeff1,coeff2)*sinphi;
+        dB[7] += dZBR(m,n,R,z,phi,coeff1,coeff2)*sinphi+dZBphi(m,n,R,z,phi,coeff1,coeff2)*cosphi;
+        dB[8] += dZBZ(m,n,R,z,phi,coeff1,coeff2);
+    }
+}
+
 #include "xtensor-python/pyarray.hpp"
 typedef xt::pyarray<double> Array;
 
@@ -471,25 +494,14 @@ Array DommaschkB(Array& mArray, Array& nArray, Array& coeffs, Array& points){
     int num_points = points.shape(0);
     int num_coeffs = coeffs.shape(0);
     Array B        = xt::zeros<double>({coeffs.shape(0), points.shape(0), points.shape(1)});
-    double x,y,z,R,phi,cosphi,sinphi,coeff1,coeff2;
-    int m,n;
     for (int j=0; j < num_coeffs; ++j) {
-        m      = mArray(j);
-        n      = nArray(j);
-        coeff1 = coeffs(j,0);
-        coeff2 = coeffs(j,1);
+        int m         = mArray(j);
+        int n         = nArray(j);
+        double coeff1 = coeffs(j,0);
+        double coeff2 = coeffs(j,1);
         #pragma omp parallel for
         for (int i = 0; i < num_points; ++i) {
-            x    = points(i, 0);
-            y    = points(i, 1);
-            z    = points(i, 2);
-            R    = sqrt(x*x+y*y);
-            phi  = atan2(y,x);
-            cosphi = x/R;
-            sinphi = y/R;
-            B(j,i,0) = BR(m,n,R,z,phi,coeff1,coeff2)*cosphi-Bphi(m,n,R,z,phi,coeff1,coeff2)*sinphi;
-            B(j,i,1) = BR(m,n,R,z,phi,coeff1,coeff2)*sinphi+Bphi(m,n,R,z,phi,coeff1,coeff2)*cosphi;
-            B(j,i,2) = BZ(m,n,R,z,phi,coeff1,coeff2);
+            DommaschkBdB_point(m, n, coeff1, coeff2, points(i, 0), points(i, 1), points(i, 2), &(B(j,i,0)), nullptr);
         }
     }
     return B;
@@ -499,31 +511,14 @@ Array DommaschkdB(Array& mArray, Array& nArray, Array& coeffs, Array& points){
     int num_points = points.shape(0);
     int num_coeffs = coeffs.shape(0);
     Array dB       = xt::zeros<double>({coeffs.shape(0), points.shape(0), points.shape(1), points.shape(1)});
-    double x,y,z,R,phi,cosphi,sinphi,coeff1,coeff2;
-    int m,n;
     for (int j=0; j < num_coeffs; ++j) {
-        m      = mArray(j);
-        n      = nArray(j);
-        coeff1 = coeffs(j,0);
-        coeff2 = coeffs(j,1);
+        int m         = mArray(j);
+        int n         = nArray(j);
+        double coeff1 = coeffs(j,0);
+        double coeff2 = coeffs(j,1);
         #pragma omp parallel for
         for (int i = 0; i < num_points; ++i) {
-            x    = points(i, 0);
-            y    = points(i, 1);
-            z    = points(i, 2);
-            R    = sqrt(x*x+y*y);
-            phi  = atan2(y,x);
-            cosphi = x/R;
-            sinphi = y/R;
-            dB(j,i,0,0) = dRBR(m,n,R,z,phi,coeff1,coeff2)*cosphi*cosphi-(dphiBR(m,n,R,z,phi,coeff1,coeff2)-Bphi(m,n,R,z,phi,coeff1,coeff2)+dRBphi(m,n,R,z,phi,coeff1,coeff2)*R)*cosphi*sinphi/R+sinphi*sinphi*(dphiBphi(m,n,R,z,phi,coeff1,coeff2)+BR(m,n,R,z,phi,coeff1,coeff2))/R;
-            dB(j,i,0,1) = sinphi*cosphi*(dRBR(m,n,R,z,phi,coeff1,coeff2)*R-dphiBphi(m,n,R,z,phi,coeff1,coeff2)-BR(m,n,R,z,phi,coeff1,coeff2))/R+sinphi*sinphi*(Bphi(m,n,R,z,phi,coeff1,coeff2)-dphiBR(m,n,R,z,phi,coeff1,coeff2))/R+cosphi*cosphi*dRBphi(m,n,R,z,phi,coeff1,coeff2);
-            dB(j,i,0,2) = dRBZ(m,n,R,z,phi,coeff1,coeff2)*cosphi-dphiBZ(m,n,R,z,phi,coeff1,coeff2)*sinphi/R;
-            dB(j,i,1,0) = sinphi*cosphi*(dRBR(m,n,R,z,phi,coeff1,coeff2)*R-dphiBphi(m,n,R,z,phi,coeff1,coeff2)-BR(m,n,R,z,phi,coeff1,coeff2))/R+cosphi*cosphi*(dphiBR(m,n,R,z,phi,coeff1,coeff2)-Bphi(m,n,R,z,phi,coeff1,coeff2))/R-sinphi*sinphi*dRBphi(m,n,R,z,phi,coeff1,coeff2);
-            dB(j,i,1,1) = dRBR(m,n,R,z,phi,coeff1,coeff2)*sinphi*sinphi+(dphiBR(m,n,R,z,phi,coeff1,coeff2)-Bphi(m,n,R,z,phi,coeff1,coeff2)+dRBphi(m,n,R,z,phi,coeff1,coeff2)*R)*cosphi*sinphi/R+cosphi*cosphi*(dphiBphi(m,n,R,z,phi,coeff1,coeff2)+BR(m,n,R,z,phi,coeff1,coeff2))/R;
-            dB(j,i,1,2) = dRBZ(m,n,R,z,phi,coeff1,coeff2)*sinphi+dphiBZ(m,n,R,z,phi,coeff1,coeff2)*cosphi/R;
-            dB(j,i,2,0) = dZBR(m,n,R,z,phi,coeff1,coeff2)*cosphi-dZBphi(m,n,R,z,phi,coeff1,coeff2)*sinphi;
-            dB(j,i,2,1) = dZBR(m,n,R,z,phi,coeff1,coeff2)*sinphi+dZBphi(m,n,R,z,phi,coeff1,coeff2)*cosphi;
-            dB(j,i,2,2) = dZBZ(m,n,R,z,phi,coeff1,coeff2);
+            DommaschkBdB_point(m, n, coeff1, coeff2, points(i, 0), points(i, 1), points(i, 2), nullptr, &(dB(j,i,0,0)));
         }
     }
     return dB;
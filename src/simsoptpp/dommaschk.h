@@ -3,3 +3,7 @@ typedef xt::pyarray<double> Array;
 
 Array DommaschkB(Array& mArray, Array& nArray, Array& coeffs, Array& points);
 Array DommaschkdB(Array& mArray, Array& nArray, Array& coeffs, Array& points);
+// Adds the field of the harmonic (m, n) with coefficients (coeff1, coeff2) at
+// the point (x, y, z) to B and its gradient (dB[3*j+l] = \partial_j B_l) to
+// dB. Either of B and dB may be a nullptr.
+void DommaschkBdB_point(int m, int n, double coeff1, double coeff2, double x, double y, double z, double* B, double* dB);
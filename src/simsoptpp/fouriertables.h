@@ -0,0 +1,173 @@
+#pragma once
+
+#include <vector>
+using std::vector;
+#include <cmath>
+#include <cstdlib>
+
+/*
+ * Tables of cos(m*theta) and sin(m*theta) for m = 0, ..., mpol and of
+ * cos(n*nfp*phi) and sin(n*nfp*phi) for n = 0, ..., ntor on the quadrature
+ * points of a surface, as well as of cos(phi) and sin(phi). The tables are
+ * filled using the angle addition formulas, so that only two calls to cos and
+ * sin are needed per quadrature point. The Fourier modes are then obtained via
+ *
+ *   cos(m*theta - n*nfp*phi) = cos(m*theta)*cos(n*nfp*phi) + sin(m*theta)*sin(n*nfp*phi)
+ *   sin(m*theta - n*nfp*phi) = sin(m*theta)*cos(n*nfp*phi) - cos(m*theta)*sin(n*nfp*phi).
+ *
+ * Since the quadrature points form a tensor product grid, a Fourier series
+ *
+ *   f(theta, phi) = \sum_{m=0}^{mpol} \sum_{n=-ntor}^{ntor} [
+ *       c_{m,n} \cos(m \theta - n nfp \phi) + s_{m,n} \sin(m \theta - n nfp \phi) ]
+ *
+ * can be evaluated in two passes: first the sums over n for each phi
+ * (`partial_sums`), then the sums over m for each theta (`sum` and
+ * `sum_dtheta`). This reduces the cost from O(nphi*ntheta*mpol*ntor) to
+ * O(nphi*mpol*(ntor + ntheta)). The same holds for the transposed operation
+ * (`sum_transpose` and `partial_sums_transpose`) that is needed for vector
+ * jacobian products with respect to the coefficients.
+ */
+class FourierTables {
+    public:
+        int mpol = -1;
+        int ntor = -1;
+        int nfp = 0;
+        int nphi = 0;
+        int ntheta = 0;
+        vector<double> cos_theta, sin_theta; // (ntheta, mpol+1)
+        vector<double> cos_phi, sin_phi;     // (nphi, ntor+1), of n*nfp*phi
+        vector<double> cos_phi1, sin_phi1;   // (nphi), of phi
+
+        FourierTables() {}
+
+        template<class Array>
+        FourierTables(const Array& quadpoints_phi, const Array& quadpoints_theta, int _mpol, int _ntor, int _nfp) :
+            mpol(_mpol), ntor(_ntor), nfp(_nfp), nphi(quadpoints_phi.size()), ntheta(quadpoints_theta.size()),
+            cos_theta(ntheta*(mpol+1)), sin_theta(ntheta*(mpol+1)),
+            cos_phi(nphi*(ntor+1)), sin_phi(nphi*(ntor+1)),
+            cos_phi1(nphi), sin_phi1(nphi) {
+            for (int k2 = 0; k2 < ntheta; ++k2) {
+                double theta = 2*M_PI*quadpoints_theta[k2];
+                fill(theta, mpol, &cos_theta[k2*(mpol+1)], &sin_theta[k2*(mpol+1)]);
+            }
+            for (int k1 = 0; k1 < nphi; ++k1) {
+                double phi = 2*M_PI*quadpoints_phi[k1];
+                fill(nfp*phi, ntor, &cos_phi[k1*(ntor+1)], &sin_phi[k1*(ntor+1)]);
+                cos_phi1[k1] = std::cos(phi);
+                sin_phi1[k1] = std::sin(phi);
+            }
+        }
+
+        // Fill c[k] = cos(k*x) and s[k] = sin(k*x) for k = 0, ..., kmax.
+        static void fill(double x, int kmax, double* c, double* s) {
+            double c1 = std::cos(x);
+            double s1 = std::sin(x);
+            c[0] = 1.;
+            s[0] = 0.;
+            for (int k = 1; k <= kmax; ++k) {
+                c[k] = c[k-1]*c1 - s[k-1]*s1;
+                s[k] = s[k-1]*c1 + c[k-1]*s1;
+            }
+        }
+
+        bool matches(int _mpol, int _ntor, int _nfp, int _nphi, int _ntheta) const {
+            return mpol == _mpol && ntor == _ntor && nfp == _nfp && nphi == _nphi && ntheta == _ntheta;
+        }
+
+        // cos(m*theta - n*nfp*phi) and sin(m*theta - n*nfp*phi) at (phi_k1, theta_k2) for -ntor <= n <= ntor.
+        inline void angle(int k1, int k2, int m, int n, double& c, double& s) const {
+            double cm = cos_theta[k2*(mpol+1)+m];
+            double sm = sin_theta[k2*(mpol+1)+m];
+            double cn = cos_phi[k1*(ntor+1)+std::abs(n)];
+            double sn = n < 0 ? -sin_phi[k1*(ntor+1)-n] : sin_phi[k1*(ntor+1)+n];
+            c = cm*cn + sm*sn;
+            s = sm*cn - cm*sn;
+        }
+
+        // For the coefficients c and s of shape (mpol+1, 2*ntor+1), computes at phi_k1
+        //
+        //   P_m = \sum_n c_{m,n} cos(n nfp phi) - s_{m,n} sin(n nfp phi)
+        //   Q_m = \sum_n c_{m,n} sin(n nfp phi) + s_{m,n} cos(n nfp phi)
+        //
+        // so that f = \sum_m P_m cos(m theta) + Q_m sin(m theta). If dP and dQ
+        // are given, the derivatives of P_m and Q_m with respect to phi are
+        // computed as well. Passing a nullptr for c or s treats those
+        // coefficients as zero.
+        template<class Array>
+        void partial_sums(int k1, const Array* c, const Array* s, double* P, double* Q, double* dP=nullptr, double* dQ=nullptr) const {
+            const double* cn = &cos_phi[k1*(ntor+1)];
+            const double* sn = &sin_phi[k1*(ntor+1)];
+            for (int m = 0; m <= mpol; ++m) {
+                double p = 0., q = 0., dp = 0., dq = 0.;
+                for (int i = 0; i < 2*ntor+1; ++i) {
+                    int n = i - ntor;
+                    double cosn = cn[std::abs(n)];
+                    double sinn = n < 0 ? -sn[-n] : sn[n];
+                    double cc = c ? (*c)(m, i) : 0.;
+                    double ss = s ? (*s)(m, i) : 0.;
+                    double a = cc*cosn - ss*sinn;
+                    double b = cc*sinn + ss*cosn;
+                    p += a;
+                    q += b;
+                    dp -= (n*nfp)*b;
+                    dq += (n*nfp)*a;
+                }
+                P[m] = p;
+                Q[m] = q;
+                if(dP) dP[m] = dp;
+                if(dQ) dQ[m] = dq;
+            }
+        }
+
+        // \sum_m P_m cos(m theta_k2) + Q_m sin(m theta_k2)
+        inline double sum(int k2, const double* P, const double* Q) const {
+            const double* cm = &cos_theta[k2*(mpol+1)];
+            const double* sm = &sin_theta[k2*(mpol+1)];
+            double res = 0.;
+            for (int m = 0; m <= mpol; ++m)
+                res += P[m]*cm[m] + Q[m]*sm[m];
+            return res;
+        }
+
+        // Derivative of `sum` with respect to theta.
+        inline double sum_dtheta(int k2, const double* P, const double* Q) const {
+            const double* cm = &cos_theta[k2*(mpol+1)];
+            const double* sm = &sin_theta[k2*(mpol+1)];
+            double res = 0.;
+            for (int m = 1; m <= mpol; ++m)
+                res += m*(Q[m]*cm[m] - P[m]*sm[m]);
+            return res;
+        }
+
+        // Transpose of `sum` and `sum_dtheta`: adds the derivatives of
+        // w*sum(k2, P, Q) + wdtheta*sum_dtheta(k2, P, Q) with respect to P and Q.
+        inline void sum_transpose(int k2, double w, double wdtheta, double* P, double* Q) const {
+            const double* cm = &cos_theta[k2*(mpol+1)];
+            const double* sm = &sin_theta[k2*(mpol+1)];
+            for (int m = 0; m <= mpol; ++m) {
+                P[m] += w*cm[m] - wdtheta*m*sm[m];
+                Q[m] += w*sm[m] + wdtheta*m*cm[m];
+            }
+        }
+
+        // Transpose of `partial_sums`: given the derivatives of a function
+        // with respect to P, Q, dP and dQ at phi_k1, adds its derivatives
+        // with respect to the coefficients c and s. Passing a nullptr for c
+        // or s skips those coefficients.
+        template<class Array>
+        void partial_sums_transpose(int k1, const double* P, const double* Q, const double* dP, const double* dQ, Array* c, Array* s) const {
+            const double* cn = &cos_phi[k1*(ntor+1)];
+            const double* sn = &sin_phi[k1*(ntor+1)];
+            for (int m = 0; m <= mpol; ++m) {
+                for (int i = 0; i < 2*ntor+1; ++i) {
+                    int n = i - ntor;
+                    double cosn = cn[std::abs(n)];
+                    double sinn = n < 0 ? -sn[-n] : sn[n];
+                    double alpha = P[m] + (n*nfp)*dQ[m];
+                    double beta = Q[m] - (n*nfp)*dP[m];
+                    if(c) (*c)(m, i) += alpha*cosn + beta*sinn;
+                    if(s) (*s)(m, i) += beta*cosn - alpha*sinn;
+                }
+            }
+        }
+};
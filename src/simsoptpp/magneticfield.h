@@ -11,12 +11,23 @@
 #include "cache.h"
 #include "cachedtensor.h"
 
+#ifdef _OPENMP
+#include <omp.h>
+#endif
+
 using std::logic_error;
 using std::vector;
 using std::shared_ptr;
 using std::make_shared;
 
 
+// Computes \nabla |B| from B and \nabla B at a single point, where
+// dB[3*j+l] = \partial_j B_l (see `MagneticField::_GradAbsB_impl`).
+inline void grad_abs_b_from_dB(const double* B, const double* dB, double* GradAbsB) {
+    double AbsB = std::sqrt(B[0]*B[0] + B[1]*B[1] + B[2]*B[2]);
+    for (int j = 0; j < 3; ++j)
+        GradAbsB[j] = (B[0]*dB[3*j+0] + B[1]*dB[3*j+1] + B[2]*dB[3*j+2])/AbsB;
+}
 
 
 template<template<class, std::size_t, xt::layout_type> class T>
@@ -128,12 +139,38 @@ class MagneticField {
         virtual void _dA_by_dX_impl(Tensor3& dA_by_dX) { throw logic_error("_dA_by_dX_impl was not implemented"); }
         virtual void _d2A_by_dXdX_impl(Tensor4& d2A_by_dXdX) { throw logic_error("_d2A_by_dXdX_impl was not implemented"); }
 
+        // Releases the quantities that are no longer valid, in a fixed order,
+        // until the cached quantities use at most `cache_budget` bytes.
+        void enforce_cache_budget() {
+            if(cache_budget < 0)
+                return;
+            long total = cache_nbytes();
+            auto release = [&](auto& tensor) {
+                if(total > cache_budget && !tensor.get_status()) {
+                    total -= tensor.nbytes();
+                    tensor.release();
+                }
+            };
+            release(data_ddB); release(data_ddA); release(data_dB); release(data_dA);
+            release(data_B); release(data_A); release(data_GradAbsB); release(data_GradAbsBcyl);
+            release(data_Bcyl); release(data_AbsB); release(points_cart); release(points_cyl);
+        }
+
+        long cache_nbytes() {
+            return points_cart.nbytes() + points_cyl.nbytes() + data_B.nbytes() + data_dB.nbytes() + data_ddB.nbytes()
+                + data_A.nbytes() + data_dA.nbytes() + data_ddA.nbytes() + data_AbsB.nbytes() + data_GradAbsB.nbytes()
+                + data_Bcyl.nbytes() + data_GradAbsBcyl.nbytes();
+        }
+
         CachedTensor<T, 2> points_cart;
         CachedTensor<T, 2> points_cyl;
         CachedTensor<T, 2> data_B, data_A, data_GradAbsB, data_AbsB, data_Bcyl, data_GradAbsBcyl;
         CachedTensor<T, 3> data_dB, data_dA;
         CachedTensor<T, 4> data_ddB, data_ddA;
         int npoints;
+        long cache_budget = -1;  // in bytes, negative means no budget
+        // used by the default implementation of `evaluate_point`
+        Tensor2 single_point_cyl = xt::zeros<double>({1, 3});
 
     public:
         MagneticField() {
@@ -141,6 +178,40 @@ class MagneticField {
             this->set_points_cart(vals);
         }
 
+        virtual ~MagneticField() = default;
+
+        // Returns a new field that evaluates to the same values as this one
+        // but has its own cache, so that the copy and the original can be
+        // evaluated concurrently from different threads. Any expensive,
+        // read-only data (e.g. interpolation tables) may be shared between
+        // the two. Fields that do not support this return a nullptr.
+        virtual shared_ptr<MagneticField<T>> clone() {
+            return nullptr;
+        }
+
+        // Evaluates B and, unless `GradAbsB` is a nullptr, \nabla |B| at the
+        // single point (x, y, z) and writes them (in cartesian coordinates)
+        // to `B` and `GradAbsB`. This is used in the right hand sides of the
+        // tracers. Fields that can evaluate a single point cheaply override
+        // this and don't touch the cache or the points of the field at all;
+        // the default sets the point via `set_points_cyl` and uses the cache.
+        virtual void evaluate_point(double x, double y, double z, double* B, double* GradAbsB) {
+            single_point_cyl(0, 0) = std::sqrt(x*x + y*y);
+            single_point_cyl(0, 1) = std::atan2(y, x);
+            if(single_point_cyl(0, 1) < 0)
+                single_point_cyl(0, 1) += 2*M_PI;
+            single_point_cyl(0, 2) = z;
+            this->set_points_cyl(single_point_cyl);
+            if(GradAbsB) {
+                Tensor2& GradAbsB_ = this->GradAbsB_ref();
+                for (int l = 0; l < 3; ++l)
+                    GradAbsB[l] = GradAbsB_(0, l);
+            }
+            Tensor2& B_ = this->B_ref();
+            for (int l = 0; l < 3; ++l)
+                B[l] = B_(0, l);
+        }
+
         virtual void invalidate_cache() {
             data_B.invalidate_cache();
             data_dB.invalidate_cache();
@@ -154,6 +225,37 @@ class MagneticField {
             data_GradAbsBcyl.invalidate_cache();
         }
 
+        // Limit the memory of the cached quantities to `bytes` (negative for
+        // no limit). Quantities that are no longer valid are released when
+        // the limit is exceeded, the valid ones are kept.
+        virtual void set_cache_budget(long bytes) {
+            cache_budget = bytes;
+            enforce_cache_budget();
+        }
+
+        long get_cache_budget() {
+            return cache_budget;
+        }
+
+        // Hits, misses, allocations and evictions of the caches of the field,
+        // summed over all cached quantities, and the memory they use in bytes.
+        virtual std::map<string, long> cache_statistics() {
+            std::map<string, long> stats = {{"hits", 0}, {"misses", 0}, {"allocations", 0}, {"evictions", 0}, {"bytes", 0}};
+            points_cart.add_statistics(stats);
+            points_cyl.add_statistics(stats);
+            data_B.add_statistics(stats);
+            data_dB.add_statistics(stats);
+            data_ddB.add_statistics(stats);
+            data_A.add_statistics(stats);
+            data_dA.add_statistics(stats);
+            data_ddA.add_statistics(stats);
+            data_AbsB.add_statistics(stats);
+            data_GradAbsB.add_statistics(stats);
+            data_Bcyl.add_statistics(stats);
+            data_GradAbsBcyl.add_statistics(stats);
+            return stats;
+        }
+
         MagneticField& set_points_cyl(Tensor2& p) {
             this->invalidate_cache();
             this->points_cart.invalidate_cache();
@@ -164,6 +266,7 @@ class MagneticField {
             for (int i = 0; i < npoints; ++i) {
                 points(i, 1) = std::fmod(points(i, 1), 2*M_PI);
             }
+            this->enforce_cache_budget();
             this->_set_points_cb();
             return *this;
         }
@@ -175,6 +278,7 @@ class MagneticField {
             npoints = p.shape(0);
             Tensor2& points = points_cart.get_or_create({npoints, 3});
             memcpy(points.data(), p.data(), 3*npoints*sizeof(double));
+            this->enforce_cache_budget();
             this->_set_points_cb();
             return *this;
         }
@@ -262,4 +366,20 @@ class MagneticField {
 
 };
 
-
+template<template<class, std::size_t, xt::layout_type> class T>
+vector<shared_ptr<MagneticField<T>>> get_fields_for_threads(shared_ptr<MagneticField<T>> field) {
+    // Every thread owns a copy of the field. Fields can't be copied in general
+    // (e.g. if they are implemented in python); in that case we return just
+    // the field itself and the caller has to fall back to a serial loop.
+    int nthreads = 1;
+#ifdef _OPENMP
+    nthreads = omp_get_max_threads();
+#endif
+    vector<shared_ptr<MagneticField<T>>> fields(nthreads);
+    for (int i = 0; i < nthreads; ++i) {
+        fields[i] = field->clone();
+        if(!fields[i])
+            return {field};
+    }
+    return fields;
+}
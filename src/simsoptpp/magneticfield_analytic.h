@@ -0,0 +1,125 @@
+#pragma once
+
+#include <array>
+#include "magneticfield.h"
+#include "dommaschk.h"
+#include "reiman.h"
+
+// Analytic fields that are given pointwise. B and \nabla B at a set of points
+// are computed by evaluating the field point by point; `evaluate_point` does
+// the same for a single point without using the cache, which makes these
+// fields cheap to use in the tracers. The remaining quantities (e.g. the
+// potential) are implemented in python.
+
+// Writes the field B0 R0/R e_phi at (x, y, z) to B and its gradient to dB,
+// either of which may be a nullptr.
+inline void toroidal_B_and_dB(double B0R0, double x, double y, double* B, double* dB) {
+    double R2 = x*x + y*y;
+    if(B) {
+        B[0] = -B0R0*y/R2;
+        B[1] = B0R0*x/R2;
+        B[2] = 0.;
+    }
+    if(dB) {
+        double R4 = R2*R2;
+        dB[0] = B0R0*2*x*y/R4;
+        dB[1] = B0R0*(y*y-x*x)/R4;
+        dB[2] = 0.;
+        dB[3] = B0R0*(y*y-x*x)/R4;
+        dB[4] = -B0R0*2*x*y/R4;
+        dB[5] = 0.;
+        dB[6] = dB[7] = dB[8] = 0.;
+    }
+}
+
+template<template<class, std::size_t, xt::layout_type> class T>
+class PointwiseMagneticField : public MagneticField<T> {
+    public:
+        using typename MagneticField<T>::Tensor2;
+        using typename MagneticField<T>::Tensor3;
+        using MagneticField<T>::npoints;
+
+    protected:
+        // Writes B and \nabla B (with dB[3*j+l] = \partial_j B_l) at the
+        // point (x, y, z). Either of B and dB may be a nullptr.
+        virtual void B_and_dB_at(double x, double y, double z, double* B, double* dB) = 0;
+
+        void _B_impl(Tensor2& B) override {
+            Tensor2& points = this->get_points_cart_ref();
+            for (int i = 0; i < npoints; ++i)
+                B_and_dB_at(points(i, 0), points(i, 1), points(i, 2), &(B(i, 0)), nullptr);
+        }
+
+        void _dB_by_dX_impl(Tensor3& dB_by_dX) override {
+            Tensor2& points = this->get_points_cart_ref();
+            for (int i = 0; i < npoints; ++i)
+                B_and_dB_at(points(i, 0), points(i, 1), points(i, 2), nullptr, &(dB_by_dX(i, 0, 0)));
+        }
+
+    public:
+        void evaluate_point(double x, double y, double z, double* B, double* GradAbsB) override {
+            if(!GradAbsB) {
+                B_and_dB_at(x, y, z, B, nullptr);
+                return;
+            }
+            double dB[9];
+            B_and_dB_at(x, y, z, B, dB);
+            grad_abs_b_from_dB(B, dB, GradAbsB);
+        }
+};
+
+// B = B0 R0/R e_phi.
+template<template<class, std::size_t, xt::layout_type> class T>
+class ToroidalField : public PointwiseMagneticField<T> {
+    protected:
+        void B_and_dB_at(double x, double y, double z, double* B, double* dB) override {
+            toroidal_B_and_dB(B0*R0, x, y, B, dB);
+        }
+
+    public:
+        const double R0, B0;
+
+        ToroidalField(double R0, double B0) : PointwiseMagneticField<T>(), R0(R0), B0(B0) { }
+};
+
+// The field of Dommaschk (1986) for the harmonics (m[i], n[i]) with
+// coefficients coeffs[i], plus the toroidal field with R0 = B0 = 1.
+template<template<class, std::size_t, xt::layout_type> class T>
+class Dommaschk : public PointwiseMagneticField<T> {
+    protected:
+        void B_and_dB_at(double x, double y, double z, double* B, double* dB) override {
+            toroidal_B_and_dB(1., x, y, B, dB);
+            for (int i = 0; i < m.size(); ++i)
+                DommaschkBdB_point(m[i], n[i], coeffs[i][0], coeffs[i][1], x, y, z, B, dB);
+        }
+
+    public:
+        const vector<int> m, n;
+        const vector<std::array<double, 2>> coeffs;
+
+        Dommaschk(vector<int> m, vector<int> n, vector<std::array<double, 2>> coeffs) :
+            PointwiseMagneticField<T>(), m(m), n(n), coeffs(coeffs) {
+            if(n.size() != m.size() || coeffs.size() != m.size())
+                throw logic_error("m, n and coeffs need to have the same length.");
+        }
+};
+
+// The field of Reiman and Greenside (1986), section 5.
+template<template<class, std::size_t, xt::layout_type> class T>
+class Reiman : public PointwiseMagneticField<T> {
+    protected:
+        void B_and_dB_at(double x, double y, double z, double* B, double* dB) override {
+            ReimanBdB_point(iota0, iota1, k.data(), epsilonk.data(), k.size(), m0, x, y, z, B, dB);
+        }
+
+    public:
+        const double iota0, iota1;
+        const vector<double> k, epsilonk;
+        const int m0;
+
+        Reiman(double iota0, double iota1, vector<double> k, vector<double> epsilonk, int m0) :
+            PointwiseMagneticField<T>(), iota0(iota0), iota1(iota1), k(k), epsilonk(epsilonk), m0(m0) {
+            if(epsilonk.size() != k.size())
+                throw logic_error("k and epsilonk need to have the same length.");
+        }
+};
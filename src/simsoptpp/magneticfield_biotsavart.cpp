@@ -1,90 +1,529 @@
 #include "magneticfield_biotsavart.h"
 #include "biot_savart_impl.h"
+#include "biot_savart_vjp_impl.h"
+#include "biot_savart_treecode.h"
 
-template<class Array>
-void set_array_to_zero(Array& data){
-    std::fill(data.begin(), data.end(), 0.);
+// Sets out = \sum_i currents[i] * (*arrays[i]). Every entry is summed over
+// the coils in the same order, independently of the number of threads, so
+// the result is bitwise reproducible.
+template<class S, class Array>
+void sum_over_coils(S& out, const vector<Array*>& arrays, const vector<double>& currents) {
+    int ncoils = arrays.size();
+    int size = out.size();
+    double* out_ptr = out.data();
+    vector<double*> ptrs(ncoils);
+    for (int i = 0; i < ncoils; ++i)
+        ptrs[i] = arrays[i]->data();
+#pragma omp parallel for schedule(static)
+    for (int k = 0; k < size; ++k) {
+        double res = 0.;
+        for (int i = 0; i < ncoils; ++i)
+            res += currents[i] * ptrs[i][k];
+        out_ptr[k] = res;
+    }
+}
+
+inline int get_max_threads() {
+#ifdef _OPENMP
+    return omp_get_max_threads();
+#else
+    return 1;
+#endif
+}
+
+inline int get_thread_num() {
+#ifdef _OPENMP
+    return omp_get_thread_num();
+#else
+    return 0;
+#endif
 }
 
 
+// Sets (or adds to, if `accumulate`) out = sign * S in, where S acts on every
+// index of the tensor `in` of the given rank with three entries per index,
+// i.e. out_{ab..} = sign * \sum S_{aa'} S_{bb'} ... in_{a'b'..}.
+inline void apply_symmetry(const std::array<double, 9>& S, double sign, const double* in, double* out, int rank, bool accumulate) {
+    double tmp[2][27];
+    int size = rank == 1 ? 3 : (rank == 2 ? 9 : 27);
+    const double* src = in;
+    int stride = size;
+    for (int m = 0; m < rank; ++m) {
+        stride /= 3;
+        double* dst = tmp[m % 2];
+        for (int idx = 0; idx < size; ++idx) {
+            int a = (idx / stride) % 3;
+            int base = idx - a*stride;
+            dst[idx] = S[3*a+0]*src[base] + S[3*a+1]*src[base+stride] + S[3*a+2]*src[base+2*stride];
+        }
+        src = dst;
+    }
+    if(accumulate)
+        for (int idx = 0; idx < size; ++idx)
+            out[idx] += sign*src[idx];
+    else
+        for (int idx = 0; idx < size; ++idx)
+            out[idx] = sign*src[idx];
+}
+
 template<template<class, std::size_t, xt::layout_type> class T, class Array>
-void BiotSavart<T, Array>::compute(int derivatives) {
-    //fmt::print("Calling compute({})\n", derivatives);
+template<class Kernel>
+void BiotSavart<T, Array>::compute_tiles(const string& name, int derivatives, int block_size, vector<Array*>& Fs, vector<Array*>& dFs, vector<Array*>& ddFs, Kernel kernel) {
     auto points = this->get_points_cart_ref();
-    this->fill_points(points);
-    Array dummyjac = xt::zeros<double>({1, 1, 1});
-    Array dummyhess = xt::zeros<double>({1, 1, 1, 1});
-    Tensor3 _dummyjac = xt::zeros<double>({1, 1, 1});
-    Tensor4 _dummyhess = xt::zeros<double>({1, 1, 1, 1});
     int ncoils = this->coils.size();
+    // The work is split into tiles of one coil and one block of targets, so
+    // that all threads are busy even if there are only a few coils. Each tile
+    // writes to different rows of the per coil arrays.
+    int nblocks = (npoints + block_size - 1)/block_size;
+    if(!symmetric) {
+        this->fill_points(points);
+#pragma omp parallel for schedule(dynamic)
+        for (int tile = 0; tile < ncoils*nblocks; ++tile) {
+            int i = tile / nblocks;
+            int start = (tile % nblocks)*block_size;
+            int end = std::min(start + block_size, npoints);
+            kernel(0, i, pointsx, pointsy, pointsz, start, end, *Fs[i], *dFs[i], *ddFs[i]);
+        }
+        return;
+    }
+
+    // The kernel writes the field of coil i at the transformed targets to
+    // scratch arrays, from which the same tile then adds the rotated rows to
+    // the per coil arrays. Only one copy of each coil is stored, so this
+    // needs the memory of the base coils only, independently of the size of
+    // the group.
+    vector<Array*> Gs(ncoils), dGs(ncoils, &dummyjac), ddGs(ncoils, &dummyhess);
+    for (int i = 0; i < ncoils; ++i) {
+        Gs[i] = &field_cache.get_or_create(fmt::format("sym_{}_{}", name, i), {npoints, 3});
+        if(derivatives > 0)
+            dGs[i] = &field_cache.get_or_create(fmt::format("sym_d{}_{}", name, i), {npoints, 3, 3});
+        if(derivatives > 1)
+            ddGs[i] = &field_cache.get_or_create(fmt::format("sym_dd{}_{}", name, i), {npoints, 3, 3, 3});
+    }
+    for (int g = 0; g < symmetries.size(); ++g) {
+        auto& S = symmetries[g];
+        double sign = symmetry_signs[g];
+        this->fill_points(points, S);
+#pragma omp parallel for schedule(dynamic)
+        for (int tile = 0; tile < ncoils*nblocks; ++tile) {
+            int i = tile / nblocks;
+            int start = (tile % nblocks)*block_size;
+            int end = std::min(start + block_size, npoints);
+            kernel(g, i, pointsx, pointsy, pointsz, start, end, *Gs[i], *dGs[i], *ddGs[i]);
+            for (int r = start; r < end; ++r) {
+                apply_symmetry(S, sign, Gs[i]->data() + 3*r, Fs[i]->data() + 3*r, 1, g > 0);
+                if(derivatives > 0)
+                    apply_symmetry(S, sign, dGs[i]->data() + 9*r, dFs[i]->data() + 9*r, 2, g > 0);
+                if(derivatives > 1)
+                    apply_symmetry(S, sign, ddGs[i]->data() + 27*r, ddFs[i]->data() + 27*r, 3, g > 0);
+            }
+        }
+    }
+}
+
+template<template<class, std::size_t, xt::layout_type> class T, class Array>
+template<class Kernel>
+void BiotSavart<T, Array>::compute_accumulated(int derivatives, const vector<double>& currents, double* F, double* dF, double* ddF, Kernel kernel) {
+    auto points = this->get_points_cart_ref();
+    int ncoils = this->coils.size();
+    int nthreads = get_max_threads();
+    // each block handles all coils, so aim for about four blocks per thread
+    int block_size = biot_savart_block_size(1, npoints, nthreads);
+    int nblocks = (npoints + block_size - 1)/block_size;
+    // the kernel only writes the first n rows of the scratch arrays, so
+    // arrays from earlier calls with larger blocks can be reused.
+    auto reserve = [nthreads, block_size](vector<Scratch>& scratch, std::vector<size_t> shape) {
+        scratch.resize(nthreads);
+        for (auto& G : scratch)
+            if(G.dimension() != shape.size() || G.shape(0) < block_size)
+                G.resize(shape);
+    };
+    reserve(scratch_G, {(size_t)block_size, 3});
+    if(derivatives > 0)
+        reserve(scratch_dG, {(size_t)block_size, 3, 3});
+    if(derivatives > 1)
+        reserve(scratch_ddG, {(size_t)block_size, 3, 3, 3});
+    vector<AlignedVector> pxs(nthreads, AlignedVector(block_size, 0.));
+    vector<AlignedVector> pys(nthreads, AlignedVector(block_size, 0.));
+    vector<AlignedVector> pzs(nthreads, AlignedVector(block_size, 0.));
+#pragma omp parallel for schedule(dynamic)
+    for (int b = 0; b < nblocks; ++b) {
+        int t = get_thread_num();
+        int start = b*block_size;
+        int n = std::min(block_size, npoints - start);
+        Scratch& G = scratch_G[t];
+        Scratch& dG = derivatives > 0 ? scratch_dG[t] : scratch_dummyjac;
+        Scratch& ddG = derivatives > 1 ? scratch_ddG[t] : scratch_dummyhess;
+        std::fill(F + 3*start, F + 3*(start+n), 0.);
+        if(derivatives > 0)
+            std::fill(dF + 9*start, dF + 9*(start+n), 0.);
+        if(derivatives > 1)
+            std::fill(ddF + 27*start, ddF + 27*(start+n), 0.);
+        for (int g = 0; g < symmetries.size(); ++g) {
+            auto& S = symmetries[g];
+            for (int r = 0; r < n; ++r) {
+                double x = points(start+r, 0), y = points(start+r, 1), z = points(start+r, 2);
+                pxs[t][r] = S[0]*x + S[3]*y + S[6]*z;
+                pys[t][r] = S[1]*x + S[4]*y + S[7]*z;
+                pzs[t][r] = S[2]*x + S[5]*y + S[8]*z;
+            }
+            for (int i = 0; i < ncoils; ++i) {
+                kernel(g, i, pxs[t], pys[t], pzs[t], 0, n, G, dG, ddG);
+                if(symmetric) {
+                    double w = symmetry_signs[g]*currents[i];
+                    for (int r = 0; r < n; ++r) {
+                        apply_symmetry(S, w, G.data() + 3*r, F + 3*(start+r), 1, true);
+                        if(derivatives > 0)
+                            apply_symmetry(S, w, dG.data() + 9*r, dF + 9*(start+r), 2, true);
+                        if(derivatives > 1)
+                            apply_symmetry(S, w, ddG.data() + 27*r, ddF + 27*(start+r), 3, true);
+                    }
+                } else {
+                    // the same order of summation as in `sum_over_coils`
+                    for (int k = 0; k < 3*n; ++k)
+                        F[3*start+k] += currents[i] * G.data()[k];
+                    if(derivatives > 0)
+                        for (int k = 0; k < 9*n; ++k)
+                            dF[9*start+k] += currents[i] * dG.data()[k];
+                    if(derivatives > 1)
+                        for (int k = 0; k < 27*n; ++k)
+                            ddF[27*start+k] += currents[i] * ddG.data()[k];
+                }
+            }
+        }
+    }
+}
+
+template<template<class, std::size_t, xt::layout_type> class T, class Array>
+template<class S>
+void BiotSavart<T, Array>::kernel_B(int derivatives, int i, AlignedVector& px, AlignedVector& py, AlignedVector& pz, int start, int end, S& B_i, S& dB_i, S& ddB_i) {
+    Array& gamma = this->coils[i]->curve->gamma();
+    Array& gammadash = this->coils[i]->curve->gammadash();
+    if(derivatives == 0){
+        if(single_precision)
+            biot_savart_kernel_float<Array, 0>(px, py, pz, gamma, gammadash, B_i, dB_i, start, end);
+        else
+            biot_savart_kernel<Array, 0>(px, py, pz, gamma, gammadash, B_i, dB_i, ddB_i, start, end);
+    } else if(derivatives == 1) {
+        if(single_precision)
+            biot_savart_kernel_float<Array, 1>(px, py, pz, gamma, gammadash, B_i, dB_i, start, end);
+        else
+            biot_savart_kernel<Array, 1>(px, py, pz, gamma, gammadash, B_i, dB_i, ddB_i, start, end);
+    } else {
+        biot_savart_kernel<Array, 2>(px, py, pz, gamma, gammadash, B_i, dB_i, ddB_i, start, end);
+    }
+}
+
+template<template<class, std::size_t, xt::layout_type> class T, class Array>
+template<class S>
+void BiotSavart<T, Array>::kernel_A(int derivatives, int i, AlignedVector& px, AlignedVector& py, AlignedVector& pz, int start, int end, S& A_i, S& dA_i, S& ddA_i) {
+    Array& gamma = this->coils[i]->curve->gamma();
+    Array& gammadash = this->coils[i]->curve->gammadash();
+    if(derivatives == 0)
+        biot_savart_kernel_A<Array, 0>(px, py, pz, gamma, gammadash, A_i, dA_i, ddA_i, start, end);
+    else if(derivatives == 1)
+        biot_savart_kernel_A<Array, 1>(px, py, pz, gamma, gammadash, A_i, dA_i, ddA_i, start, end);
+    else
+        biot_savart_kernel_A<Array, 2>(px, py, pz, gamma, gammadash, A_i, dA_i, ddA_i, start, end);
+}
+
+template<template<class, std::size_t, xt::layout_type> class T, class Array>
+void BiotSavart<T, Array>::compute(int derivatives) {
+    if(store_coil_fields) {
+        this->compute_per_coil(derivatives);
+        return;
+    }
+    if(derivatives > 2)
+        throw logic_error("Only two derivatives of Biot Savart implemented");
     Tensor2& B = data_B.get_or_create({npoints, 3});
     Tensor3& dB = derivatives >= 1 ? data_dB.get_or_create({npoints, 3, 3}) : _dummyjac;
     Tensor4& ddB = derivatives >= 2 ? data_ddB.get_or_create({npoints, 3, 3, 3}) : _dummyhess;
+    int ncoils = this->coils.size();
+    vector<double> currents(ncoils);
+    for (int i = 0; i < ncoils; ++i) {
+        this->coils[i]->curve->gamma();
+        this->coils[i]->curve->gammadash();
+        currents[i] = this->coils[i]->current->get_value();
+    }
+    this->compute_accumulated(derivatives, currents, B.data(), dB.data(), ddB.data(), [&](int g, int i, AlignedVector& px, AlignedVector& py, AlignedVector& pz, int start, int end, auto& B_i, auto& dB_i, auto& ddB_i) {
+        this->kernel_B(derivatives, i, px, py, pz, start, end, B_i, dB_i, ddB_i);
+    });
+}
+
+template<template<class, std::size_t, xt::layout_type> class T, class Array>
+void BiotSavart<T, Array>::compute_A(int derivatives) {
+    if(store_coil_fields) {
+        this->compute_A_per_coil(derivatives);
+        return;
+    }
+    if(derivatives > 2)
+        throw logic_error("Only two derivatives of the vector potential implemented");
+    Tensor2& A = data_A.get_or_create({npoints, 3});
+    Tensor3& dA = derivatives >= 1 ? data_dA.get_or_create({npoints, 3, 3}) : _dummyjac;
+    Tensor4& ddA = derivatives >= 2 ? data_ddA.get_or_create({npoints, 3, 3, 3}) : _dummyhess;
+    int ncoils = this->coils.size();
+    vector<double> currents(ncoils);
+    for (int i = 0; i < ncoils; ++i) {
+        this->coils[i]->curve->gamma();
+        this->coils[i]->curve->gammadash();
+        currents[i] = this->coils[i]->current->get_value();
+    }
+    this->compute_accumulated(derivatives, currents, A.data(), dA.data(), ddA.data(), [&](int g, int i, AlignedVector& px, AlignedVector& py, AlignedVector& pz, int start, int end, auto& A_i, auto& dA_i, auto& ddA_i) {
+        this->kernel_A(derivatives, i, px, py, pz, start, end, A_i, dA_i, ddA_i);
+    });
+}
 
-    set_array_to_zero(B);
-    set_array_to_zero(dB);
-    set_array_to_zero(ddB);
+template<template<class, std::size_t, xt::layout_type> class T, class Array>
+double BiotSavart<T, Array>::estimate_memory(int derivatives) {
+    int values_per_point = 3 + (derivatives > 0 ? 9 : 0) + (derivatives > 1 ? 27 : 0);
+    double ncoils = this->coils.size();
+    // the aligned points and the total field
+    double doubles = 3.*npoints + double(values_per_point)*npoints;
+    if(use_treecode(derivatives)) {
+        // flat arrays of the sources and their weights
+        long nsources = 0;
+        for (int i = 0; i < coils.size(); ++i)
+            nsources += coils[i]->curve->gamma().shape(0);
+        doubles += 6.*nsources*symmetries.size();
+    } else if(store_coil_fields) {
+        // the per coil arrays and, with symmetries, the scratch arrays
+        doubles += (symmetric ? 2. : 1.)*ncoils*values_per_point*npoints;
+    } else {
+        // the per thread scratch arrays for one block
+        int nthreads = get_max_threads();
+        double block_size = biot_savart_block_size(1, npoints, nthreads);
+        doubles += nthreads*block_size*(values_per_point + 3.);
+    }
+    return doubles*sizeof(double);
+}
+
+template<template<class, std::size_t, xt::layout_type> class T, class Array>
+void BiotSavart<T, Array>::compute_per_coil(int derivatives) {
+    //fmt::print("Calling compute({})\n", derivatives);
+    if(derivatives > 2)
+        throw logic_error("Only two derivatives of Biot Savart implemented");
+    // no references to the per coil arrays are held from here on, so the
+    // arrays of earlier evaluations may be evicted to stay within the budget.
+    field_cache.release();
+    int ncoils = this->coils.size();
+    Tensor2& B = data_B.get_or_create({npoints, 3});
+    Tensor3& dB = derivatives >= 1 ? data_dB.get_or_create({npoints, 3, 3}) : _dummyjac;
+    Tensor4& ddB = derivatives >= 2 ? data_ddB.get_or_create({npoints, 3, 3, 3}) : _dummyhess;
 
     // Creating new xtensor arrays from an openmp thread doesn't appear
     // to be safe. so we do that here in serial.
+    vector<Array*> Bs(ncoils), dBs(ncoils, &dummyjac), ddBs(ncoils, &dummyhess);
+    vector<double> currents(ncoils);
     for (int i = 0; i < ncoils; ++i) {
         this->coils[i]->curve->gamma();
         this->coils[i]->curve->gammadash();
-        field_cache.get_or_create(fmt::format("B_{}", i), {npoints, 3});
+        currents[i] = this->coils[i]->current->get_value();
+        Bs[i] = &field_cache.get_or_create(fmt::format("B_{}", i), {npoints, 3});
         if(derivatives > 0)
-            field_cache.get_or_create(fmt::format("dB_{}", i), {npoints, 3, 3});
+            dBs[i] = &field_cache.get_or_create(fmt::format("dB_{}", i), {npoints, 3, 3});
         if(derivatives > 1)
-            field_cache.get_or_create(fmt::format("ddB_{}", i), {npoints, 3, 3, 3});
+            ddBs[i] = &field_cache.get_or_create(fmt::format("ddB_{}", i), {npoints, 3, 3, 3});
+    }
+
+    int block_size = biot_savart_block_size(ncoils, npoints, get_max_threads());
+    this->compute_tiles("B", derivatives, block_size, Bs, dBs, ddBs, [&](int g, int i, AlignedVector& px, AlignedVector& py, AlignedVector& pz, int start, int end, Array& B_i, Array& dB_i, Array& ddB_i) {
+        this->kernel_B(derivatives, i, px, py, pz, start, end, B_i, dB_i, ddB_i);
+    });
+    sum_over_coils(B, Bs, currents);
+    if(derivatives>=1)
+        sum_over_coils(dB, dBs, currents);
+    if(derivatives>=2)
+        sum_over_coils(ddB, ddBs, currents);
+}
+
+template<template<class, std::size_t, xt::layout_type> class T, class Array>
+void BiotSavart<T, Array>::compute_A_per_coil(int derivatives) {
+    if(derivatives > 2)
+        throw logic_error("Only two derivatives of the vector potential implemented");
+    field_cache.release();
+    int ncoils = this->coils.size();
+    Tensor2& A = data_A.get_or_create({npoints, 3});
+    Tensor3& dA = derivatives >= 1 ? data_dA.get_or_create({npoints, 3, 3}) : _dummyjac;
+    Tensor4& ddA = derivatives >= 2 ? data_ddA.get_or_create({npoints, 3, 3, 3}) : _dummyhess;
+
+    // see `compute`: create all arrays in serial before entering the
+    // parallel region.
+    vector<Array*> As(ncoils), dAs(ncoils, &dummyjac), ddAs(ncoils, &dummyhess);
+    vector<double> currents(ncoils);
+    for (int i = 0; i < ncoils; ++i) {
+        this->coils[i]->curve->gamma();
+        this->coils[i]->curve->gammadash();
+        currents[i] = this->coils[i]->current->get_value();
+        As[i] = &field_cache.get_or_create(fmt::format("A_{}", i), {npoints, 3});
+        if(derivatives > 0)
+            dAs[i] = &field_cache.get_or_create(fmt::format("dA_{}", i), {npoints, 3, 3});
+        if(derivatives > 1)
+            ddAs[i] = &field_cache.get_or_create(fmt::format("ddA_{}", i), {npoints, 3, 3, 3});
+    }
+
+    int block_size = biot_savart_block_size(ncoils, npoints, get_max_threads());
+    this->compute_tiles("A", derivatives, block_size, As, dAs, ddAs, [&](int g, int i, AlignedVector& px, AlignedVector& py, AlignedVector& pz, int start, int end, Array& A_i, Array& dA_i, Array& ddA_i) {
+        this->kernel_A(derivatives, i, px, py, pz, start, end, A_i, dA_i, ddA_i);
+    });
+    sum_over_coils(A, As, currents);
+    if(derivatives>=1)
+        sum_over_coils(dA, dAs, currents);
+    if(derivatives>=2)
+        sum_over_coils(ddA, ddAs, currents);
+}
+
+template<template<class, std::size_t, xt::layout_type> class T, class Array>
+void BiotSavart<T, Array>::compute_and_vjp(Array& v, Array& vgrad, vector<Array>& dgamma_by_dcoeffs, vector<Array>& d2gamma_by_dphidcoeffs, vector<Array>& res_B, vector<Array>& res_dB) {
+    int ncoils = this->coils.size();
+    if(dgamma_by_dcoeffs.size() != ncoils || d2gamma_by_dphidcoeffs.size() != ncoils || res_B.size() != ncoils)
+        throw logic_error("Need the derivatives and the results for every coil.");
+    if(v.shape(0) != npoints)
+        throw logic_error(fmt::format("v has {} rows for {} points.", v.shape(0), npoints));
+    bool compute_dB = res_dB.size() > 0;
+    int derivatives = compute_dB ? 1 : 0;
+    field_cache.release();
+    Tensor2& B = data_B.get_or_create({npoints, 3});
+    Tensor3& dB = compute_dB ? data_dB.get_or_create({npoints, 3, 3}) : _dummyjac;
+
+    // see `compute`: create all arrays in serial before entering the
+    // parallel region.
+    vector<Array*> Bs(ncoils), dBs(ncoils, &dummyjac), ddBs(ncoils, &dummyhess);
+    vector<double> currents(ncoils);
+    vector<int> num_quad_points(ncoils);
+    for (int i = 0; i < ncoils; ++i) {
+        num_quad_points[i] = this->coils[i]->curve->gamma().shape(0);
+        this->coils[i]->curve->gammadash();
+        currents[i] = this->coils[i]->current->get_value();
+        Bs[i] = &field_cache.get_or_create(fmt::format("B_{}", i), {npoints, 3});
+        if(compute_dB)
+            dBs[i] = &field_cache.get_or_create(fmt::format("dB_{}", i), {npoints, 3, 3});
+    }
+    // the blocks of `biot_savart_vjp`, so that the result is bitwise
+    // reproducible. Each tile accumulates the vector Jacobian product into
+    // its own arrays.
+    int block_size = biot_savart_vjp_block_size(npoints);
+    int nblocks = std::max(1, (npoints + block_size - 1)/block_size);
+    int num_tiles = ncoils*nblocks;
+    vector<Array> res_gamma(num_tiles), res_dgamma_by_dphi(num_tiles), res_grad_gamma(num_tiles), res_grad_dgamma_by_dphi(num_tiles);
+    for (int tile = 0; tile < num_tiles; ++tile) {
+        int num_points = num_quad_points[tile / nblocks];
+        res_gamma[tile] = xt::zeros<double>({num_points, 3});
+        res_dgamma_by_dphi[tile] = xt::zeros<double>({num_points, 3});
+        if(compute_dB) {
+            res_grad_gamma[tile] = xt::zeros<double>({num_points, 3});
+            res_grad_dgamma_by_dphi[tile] = xt::zeros<double>({num_points, 3});
+        }
     }
+    // With symmetries, the field of copy g at x is s_g S_g B(S_g^T x), so the
+    // vector Jacobian product at the transformed targets is taken with
+    // s_g S_g^T v and s_g S_g^T vgrad S_g.
+    int nsym = symmetric ? symmetries.size() : 0;
+    vector<Array> vs(nsym), vgrads(nsym);
+    for (int g = 0; g < nsym; ++g) {
+        vs[g] = xt::zeros<double>({npoints, 3});
+        if(compute_dB)
+            vgrads[g] = xt::zeros<double>({npoints, 3, 3});
+        auto& S = symmetries[g];
+        std::array<double, 9> ST = {S[0], S[3], S[6], S[1], S[4], S[7], S[2], S[5], S[8]};
+        for (int r = 0; r < npoints; ++r) {
+            double v_r[3], vgrad_r[9];
+            for (int j = 0; j < 3; ++j) {
+                v_r[j] = v(r, j);
+                for (int l = 0; l < 3 && compute_dB; ++l)
+                    vgrad_r[3*j+l] = vgrad(r, j, l);
+            }
+            apply_symmetry(ST, symmetry_signs[g], v_r, vs[g].data() + 3*r, 1, false);
+            if(compute_dB)
+                apply_symmetry(ST, symmetry_signs[g], vgrad_r, vgrads[g].data() + 9*r, 2, false);
+        }
+    }
+    Array dummy = Array();
+
+    this->compute_tiles("B", derivatives, block_size, Bs, dBs, ddBs, [&](int g, int i, AlignedVector& px, AlignedVector& py, AlignedVector& pz, int start, int end, Array& B_i, Array& dB_i, Array& ddB_i) {
+        int tile = i*nblocks + start/block_size;
+        Array& v_g = symmetric ? vs[g] : v;
+        Array& vgrad_g = symmetric && compute_dB ? vgrads[g] : vgrad;
+        Array& gamma = this->coils[i]->curve->gamma();
+        Array& gammadash = this->coils[i]->curve->gammadash();
+        if(compute_dB)
+            biot_savart_B_vjp_kernel<Array, 1>(px, py, pz, gamma, gammadash, B_i, dB_i,
+                    v_g, res_gamma[tile], res_dgamma_by_dphi[tile],
+                    vgrad_g, res_grad_gamma[tile], res_grad_dgamma_by_dphi[tile], start, end);
+        else
+            biot_savart_B_vjp_kernel<Array, 0>(px, py, pz, gamma, gammadash, B_i, dummy,
+                    v_g, res_gamma[tile], res_dgamma_by_dphi[tile], dummy, dummy, dummy, start, end);
+    });
+    sum_over_coils(B, Bs, currents);
+    if(compute_dB)
+        sum_over_coils(dB, dBs, currents);
+    biot_savart_vjp_reduce(nblocks, num_quad_points, currents, res_gamma, res_dgamma_by_dphi, res_grad_gamma, res_grad_dgamma_by_dphi,
+            dgamma_by_dcoeffs, d2gamma_by_dphidcoeffs, res_B, res_dB);
+}
 
-#pragma omp parallel for
+template<template<class, std::size_t, xt::layout_type> class T, class Array>
+void BiotSavart<T, Array>::compute_treecode(int derivatives) {
+    if(derivatives > 1)
+        throw logic_error("The treecode only implements B and its first derivative.");
+    auto points = this->get_points_cart_ref();
+    int ncoils = this->coils.size();
+    // collect all quadrature points and current elements into flat arrays
+    vector<double> ys;
+    vector<double> ws;
     for (int i = 0; i < ncoils; ++i) {
-        Array& Bi = field_cache.get_or_create(fmt::format("B_{}", i), {npoints, 3});
-        set_array_to_zero(Bi);
         Array& gamma = this->coils[i]->curve->gamma();
         Array& gammadash = this->coils[i]->curve->gammadash();
         double current = this->coils[i]->current->get_value();
-        if(derivatives == 0){
-            biot_savart_kernel<Array, 0>(pointsx, pointsy, pointsz, gamma, gammadash, Bi, dummyjac, dummyhess);
-        } else {
-            Array& dBi = field_cache.get_or_create(fmt::format("dB_{}", i), {npoints, 3, 3});
-            set_array_to_zero(dBi);
-            if(derivatives == 1) {
-                biot_savart_kernel<Array, 1>(pointsx, pointsy, pointsz, gamma, gammadash, Bi, dBi, dummyhess);
-            } else {
-                Array& ddBi = field_cache.get_or_create(fmt::format("ddB_{}", i), {npoints, 3, 3, 3});
-                set_array_to_zero(ddBi);
-                if (derivatives == 2) {
-                    biot_savart_kernel<Array, 2>(pointsx, pointsy, pointsz, gamma, gammadash, Bi, dBi, ddBi);
-                } else {
-                    throw logic_error("Only two derivatives of Biot Savart implemented");
+        int num_quad_points = gamma.shape(0);
+        double fak = current * 1e-7/num_quad_points;
+        // the copies of the coil are sources of their own
+        for (int g = 0; g < symmetries.size(); ++g) {
+            auto& S = symmetries[g];
+            double wfak = symmetry_signs[g] * fak;
+            for (int j = 0; j < num_quad_points; ++j) {
+                for (int d = 0; d < 3; ++d) {
+                    ys.push_back(S[3*d+0]*gamma(j, 0) + S[3*d+1]*gamma(j, 1) + S[3*d+2]*gamma(j, 2));
+                    ws.push_back(wfak * (S[3*d+0]*gammadash(j, 0) + S[3*d+1]*gammadash(j, 1) + S[3*d+2]*gammadash(j, 2)));
                 }
             }
         }
     }
-    for (int i = 0; i < ncoils; ++i) {
-        Array& Bi = field_cache.get_or_create(fmt::format("B_{}", i), {npoints, 3});
-        double current = this->coils[i]->current->get_value();
-        xt::noalias(B) = B + current * Bi;
-    }
-    if(derivatives>=1) {
-        for (int i = 0; i < ncoils; ++i) {
-            Array& dBi = field_cache.get_or_create(fmt::format("dB_{}", i), {npoints, 3, 3});
-            double current = this->coils[i]->current->get_value();
-            xt::noalias(dB) = dB + current * dBi;
-        }
+    BiotSavartTreecode tree(ys, ws, this->treecode_theta, this->treecode_leaf_size);
+    Tensor2& B = data_B.get_or_create({npoints, 3});
+    if(derivatives == 0) {
+        tree.evaluate(points.data(), npoints, B.data(), nullptr, 0);
+    } else {
+        Tensor3& dB = data_dB.get_or_create({npoints, 3, 3});
+        tree.evaluate(points.data(), npoints, B.data(), dB.data(), 1);
     }
-    if(derivatives>=2) {
-        for (int i = 0; i < ncoils; ++i) {
-            Array& ddBi = field_cache.get_or_create(fmt::format("ddB_{}", i), {npoints, 3, 3, 3});
+}
+
+template<template<class, std::size_t, xt::layout_type> class T, class Array>
+void BiotSavart<T, Array>::evaluate_point(double x, double y, double z, double* B, double* GradAbsB) {
+    double dB[9] = {0., 0., 0., 0., 0., 0., 0., 0., 0.};
+    B[0] = B[1] = B[2] = 0.;
+    for (int g = 0; g < symmetries.size(); ++g) {
+        auto& S = symmetries[g];
+        double Bg[3] = {0., 0., 0.};
+        double dBg[9] = {0., 0., 0., 0., 0., 0., 0., 0., 0.};
+        double xg = S[0]*x + S[3]*y + S[6]*z;
+        double yg = S[1]*x + S[4]*y + S[7]*z;
+        double zg = S[2]*x + S[5]*y + S[8]*z;
+        for (int i = 0; i < this->coils.size(); ++i) {
+            Array& gamma = this->coils[i]->curve->gamma();
+            Array& gammadash = this->coils[i]->curve->gammadash();
             double current = this->coils[i]->current->get_value();
-            xt::noalias(ddB) = ddB + current * ddBi;
+            biot_savart_kernel_point(xg, yg, zg, gamma, gammadash, current, Bg, GradAbsB ? dBg : nullptr);
         }
+        apply_symmetry(S, symmetry_signs[g], Bg, B, 1, true);
+        if(GradAbsB)
+            apply_symmetry(S, symmetry_signs[g], dBg, dB, 2, true);
     }
+    if(GradAbsB)
+        grad_abs_b_from_dB(B, dB, GradAbsB);
 }
 
-
 #include "xtensor-python/pyarray.hpp"     // Numpy bindings
 #include "xtensor-python/pytensor.hpp"     // Numpy bindings
+#include "cache_pyarray.h"
 typedef xt::pyarray<double> PyArray;
 template class BiotSavart<xt::pytensor, PyArray>;
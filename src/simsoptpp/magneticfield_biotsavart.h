@@ -1,6 +1,8 @@
 #pragma once 
 
 #include <vector>
+#include <array>
+#include <cmath>
 #include "xtensor/xarray.hpp"
 #include "xtensor/xlayout.hpp"
 #include "simdhelpers.h"
@@ -21,7 +23,61 @@ class BiotSavart : public MagneticField<T> {
     private:
         Cache<Array> field_cache;
 
+        // if treecode_theta > 0, B and \nabla B are computed using a treecode
+        // whenever npoints * nsources >= treecode_threshold.
+        double treecode_theta = 0.;
+        long treecode_threshold = 100000000L;
+        int treecode_leaf_size = 32;
+
+        // if false, `compute` and `compute_A` sum up the contributions of
+        // the coils block by block directly into the total field and don't
+        // store the field of each coil in the field cache. The per coil
+        // arrays are then only computed on demand by `compute_coil_fields`
+        // and `compute_A_coil_fields`.
+        bool store_coil_fields = true;
+
+        // if true, B and \nabla B are computed in single precision, see
+        // `biot_savart_kernel_float`. The second derivative is always
+        // computed in double precision.
+        bool single_precision = false;
+
+        // The field is \sum_g s_g S_g B(S_g^T x), where B is the field of
+        // `coils` and (S_g, s_g) runs over the symmetry group of the coil
+        // set: S_g is a rotation (stored row major), i.e. the coil copy g
+        // is S_g \Gamma, and s_g = \pm 1 is the sign of its current. By
+        // default the group only contains the identity. The per coil arrays
+        // in the field cache (`B_i` etc.) contain the field of coil i and all
+        // of its copies.
+        vector<std::array<double, 9>> symmetries = {{1., 0., 0., 0., 1., 0., 0., 0., 1.}};
+        vector<double> symmetry_signs = {1.};
+        bool symmetric = false;
+
+        bool use_treecode(int derivatives) {
+            if(treecode_theta <= 0. || derivatives > 1)
+                return false;
+            long nsources = 0;
+            for (int i = 0; i < coils.size(); ++i)
+                nsources += coils[i]->curve->gamma().shape(0);
+            nsources *= symmetries.size();
+            return ((long) npoints) * nsources >= treecode_threshold;
+        }
+
         vector<shared_ptr<Coil<Array>>> coils;
+        // placeholders for derivatives that are not computed. these are
+        // created once here, since creating xtensor-python arrays is not safe
+        // when the field is evaluated from an openmp thread (see `clone`).
+        Array dummyjac = xt::zeros<double>({1, 1, 1});
+        Array dummyhess = xt::zeros<double>({1, 1, 1, 1});
+        Tensor3 _dummyjac = xt::zeros<double>({1, 1, 1});
+        Tensor4 _dummyhess = xt::zeros<double>({1, 1, 1, 1});
+        // per thread scratch arrays of `compute_accumulated` for a single
+        // block of targets. These are plain xtensor arrays, which can also be
+        // allocated when a clone is evaluated from an openmp thread. They are
+        // kept between calls and only reallocated when they need to grow.
+        typedef xt::xarray<double> Scratch;
+        vector<Scratch> scratch_G, scratch_dG, scratch_ddG;
+        Scratch scratch_dummyjac = xt::zeros<double>({1, 1, 1});
+        Scratch scratch_dummyhess = xt::zeros<double>({1, 1, 1, 1});
         // this vectors are aligned in memory for fast simd usage.
         AlignedVector pointsx = AlignedVector(xsimd::simd_type<double>::size, 0.);
         AlignedVector pointsy = AlignedVector(xsimd::simd_type<double>::size, 0.);
@@ -43,36 +99,227 @@ class BiotSavart : public MagneticField<T> {
             }
         }
 
+        // Fills the aligned vectors with the points S^T x.
+        inline void fill_points(const Tensor2& points, const std::array<double, 9>& S) {
+            fill_points(points);
+            for (int i = 0; i < npoints; ++i) {
+                double x = pointsx[i], y = pointsy[i], z = pointsz[i];
+                pointsx[i] = S[0]*x + S[3]*y + S[6]*z;
+                pointsy[i] = S[1]*x + S[4]*y + S[7]*z;
+                pointsz[i] = S[2]*x + S[5]*y + S[8]*z;
+            }
+        }
+
+        // Calls `kernel(g, i, px, py, pz, start, end, F_i, dF_i, ddF_i)` for all tiles of
+        // one coil i and one block [start, end) of targets of length
+        // `block_size` and writes the result to the per coil arrays Fs, dFs
+        // and ddFs. With symmetries, the kernel is evaluated at the
+        // transformed targets for each group element g in turn, and the
+        // result is rotated and summed up, see `symmetries`. `name` is used
+        // for the keys of the scratch arrays.
+        template<class Kernel>
+        void compute_tiles(const string& name, int derivatives, int block_size, vector<Array*>& Fs, vector<Array*>& dFs, vector<Array*>& ddFs, Kernel kernel);
+        // As `compute_tiles`, but the work is split into blocks of targets
+        // only, and each block sums up the contributions of all coils (and
+        // all of their copies) weighted by `currents` directly into the total
+        // arrays F, dF and ddF. The kernel is called with per thread scratch
+        // arrays for a single block of targets.
+        template<class Kernel>
+        void compute_accumulated(int derivatives, const vector<double>& currents, double* F, double* dF, double* ddF, Kernel kernel);
+        // Evaluate B (or A) and its derivatives for coil i and unit current
+        // at the targets [start, end) of px, py and pz. Derivatives that are
+        // not computed are written to dB_i and ddB_i, which then have to be
+        // placeholders of shape (1, 1, 1) and (1, 1, 1, 1).
+        template<class S>
+        void kernel_B(int derivatives, int i, AlignedVector& px, AlignedVector& py, AlignedVector& pz, int start, int end, S& B_i, S& dB_i, S& ddB_i);
+        template<class S>
+        void kernel_A(int derivatives, int i, AlignedVector& px, AlignedVector& py, AlignedVector& pz, int start, int end, S& A_i, S& dA_i, S& ddA_i);
+        // Fills the per coil arrays in the field cache and sums them up.
+        void compute_per_coil(int derivatives);
+        void compute_A_per_coil(int derivatives);
+
     protected:
 
         void _B_impl(Tensor2& B) override {
-            this->compute(0);
+            if(this->use_treecode(0))
+                this->compute_treecode(0);
+            else
+                this->compute(0);
         }
         
         void _dB_by_dX_impl(Tensor3& dB_by_dX) override {
-            this->compute(1);
+            if(this->use_treecode(1))
+                this->compute_treecode(1);
+            else
+                this->compute(1);
         }
 
         void _d2B_by_dXdX_impl(Tensor4& d2B_by_dXdX) override {
             this->compute(2);
         }
 
+        void _A_impl(Tensor2& A) override {
+            this->compute_A(0);
+        }
+
+        void _dA_by_dX_impl(Tensor3& dA_by_dX) override {
+            this->compute_A(1);
+        }
+
+        void _d2A_by_dXdX_impl(Tensor4& d2A_by_dXdX) override {
+            this->compute_A(2);
+        }
+
 
     public:
         using MagneticField<T>::npoints;
         using MagneticField<T>::data_B;
         using MagneticField<T>::data_dB;
         using MagneticField<T>::data_ddB;
+        using MagneticField<T>::data_A;
+        using MagneticField<T>::data_dA;
+        using MagneticField<T>::data_ddA;
 
         BiotSavart(vector<shared_ptr<Coil<Array>>> coils) : MagneticField<T>(), coils(coils) {
 
         }
 
-        void compute(int derivatives);       virtual void invalidate_cache() override {
+        // Compute B and its derivatives. Unless per coil storage is disabled
+        // (see `set_store_coil_fields`), the contributions of the individual
+        // coils (for unit current) are stored in the field cache under the
+        // keys `B_i`, `dB_i` and `ddB_i`.
+        void compute(int derivatives);
+        // As `compute`, but always fills the per coil arrays.
+        void compute_coil_fields(int derivatives) { this->compute_per_coil(derivatives); }
+        // Compute the vector potential A and its derivatives. As for B, the
+        // contributions of the individual coils (for unit current) are stored
+        // in the field cache under the keys `A_i`, `dA_i` and `ddA_i`.
+        void compute_A(int derivatives);
+        void compute_A_coil_fields(int derivatives) { this->compute_A_per_coil(derivatives); }
+        // Compute B and \nabla B (if `res_dB` is not empty) as in `compute`
+        // and, in the same pass over all pairs of targets and quadrature
+        // points, the vector Jacobian products with `v` and `vgrad` as in
+        // `biot_savart_vjp`. The results for coil i are added to res_B[i]
+        // (and res_dB[i]). This always uses the direct sum in double
+        // precision.
+        void compute_and_vjp(Array& v, Array& vgrad, vector<Array>& dgamma_by_dcoeffs, vector<Array>& d2gamma_by_dphidcoeffs, vector<Array>& res_B, vector<Array>& res_dB);
+        // Compute B (and \nabla B if derivatives == 1) using a treecode. This
+        // only fills the total field and not the per coil contributions.
+        void compute_treecode(int derivatives);
+        // Sums up the contributions of all coils directly at the given point,
+        // always in double precision and without the treecode or the cache.
+        void evaluate_point(double x, double y, double z, double* B, double* GradAbsB) override;
+
+        // Enable the treecode for B and \nabla B with opening angle `theta`
+        // whenever the number of targets times the number of quadrature
+        // points on all coils is at least `threshold`. `theta = 0` disables
+        // the treecode.
+        void set_treecode(double theta, long threshold, int leaf_size) {
+            if(theta < 0. || theta >= 1.)
+                throw logic_error("The opening angle theta of the treecode has to lie in [0, 1).");
+            this->treecode_theta = theta;
+            this->treecode_threshold = threshold;
+            this->treecode_leaf_size = leaf_size;
+            MagneticField<T>::invalidate_cache();
+        }
+
+        double get_treecode_theta() { return this->treecode_theta; }
+
+        // Set the symmetry group of the coils, see `symmetries`. The first
+        // element is usually the identity. Each rotation is given as the nine
+        // entries of a 3x3 matrix in row major order.
+        void set_symmetries(const vector<std::array<double, 9>>& rotations, const vector<double>& signs) {
+            if(rotations.size() == 0 || rotations.size() != signs.size())
+                throw logic_error("Need the same, positive number of rotations and signs.");
+            for (auto& S : rotations) {
+                for (int j = 0; j < 3; ++j) {
+                    for (int k = 0; k < 3; ++k) {
+                        double StS = S[j]*S[k] + S[3+j]*S[3+k] + S[6+j]*S[6+k];
+                        if(std::abs(StS - (j == k ? 1. : 0.)) > 1e-12)
+                            throw logic_error("The symmetries have to be orthogonal matrices.");
+                    }
+                }
+            }
+            this->symmetries = rotations;
+            this->symmetry_signs = signs;
+            std::array<double, 9> identity = {1., 0., 0., 0., 1., 0., 0., 0., 1.};
+            this->symmetric = rotations.size() > 1 || rotations[0] != identity || signs[0] != 1.;
             MagneticField<T>::invalidate_cache();
             this->field_cache.invalidate_cache();
         }
 
+        vector<std::array<double, 9>> get_symmetries() { return this->symmetries; }
+        vector<double> get_symmetry_signs() { return this->symmetry_signs; }
+
+        // Whether `compute` and `compute_A` store the field of every coil in
+        // the field cache, see `store_coil_fields`. Without per coil storage
+        // the memory does not grow with the number of coils.
+        void set_store_coil_fields(bool store) {
+            this->store_coil_fields = store;
+            MagneticField<T>::invalidate_cache();
+            this->field_cache.invalidate_cache();
+        }
+
+        bool get_store_coil_fields() { return this->store_coil_fields; }
+
+        // Estimate of the peak memory in bytes that `compute(derivatives)`
+        // needs at the current points, including the total field and the
+        // per coil and scratch arrays, but not the internal storage of the
+        // treecode.
+        double estimate_memory(int derivatives);
+
+        // Either "double" (the default) or "float". In single precision, B and
+        // \nabla B have a relative error of about 1e-6, but are computed
+        // about twice as fast.
+        void set_precision(const string& precision) {
+            if(precision == "double")
+                this->single_precision = false;
+            else if(precision == "float")
+                this->single_precision = true;
+            else
+                throw logic_error(fmt::format("Unknown precision '{}', use 'double' or 'float'.", precision));
+            MagneticField<T>::invalidate_cache();
+            this->field_cache.invalidate_cache();
+        }
+
+        string get_precision() { return this->single_precision ? "float" : "double"; }
+
+        // The clone shares the coils with this field but has its own caches.
+        // Once the clone has been evaluated at the same number of points (so
+        // that all cached arrays exist), it can be evaluated from a different
+        // thread than this field, as long as the coils are not modified.
+        shared_ptr<MagneticField<T>> clone() override {
+            for (int i = 0; i < coils.size(); ++i) {
+                coils[i]->curve->gamma();
+                coils[i]->curve->gammadash();
+            }
+            auto res = std::make_shared<BiotSavart<T, Array>>(coils);
+            res->set_treecode(treecode_theta, treecode_threshold, treecode_leaf_size);
+            res->single_precision = single_precision;
+            res->set_symmetries(symmetries, symmetry_signs);
+            res->store_coil_fields = store_coil_fields;
+            return res;
+        }
+       virtual void invalidate_cache() override {
+            MagneticField<T>::invalidate_cache();
+            this->field_cache.invalidate_cache();
+        }
+
+        // Includes the field cache, which holds the per coil arrays.
+        std::map<string, long> cache_statistics() override {
+            auto stats = MagneticField<T>::cache_statistics();
+            for (auto& kv : this->field_cache.statistics())
+                stats[kv.first] += kv.second;
+            return stats;
+        }
+
+        // The budget applies to the quantities of the field and, separately,
+        // to the field cache, see `Cache`.
+        void set_cache_budget(long bytes) override {
+            MagneticField<T>::set_cache_budget(bytes);
+            this->field_cache.set_budget(bytes);
+        }
+
         Array& fieldcache_get_or_create(string key, vector<int> dims){
             return this->field_cache.get_or_create(key, dims);
         }
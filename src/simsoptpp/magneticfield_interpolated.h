@@ -3,6 +3,8 @@
 #include "magneticfield.h"
 #include "xtensor/xlayout.hpp"
 #include "regular_grid_interpolant_3d.h"
+#include "adaptive_grid_interpolant_3d.h"
+#include <exception>
 
 template<template<class, std::size_t, xt::layout_type> class T>
 class InterpolatedField : public MagneticField<T> {
@@ -14,7 +16,12 @@ class InterpolatedField : public MagneticField<T> {
         std::function<Vec(double, double, double)> f_B;
         std::function<Vec(Vec, Vec, Vec)> fbatch_B;
         std::function<Vec(Vec, Vec, Vec)> fbatch_GradAbsB;
-        shared_ptr<RegularGridInterpolant3D<Tensor2>> interp_B, interp_GradAbsB;
+        shared_ptr<Interpolant3D<Tensor2>> interp_B, interp_GradAbsB;
+        // if adaptive_tol > 0, an AdaptiveGridInterpolant3D is used instead
+        // of the interpolant on the regular grid.
+        double adaptive_tol = 0.;
+        int adaptive_max_level = 0;
+        std::function<std::vector<bool>(Vec, Vec, Vec)> skip;
         bool status_B = false;
         bool status_GradAbsB = false;
         const bool extrapolate;
@@ -22,16 +29,118 @@ class InterpolatedField : public MagneticField<T> {
         const int nfp = 1;
         vector<bool> symmetries = vector<bool>(1, false);
 
-    protected:
-        void _B_cyl_impl(Tensor2& B_cyl) override {
-            if(!interp_B)
-                interp_B = std::make_shared<RegularGridInterpolant3D<Tensor2>>(rule, r_range, phi_range, z_range, 3, extrapolate);
-            if(!status_B) {
+        // Evaluates B_cyl (or GradAbsB_cyl if `gradabsb` is true) of the
+        // underlying field at all interpolation nodes of `interp`. If the field
+        // can be cloned, the nodes are split into chunks that are evaluated
+        // concurrently, each thread using its own copy of the field.
+        void interpolate(shared_ptr<RegularGridInterpolant3D<Tensor2>> interp, bool gradabsb) {
+            auto fields = get_fields_for_threads(field);
+            if(fields.size() == 1 && fields[0] == field) {
+                Tensor2 old_points = this->field->get_points_cart();
+                interp->interpolate_batch(gradabsb ? fbatch_GradAbsB : fbatch_B);
+                this->field->set_points_cart(old_points);
+                return;
+            }
+            auto eval = [gradabsb](MagneticField<T>& f) -> Tensor2& {
+                return gradabsb ? f.GradAbsB_cyl_ref() : f.B_cyl_ref();
+            };
+            Vec rs, phis, zs;
+            std::tie(rs, phis, zs) = interp->interpolation_nodes();
+            int nnodes = rs.size();
+            int nthreads = fields.size();
+            int chunk_size = std::max((nnodes + 8*nthreads - 1)/(8*nthreads), 1);
+            int nchunks = (nnodes + chunk_size - 1)/chunk_size;
+
+            // All chunks have the same size (the last one is padded by
+            // repeating the last node), so that after evaluating each field
+            // once here, no arrays are allocated inside the parallel region.
+            vector<Tensor2> points(nthreads);
+            for (int t = 0; t < nthreads; ++t) {
+                points[t] = xt::zeros<double>({chunk_size, 3});
+                for (int i = 0; i < chunk_size; ++i) {
+                    int idx = std::min(i, nnodes-1);
+                    points[t](i, 0) = rs[idx];
+                    points[t](i, 1) = phis[idx];
+                    points[t](i, 2) = zs[idx];
+                }
+                fields[t]->set_points_cyl(points[t]);
+                eval(*fields[t]);
+            }
+
+            Vec fxyz(3*nnodes, 0.);
+            std::exception_ptr eptr = nullptr;
+#pragma omp parallel for schedule(dynamic) num_threads(nthreads)
+            for (int c = 0; c < nchunks; ++c) {
+                int t = 0;
+#ifdef _OPENMP
+                t = omp_get_thread_num();
+#endif
+                try {
+                    int first = c*chunk_size;
+                    for (int i = 0; i < chunk_size; ++i) {
+                        int idx = std::min(first+i, nnodes-1);
+                        points[t](i, 0) = rs[idx];
+                        points[t](i, 1) = phis[idx];
+                        points[t](i, 2) = zs[idx];
+                    }
+                    fields[t]->set_points_cyl(points[t]);
+                    Tensor2& vals = eval(*fields[t]);
+                    int count = std::min(chunk_size, nnodes-first);
+                    memcpy(fxyz.data()+3*first, vals.data(), 3*count*sizeof(double));
+                } catch (...) {
+#pragma omp critical
+                    eptr = std::current_exception();
+                }
+            }
+            if(eptr)
+                std::rethrow_exception(eptr);
+            interp->set_values(fxyz);
+        }
+
+        shared_ptr<RegularGridInterpolant3D<Tensor2>> make_regular_grid_interpolant() {
+            auto interp = std::make_shared<RegularGridInterpolant3D<Tensor2>>(rule, r_range, phi_range, z_range, 3, extrapolate);
+            if(skip)
+                interp->skip_cells(skip);
+            return interp;
+        }
+
+        shared_ptr<Interpolant3D<Tensor2>> build_interp(bool gradabsb) {
+            if(adaptive_tol > 0) {
+                auto interp = std::make_shared<AdaptiveGridInterpolant3D<Tensor2>>(rule, r_range, phi_range, z_range, 3, extrapolate, adaptive_tol, adaptive_max_level);
                 Tensor2 old_points = this->field->get_points_cart();
-                interp_B->interpolate_batch(fbatch_B);
+                interp->interpolate_batch(gradabsb ? fbatch_GradAbsB : fbatch_B, skip);
                 this->field->set_points_cart(old_points);
+                return interp;
+            }
+            auto interp = make_regular_grid_interpolant();
+            interpolate(interp, gradabsb);
+            return interp;
+        }
+
+        void build_interp_B() {
+            if(!status_B) {
+                interp_B = build_interp(false);
                 status_B = true;
             }
+        }
+
+        void build_interp_GradAbsB() {
+            if(!status_GradAbsB) {
+                interp_GradAbsB = build_interp(true);
+                status_GradAbsB = true;
+            }
+        }
+
+        shared_ptr<RegularGridInterpolant3D<Tensor2>> regular_grid_interpolant(shared_ptr<Interpolant3D<Tensor2>> interp) {
+            auto res = std::dynamic_pointer_cast<RegularGridInterpolant3D<Tensor2>>(interp);
+            if(!res)
+                throw std::runtime_error("This operation is only supported for interpolants on a regular grid.");
+            return res;
+        }
+
+    protected:
+        void _B_cyl_impl(Tensor2& B_cyl) override {
+            build_interp_B();
             if(nfp > 1 || stellsym){
                 Tensor2& rphiz = this->get_points_cyl_ref();
                 Tensor2& rphiz_sym = points_cyl_sym.get_or_create({npoints, 3});
@@ -44,14 +153,7 @@ class InterpolatedField : public MagneticField<T> {
         }
 
         void _GradAbsB_cyl_impl(Tensor2& GradAbsB_cyl) override {
-            if(!interp_GradAbsB)
-                interp_GradAbsB = std::make_shared<RegularGridInterpolant3D<Tensor2>>(rule, r_range, phi_range, z_range, 3, extrapolate);
-            if(!status_GradAbsB) {
-                Tensor2 old_points = this->field->get_points_cart();
-                interp_GradAbsB->interpolate_batch(fbatch_GradAbsB);
-                this->field->set_points_cart(old_points);
-                status_GradAbsB = true;
-            }
+            build_interp_GradAbsB();
             if(nfp > 1 || stellsym){
                 Tensor2& rphiz = this->get_points_cyl_ref();
                 Tensor2& rphiz_sym = points_cyl_sym.get_or_create({npoints, 3});
@@ -87,30 +189,32 @@ class InterpolatedField : public MagneticField<T> {
             }
         }
 
+        // Maps (phi, z) to the fundamental domain of the field and returns
+        // whether stellarator symmetry was used to do so.
+        bool exploit_symmetries_point(double& phi, double& z){
+            double period = (2*M_PI)/nfp;
+            bool flipped = false;
+            if(z < 0 && stellsym) {
+                z = -z;
+                phi = 2*M_PI-phi;
+                flipped = true;
+            }
+            int phi_mult = int(phi/period);
+            phi = phi - phi_mult * period;
+            return flipped;
+        }
+
         void exploit_symmetries_points(Tensor2& rphiz, Tensor2& rphiz_sym){
             int npoints = rphiz.shape(0);
             if(symmetries.size() != npoints)
                 symmetries = vector<bool>(npoints, false);
-            double period = (2*M_PI)/nfp;
             double* dataptr = &(rphiz(0, 0));
             double* datasymptr = &(rphiz_sym(0, 0));
             for (int i = 0; i < npoints; ++i) {
                 double r = dataptr[3*i+0];
                 double phi = dataptr[3*i+1];
                 double z = dataptr[3*i+2];
-                //fmt::print("(r, phi, z) = ({}, {}, {})", r, phi, z);
-                if(z < 0 && stellsym) {
-                    z = -z;
-                    phi = 2*M_PI-phi;
-                    int phi_mult = int(phi/period);
-                    phi = phi - phi_mult * period;
-                    symmetries[i] = true;
-                }else{
-                    int phi_mult = int(phi/period);
-                    phi = phi - phi_mult * period;
-                    symmetries[i] = false;
-                }
-                //fmt::print(" -> (r, phi, z) = ({}, {}, {})\n", r, phi, z);
+                symmetries[i] = exploit_symmetries_point(phi, z);
                 datasymptr[3*i+0] = r;
                 datasymptr[3*i+1] = phi;
                 datasymptr[3*i+2] = z;
@@ -185,26 +289,143 @@ class InterpolatedField : public MagneticField<T> {
                 RangeTriplet r_range, RangeTriplet phi_range, RangeTriplet z_range,
                 bool extrapolate, int nfp, bool stellsym) : InterpolatedField(field, UniformInterpolationRule(degree), r_range, phi_range, z_range, extrapolate, nfp, stellsym) {}
 
-        std::pair<double, double> estimate_error_B(int samples) {
-            if(!interp_B)
-                interp_B = std::make_shared<RegularGridInterpolant3D<Tensor2>>(rule, r_range, phi_range, z_range, 3, extrapolate);
-            if(!status_B) {
-                Tensor2 old_points = this->field->get_points_cart();
-                interp_B->interpolate_batch(fbatch_B);
-                this->field->set_points_cart(old_points);
-                status_B = true;
+        // The clone shares the interpolation tables with this field, so both
+        // interpolants are built before the clone is created.
+        shared_ptr<MagneticField<T>> clone() override {
+            build_interp_B();
+            build_interp_GradAbsB();
+            auto res = std::make_shared<InterpolatedField<T>>(field, rule, r_range, phi_range, z_range, extrapolate, nfp, stellsym);
+            res->interp_B = interp_B;
+            res->interp_GradAbsB = interp_GradAbsB;
+            res->status_B = true;
+            res->status_GradAbsB = true;
+            return res;
+        }
+
+        // Store both interpolation tables on disk, see
+        // RegularGridInterpolant3D::save.
+        void save(const std::string& filename_B, const std::string& filename_GradAbsB, const std::string& key) {
+            build_interp_B();
+            build_interp_GradAbsB();
+            regular_grid_interpolant(interp_B)->save(filename_B, key);
+            regular_grid_interpolant(interp_GradAbsB)->save(filename_GradAbsB, key);
+        }
+
+        // Memory map both interpolation tables from disk. Returns false (and
+        // leaves the field unchanged) if either of the files is missing or
+        // does not match the grid, the interpolation rule or the key.
+        bool load(const std::string& filename_B, const std::string& filename_GradAbsB, const std::string& key) {
+            auto new_interp_B = make_regular_grid_interpolant();
+            auto new_interp_GradAbsB = make_regular_grid_interpolant();
+            if(!new_interp_B->load(filename_B, key) || !new_interp_GradAbsB->load(filename_GradAbsB, key))
+                return false;
+            interp_B = new_interp_B;
+            interp_GradAbsB = new_interp_GradAbsB;
+            status_B = true;
+            status_GradAbsB = true;
+            return true;
+        }
+
+        // Coordinates (r, phi, z) of the interpolation nodes, shape (nnodes, 3).
+        // Together with `set_interpolation_values` this allows to distribute
+        // the construction of the interpolant, e.g. across MPI ranks.
+        Tensor2 interpolation_nodes() {
+            auto interp = make_regular_grid_interpolant();
+            Vec rs, phis, zs;
+            std::tie(rs, phis, zs) = interp->interpolation_nodes();
+            int nnodes = rs.size();
+            Tensor2 nodes = xt::zeros<double>({nnodes, 3});
+            for (int i = 0; i < nnodes; ++i) {
+                nodes(i, 0) = rs[i];
+                nodes(i, 1) = phis[i];
+                nodes(i, 2) = zs[i];
             }
+            return nodes;
+        }
+
+        // Build both interpolants from the values of B_cyl and GradAbsB_cyl
+        // (both of shape (nnodes, 3)) at the nodes returned by
+        // `interpolation_nodes`.
+        void set_interpolation_values(Tensor2& B_cyl, Tensor2& GradAbsB_cyl) {
+            int nnodes = B_cyl.shape(0);
+            if(B_cyl.shape(1) != 3 || GradAbsB_cyl.shape(0) != nnodes || GradAbsB_cyl.shape(1) != 3)
+                throw std::runtime_error("B_cyl and GradAbsB_cyl need to be arrays of shape (nnodes, 3).");
+            auto new_interp_B = make_regular_grid_interpolant();
+            auto new_interp_GradAbsB = make_regular_grid_interpolant();
+            new_interp_B->set_values(Vec(B_cyl.data(), B_cyl.data()+3*nnodes));
+            new_interp_GradAbsB->set_values(Vec(GradAbsB_cyl.data(), GradAbsB_cyl.data()+3*nnodes));
+            interp_B = new_interp_B;
+            interp_GradAbsB = new_interp_GradAbsB;
+            status_B = true;
+            status_GradAbsB = true;
+            this->invalidate_cache();
+        }
+
+        // Don't interpolate cells for which `skip` is true at all corners, see
+        // RegularGridInterpolant3D::skip_cells.
+        void set_skip(std::function<std::vector<bool>(Vec, Vec, Vec)> skip) {
+            this->skip = skip;
+            status_B = false;
+            status_GradAbsB = false;
+            this->invalidate_cache();
+        }
+
+        // Use an adaptively refined grid with tolerance `tol` and at most
+        // `max_level` refinements of the cells of the regular grid, see
+        // AdaptiveGridInterpolant3D. Cells for which `skip` is true at all
+        // corners are not interpolated.
+        void set_adaptive(double tol, int max_level, std::function<std::vector<bool>(Vec, Vec, Vec)> skip) {
+            if(tol <= 0)
+                throw std::logic_error("The tolerance of the adaptive interpolant has to be positive.");
+            this->adaptive_tol = tol;
+            this->adaptive_max_level = max_level;
+            this->skip = skip;
+            status_B = false;
+            status_GradAbsB = false;
+            this->invalidate_cache();
+        }
+
+        // Evaluates the interpolants directly at (x, y, z), without using the
+        // cache. Gives the same values as `B` and `GradAbsB`.
+        void evaluate_point(double x, double y, double z, double* B, double* GradAbsB) override {
+            build_interp_B();
+            if(GradAbsB)
+                build_interp_GradAbsB();
+            double r = std::sqrt(x*x + y*y);
+            double phi = std::atan2(y, x);
+            if(phi < 0)
+                phi += 2*M_PI;
+            double cosphi = std::cos(phi);
+            double sinphi = std::sin(phi);
+            bool flipped = false;
+            if(nfp > 1 || stellsym)
+                flipped = exploit_symmetries_point(phi, z);
+            double B_cyl[3];
+            interp_B->evaluate_inplace(r, phi, z, B_cyl);
+            if(flipped)
+                B_cyl[0] = -B_cyl[0];
+            B[0] = cosphi*B_cyl[0] - sinphi*B_cyl[1];
+            B[1] = sinphi*B_cyl[0] + cosphi*B_cyl[1];
+            B[2] = B_cyl[2];
+            if(GradAbsB) {
+                double GradAbsB_cyl[3];
+                interp_GradAbsB->evaluate_inplace(r, phi, z, GradAbsB_cyl);
+                if(flipped) {
+                    GradAbsB_cyl[1] = -GradAbsB_cyl[1];
+                    GradAbsB_cyl[2] = -GradAbsB_cyl[2];
+                }
+                GradAbsB[0] = cosphi*GradAbsB_cyl[0] - sinphi*GradAbsB_cyl[1];
+                GradAbsB[1] = sinphi*GradAbsB_cyl[0] + cosphi*GradAbsB_cyl[1];
+                GradAbsB[2] = GradAbsB_cyl[2];
+            }
+        }
+
+        std::pair<double, double> estimate_error_B(int samples) {
+            build_interp_B();
             return interp_B->estimate_error(this->fbatch_B, samples);
         }
         std::pair<double, double> estimate_error_GradAbsB(int samples) {
-            if(!interp_GradAbsB)
-                interp_GradAbsB = std::make_shared<RegularGridInterpolant3D<Tensor2>>(rule, r_range, phi_range, z_range, 3, extrapolate);
-            if(!status_GradAbsB) {
-                Tensor2 old_points = this->field->get_points_cart();
-                interp_GradAbsB->interpolate_batch(fbatch_GradAbsB);
-                this->field->set_points_cart(old_points);
-                status_GradAbsB = true;
-            }
+            build_interp_GradAbsB();
             return interp_GradAbsB->estimate_error(this->fbatch_GradAbsB, samples);
         }
 };
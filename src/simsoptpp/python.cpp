@@ -13,6 +13,7 @@ typedef xt::pyarray<double> PyArray;
 #include "biot_savart_vjp_py.h"
 #include "dommaschk.h"
 #include "reiman.h"
+#include "boozer_residual.h"
 
 namespace py = pybind11;
 
@@ -76,6 +77,9 @@ PYBIND11_MODULE(simsoptpp, m) {
             return res;
         });
 
+    // the second derivatives of the residual in boozer_surface_residual, contracted with weights
+    m.def("boozer_residual_hessian_contracted", &boozer_residual_hessian_contracted<PyArray>);
+
 #ifdef VERSION_INFO
     m.attr("__version__") = VERSION_INFO;
 #else
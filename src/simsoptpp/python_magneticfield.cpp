@@ -3,6 +3,7 @@
 #include "pybind11/functional.h"
 #include "xtensor-python/pyarray.hpp"     // Numpy bindings
 #include "xtensor-python/pytensor.hpp"     // Numpy bindings
+#include "cache_pyarray.h"
 typedef xt::pyarray<double> PyArray;
 typedef xt::pytensor<double, 2, xt::layout_type::row_major> PyTensor;
 #include "py_shared_ptr.h"
@@ -13,11 +14,16 @@ using std::vector;
 #include "magneticfield.h"
 #include "magneticfield_biotsavart.h"
 #include "magneticfield_interpolated.h"
+#include "magneticfield_analytic.h"
 #include "pymagneticfield.h"
 #include "regular_grid_interpolant_3d.h"
+#include "adaptive_grid_interpolant_3d.h"
 typedef MagneticField<xt::pytensor> PyMagneticField;
 typedef BiotSavart<xt::pytensor, PyArray> PyBiotSavart;
 typedef InterpolatedField<xt::pytensor> PyInterpolatedField;
+typedef ToroidalField<xt::pytensor> PyToroidalField;
+typedef Dommaschk<xt::pytensor> PyDommaschk;
+typedef Reiman<xt::pytensor> PyReiman;
 
 
 
@@ -43,13 +49,22 @@ template <typename T, typename S> void register_common_field_methods(S &c) {
      .def("dA_by_dX_ref", py::overload_cast<>(&T::dA_by_dX_ref), "As `dA_by_dX`, but returns a reference to the array (this array should be read only).")
      .def("d2A_by_dXdX_ref", py::overload_cast<>(&T::d2A_by_dXdX_ref), "As `d2A_by_dXdX`, but returns a reference to the array (this array should be read only).")
      .def("invalidate_cache", &T::invalidate_cache, "Clear the cache. Called automatically after each call to `set_points[...]`.")
+     .def("cache_statistics", &T::cache_statistics, "Returns a dictionary with the number of `hits`, `misses`, `allocations` and `evictions` of the caches of the field and the memory `bytes` they use. Fields with a cache of per coil arrays additionally report the number of `reuses` of spare buffers.")
+     .def("set_cache_budget", &T::set_cache_budget, py::arg("bytes"), "Limit the memory of the caches of the field to `bytes` (negative for no limit). Cached quantities that are no longer valid are released when the limit is exceeded. For ``BiotSavart``, the limit applies separately to the cache of per coil arrays, which also releases valid arrays (in least recently used order) and reuses larger spare buffers for fewer points.")
+     .def("get_cache_budget", &T::get_cache_budget)
      .def("get_points_cart", &T::get_points_cart, "Get the point where the field should be evaluated in cartesian coordinates.")
      .def("get_points_cyl", &T::get_points_cyl, "Get the point where the field should be evaluated in cylindrical coordinates (the order is :math:`(r, \\phi, z)`).")
      .def("get_points_cart_ref", &T::get_points_cart_ref, "As `get_points_cart`, but returns a reference to the array (this array should be read only).")
      .def("get_points_cyl_ref", &T::get_points_cyl_ref, "As `get_points_cyl`, but returns a reference to the array (this array should be read only).")
      .def("set_points_cart", &T::set_points_cart, "Set the points where to evaluate the magnetic fields, in cartesian coordinates.")
      .def("set_points_cyl", &T::set_points_cyl, "Set the points where to evaluate the magnetic fields, in cylindrical coordinates (the order is :math:`(r, \\phi, z)`).")
-     .def("set_points", &T::set_points, "Shorthand for `set_points_cart`.");
+     .def("set_points", &T::set_points, "Shorthand for `set_points_cart`.")
+     .def("evaluate_point", [](T& field, double x, double y, double z) {
+                 std::array<double, 3> B, GradAbsB;
+                 field.evaluate_point(x, y, z, B.data(), GradAbsB.data());
+                 return std::make_pair(B, GradAbsB);
+             }, py::arg("x"), py::arg("y"), py::arg("z"),
+             "Returns `B` and `GradAbsB` at the single point `(x, y, z)` (in cartesian coordinates). This is the function used by the tracers; for most fields implemented in C++ it does not use the cache and does not change the points set by `set_points`.");
 }
 
 void init_magneticfields(py::module_ &m){
@@ -64,7 +79,13 @@ void init_magneticfields(py::module_ &m){
         .def(py::init<int>())
         .def_readonly("degree", &ChebyshevInterpolationRule::degree, "The degree of the polynomial. The number of interpolation points in `degree+1`.");
 
-    py::class_<RegularGridInterpolant3D<PyTensor>, py_shared_ptr<RegularGridInterpolant3D<PyTensor>>>(m, "RegularGridInterpolant3D",
+    py::class_<Interpolant3D<PyTensor>, py_shared_ptr<Interpolant3D<PyTensor>>>(m, "Interpolant3D", "Abstract class for interpolants of (vector valued) functions in three dimensions.")
+        .def("evaluate", &Interpolant3D<PyTensor>::evaluate, "Evaluate the interpolant at a point.")
+        .def("evaluate_batch", &Interpolant3D<PyTensor>::evaluate_batch, "Evaluate the interpolant at multiple points.")
+        .def("estimate_error", &Interpolant3D<PyTensor>::estimate_error, "Estimate the error of the interpolant by comparing to the function at `samples` many random points. Returns an interval for the mean error.")
+        .def("is_skipped", &Interpolant3D<PyTensor>::is_skipped, "Whether the point lies in a cell that was skipped when building the interpolant.");
+
+    py::class_<RegularGridInterpolant3D<PyTensor>, py_shared_ptr<RegularGridInterpolant3D<PyTensor>>, Interpolant3D<PyTensor>>(m, "RegularGridInterpolant3D",
             R"pbdoc(
             Interpolates a (vector valued) function on a uniform grid. 
             This interpolant is optimized for fast function evaluation (at the cost of memory usage). The main purpose of this class is to be used to interpolate magnetic fields and then use the interpolant for tasks such as fieldline or particle tracing for which the field needs to be evaluated many many times.
@@ -72,7 +93,27 @@ void init_magneticfields(py::module_ &m){
         .def(py::init<InterpolationRule, RangeTriplet, RangeTriplet, RangeTriplet, int, bool>())
         .def("interpolate_batch", &RegularGridInterpolant3D<PyTensor>::interpolate_batch, "Interpolate a function by evaluating the function on all interpolation nodes simultanuously.")
         .def("evaluate", &RegularGridInterpolant3D<PyTensor>::evaluate, "Evaluate the interpolant at a point.")
-        .def("evaluate_batch", &RegularGridInterpolant3D<PyTensor>::evaluate_batch, "Evaluate the interpolant at multiple points (faster than `evaluate` as it uses prefetching).");
+        .def("evaluate_batch", &RegularGridInterpolant3D<PyTensor>::evaluate_batch, "Evaluate the interpolant at multiple points (faster than `evaluate` as it uses prefetching).")
+        .def("interpolation_nodes", &RegularGridInterpolant3D<PyTensor>::interpolation_nodes, "Returns the coordinates of all interpolation nodes (of cells that are not skipped) as three lists `(xs, ys, zs)`.")
+        .def("skip_cells", &RegularGridInterpolant3D<PyTensor>::skip_cells, py::arg("skip"), "Don't interpolate cells for which `skip(xs, ys, zs)` returns `True` at all eight corners. Needs to be called before the interpolant is built.")
+        .def("ncells", &RegularGridInterpolant3D<PyTensor>::ncells, "Number of cells whose values are stored.")
+        .def("set_values", &RegularGridInterpolant3D<PyTensor>::set_values, "Build the interpolant from the function values at the nodes returned by `interpolation_nodes` (in the same layout as the output of the function passed to `interpolate_batch`).")
+        .def("save", &RegularGridInterpolant3D<PyTensor>::save, "Write the interpolation table to a file, together with a key that identifies the interpolated function.")
+        .def("load", &RegularGridInterpolant3D<PyTensor>::load, "Memory map an interpolation table written by `save`. Returns `False` if the file does not exist, is not a complete interpolation table or does not match the grid, interpolation rule or key.");
+
+    py::class_<AdaptiveGridInterpolant3D<PyTensor>, py_shared_ptr<AdaptiveGridInterpolant3D<PyTensor>>, Interpolant3D<PyTensor>>(m, "AdaptiveGridInterpolant3D",
+            R"pbdoc(
+            Interpolates a (vector valued) function on an adaptively refined grid.
+            Starting from a uniform grid, cells are split into eight until the interpolation error (estimated at a few points per cell) is below `tol`, or until the cells were refined `max_level` times. Cells for which the optional `skip` function returns `True` at all corners are not interpolated, and evaluating the interpolant in such a cell raises an error.
+            )pbdoc")
+        .def(py::init<InterpolationRule, RangeTriplet, RangeTriplet, RangeTriplet, int, bool, double, int>(),
+                py::arg("rule"), py::arg("xrange"), py::arg("yrange"), py::arg("zrange"), py::arg("value_size"), py::arg("extrapolate"), py::arg("tol"), py::arg("max_level"))
+        .def("interpolate_batch", py::overload_cast<std::function<Vec(Vec, Vec, Vec)>&, std::function<std::vector<bool>(Vec, Vec, Vec)>&>(&AdaptiveGridInterpolant3D<PyTensor>::interpolate_batch),
+                py::arg("f"), py::arg("skip"), "Interpolate a function, `f` is called once per refinement level with all nodes on that level. `skip(xs, ys, zs)` returns a list of booleans.")
+        .def("interpolate_batch", py::overload_cast<std::function<Vec(Vec, Vec, Vec)>&>(&AdaptiveGridInterpolant3D<PyTensor>::interpolate_batch),
+                py::arg("f"), "Interpolate a function, `f` is called once per refinement level with all nodes on that level.")
+        .def("ncells", &AdaptiveGridInterpolant3D<PyTensor>::ncells, "Number of cells on which the function is interpolated.")
+        .def("nskipped", &AdaptiveGridInterpolant3D<PyTensor>::nskipped, "Number of cells that were skipped.");
 
 
     py::class_<Current<PyArray>, py_shared_ptr<Current<PyArray>>>(m, "Current", "Simple class that wraps around a single double representing a coil current.")
@@ -89,13 +130,32 @@ void init_magneticfields(py::module_ &m){
         .def_readonly("current", &Coil<PyArray>::current, "Get the underlying current.");
 
     auto mf = py::class_<PyMagneticField, PyMagneticFieldTrampoline<PyMagneticField>, py_shared_ptr<PyMagneticField>>(m, "MagneticField", "Abstract class representing magnetic fields.")
-        .def(py::init<>());
+        .def(py::init<>())
+        .def("clone", &PyMagneticField::clone, "Returns a copy of the field with its own cache that shares all other (read only) data with this field, or `None` if the field does not support this. Used to evaluate the field from several threads at once.");
     register_common_field_methods<PyMagneticField>(mf);
         //.def("B", py::overload_cast<>(&PyMagneticField::B));
 
     auto bs = py::class_<PyBiotSavart, PyMagneticFieldTrampoline<PyBiotSavart>, py_shared_ptr<PyBiotSavart>, PyMagneticField>(m, "BiotSavart")
         .def(py::init<vector<shared_ptr<Coil<PyArray>>>>())
         .def("compute", &PyBiotSavart::compute)
+        .def("compute_A", &PyBiotSavart::compute_A, py::arg("derivatives")=0, "Compute the vector potential `A` and, depending on `derivatives`, its first and second derivatives. The contributions of the individual coils (for unit current) are stored in the field cache as `A_i`, `dA_i` and `ddA_i`.")
+        .def("compute_and_vjp", &PyBiotSavart::compute_and_vjp, "Compute `B` (and `dB_by_dX` if `res_dB` is not empty) and, in the same pass, the vector Jacobian products as in `biot_savart_vjp`.")
+        .def("compute_coil_fields", &PyBiotSavart::compute_coil_fields, py::arg("derivatives")=0, "As `compute`, but always stores the contributions of the individual coils in the field cache.")
+        .def("compute_A_coil_fields", &PyBiotSavart::compute_A_coil_fields, py::arg("derivatives")=0)
+        .def("set_store_coil_fields", &PyBiotSavart::set_store_coil_fields, py::arg("store"), "Whether `compute` and `compute_A` store the field of every coil in the field cache. If `False`, the contributions of the coils are summed up directly into the total field, so that the memory does not grow with the number of coils.")
+        .def("get_store_coil_fields", &PyBiotSavart::get_store_coil_fields)
+     .def("cache_statistics", &T::cache_statistics, "Returns a dictionary with the number of `hits`, `misses`, `allocations` and `evictions` of the caches of the field and the memory `bytes` they use. Fields with a cache of per coil arrays additionally report the number of `reuses` of spare buffers.")
+     .def("set_cache_budget", &T::set_cache_budget, py::arg("bytes"), "Limit the memory of the caches of the field to `bytes` (negative for no limit). Cached quantities that are no longer valid are released when the limit is exceeded. For ``BiotSavart``, the limit applies separately to the cache of per coil arrays, which also releases valid arrays (in least recently used order) and reuses larger spare buffers for fewer points.")
+     .def("get_cache_budget", &T::get_cache_budget)
+        .def("estimate_memory", &PyBiotSavart::estimate_memory, py::arg("derivatives")=0, "Estimate of the peak memory in bytes needed to compute `B` and `derivatives` of its derivatives at the current points.")
+        .def("compute_treecode", &PyBiotSavart::compute_treecode)
+        .def("set_treecode", &PyBiotSavart::set_treecode, py::arg("theta"), py::arg("threshold")=100000000L, py::arg("leaf_size")=32)
+        .def("get_treecode_theta", &PyBiotSavart::get_treecode_theta)
+        .def("set_precision", &PyBiotSavart::set_precision, py::arg("precision"), "Either `'double'` (the default) or `'float'`. In single precision, `B` and `dB_by_dX` are computed about twice as fast with a relative error of about `1e-6`.")
+        .def("get_precision", &PyBiotSavart::get_precision)
+        .def("set_symmetries", &PyBiotSavart::set_symmetries, py::arg("rotations"), py::arg("signs"), "Set the symmetry group of the coils: the field is the sum over `g` of `signs[g] * S_g B(S_g^T x)`, where `S_g` are the rotations, each given as the nine entries of a 3x3 matrix in row major order, and `B` is the field of the coils.")
+        .def("get_symmetries", &PyBiotSavart::get_symmetries)
+        .def("get_symmetry_signs", &PyBiotSavart::get_symmetry_signs)
         .def("fieldcache_get_or_create", &PyBiotSavart::fieldcache_get_or_create)
         .def("fieldcache_get_status", &PyBiotSavart::fieldcache_get_status);
     register_common_field_methods<PyBiotSavart>(bs);
@@ -105,10 +165,25 @@ void init_magneticfields(py::module_ &m){
         .def(py::init<shared_ptr<PyMagneticField>, int, RangeTriplet, RangeTriplet, RangeTriplet, bool, int, bool>())
         .def("estimate_error_B", &PyInterpolatedField::estimate_error_B)
         .def("estimate_error_GradAbsB", &PyInterpolatedField::estimate_error_GradAbsB)
+        .def("interpolation_nodes", &PyInterpolatedField::interpolation_nodes, "Returns a `(nnodes, 3)` array containing the interpolation nodes in cylindrical coordinates.")
+        .def("set_interpolation_values", &PyInterpolatedField::set_interpolation_values, py::arg("B_cyl"), py::arg("GradAbsB_cyl"), "Build the interpolants from `B_cyl` and `GradAbsB_cyl` of the underlying field evaluated at `interpolation_nodes()`.")
+        .def("set_skip", &PyInterpolatedField::set_skip, py::arg("skip"), "Don't interpolate cells for which `skip(rs, phis, zs)` is `True` at all corners.")
+        .def("set_adaptive", &PyInterpolatedField::set_adaptive, py::arg("tol"), py::arg("max_level"), py::arg("skip"), "Use an adaptively refined grid instead of a regular grid, see `AdaptiveGridInterpolant3D`.")
+        .def("save", &PyInterpolatedField::save, py::arg("filename_B"), py::arg("filename_GradAbsB"), py::arg("key"))
+        .def("load", &PyInterpolatedField::load, py::arg("filename_B"), py::arg("filename_GradAbsB"), py::arg("key"))
         .def_readonly("r_range", &PyInterpolatedField::r_range)
         .def_readonly("phi_range", &PyInterpolatedField::phi_range)
         .def_readonly("z_range", &PyInterpolatedField::z_range)
         .def_readonly("rule", &PyInterpolatedField::rule);
     //register_common_field_methods<PyInterpolatedField>(ifield);
+
+    py::class_<PyToroidalField, PyMagneticFieldTrampoline<PyToroidalField>, py_shared_ptr<PyToroidalField>, PyMagneticField>(m, "ToroidalField", "The field `B0*R0/R` in the toroidal direction, see `simsopt.field.magneticfieldclasses.ToroidalField`.")
+        .def(py::init<double, double>(), py::arg("R0"), py::arg("B0"));
+
+    py::class_<PyDommaschk, PyMagneticFieldTrampoline<PyDommaschk>, py_shared_ptr<PyDommaschk>, PyMagneticField>(m, "Dommaschk", "The field of Dommaschk (1986), see `simsopt.field.magneticfieldclasses.Dommaschk`.")
+        .def(py::init<vector<int>, vector<int>, vector<std::array<double, 2>>>(), py::arg("m"), py::arg("n"), py::arg("coeffs"));
+
+    py::class_<PyReiman, PyMagneticFieldTrampoline<PyReiman>, py_shared_ptr<PyReiman>, PyMagneticField>(m, "Reiman", "The field of Reiman and Greenside (1986), see `simsopt.field.magneticfieldclasses.Reiman`.")
+        .def(py::init<double, double, vector<double>, vector<double>, int>(), py::arg("iota0"), py::arg("iota1"), py::arg("k"), py::arg("epsilonk"), py::arg("m0"));
  
 }
@@ -16,6 +16,11 @@ typedef SurfaceRZFourier<PyArray> PySurfaceRZFourier;
 typedef SurfaceXYZFourier<PyArray> PySurfaceXYZFourier;
 #include "surfacexyztensorfourier.h"
 typedef SurfaceXYZTensorFourier<PyArray> PySurfaceXYZTensorFourier;
+#include "surface_distance.h"
+typedef SurfaceDistance<PyArray> PySurfaceDistance;
+#include "xtensor-python/pytensor.hpp"     // Numpy bindings
+#include "regular_grid_interpolant_3d.h"
+typedef xt::pytensor<double, 2, xt::layout_type::row_major> PyTensor;
 
 template <class PySurfaceRZFourierBase = PySurfaceRZFourier> class PySurfaceRZFourierTrampoline : public PySurfaceTrampoline<PySurfaceRZFourierBase> {
     public:
@@ -122,6 +127,15 @@ template <typename T, typename S> void register_common_surface_methods(S &s) {
      .def("normal", &T::normal)
      .def("dnormal_by_dcoeff", &T::dnormal_by_dcoeff)
      .def("d2normal_by_dcoeffdcoeff", &T::d2normal_by_dcoeffdcoeff)
+     .def("dgamma_by_dcoeff_vjp", &T::dgamma_by_dcoeff_vjp)
+     .def("dgammadash1_by_dcoeff_vjp", &T::dgammadash1_by_dcoeff_vjp)
+     .def("dgammadash2_by_dcoeff_vjp", &T::dgammadash2_by_dcoeff_vjp)
+     .def("dnormal_by_dcoeff_vjp", &T::dnormal_by_dcoeff_vjp)
+     .def("d2normal_by_dcoeffdcoeff_vjp", &T::d2normal_by_dcoeffdcoeff_vjp)
+     .def("dgamma_by_dcoeff_matvec", &T::dgamma_by_dcoeff_matvec)
+     .def("dgammadash1_by_dcoeff_matvec", &T::dgammadash1_by_dcoeff_matvec)
+     .def("dgammadash2_by_dcoeff_matvec", &T::dgammadash2_by_dcoeff_matvec)
+     .def("dnormal_by_dcoeff_matvec", &T::dnormal_by_dcoeff_matvec)
      .def("unitnormal", &T::unitnormal)
      .def("area", &T::area)
      .def("darea_by_dcoeff", &T::darea_by_dcoeff)
@@ -188,4 +202,23 @@ void init_surfaces(py::module_ &m){
         .def_readwrite("nfp", &PySurfaceXYZTensorFourier::nfp)
         .def_readwrite("stellsym", &PySurfaceXYZTensorFourier::stellsym);
     register_common_surface_methods<PySurfaceXYZTensorFourier>(pysurfacexyztensorfourier);
+
+    py::class_<PySurfaceDistance, shared_ptr<PySurfaceDistance>>(m, "SurfaceDistance",
+            R"pbdoc(
+            Exact signed distance to a toroidal surface, positive inside and negative outside of the surface.
+            The surface is given by its values on a uniform grid in ``(phi, theta)`` that covers the whole torus, from which its Fourier representation is computed.
+            The closest point is found with a bounding volume hierarchy over the triangulated grid and then refined by Newton's method on the parametric surface.
+            )pbdoc")
+        .def(py::init<PyArray&, double>(), py::arg("gamma"), py::arg("tol")=1e-13)
+        .def("num_modes", &PySurfaceDistance::num_modes, "Number of Fourier modes used to represent the surface.")
+        .def("signed_distance", &PySurfaceDistance::signed_distance, py::arg("xyz"), "Signed distance of the points ``xyz`` (shape ``(n, 3)``) to the surface.")
+        .def("signed_distance_cyl", &PySurfaceDistance::signed_distance_cyl, py::arg("rs"), py::arg("phis"), py::arg("zs"), "Signed distance of points given in cylindrical coordinates.")
+        .def("closest_point", &PySurfaceDistance::closest_point, py::arg("xyz"), "Parameters ``(phi, theta)`` of the closest points on the surface, shape ``(n, 2)``.")
+        .def("gamma_lin", &PySurfaceDistance::gamma_lin, py::arg("phis"), py::arg("thetas"), "Evaluate the surface at the parameters ``(phis[i], thetas[i])``.")
+        .def("interpolate", [](const PySurfaceDistance& dist, RegularGridInterpolant3D<PyTensor>& interp) {
+                // the interpolant lives on a grid in cylindrical coordinates
+                Vec rs, phis, zs;
+                std::tie(rs, phis, zs) = interp.interpolation_nodes();
+                interp.set_values(dist.signed_distance_cyl(rs, phis, zs));
+            }, py::arg("interpolant"), "Build a ``RegularGridInterpolant3D`` on a grid in cylindrical coordinates ``(r, phi, z)`` from the signed distance at its nodes.");
 }
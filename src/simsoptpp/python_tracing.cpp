@@ -15,11 +15,31 @@ using std::vector;
 void init_tracing(py::module_ &m){
 
 
+    py::class_<RecordOptions>(m, "RecordOptions")
+        .def(py::init<int, double>(), py::arg("every")=1, py::arg("interval")=0.)
+        .def_readonly("every", &RecordOptions::every)
+        .def_readonly("interval", &RecordOptions::interval);
+
     py::class_<StoppingCriterion, shared_ptr<StoppingCriterion>>(m, "StoppingCriterion");
     py::class_<IterationStoppingCriterion, shared_ptr<IterationStoppingCriterion>, StoppingCriterion>(m, "IterationStoppingCriterion")
         .def(py::init<int>());
     py::class_<LevelsetStoppingCriterion<PyTensor>, shared_ptr<LevelsetStoppingCriterion<PyTensor>>, StoppingCriterion>(m, "LevelsetStoppingCriterion")
-        .def(py::init<shared_ptr<RegularGridInterpolant3D<PyTensor>>>());
+        .def(py::init<shared_ptr<Interpolant3D<PyTensor>>>());
+    py::class_<MinToroidalFluxStoppingCriterion, shared_ptr<MinToroidalFluxStoppingCriterion>, StoppingCriterion>(m, "MinToroidalFluxStoppingCriterion")
+        .def(py::init<double>());
+    py::class_<MaxToroidalFluxStoppingCriterion, shared_ptr<MaxToroidalFluxStoppingCriterion>, StoppingCriterion>(m, "MaxToroidalFluxStoppingCriterion")
+        .def(py::init<double>());
+
+    py::class_<BoozerSpectralField, shared_ptr<BoozerSpectralField>>(m, "BoozerSpectralField")
+        .def(py::init<Vec, vector<int>, vector<int>, vector<Vec>, Vec, Vec, Vec, double, int>(),
+            py::arg("s"), py::arg("xm"), py::arg("xn"), py::arg("bmnc"), py::arg("G"), py::arg("I"), py::arg("iota"), py::arg("psi0"), py::arg("nfp"))
+        .def_readonly("psi0", &BoozerSpectralField::psi0)
+        .def_readonly("nfp", &BoozerSpectralField::nfp)
+        .def("num_modes", &BoozerSpectralField::num_modes)
+        .def("smin", &BoozerSpectralField::smin)
+        .def("smax", &BoozerSpectralField::smax)
+        .def("modB", &BoozerSpectralField::modB, py::arg("stz"))
+        .def("profiles", &BoozerSpectralField::profiles, py::arg("s"));
 
     m.def("particle_guiding_center_tracing", &particle_guiding_center_tracing<xt::pytensor>,
         py::arg("field"), 
@@ -35,6 +55,22 @@ void init_tracing(py::module_ &m){
         py::arg("stopping_criteria")=vector<shared_ptr<StoppingCriterion>>{}
         );
 
+    m.def("particle_guiding_center_tracing_batch", &particle_guiding_center_tracing_batch<xt::pytensor>,
+        py::arg("field"),
+        py::arg("xyz_inits"),
+        py::arg("m"),
+        py::arg("q"),
+        py::arg("vtotal"),
+        py::arg("vtangs"),
+        py::arg("tmax"),
+        py::arg("tol"),
+        py::arg("vacuum"),
+        py::arg("phis")=vector<double>{},
+        py::arg("stopping_criteria")=vector<shared_ptr<StoppingCriterion>>{},
+        py::arg("packet_size")=1,
+        py::arg("record")=RecordOptions()
+        );
+
     m.def("particle_fullorbit_tracing", &particle_fullorbit_tracing<xt::pytensor>,
         py::arg("field"), 
         py::arg("xyz_init"), 
@@ -44,7 +80,35 @@ void init_tracing(py::module_ &m){
         py::arg("tmax"), 
         py::arg("tol"), 
         py::arg("phis")=vector<double>{},
-        py::arg("stopping_criteria")=vector<shared_ptr<StoppingCriterion>>{}
+        py::arg("stopping_criteria")=vector<shared_ptr<StoppingCriterion>>{},
+        py::arg("record")=RecordOptions()
+        );
+
+    m.def("particle_fullorbit_boris_tracing_batch", &particle_fullorbit_boris_tracing_batch<xt::pytensor>,
+        py::arg("field"),
+        py::arg("xyz_inits"),
+        py::arg("v_inits"),
+        py::arg("m"),
+        py::arg("q"),
+        py::arg("tmax"),
+        py::arg("steps_per_gyroperiod"),
+        py::arg("phis")=vector<double>{},
+        py::arg("stopping_criteria")=vector<shared_ptr<StoppingCriterion>>{},
+        py::arg("record")=RecordOptions()
+        );
+
+    m.def("particle_guiding_center_boozer_tracing_batch", &particle_guiding_center_boozer_tracing_batch,
+        py::arg("field"),
+        py::arg("stz_inits"),
+        py::arg("m"),
+        py::arg("q"),
+        py::arg("vtotal"),
+        py::arg("vtangs"),
+        py::arg("tmax"),
+        py::arg("tol"),
+        py::arg("s_surfaces")=vector<double>{},
+        py::arg("stopping_criteria")=vector<shared_ptr<StoppingCriterion>>{},
+        py::arg("record")=RecordOptions()
         );
 
     m.def("fieldline_tracing", &fieldline_tracing<xt::pytensor>, 
@@ -55,4 +119,14 @@ void init_tracing(py::module_ &m){
             py::arg("phis")=vector<double>{},
             py::arg("stopping_criteria")=vector<shared_ptr<StoppingCriterion>>{});
 
+    m.def("fieldline_tracing_batch", &fieldline_tracing_batch<xt::pytensor>,
+            py::arg("field"),
+            py::arg("xyz_inits"),
+            py::arg("tmax"),
+            py::arg("tol"),
+            py::arg("phis")=vector<double>{},
+            py::arg("stopping_criteria")=vector<shared_ptr<StoppingCriterion>>{},
+            py::arg("packet_size")=1,
+            py::arg("record")=RecordOptions());
+
 }
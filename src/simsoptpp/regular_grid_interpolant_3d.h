@@ -8,6 +8,8 @@
 #include <random>
 #include <stdexcept>
 #include <algorithm>
+#include <memory>
+#include <string>
 #include <fmt/core.h>
 #include "simdhelpers.h"
 
@@ -86,8 +88,30 @@ class ChebyshevInterpolationRule : public InterpolationRule {
         }
 };
 
+// Evaluates the polynomial interpolant on a single cell. `vals_local`
+// contains the values at the (degree+1)^3 nodes of the cell (each padded to
+// `padded_value_size`) and (x, y, z) are the local coordinates in [0, 1]^3.
+void evaluate_local_vals(const InterpolationRule& rule, int value_size, int padded_value_size, const double* vals_local, double x, double y, double z, double* res);
+
+// Common interface of the interpolants, so that e.g. `InterpolatedField` and
+// `LevelsetStoppingCriterion` can use either of them.
 template<class Array>
-class RegularGridInterpolant3D {
+class Interpolant3D {
+    public:
+        virtual ~Interpolant3D() = default;
+        virtual void evaluate_batch(Array& xyz, Array& fxyz) = 0;
+        virtual Vec evaluate(double x, double y, double z) = 0;
+        // As `evaluate`, but writes the `value_size` values to `res` instead
+        // of allocating a new vector.
+        virtual void evaluate_inplace(double x, double y, double z, double* res) = 0;
+        virtual std::pair<double, double> estimate_error(std::function<Vec(Vec, Vec, Vec)> &f, int samples) = 0;
+        // Whether (x, y, z) lies in a cell that was skipped when building the
+        // interpolant, i.e. in which the interpolant can't be evaluated.
+        virtual bool is_skipped(double x, double y, double z) = 0;
+};
+
+template<class Array>
+class RegularGridInterpolant3D : public Interpolant3D<Array> {
     private:
         const int nx, ny, nz;
         const double xmin, ymin, zmin;
@@ -103,10 +127,17 @@ class RegularGridInterpolant3D {
         Vec ysmesh;
         Vec zsmesh;
         AlignedVec all_local_vals;
+        // points either to all_local_vals or into a read only memory mapping
+        // of a file created by `save` (see `load`).
+        const double* local_vals_data = nullptr;
+        std::shared_ptr<void> mapping;
+        // Maps the index of a cell to the index of its values in the table,
+        // -1 for cells that were skipped. Empty if no cells are skipped.
+        std::vector<int> cell_index;
+        int nstored_cells;
         int local_vals_size;
         static const int simdcount = xsimd::simd_type<double>::size;
         const InterpolationRule rule;
-        Vec pkxs, pkys, pkzs;
 
     public:
         bool extrapolate;
@@ -119,9 +150,6 @@ class RegularGridInterpolant3D {
             value_size(value_size), extrapolate(extrapolate)
         {
             int degree = rule.degree;
-            pkxs = Vec(degree+1, 0.);
-            pkys = Vec(degree+1, 0.);
-            pkzs = Vec(degree+1, 0.);
             hx = (xmax-xmin)/nx;
             hy = (ymax-ymin)/ny;
             hz = (zmax-zmin)/nz;
@@ -154,6 +182,7 @@ class RegularGridInterpolant3D {
             int nnodes = (nx*degree+1)*(ny*degree+1)*(nz*degree+1);
             vals = AlignedVec(nnodes*padded_value_size, 0.);
             local_vals_size = (degree+1)*(degree+1)*(degree+1)*padded_value_size;
+            nstored_cells = nx*ny*nz;
             //vals_local = Vec((degree+1)*(degree+1)*(degree+1)*padded_value_size, 0.);
             //fmt::print("Memory usage of interpolant={:E} bytes \n", double(vals.size()*sizeof(double)));
             //fmt::print("{} function evaluations required\n", nnodes);
@@ -167,6 +196,21 @@ class RegularGridInterpolant3D {
 
         void interpolate(std::function<Vec(double, double, double)> &f);
         void interpolate_batch(std::function<Vec(Vec, Vec, Vec)> &f);
+        // Coordinates of all interpolation nodes. Instead of calling
+        // `interpolate_batch`, one can evaluate the function at these nodes
+        // (e.g. split up across threads or MPI ranks) and pass the values,
+        // in the same order, to `set_values`.
+        std::tuple<Vec, Vec, Vec> interpolation_nodes();
+        void set_values(const Vec& fxyz);
+        // Don't interpolate cells for which `skip` returns true at all eight
+        // corners. This has to be called before the interpolant is built (or
+        // loaded); only the nodes of the remaining cells are evaluated and
+        // only their values are stored. Evaluating the interpolant in a
+        // skipped cell throws an error, see also `is_skipped`.
+        void skip_cells(std::function<std::vector<bool>(Vec, Vec, Vec)> &skip);
+        // Number of cells whose values are stored.
+        int ncells() { return nstored_cells; }
+        bool is_skipped(double x, double y, double z) override;
         void build_local_vals();
 
         inline int idx_dof(int i, int j, int k){
@@ -187,11 +231,26 @@ class RegularGridInterpolant3D {
             return i*(degree+1)*(degree+1) + j*(degree+1) + k;
         }
 
+        // Flags the nodes that belong to at least one cell that is not
+        // skipped. Empty if no cells are skipped.
+        std::vector<bool> needed_nodes();
+
         int locate_unsafe(double x, double y, double z);
         void evaluate_batch_with_transform(Array& xyz, Array& fxyz);
-        void evaluate_batch(Array& xyz, Array& fxyz);
-        Vec evaluate(double x, double y, double z);
-        void evaluate_inplace(double x, double y, double z, double* res);
+        void evaluate_batch(Array& xyz, Array& fxyz) override;
+        Vec evaluate(double x, double y, double z) override;
+        void evaluate_inplace(double x, double y, double z, double* res) override;
         void evaluate_local(double x, double y, double z, int cell_idx, double* res);
-        std::pair<double, double> estimate_error(std::function<Vec(Vec, Vec, Vec)> &f, int samples);
+        std::pair<double, double> estimate_error(std::function<Vec(Vec, Vec, Vec)> &f, int samples) override;
+
+        // Write the interpolation table to a binary file. The file stores the
+        // grid, the interpolation rule and the user provided `key`, which
+        // should identify the function that was interpolated.
+        void save(const std::string& filename, const std::string& key);
+        // Memory map the interpolation table stored in `filename` (read only,
+        // so all processes on a node share the same physical memory). Returns
+        // false and leaves the interpolant unchanged if the file does not
+        // exist, or if it was written by a different version, for a different
+        // grid, rule, SIMD width or key.
+        bool load(const std::string& filename, const std::string& key);
 };
@@ -3,6 +3,15 @@
 #include "xtensor/xlayout.hpp"
 #define _USE_MATH_DEFINES
 #include <math.h>
+#include <cstdint>
+#include <cstdio>
+#include <cstring>
+#include <numeric>
+#include <fstream>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <fcntl.h>
+#include <unistd.h>
 
 #define _EPS_ 1e-13
 
@@ -12,10 +21,16 @@ const int RegularGridInterpolant3D<Array>::simdcount;
 template<class Array>
 void RegularGridInterpolant3D<Array>::interpolate(std::function<Vec(double, double, double)> &f) {
     int degree = rule.degree;
+    int nnodes = (nx*degree+1)*(ny*degree+1)*(nz*degree+1);
+    if(vals.size() != nnodes*padded_value_size)
+        vals = AlignedVec(nnodes*padded_value_size, 0.);
+    std::vector<bool> needed = needed_nodes();
     Vec t;
     for (int i = 0; i <= nx*degree; ++i) {
         for (int j = 0; j <= ny*degree; ++j) {
             for (int k = 0; k <= nz*degree; ++k) {
+                if(needed.size() > 0 && !needed[idx_dof(i, j, k)])
+                    continue;
                 int offset = padded_value_size*idx_dof(i, j, k);
                 t = f(xs[i], ys[j], zs[k]);
                 for (int l = 0; l < value_size; ++l) {
@@ -28,36 +43,119 @@ void RegularGridInterpolant3D<Array>::interpolate(std::function<Vec(double, doub
 }
 
 template<class Array>
-void RegularGridInterpolant3D<Array>::interpolate_batch(std::function<Vec(Vec, Vec, Vec)> &f) {
+std::vector<bool> RegularGridInterpolant3D<Array>::needed_nodes() {
+    if(cell_index.size() == 0)
+        return std::vector<bool>();
     int degree = rule.degree;
-    Vec xcoords((nx*degree+1)*(ny*degree+1)*(nz*degree+1), 0.);
-    Vec ycoords((nx*degree+1)*(ny*degree+1)*(nz*degree+1), 0.);
-    Vec zcoords((nx*degree+1)*(ny*degree+1)*(nz*degree+1), 0.);
+    std::vector<bool> needed((nx*degree+1)*(ny*degree+1)*(nz*degree+1), false);
+    for (int xidx = 0; xidx < nx; ++xidx) {
+        for (int yidx = 0; yidx < ny; ++yidx) {
+            for (int zidx = 0; zidx < nz; ++zidx) {
+                if(cell_index[idx_cell(xidx, yidx, zidx)] < 0)
+                    continue;
+                for (int i = 0; i < degree+1; ++i)
+                    for (int j = 0; j < degree+1; ++j)
+                        for (int k = 0; k < degree+1; ++k)
+                            needed[idx_dof(xidx*degree+i, yidx*degree+j, zidx*degree+k)] = true;
+            }
+        }
+    }
+    return needed;
+}
+
+template<class Array>
+void RegularGridInterpolant3D<Array>::skip_cells(std::function<std::vector<bool>(Vec, Vec, Vec)> &skip) {
+    int ncells = nx*ny*nz;
+    Vec cx(8*ncells), cy(8*ncells), cz(8*ncells);
+    for (int xidx = 0; xidx < nx; ++xidx) {
+        for (int yidx = 0; yidx < ny; ++yidx) {
+            for (int zidx = 0; zidx < nz; ++zidx) {
+                int cell = idx_cell(xidx, yidx, zidx);
+                for (int o = 0; o < 8; ++o) {
+                    cx[8*cell+o] = xsmesh[xidx + ((o >> 2) & 1)];
+                    cy[8*cell+o] = ysmesh[yidx + ((o >> 1) & 1)];
+                    cz[8*cell+o] = zsmesh[zidx + (o & 1)];
+                }
+            }
+        }
+    }
+    std::vector<bool> outside = skip(cx, cy, cz);
+    if(outside.size() != 8*ncells)
+        throw std::runtime_error(fmt::format("The skip function returned {} values for {} points.", outside.size(), 8*ncells));
+    cell_index = std::vector<int>(ncells, -1);
+    nstored_cells = 0;
+    for (int cell = 0; cell < ncells; ++cell) {
+        bool all_outside = true;
+        for (int o = 0; o < 8; ++o)
+            all_outside = all_outside && outside[8*cell+o];
+        if(!all_outside)
+            cell_index[cell] = nstored_cells++;
+    }
+    // the old table (if any) doesn't match the new cell index
+    all_local_vals = AlignedVec();
+    local_vals_data = nullptr;
+    mapping = nullptr;
+}
+
+template<class Array>
+std::tuple<Vec, Vec, Vec> RegularGridInterpolant3D<Array>::interpolation_nodes() {
+    int degree = rule.degree;
+    std::vector<bool> needed = needed_nodes();
+    int nnodes = needed.size() > 0 ? std::count(needed.begin(), needed.end(), true) : (nx*degree+1)*(ny*degree+1)*(nz*degree+1);
+    Vec xcoords(nnodes, 0.);
+    Vec ycoords(nnodes, 0.);
+    Vec zcoords(nnodes, 0.);
+    int offset = 0;
     for (int i = 0; i <= nx*degree; ++i) {
         for (int j = 0; j <= ny*degree; ++j) {
             for (int k = 0; k <= nz*degree; ++k) {
-                int offset = idx_dof(i, j, k);
+                if(needed.size() > 0 && !needed[idx_dof(i, j, k)])
+                    continue;
                 xcoords[offset] = xs[i];
                 ycoords[offset] = ys[j];
                 zcoords[offset] = zs[k];
+                offset++;
             }
         }
     }
-    Vec fxyz  = f(xcoords, ycoords, zcoords);
+    return std::make_tuple(xcoords, ycoords, zcoords);
+}
+
+template<class Array>
+void RegularGridInterpolant3D<Array>::set_values(const Vec& fxyz) {
+    int degree = rule.degree;
+    int nnodes_total = (nx*degree+1)*(ny*degree+1)*(nz*degree+1);
+    std::vector<bool> needed = needed_nodes();
+    int nnodes = needed.size() > 0 ? std::count(needed.begin(), needed.end(), true) : nnodes_total;
+    if(fxyz.size() != nnodes*value_size)
+        throw std::runtime_error(fmt::format("Expected {} values ({} nodes times value size {}), but got {}.", nnodes*value_size, nnodes, value_size, fxyz.size()));
+    if(vals.size() != nnodes_total*padded_value_size)
+        vals = AlignedVec(nnodes_total*padded_value_size, 0.);
+    int offset = 0;
     for (int i = 0; i <= nx*degree; ++i) {
         for (int j = 0; j <= ny*degree; ++j) {
             for (int k = 0; k <= nz*degree; ++k) {
-                int offset = value_size*idx_dof(i, j, k);
+                if(needed.size() > 0 && !needed[idx_dof(i, j, k)])
+                    continue;
                 int offset_padded = padded_value_size*idx_dof(i, j, k);
                 for (int l = 0; l < value_size; ++l) {
-                    vals[offset_padded + l] = fxyz[offset+l];
+                    vals[offset_padded + l] = fxyz[value_size*offset + l];
                 }
+                offset++;
             }
         }
     }
     build_local_vals();
 }
 
+template<class Array>
+void RegularGridInterpolant3D<Array>::interpolate_batch(std::function<Vec(Vec, Vec, Vec)> &f) {
+    Vec xcoords, ycoords, zcoords;
+    std::tie(xcoords, ycoords, zcoords) = interpolation_nodes();
+    Vec fxyz  = f(xcoords, ycoords, zcoords);
+    set_values(fxyz);
+}
+
 template<class Array>
 void RegularGridInterpolant3D<Array>::build_local_vals(){
     int degree = rule.degree;
@@ -65,11 +163,15 @@ void RegularGridInterpolant3D<Array>::build_local_vals(){
     //        nx*ny*nz,
     //        AlignedVec((degree+1)*(degree+1)*(degree+1)*padded_value_size, 0.)
     //        );
-    all_local_vals = AlignedVec(nx*ny*nz*local_vals_size, 0.);
+    all_local_vals = AlignedVec(nstored_cells*local_vals_size, 0.);
     for (int xidx = 0; xidx < nx; ++xidx) {
         for (int yidx = 0; yidx < ny; ++yidx) {
             for (int zidx = 0; zidx < nz; ++zidx) {
                 int meshidx = idx_cell(xidx, yidx, zidx);
+                if(cell_index.size() > 0)
+                    meshidx = cell_index[meshidx];
+                if(meshidx < 0)
+                    continue;
                 for (int i = 0; i < degree+1; ++i) {
                     for (int j = 0; j < degree+1; ++j) {
                         int offset = padded_value_size*idx_dof(xidx*degree+i, yidx*degree+j, zidx*degree+0);
@@ -80,6 +182,10 @@ void RegularGridInterpolant3D<Array>::build_local_vals(){
             }
         }
     }
+    local_vals_data = all_local_vals.data();
+    mapping = nullptr;
+    // the values at the interpolation nodes are not needed any more
+    vals = AlignedVec();
 }
 
 template<class Array>
@@ -90,18 +196,20 @@ void RegularGridInterpolant3D<Array>::evaluate_batch(Array& xyz, Array& fxyz){
     for (int i = 0; i < npoints; ++i) {
         if(i < npoints-1){
             int idx = locate_unsafe(xyz(i+1, 0), xyz(i+1, 1), xyz(i+1, 2));
-            double* ptr = all_local_vals.data()+idx*local_vals_size;
-            __builtin_prefetch(ptr+(0*8), 0, 0);
-            __builtin_prefetch(ptr+(1*8), 0, 0);
-            __builtin_prefetch(ptr+(2*8), 0, 0);
-            __builtin_prefetch(ptr+(3*8), 0, 0);
-            __builtin_prefetch(ptr+(4*8), 0, 0);
-            __builtin_prefetch(ptr+(5*8), 0, 0);
-            __builtin_prefetch(ptr+(6*8), 0, 0);
-            __builtin_prefetch(ptr+(7*8), 0, 0);
-            __builtin_prefetch(ptr+(8*8), 0, 0);
-            __builtin_prefetch(ptr+(9*8), 0, 0);
-            __builtin_prefetch(ptr+(10*8), 0, 0);
+            if(idx >= 0) {
+                const double* ptr = local_vals_data+idx*local_vals_size;
+                __builtin_prefetch(ptr+(0*8), 0, 0);
+                __builtin_prefetch(ptr+(1*8), 0, 0);
+                __builtin_prefetch(ptr+(2*8), 0, 0);
+                __builtin_prefetch(ptr+(3*8), 0, 0);
+                __builtin_prefetch(ptr+(4*8), 0, 0);
+                __builtin_prefetch(ptr+(5*8), 0, 0);
+                __builtin_prefetch(ptr+(6*8), 0, 0);
+                __builtin_prefetch(ptr+(7*8), 0, 0);
+                __builtin_prefetch(ptr+(8*8), 0, 0);
+                __builtin_prefetch(ptr+(9*8), 0, 0);
+                __builtin_prefetch(ptr+(10*8), 0, 0);
+            }
         }
         evaluate_inplace(xyz(i, 0), xyz(i, 1), xyz(i, 2), fxyz.data() + value_size*i);
     }
@@ -120,7 +228,21 @@ int RegularGridInterpolant3D<Array>::locate_unsafe(double x, double y, double z)
     int xidx = int(nx*(x-xmin)/(xmax-xmin)); // find idx so that xsmesh[xidx] <= x <= xs[xidx+1]
     int yidx = int(ny*(y-ymin)/(ymax-ymin));
     int zidx = int(nz*(z-zmin)/(zmax-zmin));
-    return idx_cell(xidx, yidx, zidx);
+    if(cell_index.size() == 0)
+        return idx_cell(xidx, yidx, zidx);
+    if(xidx < 0 || xidx >= nx || yidx < 0 || yidx >= ny || zidx < 0 || zidx >= nz)
+        return -1;
+    return cell_index[idx_cell(xidx, yidx, zidx)];
+}
+
+template<class Array>
+bool RegularGridInterpolant3D<Array>::is_skipped(double x, double y, double z){
+    if(cell_index.size() == 0)
+        return false;
+    int xidx = std::max(std::min(int(nx*(x-xmin)/(xmax-xmin)), nx-1), 0);
+    int yidx = std::max(std::min(int(ny*(y-ymin)/(ymax-ymin)), ny-1), 0);
+    int zidx = std::max(std::min(int(nz*(z-zmin)/(zmax-zmin)), nz-1), 0);
+    return cell_index[idx_cell(xidx, yidx, zidx)] < 0;
 }
 
 template<class Array>
@@ -158,37 +280,57 @@ void RegularGridInterpolant3D<Array>::evaluate_inplace(double x, double y, doubl
     if(zlocal < 0.-_EPS_ || zlocal > 1.+_EPS_)
         throw std::runtime_error(fmt::format("zlocal={} not within [0, 1]", zlocal));
     //std::cout << "local coordinates=(" << xlocal << ", " << ylocal << ", " << zlocal << ")" << std::endl;
-    return evaluate_local(xlocal, ylocal, zlocal, idx_cell(xidx, yidx, zidx), res);
+    int cell = idx_cell(xidx, yidx, zidx);
+    if(cell_index.size() > 0) {
+        cell = cell_index[cell];
+        if(cell < 0)
+            throw std::runtime_error(fmt::format("({}, {}, {}) lies in a cell that was skipped when building the interpolant.", x, y, z));
+    }
+    return evaluate_local(xlocal, ylocal, zlocal, cell, res);
 }
 
 template<class Array>
 void RegularGridInterpolant3D<Array>::evaluate_local(double x, double y, double z, int cell_idx, double* res)
+{
+    const double* vals_local = local_vals_data+cell_idx*local_vals_size;
+    evaluate_local_vals(rule, value_size, padded_value_size, vals_local, x, y, z, res);
+}
+
+void evaluate_local_vals(const InterpolationRule& rule, int value_size, int padded_value_size, const double* vals_local, double x, double y, double z, double* res)
 {
     int degree = rule.degree;
-    double* vals_local = all_local_vals.data()+cell_idx*local_vals_size;
+    int simdcount = xsimd::simd_type<double>::size;
+    // scratch space for the basis function values. this is thread local so
+    // that the interpolant can be evaluated concurrently from several threads.
+    static thread_local Vec pkxs, pkys, pkzs;
+    if(pkxs.size() < degree+1) {
+        pkxs = Vec(degree+1, 0.);
+        pkys = Vec(degree+1, 0.);
+        pkzs = Vec(degree+1, 0.);
+    }
     if(xsimd::simd_type<double>::size >= 3){
         simd_t xyz;
         xyz[0] = x;
         xyz[1] = y;
         xyz[2] = z;
         for (int k = 0; k < degree+1; ++k) {
-            simd_t temp = this->rule.basis_fun(k, xyz);
+            simd_t temp = rule.basis_fun(k, xyz);
             pkxs[k] = temp[0];
             pkys[k] = temp[1];
             pkzs[k] = temp[2];
         }
     } else {
         for (int k = 0; k < degree+1; ++k) {
-            pkxs[k] = this->rule.basis_fun(k, x);
-            pkys[k] = this->rule.basis_fun(k, y);
-            pkzs[k] = this->rule.basis_fun(k, z);
+            pkxs[k] = rule.basis_fun(k, x);
+            pkys[k] = rule.basis_fun(k, y);
+            pkzs[k] = rule.basis_fun(k, z);
         }
     }
 
     for(int l=0; l<padded_value_size; l += simdcount) {
         simd_t sumi(0.);
         int offset_local = l;
-        double* val_ptr = &(vals_local[offset_local]);
+        const double* val_ptr = &(vals_local[offset_local]);
         for (int i = 0; i < degree+1; ++i) {
             simd_t sumj(0.); 
             for (int j = 0; j < degree+1; ++j) {
@@ -216,15 +358,26 @@ std::pair<double, double> RegularGridInterpolant3D<Array>::estimate_error(std::f
     std::uniform_real_distribution<double> distribution(0.0, +1.0);
     double err = 0;
     double errsq = 0;
-    Vec xs(samples, 0.);
-    Vec ys(samples, 0.);
-    Vec zs(samples, 0.);
+    Vec xs;
+    Vec ys;
+    Vec zs;
+    // points in skipped cells are ignored
+    for (int i = 0; i < samples; ++i) {
+        double x = xmin + distribution(generator)*(xmax-xmin);
+        double y = ymin + distribution(generator)*(ymax-ymin);
+        double z = zmin + distribution(generator)*(zmax-zmin);
+        if(is_skipped(x, y, z))
+            continue;
+        xs.push_back(x);
+        ys.push_back(y);
+        zs.push_back(z);
+    }
+    samples = xs.size();
+    if(samples < 2)
+        throw std::runtime_error("Not enough samples in cells that were not skipped.");
     Array xyz = xt::zeros<double>({samples, 3});
     Array fhxyz = xt::zeros<double>({samples, value_size});
     for (int i = 0; i < samples; ++i) {
-        xs[i] = xmin + distribution(generator)*(xmax-xmin);
-        ys[i] = ymin + distribution(generator)*(ymax-ymin);
-        zs[i] = zmin + distribution(generator)*(zmax-zmin);
         xyz(i, 0) = xs[i];
         xyz(i, 1) = ys[i];
         xyz(i, 2) = zs[i];
@@ -246,6 +399,135 @@ std::pair<double, double> RegularGridInterpolant3D<Array>::estimate_error(std::f
 }
 
 
+#define RGI_FILE_MAGIC "SOPPRGI"
+#define RGI_FILE_VERSION 2
+#define RGI_FILE_ALIGNMENT 4096
+
+namespace {
+    struct RGIFileHeader {
+        char magic[8];
+        uint32_t version;
+        int32_t nx, ny, nz, degree, value_size, padded_value_size;
+        double xmin, xmax, ymin, ymax, zmin, zmax;
+        uint64_t keylen;
+        uint64_t nstored_cells; // if less than nx*ny*nz, the cell index is stored after the nodes
+        uint64_t data_offset;
+        uint64_t data_size;
+    };
+}
+
+template<class Array>
+void RegularGridInterpolant3D<Array>::save(const std::string& filename, const std::string& key) {
+    if(!local_vals_data)
+        throw std::runtime_error("The interpolant needs to be built before it can be saved.");
+    int degree = rule.degree;
+    RGIFileHeader header = {};
+    std::strncpy(header.magic, RGI_FILE_MAGIC, sizeof(header.magic));
+    header.version = RGI_FILE_VERSION;
+    header.nx = nx; header.ny = ny; header.nz = nz;
+    header.degree = degree;
+    header.value_size = value_size;
+    header.padded_value_size = padded_value_size;
+    header.xmin = xmin; header.xmax = xmax;
+    header.ymin = ymin; header.ymax = ymax;
+    header.zmin = zmin; header.zmax = zmax;
+    header.keylen = key.size();
+    header.nstored_cells = nstored_cells;
+    size_t ncell_index = nstored_cells < nx*ny*nz ? cell_index.size() : 0;
+    uint64_t header_size = sizeof(RGIFileHeader) + key.size() + (degree+1)*sizeof(double) + ncell_index*sizeof(int);
+    header.data_offset = ((header_size + RGI_FILE_ALIGNMENT - 1)/RGI_FILE_ALIGNMENT)*RGI_FILE_ALIGNMENT;
+    header.data_size = uint64_t(nstored_cells)*local_vals_size;
+
+    // write to a temporary file first and then move it into place, so that
+    // other processes never see a partially written file.
+    std::string tmpfilename = fmt::format("{}.tmp{}", filename, getpid());
+    {
+        std::ofstream out(tmpfilename, std::ios::binary | std::ios::trunc);
+        if(!out)
+            throw std::runtime_error(fmt::format("Could not open {} for writing.", tmpfilename));
+        out.write(reinterpret_cast<const char*>(&header), sizeof(RGIFileHeader));
+        out.write(key.data(), key.size());
+        out.write(reinterpret_cast<const char*>(rule.nodes.data()), (degree+1)*sizeof(double));
+        out.write(reinterpret_cast<const char*>(cell_index.data()), ncell_index*sizeof(int));
+        std::vector<char> padding(header.data_offset - header_size, 0);
+        out.write(padding.data(), padding.size());
+        out.write(reinterpret_cast<const char*>(local_vals_data), header.data_size*sizeof(double));
+        if(!out)
+            throw std::runtime_error(fmt::format("Writing to {} failed.", tmpfilename));
+    }
+    if(std::rename(tmpfilename.c_str(), filename.c_str()) != 0)
+        throw std::runtime_error(fmt::format("Could not move {} to {}.", tmpfilename, filename));
+}
+
+template<class Array>
+bool RegularGridInterpolant3D<Array>::load(const std::string& filename, const std::string& key) {
+    int degree = rule.degree;
+    std::ifstream in(filename, std::ios::binary);
+    if(!in)
+        return false;
+    RGIFileHeader header;
+    in.read(reinterpret_cast<char*>(&header), sizeof(RGIFileHeader));
+    // stray or corrupt files are treated like tables that do not match, so
+    // that the caller rebuilds the table
+    if(!in || std::strncmp(header.magic, RGI_FILE_MAGIC, sizeof(header.magic)) != 0)
+        return false;
+    if(header.version != RGI_FILE_VERSION)
+        return false;
+    if(header.nx != nx || header.ny != ny || header.nz != nz || header.degree != degree
+            || header.value_size != value_size || header.padded_value_size != padded_value_size
+            || header.xmin != xmin || header.xmax != xmax || header.ymin != ymin
+            || header.ymax != ymax || header.zmin != zmin || header.zmax != zmax
+            || header.keylen != key.size() || header.nstored_cells != nstored_cells
+            || header.data_size != uint64_t(nstored_cells)*local_vals_size)
+        return false;
+    std::string filekey(header.keylen, ' ');
+    in.read(&filekey[0], header.keylen);
+    Vec nodes(degree+1, 0.);
+    in.read(reinterpret_cast<char*>(nodes.data()), (degree+1)*sizeof(double));
+    // cells that are skipped have to agree with the ones set by `skip_cells`
+    std::vector<int> file_cell_index(header.nstored_cells < uint64_t(nx)*ny*nz ? nx*ny*nz : 0);
+    in.read(reinterpret_cast<char*>(file_cell_index.data()), file_cell_index.size()*sizeof(int));
+    if(!in)
+        return false;
+    if(filekey != key || nodes != rule.nodes)
+        return false;
+    if(file_cell_index.size() > 0 || cell_index.size() > 0) {
+        // an index in which no cell is skipped is equivalent to no index
+        std::vector<int> own_cell_index = cell_index;
+        if(own_cell_index.size() == 0) {
+            own_cell_index.resize(nx*ny*nz);
+            std::iota(own_cell_index.begin(), own_cell_index.end(), 0);
+        }
+        if(file_cell_index.size() == 0) {
+            file_cell_index.resize(nx*ny*nz);
+            std::iota(file_cell_index.begin(), file_cell_index.end(), 0);
+        }
+        if(file_cell_index != own_cell_index)
+            return false;
+    }
+    in.close();
+
+    int fd = open(filename.c_str(), O_RDONLY);
+    if(fd < 0)
+        return false;
+    struct stat st;
+    size_t length = header.data_offset + header.data_size*sizeof(double);
+    if(fstat(fd, &st) != 0 || size_t(st.st_size) < length) {
+        close(fd);
+        return false;
+    }
+    void* addr = mmap(nullptr, length, PROT_READ, MAP_SHARED, fd, 0);
+    close(fd);
+    if(addr == MAP_FAILED)
+        throw std::runtime_error(fmt::format("Could not memory map {}.", filename));
+    mapping = std::shared_ptr<void>(addr, [length](void* p) { munmap(p, length); });
+    local_vals_data = reinterpret_cast<const double*>(static_cast<const char*>(addr) + header.data_offset);
+    // the values at the interpolation nodes are not needed any more
+    vals = AlignedVec();
+    all_local_vals = AlignedVec();
+    return true;
+}
+
 
 Vec linspace(double min, double max, int n, bool endpoint) {
     Vec res(n, 0.);
@@ -1,4 +1,5 @@
 #include "regular_grid_interpolant_3d_impl.h"
+#include "adaptive_grid_interpolant_3d_impl.h"
 #include "xtensor/xlayout.hpp"
 #include "xtensor-python/pyarray.hpp"     // Numpy bindings
 #include "xtensor-python/pytensor.hpp"     // Numpy bindings
@@ -6,3 +7,5 @@ typedef xt::pyarray<double> Array;
 
 template class RegularGridInterpolant3D<Array>;
 template class RegularGridInterpolant3D<xt::pytensor<double, 2, xt::layout_type::row_major>>;
+template class AdaptiveGridInterpolant3D<Array>;
+template class AdaptiveGridInterpolant3D<xt::pytensor<double, 2, xt::layout_type::row_major>>;
@@ -2,3 +2,6 @@
 typedef xt::pyarray<double> Array;
 Array ReimanB(double& iota0, double& iota1, Array& k_theta, Array& epsilon, int& m0_symmetry, Array& points);
 Array ReimandB(double& iota0, double& iota1, Array& k_theta, Array& epsilon, int& m0_symmetry, Array& points);
+// Writes the field at the point (x, y, z) to B and its gradient
+// (dB[3*j+l] = \partial_j B_l) to dB. Either of B and dB may be a nullptr.
+void ReimanBdB_point(double iota0, double iota1, const double* k_theta, const double* epsilon, int num_coeffs, int m0_symmetry, double x, double y, double ZZ, double* B, double* dB);
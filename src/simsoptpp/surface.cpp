@@ -36,6 +36,25 @@ Array surface_vjp_contraction(const Array& mat, const Array& v){
     return res;
 }
 
+template<class Array>
+Array surface_matvec_contraction(const Array& mat, const Array& v){
+    if(mat.layout() != xt::layout_type::row_major)
+          throw std::runtime_error("mat needs to be in row-major storage order");
+    int numquadpoints_phi = mat.shape(0);
+    int numquadpoints_theta = mat.shape(1);
+    int numdofs = mat.shape(3);
+    if(v.size() != numdofs)
+        throw std::runtime_error("v needs to have one entry per dof");
+    Array res = xt::zeros<double>({numquadpoints_phi, numquadpoints_theta, 3});
+    Eigen::Map<Eigen::Matrix<double,Eigen::Dynamic,Eigen::Dynamic,Eigen::RowMajor>> eigen_mat(const_cast<double*>(mat.data()), numquadpoints_phi*numquadpoints_theta*3, numdofs);
+    Eigen::VectorXd eigen_v(numdofs);
+    for (int i = 0; i < numdofs; ++i)
+        eigen_v(i) = v[i];
+    Eigen::Map<Eigen::VectorXd> eigen_res(res.data(), numquadpoints_phi*numquadpoints_theta*3);
+    eigen_res = eigen_mat*eigen_v;
+    return res;
+}
+
 template<class Array>
 void Surface<Array>::least_squares_fit(Array& target_values) {
     if(target_values.shape(0) != numquadpoints_phi)
@@ -293,35 +312,87 @@ Array Surface<Array>::dnormal_by_dcoeff_vjp(Array& v) {
     return dgammadash1_by_dcoeff_vjp(res_dgammadash1) + dgammadash2_by_dcoeff_vjp(res_dgammadash2);
 }
 
+template<class Array>
+Array Surface<Array>::dnormal_by_dcoeff_matvec(Array& v) {
+    auto& dg1 = this->gammadash1();
+    auto& dg2 = this->gammadash2();
+    Array a = dgammadash1_by_dcoeff_matvec(v);
+    Array b = dgammadash2_by_dcoeff_matvec(v);
+    Array res = xt::zeros<double>({numquadpoints_phi, numquadpoints_theta, 3});
+    for (int i = 0; i < numquadpoints_phi; ++i) {
+        for (int j = 0; j < numquadpoints_theta; ++j) {
+            res(i, j, 0) = a(i, j, 1)*dg2(i, j, 2) - a(i, j, 2)*dg2(i, j, 1) + dg1(i, j, 1)*b(i, j, 2) - dg1(i, j, 2)*b(i, j, 1);
+            res(i, j, 1) = a(i, j, 2)*dg2(i, j, 0) - a(i, j, 0)*dg2(i, j, 2) + dg1(i, j, 2)*b(i, j, 0) - dg1(i, j, 0)*b(i, j, 2);
+            res(i, j, 2) = a(i, j, 0)*dg2(i, j, 1) - a(i, j, 1)*dg2(i, j, 0) + dg1(i, j, 0)*b(i, j, 1) - dg1(i, j, 1)*b(i, j, 0);
+        }
+    }
+    return res;
+}
+
+template<class Array>
+Array Surface<Array>::d2normal_by_dcoeffdcoeff_vjp(Array& v) {
+    // The second derivative of the normal is
+    //   d2N/(dc_m dc_n) = dg1/dc_m x dg2/dc_n + dg1/dc_n x dg2/dc_m,
+    // so its contraction with v is K + K^T, where
+    //   K_mn = \sum_{i,j} dg1/dc_m . (dg2/dc_n x v).
+    // This avoids forming the (nphi, ntheta, 3, ndofs, ndofs) array.
+    auto& dg1_dc = this->dgammadash1_by_dcoeff();
+    auto& dg2_dc = this->dgammadash2_by_dcoeff();
+    int ndofs = num_dofs();
+    int npoints = numquadpoints_phi*numquadpoints_theta;
+    Eigen::Matrix<double,Eigen::Dynamic,Eigen::Dynamic,Eigen::RowMajor> C(3*npoints, ndofs);
+    for (int i = 0; i < numquadpoints_phi; ++i) {
+        for (int j = 0; j < numquadpoints_theta; ++j) {
+            int row = 3*(i*numquadpoints_theta + j);
+            double v0 = v(i, j, 0), v1 = v(i, j, 1), v2 = v(i, j, 2);
+            for (int m = 0; m < ndofs; ++m) {
+                double a0 = dg2_dc(i, j, 0, m), a1 = dg2_dc(i, j, 1, m), a2 = dg2_dc(i, j, 2, m);
+                C(row, m)   = a1*v2 - a2*v1;
+                C(row+1, m) = a2*v0 - a0*v2;
+                C(row+2, m) = a0*v1 - a1*v0;
+            }
+        }
+    }
+    Eigen::Map<Eigen::Matrix<double,Eigen::Dynamic,Eigen::Dynamic,Eigen::RowMajor>> D1(dg1_dc.data(), 3*npoints, ndofs);
+    Eigen::MatrixXd K = D1.transpose()*C;
+    Array res = xt::zeros<double>({ndofs, ndofs});
+    for (int m = 0; m < ndofs; ++m)
+        for (int n = 0; n < ndofs; ++n)
+            res(m, n) = K(m, n) + K(n, m);
+    return res;
+}
+
 template<class Array>
 void Surface<Array>::d2area_by_dcoeffdcoeff_impl(Array& data) {
-    data *= 0.;
-    double norm, dnorm_dcoeffn;
-    auto nor = this->normal();
-    auto dnor_dc = this->dnormal_by_dcoeff();
-    auto d2nor_dcdc = this->d2normal_by_dcoeffdcoeff();
+    // With w = N/|N|, the hessian of |N| is
+    //   dN/dc_m . (I - w w^T) dN/dc_n / |N| + w . d2N/(dc_m dc_n).
+    // Both terms are summed over the quadrature points as matrix products.
+    auto& nor = this->normal();
+    auto& dnor_dc = this->dnormal_by_dcoeff();
     int ndofs = num_dofs();
+    int npoints = numquadpoints_phi*numquadpoints_theta;
+    Array unitnormal = xt::zeros<double>({numquadpoints_phi, numquadpoints_theta, 3});
+    Eigen::Matrix<double,Eigen::Dynamic,Eigen::Dynamic,Eigen::RowMajor> PdN(3*npoints, ndofs);
     for (int i = 0; i < numquadpoints_phi; ++i) {
         for (int j = 0; j < numquadpoints_theta; ++j) {
+            int row = 3*(i*numquadpoints_theta + j);
+            double norm = sqrt(nor(i,j,0)*nor(i,j,0) + nor(i,j,1)*nor(i,j,1) + nor(i,j,2)*nor(i,j,2));
+            double w[3] = {nor(i,j,0)/norm, nor(i,j,1)/norm, nor(i,j,2)/norm};
+            for (int d = 0; d < 3; ++d)
+                unitnormal(i, j, d) = w[d];
             for (int m = 0; m < ndofs; ++m) {
-                for (int n = 0; n < ndofs; ++n) {
-                    norm = sqrt(nor(i,j,0)*nor(i,j,0)
-                            + nor(i,j,1)*nor(i,j,1) 
-                            + nor(i,j,2)*nor(i,j,2));
-                    dnorm_dcoeffn = (dnor_dc(i,j,0,n)*nor(i,j,0) 
-                            + dnor_dc(i,j,1,n)*nor(i,j,1) 
-                            + dnor_dc(i,j,2,n)*nor(i,j,2)) / norm;
-                    data(m,n) +=  dnor_dc(i,j,0,m) * (dnor_dc(i,j,0,n) * norm - dnorm_dcoeffn * nor(i,j,0)) / (norm*norm)
-                        + dnor_dc(i,j,1,m) * (dnor_dc(i,j,1,n) * norm - dnorm_dcoeffn * nor(i,j,1)) / (norm*norm)
-                        + dnor_dc(i,j,2,m) * (dnor_dc(i,j,2,n) * norm - dnorm_dcoeffn * nor(i,j,2)) / (norm*norm)
-                        + d2nor_dcdc(i,j,0,m,n) * nor(i,j,0) / norm
-                        + d2nor_dcdc(i,j,1,m,n) * nor(i,j,1) / norm
-                        + d2nor_dcdc(i,j,2,m,n) * nor(i,j,2) / norm;
-                }
+                double proj = dnor_dc(i,j,0,m)*w[0] + dnor_dc(i,j,1,m)*w[1] + dnor_dc(i,j,2,m)*w[2];
+                for (int d = 0; d < 3; ++d)
+                    PdN(row+d, m) = (dnor_dc(i,j,d,m) - proj*w[d])/norm;
             }
         }
     }
-    data *= 1./ (numquadpoints_phi*numquadpoints_theta);
+    Eigen::Map<Eigen::Matrix<double,Eigen::Dynamic,Eigen::Dynamic,Eigen::RowMajor>> dN(dnor_dc.data(), 3*npoints, ndofs);
+    Eigen::MatrixXd H = dN.transpose()*PdN;
+    Array d2 = d2normal_by_dcoeffdcoeff_vjp(unitnormal);
+    for (int m = 0; m < ndofs; ++m)
+        for (int n = 0; n < ndofs; ++n)
+            data(m, n) = (H(m, n) + d2(m, n))/npoints;
 }
 
 
@@ -379,28 +450,20 @@ void Surface<Array>::dvolume_by_dcoeff_impl(Array& data) {
 }
 template<class Array>
 void Surface<Array>::d2volume_by_dcoeffdcoeff_impl(Array& data) {
-    data *= 0.;
-    auto nor = this->normal();
-    auto dnor_dc = this->dnormal_by_dcoeff();
-    auto d2nor_dcdc = this->d2normal_by_dcoeffdcoeff();
-    auto xyz = this->gamma();
-    auto dxyz_dc = this->dgamma_by_dcoeff();
+    // (1/3) (dx/dc_m . dN/dc_n + dx/dc_n . dN/dc_m + x . d2N/(dc_m dc_n))
+    // summed over the quadrature points
+    auto& dnor_dc = this->dnormal_by_dcoeff();
+    auto& xyz = this->gamma();
+    auto& dxyz_dc = this->dgamma_by_dcoeff();
     int ndofs = num_dofs();
-    for (int i = 0; i < numquadpoints_phi; ++i) {
-        for (int j = 0; j < numquadpoints_theta; ++j) {
-            for (int m = 0; m < ndofs; ++m){ 
-                for (int n = 0; n < ndofs; ++n){ 
-                    data(m,n) += (1./3) * (dxyz_dc(i,j,0,m)*dnor_dc(i,j,0,n)
-                            +dxyz_dc(i,j,1,m)*dnor_dc(i,j,1,n)
-                            +dxyz_dc(i,j,2,m)*dnor_dc(i,j,2,n));
-                    data(m,n) += (1./3) * (xyz(i,j,0)*d2nor_dcdc(i,j,0,m,n) + dxyz_dc(i,j,0,n) * dnor_dc(i,j,0,m)
-                            +xyz(i,j,1)*d2nor_dcdc(i,j,1,m,n) + dxyz_dc(i,j,1,n) * dnor_dc(i,j,1,m)
-                            +xyz(i,j,2)*d2nor_dcdc(i,j,2,m,n) + dxyz_dc(i,j,2,n) * dnor_dc(i,j,2,m));
-                }
-            }
-        }
-    }
-    data *= 1./ (numquadpoints_phi*numquadpoints_theta);
+    int npoints = numquadpoints_phi*numquadpoints_theta;
+    Eigen::Map<Eigen::Matrix<double,Eigen::Dynamic,Eigen::Dynamic,Eigen::RowMajor>> dN(dnor_dc.data(), 3*npoints, ndofs);
+    Eigen::Map<Eigen::Matrix<double,Eigen::Dynamic,Eigen::Dynamic,Eigen::RowMajor>> dX(dxyz_dc.data(), 3*npoints, ndofs);
+    Eigen::MatrixXd H = dX.transpose()*dN;
+    Array d2 = d2normal_by_dcoeffdcoeff_vjp(xyz);
+    for (int m = 0; m < ndofs; ++m)
+        for (int n = 0; n < ndofs; ++n)
+            data(m, n) = (1./3) * (H(m, n) + H(n, m) + d2(m, n))/npoints;
 }
 
 #include "xtensor-python/pyarray.hpp"     // Numpy bindings
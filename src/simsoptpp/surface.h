@@ -17,6 +17,8 @@ using std::logic_error;
 
 template<class Array>
 Array surface_vjp_contraction(const Array& mat, const Array& v);
+template<class Array>
+Array surface_matvec_contraction(const Array& mat, const Array& v);
 
 template<class Array>
 class Surface {
@@ -137,10 +139,29 @@ class Surface {
             return surface_vjp_contraction<Array>(dgammadash2_by_dcoeff(), v);
         };
 
+        // The derivatives of gamma, gammadash1 and gammadash2 with respect to
+        // the dofs applied to the vector v of length num_dofs(). Since the
+        // representations are linear in the dofs, this is the same as
+        // evaluating the surface with dofs v. Children can override these
+        // and the vjp's above to avoid materializing the dcoeff arrays.
+        virtual Array dgamma_by_dcoeff_matvec(Array& v) {
+            return surface_matvec_contraction<Array>(dgamma_by_dcoeff(), v);
+        };
+
+        virtual Array dgammadash1_by_dcoeff_matvec(Array& v) {
+            return surface_matvec_contraction<Array>(dgammadash1_by_dcoeff(), v);
+        };
+
+        virtual Array dgammadash2_by_dcoeff_matvec(Array& v) {
+            return surface_matvec_contraction<Array>(dgammadash2_by_dcoeff(), v);
+        };
+
         void normal_impl(Array& data);
         void dnormal_by_dcoeff_impl(Array& data);
         void d2normal_by_dcoeffdcoeff_impl(Array& data);
         Array dnormal_by_dcoeff_vjp(Array& v);
+        Array dnormal_by_dcoeff_matvec(Array& v);
+        Array d2normal_by_dcoeffdcoeff_vjp(Array& v);
 
         void unitnormal_impl(Array& data);
 
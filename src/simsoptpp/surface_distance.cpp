@@ -0,0 +1,480 @@
+#include "surface_distance.h"
+#include <cmath>
+#include <limits>
+#include <algorithm>
+#include <fmt/core.h>
+
+#ifdef _OPENMP
+#include <omp.h>
+#endif
+
+using std::complex;
+
+template<class Array>
+SurfaceDistance<Array>::SurfaceDistance(Array& gamma, double tol) {
+    if(gamma.dimension() != 3 || gamma.shape(2) != 3)
+        throw std::logic_error("gamma needs to have shape (nphi, ntheta, 3).");
+    nphi = gamma.shape(0);
+    ntheta = gamma.shape(1);
+    if(nphi < 3 || ntheta < 3)
+        throw std::logic_error(fmt::format("Need at least 3 samples in each direction, but got {}x{}.", nphi, ntheta));
+    samples = Vec(nphi*ntheta*3, 0.);
+    for (int j = 0; j < nphi; ++j)
+        for (int l = 0; l < ntheta; ++l)
+            for (int d = 0; d < 3; ++d)
+                samples[3*(j*ntheta+l)+d] = gamma(j, l, d);
+    compute_coefficients(tol);
+    build_index();
+}
+
+template<class Array>
+void SurfaceDistance<Array>::compute_coefficients(double tol) {
+    // Nyquist modes are dropped, since their phase can't be recovered from
+    // the samples.
+    kmax = (nphi-1)/2;
+    mmax = (ntheta-1)/2;
+    int nm = 2*mmax+1;
+    int nmodes_max = (kmax+1)*nm;
+    vector<complex<double>> twiddle_phi(nphi), twiddle_theta(ntheta);
+    for (int j = 0; j < nphi; ++j)
+        twiddle_phi[j] = std::polar(1., -2*M_PI*j/nphi);
+    for (int l = 0; l < ntheta; ++l)
+        twiddle_theta[l] = std::polar(1., -2*M_PI*l/ntheta);
+
+    // transform in theta ...
+    vector<complex<double>> A(nphi*nm*3, 0.);
+    for (int j = 0; j < nphi; ++j) {
+        for (int mi = 0; mi < nm; ++mi) {
+            int m = mi - mmax;
+            for (int l = 0; l < ntheta; ++l) {
+                complex<double> e = twiddle_theta[((m*l) % ntheta + ntheta) % ntheta];
+                for (int d = 0; d < 3; ++d)
+                    A[3*(j*nm+mi)+d] += samples[3*(j*ntheta+l)+d] * e;
+            }
+        }
+    }
+    // ... and in phi, only for k >= 0 since the surface is real.
+    vector<complex<double>> C(nmodes_max*3, 0.);
+    double cmax = 0.;
+    for (int k = 0; k <= kmax; ++k) {
+        for (int mi = 0; mi < nm; ++mi) {
+            for (int j = 0; j < nphi; ++j) {
+                complex<double> e = twiddle_phi[(k*j) % nphi];
+                for (int d = 0; d < 3; ++d)
+                    C[3*(k*nm+mi)+d] += A[3*(j*nm+mi)+d] * e;
+            }
+            for (int d = 0; d < 3; ++d) {
+                C[3*(k*nm+mi)+d] /= double(nphi*ntheta);
+                cmax = std::max(cmax, std::abs(C[3*(k*nm+mi)+d]));
+            }
+        }
+    }
+
+    for (int k = 0; k <= kmax; ++k) {
+        for (int mi = 0; mi < nm; ++mi) {
+            int m = mi - mmax;
+            if(k == 0 && m < 0)
+                continue;
+            double c = 0.;
+            for (int d = 0; d < 3; ++d)
+                c = std::max(c, std::abs(C[3*(k*nm+mi)+d]));
+            if(c <= tol*cmax)
+                continue;
+            modes_k.push_back(k);
+            modes_m.push_back(m);
+            weights.push_back((k == 0 && m == 0) ? 1. : 2.);
+            coeffs.push_back({C[3*(k*nm+mi)+0], C[3*(k*nm+mi)+1], C[3*(k*nm+mi)+2]});
+        }
+    }
+    // only compute the powers of exp(2 pi i phi) and exp(2 pi i theta) that are needed
+    kmax = 0;
+    mmax = 0;
+    for (int i = 0; i < modes_k.size(); ++i) {
+        kmax = std::max(kmax, modes_k[i]);
+        mmax = std::max(mmax, std::abs(modes_m[i]));
+    }
+
+    // Determine the orientation from the sign of the enclosed volume,
+    // V = 1/3 \int gamma . (dgamma/dphi x dgamma/dtheta) dphi dtheta.
+    Workspace ws;
+    double g[3], gp[3], gt[3], gpp[3], gpt[3], gtt[3];
+    double vol = 0.;
+    for (int j = 0; j < nphi; ++j) {
+        for (int l = 0; l < ntheta; ++l) {
+            evaluate(ws, double(j)/nphi, double(l)/ntheta, g, gp, gt, gpp, gpt, gtt);
+            vol += g[0]*(gp[1]*gt[2]-gp[2]*gt[1]) + g[1]*(gp[2]*gt[0]-gp[0]*gt[2]) + g[2]*(gp[0]*gt[1]-gp[1]*gt[0]);
+        }
+    }
+    orientation = vol > 0 ? 1. : -1.;
+}
+
+template<class Array>
+void SurfaceDistance<Array>::evaluate(Workspace& ws, double phi, double theta, double* g, double* gphi, double* gtheta,
+        double* gphiphi, double* gphitheta, double* gthetatheta) const {
+    ws.ephi.resize(kmax+1);
+    ws.etheta.resize(mmax+1);
+    complex<double> e1 = std::polar(1., 2*M_PI*phi);
+    complex<double> e2 = std::polar(1., 2*M_PI*theta);
+    ws.ephi[0] = 1.;
+    for (int k = 1; k <= kmax; ++k)
+        ws.ephi[k] = ws.ephi[k-1] * e1;
+    ws.etheta[0] = 1.;
+    for (int m = 1; m <= mmax; ++m)
+        ws.etheta[m] = ws.etheta[m-1] * e2;
+
+    for (int d = 0; d < 3; ++d) {
+        g[d] = 0.; gphi[d] = 0.; gtheta[d] = 0.;
+        gphiphi[d] = 0.; gphitheta[d] = 0.; gthetatheta[d] = 0.;
+    }
+    int nmodes = modes_k.size();
+    for (int i = 0; i < nmodes; ++i) {
+        int k = modes_k[i];
+        int m = modes_m[i];
+        complex<double> e = ws.ephi[k] * (m >= 0 ? ws.etheta[m] : std::conj(ws.etheta[-m]));
+        double tk = 2*M_PI*k;
+        double tm = 2*M_PI*m;
+        for (int d = 0; d < 3; ++d) {
+            complex<double> z = coeffs[i][d] * e;
+            double re = weights[i] * z.real();
+            double im = weights[i] * z.imag();
+            g[d] += re;
+            gphi[d] -= tk * im;
+            gtheta[d] -= tm * im;
+            gphiphi[d] -= tk * tk * re;
+            gphitheta[d] -= tk * tm * re;
+            gthetatheta[d] -= tm * tm * re;
+        }
+    }
+}
+
+template<class Array>
+void SurfaceDistance<Array>::build_index() {
+    triangles.clear();
+    triangle_params.clear();
+    for (int j = 0; j < nphi; ++j) {
+        for (int l = 0; l < ntheta; ++l) {
+            int j1 = (j+1) % nphi;
+            int l1 = (l+1) % ntheta;
+            int a = j*ntheta+l, b = j1*ntheta+l, c = j1*ntheta+l1, d = j*ntheta+l1;
+            double p0 = double(j)/nphi, p1 = double(j+1)/nphi;
+            double t0 = double(l)/ntheta, t1 = double(l+1)/ntheta;
+            triangles.push_back({a, b, c});
+            triangle_params.push_back({p0, t0, p1, t0, p1, t1});
+            triangles.push_back({a, c, d});
+            triangle_params.push_back({p0, t0, p1, t1, p0, t1});
+        }
+    }
+    int ntriangles = triangles.size();
+    vector<double> centroids(3*ntriangles, 0.);
+    bvh_triangles = vector<int>(ntriangles, 0);
+    for (int t = 0; t < ntriangles; ++t) {
+        bvh_triangles[t] = t;
+        for (int v = 0; v < 3; ++v)
+            for (int k = 0; k < 3; ++k)
+                centroids[3*t+k] += samples[3*triangles[t][v]+k]/3.;
+    }
+    nodes.clear();
+    nodes.reserve(2*ntriangles);
+    build_node(centroids, 0, ntriangles);
+}
+
+template<class Array>
+int SurfaceDistance<Array>::build_node(vector<double>& centroids, int start, int end) {
+    int idx = nodes.size();
+    nodes.push_back(Node());
+    Node node;
+    double clo[3], chi[3];
+    for (int k = 0; k < 3; ++k) {
+        node.lo[k] = clo[k] = std::numeric_limits<double>::infinity();
+        node.hi[k] = chi[k] = -std::numeric_limits<double>::infinity();
+    }
+    for (int i = start; i < end; ++i) {
+        int t = bvh_triangles[i];
+        for (int k = 0; k < 3; ++k) {
+            for (int v = 0; v < 3; ++v) {
+                node.lo[k] = std::min(node.lo[k], samples[3*triangles[t][v]+k]);
+                node.hi[k] = std::max(node.hi[k], samples[3*triangles[t][v]+k]);
+            }
+            clo[k] = std::min(clo[k], centroids[3*t+k]);
+            chi[k] = std::max(chi[k], centroids[3*t+k]);
+        }
+    }
+    if(end - start <= 4) {
+        node.start = start;
+        node.count = end - start;
+    } else {
+        // split at the median along the axis with the largest spread of the centroids
+        int axis = 0;
+        for (int k = 1; k < 3; ++k)
+            if(chi[k] - clo[k] > chi[axis] - clo[axis])
+                axis = k;
+        int mid = (start + end)/2;
+        std::nth_element(bvh_triangles.begin() + start, bvh_triangles.begin() + mid, bvh_triangles.begin() + end,
+                [&centroids, axis](int t0, int t1) { return centroids[3*t0+axis] < centroids[3*t1+axis]; });
+        node.left = build_node(centroids, start, mid);
+        node.right = build_node(centroids, mid, end);
+    }
+    nodes[idx] = node;
+    return idx;
+}
+
+// Closest point to p on the triangle (a, b, c), returned in barycentric
+// coordinates a + v (b-a) + w (c-a), see Ericson, Real-Time Collision
+// Detection, Section 5.1.5.
+static double closest_point_on_triangle(const double* p, const double* a, const double* b, const double* c, double& v, double& w) {
+    double ab[3], ac[3], ap[3];
+    for (int k = 0; k < 3; ++k) {
+        ab[k] = b[k] - a[k];
+        ac[k] = c[k] - a[k];
+        ap[k] = p[k] - a[k];
+    }
+    auto dot = [](const double* x, const double* y) { return x[0]*y[0] + x[1]*y[1] + x[2]*y[2]; };
+    double d1 = dot(ab, ap), d2 = dot(ac, ap);
+    if(d1 <= 0 && d2 <= 0) {
+        v = 0.; w = 0.;
+    } else {
+        double bp[3], cp[3];
+        for (int k = 0; k < 3; ++k) {
+            bp[k] = p[k] - b[k];
+            cp[k] = p[k] - c[k];
+        }
+        double d3 = dot(ab, bp), d4 = dot(ac, bp);
+        double d5 = dot(ab, cp), d6 = dot(ac, cp);
+        double vc = d1*d4 - d3*d2;
+        double vb = d5*d2 - d1*d6;
+        double va = d3*d6 - d5*d4;
+        if(d3 >= 0 && d4 <= d3) {
+            v = 1.; w = 0.;
+        } else if(vc <= 0 && d1 >= 0 && d3 <= 0) {
+            v = d1/(d1-d3); w = 0.;
+        } else if(d6 >= 0 && d5 <= d6) {
+            v = 0.; w = 1.;
+        } else if(vb <= 0 && d2 >= 0 && d6 <= 0) {
+            v = 0.; w = d2/(d2-d6);
+        } else if(va <= 0 && (d4-d3) >= 0 && (d5-d6) >= 0) {
+            w = (d4-d3)/((d4-d3)+(d5-d6)); v = 1.-w;
+        } else {
+            double denom = 1./(va+vb+vc);
+            v = vb*denom; w = vc*denom;
+        }
+    }
+    double dist2 = 0.;
+    for (int k = 0; k < 3; ++k)
+        dist2 += std::pow(ap[k] - v*ab[k] - w*ac[k], 2);
+    return dist2;
+}
+
+template<class Array>
+double SurfaceDistance<Array>::closest_triangle_point(double x, double y, double z, double& phi, double& theta) const {
+    double p[3] = {x, y, z};
+    auto box_distance = [&p](const Node& node) {
+        double res = 0.;
+        for (int k = 0; k < 3; ++k) {
+            double d = std::max(0., std::max(node.lo[k] - p[k], p[k] - node.hi[k]));
+            res += d*d;
+        }
+        return res;
+    };
+
+    double best = std::numeric_limits<double>::infinity();
+    int best_triangle = -1;
+    double best_v = 0., best_w = 0.;
+    // Depth first search that visits the closer child first and skips all
+    // nodes whose bounding box is further away than the closest triangle
+    // found so far. The tree is balanced, so the stack stays small.
+    vector<std::pair<int, double>> stack;
+    stack.reserve(64);
+    stack.push_back({0, box_distance(nodes[0])});
+    while(!stack.empty()) {
+        auto top = stack.back();
+        stack.pop_back();
+        if(top.second >= best)
+            continue;
+        const Node& node = nodes[top.first];
+        if(node.left < 0) {
+            for (int i = node.start; i < node.start + node.count; ++i) {
+                int t = bvh_triangles[i];
+                double v, w;
+                double dist2 = closest_point_on_triangle(p, &samples[3*triangles[t][0]], &samples[3*triangles[t][1]], &samples[3*triangles[t][2]], v, w);
+                if(dist2 < best) {
+                    best = dist2;
+                    best_triangle = t;
+                    best_v = v;
+                    best_w = w;
+                }
+            }
+        } else {
+            double dl = box_distance(nodes[node.left]);
+            double dr = box_distance(nodes[node.right]);
+            if(dl <= dr) {
+                stack.push_back({node.right, dr});
+                stack.push_back({node.left, dl});
+            } else {
+                stack.push_back({node.left, dl});
+                stack.push_back({node.right, dr});
+            }
+        }
+    }
+    auto& params = triangle_params[best_triangle];
+    phi = (1-best_v-best_w)*params[0] + best_v*params[2] + best_w*params[4];
+    theta = (1-best_v-best_w)*params[1] + best_v*params[3] + best_w*params[5];
+    return best;
+}
+
+template<class Array>
+double SurfaceDistance<Array>::distance_and_projection(Workspace& ws, double x, double y, double z, double& phi, double& theta) const {
+    closest_triangle_point(x, y, z, phi, theta);
+    double p[3] = {x, y, z};
+    // current and trial values of gamma and its first and second derivatives
+    std::array<double, 18> cur, trial;
+    auto eval = [&](std::array<double, 18>& res, double ph, double th) {
+        evaluate(ws, ph, th, &res[0], &res[3], &res[6], &res[9], &res[12], &res[15]);
+        double f = 0.;
+        for (int d = 0; d < 3; ++d)
+            f += 0.5*std::pow(res[d]-p[d], 2);
+        return f;
+    };
+    double f = eval(cur, phi, theta);
+    // Newton's method for min_{phi, theta} |gamma(phi, theta) - p|^2 / 2,
+    // falling back to Gauss-Newton where the Hessian is not positive
+    // definite, with a backtracking line search.
+    for (int it = 0; it < maxiter; ++it) {
+        double grad0 = 0., grad1 = 0., a = 0., b = 0., c = 0., H00, H01, H11;
+        double rpp = 0., rpt = 0., rtt = 0.;
+        for (int d = 0; d < 3; ++d) {
+            double r = cur[d] - p[d];
+            grad0 += cur[3+d]*r;
+            grad1 += cur[6+d]*r;
+            a += cur[3+d]*cur[3+d];
+            b += cur[3+d]*cur[6+d];
+            c += cur[6+d]*cur[6+d];
+            rpp += cur[9+d]*r;
+            rpt += cur[12+d]*r;
+            rtt += cur[15+d]*r;
+        }
+        H00 = a + rpp; H01 = b + rpt; H11 = c + rtt;
+        double det = H00*H11 - H01*H01;
+        if(!(H00 > 0 && det > 0)) {
+            H00 = a; H01 = b; H11 = c;
+            det = H00*H11 - H01*H01;
+        }
+        if(!(det > 0))
+            break;
+        double s0 = -(H11*grad0 - H01*grad1)/det;
+        double s1 = -(H00*grad1 - H01*grad0)/det;
+        double step = std::max(std::abs(s0), std::abs(s1));
+        if(step < 1e-13)
+            break;
+        double slope = grad0*s0 + grad1*s1;
+        double alpha = 1.;
+        double fnew = eval(trial, phi + s0, theta + s1);
+        // Close to the minimum the decrease of f is below its rounding
+        // error, so once Newton's method converges quadratically we take the
+        // full step.
+        if(step >= 1e-8) {
+            for (int ls = 0; ls < 30 && fnew > f + 1e-4*alpha*slope; ++ls) {
+                alpha *= 0.5;
+                fnew = eval(trial, phi + alpha*s0, theta + alpha*s1);
+            }
+            if(fnew > f + 1e-4*alpha*slope)
+                break;
+        }
+        phi += alpha*s0;
+        theta += alpha*s1;
+        std::swap(cur, trial);
+        f = fnew;
+    }
+    // The sign follows from the side of the tangent plane at the closest
+    // point on which p lies.
+    double n[3] = {
+        cur[4]*cur[8] - cur[5]*cur[7],
+        cur[5]*cur[6] - cur[3]*cur[8],
+        cur[3]*cur[7] - cur[4]*cur[6]
+    };
+    double side = 0.;
+    for (int d = 0; d < 3; ++d)
+        side += (cur[d]-p[d]) * n[d];
+    double dist = std::sqrt(2*f);
+    return orientation*side >= 0 ? dist : -dist;
+}
+
+template<class Array>
+double SurfaceDistance<Array>::signed_distance_point(double x, double y, double z, double& phi, double& theta) const {
+    Workspace ws;
+    double res = distance_and_projection(ws, x, y, z, phi, theta);
+    phi -= std::floor(phi);
+    theta -= std::floor(theta);
+    return res;
+}
+
+template<class Array>
+Array SurfaceDistance<Array>::signed_distance(Array& xyz) const {
+    if(xyz.dimension() != 2 || xyz.shape(1) != 3)
+        throw std::logic_error("xyz needs to have shape (n, 3).");
+    int n = xyz.shape(0);
+    Array res = xt::zeros<double>({n});
+    double* res_ptr = res.data();
+    Vec pts(3*n);
+    for (int i = 0; i < n; ++i)
+        for (int d = 0; d < 3; ++d)
+            pts[3*i+d] = xyz(i, d);
+#pragma omp parallel
+    {
+        Workspace ws;
+#pragma omp for schedule(dynamic, 64)
+        for (int i = 0; i < n; ++i) {
+            double phi, theta;
+            res_ptr[i] = distance_and_projection(ws, pts[3*i+0], pts[3*i+1], pts[3*i+2], phi, theta);
+        }
+    }
+    return res;
+}
+
+template<class Array>
+Vec SurfaceDistance<Array>::signed_distance_cyl(const Vec& rs, const Vec& phis, const Vec& zs) const {
+    int n = rs.size();
+    if(phis.size() != n || zs.size() != n)
+        throw std::logic_error("rs, phis and zs need to have the same length.");
+    Vec res(n, 0.);
+#pragma omp parallel
+    {
+        Workspace ws;
+#pragma omp for schedule(dynamic, 64)
+        for (int i = 0; i < n; ++i) {
+            double phi, theta;
+            res[i] = distance_and_projection(ws, rs[i]*std::cos(phis[i]), rs[i]*std::sin(phis[i]), zs[i], phi, theta);
+        }
+    }
+    return res;
+}
+
+template<class Array>
+Array SurfaceDistance<Array>::closest_point(Array& xyz) const {
+    if(xyz.dimension() != 2 || xyz.shape(1) != 3)
+        throw std::logic_error("xyz needs to have shape (n, 3).");
+    int n = xyz.shape(0);
+    Array res = xt::zeros<double>({n, 2});
+    for (int i = 0; i < n; ++i)
+        signed_distance_point(xyz(i, 0), xyz(i, 1), xyz(i, 2), res(i, 0), res(i, 1));
+    return res;
+}
+
+template<class Array>
+Array SurfaceDistance<Array>::gamma_lin(Array& phis, Array& thetas) const {
+    int n = phis.size();
+    if(thetas.size() != n)
+        throw std::logic_error("phis and thetas need to have the same length.");
+    Array res = xt::zeros<double>({n, 3});
+    Workspace ws;
+    double g[3], gp[3], gt[3], gpp[3], gpt[3], gtt[3];
+    for (int i = 0; i < n; ++i) {
+        evaluate(ws, phis[i], thetas[i], g, gp, gt, gpp, gpt, gtt);
+        for (int d = 0; d < 3; ++d)
+            res(i, d) = g[d];
+    }
+    return res;
+}
+
+#include "xtensor-python/pyarray.hpp"     // Numpy bindings
+typedef xt::pyarray<double> Array;
+template class SurfaceDistance<Array>;
@@ -0,0 +1,94 @@
+#pragma once
+
+#include <vector>
+#include <complex>
+#include <array>
+#include <tuple>
+#include <stdexcept>
+#include "xtensor/xarray.hpp"
+
+using std::vector;
+using Vec = std::vector<double>;
+
+/*
+ * Exact signed distance to a closed toroidal surface.
+ *
+ * The surface is given by its values gamma(phi, theta) on a uniform grid
+ * phi_j = j/nphi, theta_l = l/ntheta that covers the whole torus. From these
+ * samples we compute the Fourier coefficients of the surface, which
+ * represent it exactly as long as it is a trigonometric polynomial of degree
+ * less than nphi/2 in phi and less than ntheta/2 in theta (this is the case
+ * for all Fourier based surfaces if the grid is fine enough).
+ *
+ * The distance of a point x to the surface is computed in two steps:
+ *  1. The grid is split into triangles, which are stored in a bounding volume
+ *     hierarchy. A branch and bound search of the hierarchy gives the closest
+ *     triangle and the closest point on it.
+ *  2. Starting from the parameters (phi, theta) of that point, Newton's
+ *     method minimizes |gamma(phi, theta) - x|^2 on the parametric surface.
+ * The distance is positive for points inside the surface and negative for
+ * points outside of it.
+ *
+ * All methods are const, so one object can be shared across threads.
+ */
+template<class Array>
+class SurfaceDistance {
+    private:
+        int nphi, ntheta;
+        // Fourier coefficients gamma(phi, theta) = \sum_i weight_i Re(coeffs_i exp(2 pi i (k_i phi + m_i theta)))
+        int kmax, mmax;
+        vector<int> modes_k, modes_m;
+        Vec weights;
+        vector<std::array<std::complex<double>, 3>> coeffs;
+        // +1 if dgamma/dphi x dgamma/dtheta points outwards, -1 otherwise
+        double orientation;
+
+        // samples and triangles
+        Vec samples;
+        vector<std::array<int, 3>> triangles;
+        // parameters (phi, theta) of the vertices of each triangle, not wrapped into [0, 1)
+        vector<std::array<double, 6>> triangle_params;
+
+        // bounding volume hierarchy over the triangles
+        struct Node {
+            double lo[3], hi[3];
+            int left = -1, right = -1;  // children, -1 for leaves
+            int start = 0, count = 0;   // range in bvh_triangles for leaves
+        };
+        vector<Node> nodes;
+        vector<int> bvh_triangles;
+
+        struct Workspace {
+            vector<std::complex<double>> ephi, etheta;
+        };
+
+        void compute_coefficients(double tol);
+        void build_index();
+        int build_node(vector<double>& centroids, int start, int end);
+        void evaluate(Workspace& ws, double phi, double theta, double* g, double* gphi, double* gtheta,
+                double* gphiphi, double* gphitheta, double* gthetatheta) const;
+        // Closest point on the triangulation, returns the squared distance
+        // and the parameters of the closest point.
+        double closest_triangle_point(double x, double y, double z, double& phi, double& theta) const;
+        double distance_and_projection(Workspace& ws, double x, double y, double z, double& phi, double& theta) const;
+
+    public:
+        int maxiter = 30;
+
+        SurfaceDistance(Array& gamma, double tol=1e-13);
+
+        int num_modes() const { return modes_k.size(); }
+
+        // Signed distance of the point (x, y, z) to the surface. On return,
+        // (phi, theta) are the parameters of the closest point on the surface.
+        double signed_distance_point(double x, double y, double z, double& phi, double& theta) const;
+
+        // Signed distance of the points xyz (shape (n, 3)) to the surface.
+        Array signed_distance(Array& xyz) const;
+        // Signed distance of the points given in cylindrical coordinates.
+        Vec signed_distance_cyl(const Vec& rs, const Vec& phis, const Vec& zs) const;
+        // Parameters (phi, theta) of the closest point on the surface for the points xyz, shape (n, 2).
+        Array closest_point(Array& xyz) const;
+        // Value of the parametric surface at the parameters (phi, theta).
+        Array gamma_lin(Array& phis, Array& thetas) const;
+};
@@ -2,52 +2,129 @@
 
 template<class Array>
 void SurfaceRZFourier<Array>::gamma_impl(Array& data, Array& quadpoints_phi, Array& quadpoints_theta) {
-    int numquadpoints_phi = quadpoints_phi.size();
-    int numquadpoints_theta = quadpoints_theta.size();
+    // the cached tables can only be used when evaluating on the quadrature points of the surface
+    bool own_quadpoints = &quadpoints_phi == &this->quadpoints_phi && &quadpoints_theta == &this->quadpoints_theta;
+    FourierTables other_tables;
+    if(!own_quadpoints)
+        other_tables = FourierTables(quadpoints_phi, quadpoints_theta, mpol, ntor, nfp);
+    const FourierTables& tab = own_quadpoints ? fourier_tables() : other_tables;
+    evaluate(tab, rc, rs, zc, zs, data, 0);
+}
 
+template<class Array>
+void SurfaceRZFourier<Array>::evaluate(const FourierTables& tab, const Array& _rc, const Array& _rs, const Array& _zc, const Array& _zs, Array& data, int deriv) {
+    vector<double> rP(mpol+1), rQ(mpol+1), rdP(mpol+1), rdQ(mpol+1), zP(mpol+1), zQ(mpol+1), zdP(mpol+1), zdQ(mpol+1);
+    for (int k1 = 0; k1 < tab.nphi; ++k1) {
+        double cosphi = tab.cos_phi1[k1];
+        double sinphi = tab.sin_phi1[k1];
+        tab.partial_sums(k1, &_rc, stellsym ? nullptr : &_rs, rP.data(), rQ.data(), rdP.data(), rdQ.data());
+        tab.partial_sums(k1, stellsym ? nullptr : &_zc, &_zs, zP.data(), zQ.data(), zdP.data(), zdQ.data());
+        for (int k2 = 0; k2 < tab.ntheta; ++k2) {
+            if(deriv == 0) {
+                double r = tab.sum(k2, rP.data(), rQ.data());
+                double z = tab.sum(k2, zP.data(), zQ.data());
+                data(k1, k2, 0) = r * cosphi;
+                data(k1, k2, 1) = r * sinphi;
+                data(k1, k2, 2) = z;
+            } else if(deriv == 1) {
+                double r  = tab.sum(k2, rP.data(), rQ.data());
+                double rd = tab.sum(k2, rdP.data(), rdQ.data());
+                double zd = tab.sum(k2, zdP.data(), zdQ.data());
+                data(k1, k2, 0) = 2*M_PI*(rd * cosphi - r * sinphi);
+                data(k1, k2, 1) = 2*M_PI*(rd * sinphi + r * cosphi);
+                data(k1, k2, 2) = 2*M_PI*zd;
+            } else {
+                double rd = tab.sum_dtheta(k2, rP.data(), rQ.data());
+                double zd = tab.sum_dtheta(k2, zP.data(), zQ.data());
+                data(k1, k2, 0) = 2*M_PI*rd*cosphi;
+                data(k1, k2, 1) = 2*M_PI*rd*sinphi;
+                data(k1, k2, 2) = 2*M_PI*zd;
+            }
+        }
+    }
+}
+
+template<class Array>
+Array SurfaceRZFourier<Array>::evaluate_matvec(Array& v, int deriv) {
+    if(v.size() != num_dofs())
+        throw std::logic_error("v needs to have one entry per dof");
+    vector<double> dofs(v.size());
+    for (int i = 0; i < v.size(); ++i)
+        dofs[i] = v[i];
+    Array _rc = xt::zeros<double>({mpol+1, 2*ntor+1});
+    Array _rs = xt::zeros<double>({mpol+1, 2*ntor+1});
+    Array _zc = xt::zeros<double>({mpol+1, 2*ntor+1});
+    Array _zs = xt::zeros<double>({mpol+1, 2*ntor+1});
+    dofs_to_coefficients(dofs, _rc, _rs, _zc, _zs);
+    Array res = xt::zeros<double>({numquadpoints_phi, numquadpoints_theta, 3});
+    evaluate(fourier_tables(), _rc, _rs, _zc, _zs, res, deriv);
+    return res;
+}
+
+template<class Array>
+Array SurfaceRZFourier<Array>::evaluate_vjp(Array& v, int deriv) {
+    const FourierTables& tab = fourier_tables();
+    Array grc = xt::zeros<double>({mpol+1, 2*ntor+1});
+    Array grs = xt::zeros<double>({mpol+1, 2*ntor+1});
+    Array gzc = xt::zeros<double>({mpol+1, 2*ntor+1});
+    Array gzs = xt::zeros<double>({mpol+1, 2*ntor+1});
+    vector<double> rP(mpol+1), rQ(mpol+1), rdP(mpol+1), rdQ(mpol+1), zP(mpol+1), zQ(mpol+1), zdP(mpol+1), zdQ(mpol+1);
     for (int k1 = 0; k1 < numquadpoints_phi; ++k1) {
-        double phi  = 2*M_PI*quadpoints_phi[k1];
+        double cosphi = tab.cos_phi1[k1];
+        double sinphi = tab.sin_phi1[k1];
+        for (auto* P : {&rP, &rQ, &rdP, &rdQ, &zP, &zQ, &zdP, &zdQ})
+            std::fill(P->begin(), P->end(), 0.);
         for (int k2 = 0; k2 < numquadpoints_theta; ++k2) {
-            double theta  = 2*M_PI*quadpoints_theta[k2];
-            double r = 0;
-            double z = 0;
-            for (int m = 0; m <= mpol; ++m) {
-                for (int i = 0; i < 2*ntor+1; ++i) {
-                    int n  = i - ntor;
-                    r += rc(m, i) * cos(m*theta-n*nfp*phi);
-                    if(!stellsym) {
-                        r += rs(m, i) * sin(m*theta-n*nfp*phi);
-                        z += zc(m, i) * cos(m*theta-n*nfp*phi);
-                    }
-                    z += zs(m, i) * sin(m*theta-n*nfp*phi);
-                }
+            // v projected onto the directions in which r and z enter gamma
+            double vr = v(k1, k2, 0) * cosphi + v(k1, k2, 1) * sinphi;
+            double vz = v(k1, k2, 2);
+            if(deriv == 0) {
+                tab.sum_transpose(k2, vr, 0., rP.data(), rQ.data());
+                tab.sum_transpose(k2, vz, 0., zP.data(), zQ.data());
+            } else if(deriv == 1) {
+                double vphi = -v(k1, k2, 0) * sinphi + v(k1, k2, 1) * cosphi;
+                tab.sum_transpose(k2, 2*M_PI*vphi, 0., rP.data(), rQ.data());
+                tab.sum_transpose(k2, 2*M_PI*vr, 0., rdP.data(), rdQ.data());
+                tab.sum_transpose(k2, 2*M_PI*vz, 0., zdP.data(), zdQ.data());
+            } else {
+                tab.sum_transpose(k2, 0., 2*M_PI*vr, rP.data(), rQ.data());
+                tab.sum_transpose(k2, 0., 2*M_PI*vz, zP.data(), zQ.data());
             }
-            data(k1, k2, 0) = r * cos(phi);
-            data(k1, k2, 1) = r * sin(phi);
-            data(k1, k2, 2) = z;
         }
+        tab.partial_sums_transpose(k1, rP.data(), rQ.data(), rdP.data(), rdQ.data(), &grc, stellsym ? nullptr : &grs);
+        tab.partial_sums_transpose(k1, zP.data(), zQ.data(), zdP.data(), zdQ.data(), stellsym ? nullptr : &gzc, &gzs);
     }
+    vector<double> grad = coefficients_to_dofs(grc, grs, gzc, gzs);
+    Array res = xt::zeros<double>({(int)grad.size()});
+    for (int i = 0; i < grad.size(); ++i)
+        res[i] = grad[i];
+    return res;
 }
 
 
 template<class Array>
 void SurfaceRZFourier<Array>::gamma_lin(Array& data, Array& quadpoints_phi, Array& quadpoints_theta) {
     int numquadpoints = quadpoints_phi.size();
-
+    vector<double> cosm(mpol+1), sinm(mpol+1), cosn(ntor+1), sinn(ntor+1);
     for (int k1 = 0; k1 < numquadpoints; ++k1) {
         double phi  = 2*M_PI*quadpoints_phi[k1];
         double theta  = 2*M_PI*quadpoints_theta[k1];
+        FourierTables::fill(theta, mpol, cosm.data(), sinm.data());
+        FourierTables::fill(nfp*phi, ntor, cosn.data(), sinn.data());
         double r = 0;
         double z = 0;
         for (int m = 0; m <= mpol; ++m) {
             for (int i = 0; i < 2*ntor+1; ++i) {
                 int n  = i - ntor;
-                r += rc(m, i) * cos(m*theta-n*nfp*phi);
+                double sn = n < 0 ? -sinn[-n] : sinn[n];
+                double c = cosm[m]*cosn[std::abs(n)] + sinm[m]*sn;
+                double s = sinm[m]*cosn[std::abs(n)] - cosm[m]*sn;
+                r += rc(m, i) * c;
                 if(!stellsym) {
-                    r += rs(m, i) * sin(m*theta-n*nfp*phi);
-                    z += zc(m, i) * cos(m*theta-n*nfp*phi);
+                    r += rs(m, i) * s;
+                    z += zc(m, i) * c;
                 }
-                z += zs(m, i) * sin(m*theta-n*nfp*phi);
+                z += zs(m, i) * s;
             }
         }
         data(k1, 0) = r * cos(phi);
@@ -62,70 +139,29 @@ void SurfaceRZFourier<Array>::gamma_lin(Array& data, Array& quadpoints_phi, Arra
 
 template<class Array>
 void SurfaceRZFourier<Array>::gammadash1_impl(Array& data) {
-    for (int k1 = 0; k1 < numquadpoints_phi; ++k1) {
-        double phi  = 2*M_PI*quadpoints_phi[k1];
-        for (int k2 = 0; k2 < numquadpoints_theta; ++k2) {
-            double theta  = 2*M_PI*quadpoints_theta[k2];
-            double r = 0;
-            double rd = 0;
-            double zd = 0;
-            for (int i = 0; i < 2*ntor+1; ++i) {
-                int n  = i - ntor;
-                for (int m = 0; m <= mpol; ++m) {
-                    r  += rc(m, i) * cos(m*theta-n*nfp*phi);
-                    rd += rc(m, i) * (n*nfp) * sin(m*theta-n*nfp*phi);
-                    if(!stellsym) {
-                        r  += rs(m, i) * sin(m*theta-n*nfp*phi);
-                        rd += rs(m, i) * (-n*nfp)*cos(m*theta-n*nfp*phi);
-                        zd += zc(m, i) * (n*nfp)*sin(m*theta-n*nfp*phi);
-                    }
-                    zd += zs(m, i) * (-n*nfp)*cos(m*theta-n*nfp*phi);
-                }
-            }
-            data(k1, k2, 0) = 2*M_PI*(rd * cos(phi) - r * sin(phi));
-            data(k1, k2, 1) = 2*M_PI*(rd * sin(phi) + r * cos(phi));
-            data(k1, k2, 2) = 2*M_PI*zd;
-        }
-    }
+    evaluate(fourier_tables(), rc, rs, zc, zs, data, 1);
 }
+
 template<class Array>
 void SurfaceRZFourier<Array>::gammadash2_impl(Array& data) {
-    for (int k1 = 0; k1 < numquadpoints_phi; ++k1) {
-        double phi  = 2*M_PI*quadpoints_phi[k1];
-        for (int k2 = 0; k2 < numquadpoints_theta; ++k2) {
-            double theta  = 2*M_PI*quadpoints_theta[k2];
-            double rd = 0;
-            double zd = 0;
-            for (int i = 0; i < 2*ntor+1; ++i) {
-                int n  = i - ntor;
-                for (int m = 0; m <= mpol; ++m) {
-                    rd += rc(m, i) * (-m) * sin(m*theta-n*nfp*phi);
-                    if(!stellsym) {
-                        rd += rs(m, i) * m * cos(m*theta-n*nfp*phi);
-                        zd += zc(m, i) * (-m) * sin(m*theta-n*nfp*phi);
-                    }
-                    zd += zs(m, i) * m * cos(m*theta-n*nfp*phi);
-                }
-            }
-            data(k1, k2, 0) = 2*M_PI*rd*cos(phi);
-            data(k1, k2, 1) = 2*M_PI*rd*sin(phi);
-            data(k1, k2, 2) = 2*M_PI*zd;
-        }
-    }
+    evaluate(fourier_tables(), rc, rs, zc, zs, data, 2);
 }
 
 template<class Array>
 void SurfaceRZFourier<Array>::dgamma_by_dcoeff_impl(Array& data) {
+    const FourierTables& tab = fourier_tables();
+    double c, s;
     for (int k1 = 0; k1 < numquadpoints_phi; ++k1) {
-        double phi  = 2*M_PI*quadpoints_phi[k1];
+        double cosphi = tab.cos_phi1[k1];
+        double sinphi = tab.sin_phi1[k1];
         for (int k2 = 0; k2 < numquadpoints_theta; ++k2) {
-            double theta  = 2*M_PI*quadpoints_theta[k2];
             int counter = 0;
             for (int m = 0; m <= mpol; ++m) {
                 for (int n = -ntor; n <= ntor; ++n) {
                     if(m==0 && n<0) continue;
-                    data(k1, k2, 0, counter) = cos(m*theta-n*nfp*phi) * cos(phi);
-                    data(k1, k2, 1, counter) = cos(m*theta-n*nfp*phi) * sin(phi);
+                    tab.angle(k1, k2, m, n, c, s);
+                    data(k1, k2, 0, counter) = c * cosphi;
+                    data(k1, k2, 1, counter) = c * sinphi;
                     data(k1, k2, 2, counter) = 0;
                     counter++;
                 }
@@ -134,8 +170,9 @@ void SurfaceRZFourier<Array>::dgamma_by_dcoeff_impl(Array& data) {
                 for (int m = 0; m <= mpol; ++m) {
                     for (int n = -ntor; n <= ntor; ++n) {
                         if(m==0 && n<=0) continue;
-                        data(k1, k2, 0, counter) = sin(m*theta-n*nfp*phi) * cos(phi);
-                        data(k1, k2, 1, counter) = sin(m*theta-n*nfp*phi) * sin(phi);
+                        tab.angle(k1, k2, m, n, c, s);
+                        data(k1, k2, 0, counter) = s * cosphi;
+                        data(k1, k2, 1, counter) = s * sinphi;
                         data(k1, k2, 2, counter) = 0;
                         counter++;
                     }
@@ -143,9 +180,10 @@ void SurfaceRZFourier<Array>::dgamma_by_dcoeff_impl(Array& data) {
                 for (int m = 0; m <= mpol; ++m) {
                     for (int n = -ntor; n <= ntor; ++n) {
                         if(m==0 && n<0) continue;
+                        tab.angle(k1, k2, m, n, c, s);
                         data(k1, k2, 0, counter) = 0;
                         data(k1, k2, 1, counter) = 0;
-                        data(k1, k2, 2, counter) = cos(m*theta-n*nfp*phi);
+                        data(k1, k2, 2, counter) = c;
                         counter++;
                     }
                 }
@@ -153,9 +191,10 @@ void SurfaceRZFourier<Array>::dgamma_by_dcoeff_impl(Array& data) {
             for (int m = 0; m <= mpol; ++m) {
                 for (int n = -ntor; n <= ntor; ++n) {
                     if(m==0 && n<=0) continue;
+                    tab.angle(k1, k2, m, n, c, s);
                     data(k1, k2, 0, counter) = 0;
                     data(k1, k2, 1, counter) = 0;
-                    data(k1, k2, 2, counter) = sin(m*theta-n*nfp*phi);
+                    data(k1, k2, 2, counter) = s;
                     counter++;
                 }
             }
@@ -165,16 +204,19 @@ void SurfaceRZFourier<Array>::dgamma_by_dcoeff_impl(Array& data) {
 
 template<class Array>
 void SurfaceRZFourier<Array>::dgammadash1_by_dcoeff_impl(Array& data) {
+    const FourierTables& tab = fourier_tables();
+    double c, s;
     for (int k1 = 0; k1 < numquadpoints_phi; ++k1) {
-        double phi  = 2*M_PI*quadpoints_phi[k1];
+        double cosphi = tab.cos_phi1[k1];
+        double sinphi = tab.sin_phi1[k1];
         for (int k2 = 0; k2 < numquadpoints_theta; ++k2) {
-            double theta  = 2*M_PI*quadpoints_theta[k2];
             int counter = 0;
             for (int m = 0; m <= mpol; ++m) {
                 for (int n = -ntor; n <= ntor; ++n) {
                     if(m==0 && n<0) continue;
-                    data(k1, k2, 0, counter) = 2*M_PI*((n*nfp) * sin(m*theta-n*nfp*phi) * cos(phi) - cos(m*theta-n*nfp*phi) * sin(phi));
-                    data(k1, k2, 1, counter) = 2*M_PI*((n*nfp) * sin(m*theta-n*nfp*phi) * sin(phi) + cos(m*theta-n*nfp*phi) * cos(phi));
+                    tab.angle(k1, k2, m, n, c, s);
+                    data(k1, k2, 0, counter) = 2*M_PI*((n*nfp) * s * cosphi - c * sinphi);
+                    data(k1, k2, 1, counter) = 2*M_PI*((n*nfp) * s * sinphi + c * cosphi);
                     data(k1, k2, 2, counter) = 0;
                     counter++;
                 }
@@ -183,8 +225,9 @@ void SurfaceRZFourier<Array>::dgammadash1_by_dcoeff_impl(Array& data) {
                 for (int m = 0; m <= mpol; ++m) {
                     for (int n = -ntor; n <= ntor; ++n) {
                         if(m==0 && n<=0) continue;
-                        data(k1, k2, 0, counter) = 2*M_PI*((-n*nfp)*cos(m*theta-n*nfp*phi) * cos(phi) - sin(m*theta-n*nfp*phi) * sin(phi));
-                        data(k1, k2, 1, counter) = 2*M_PI*((-n*nfp)*cos(m*theta-n*nfp*phi) * sin(phi) + sin(m*theta-n*nfp*phi) * cos(phi));
+                        tab.angle(k1, k2, m, n, c, s);
+                        data(k1, k2, 0, counter) = 2*M_PI*((-n*nfp)*c * cosphi - s * sinphi);
+                        data(k1, k2, 1, counter) = 2*M_PI*((-n*nfp)*c * sinphi + s * cosphi);
                         data(k1, k2, 2, counter) = 0;
                         counter++;
                     }
@@ -192,9 +235,10 @@ void SurfaceRZFourier<Array>::dgammadash1_by_dcoeff_impl(Array& data) {
                 for (int m = 0; m <= mpol; ++m) {
                     for (int n = -ntor; n <= ntor; ++n) {
                         if(m==0 && n<0) continue;
+                        tab.angle(k1, k2, m, n, c, s);
                         data(k1, k2, 0, counter) = 0;
                         data(k1, k2, 1, counter) = 0;
-                        data(k1, k2, 2, counter) = 2*M_PI*(n*nfp)*sin(m*theta-n*nfp*phi);
+                        data(k1, k2, 2, counter) = 2*M_PI*(n*nfp)*s;
                         counter++;
                     }
                 }
@@ -202,9 +246,10 @@ void SurfaceRZFourier<Array>::dgammadash1_by_dcoeff_impl(Array& data) {
             for (int m = 0; m <= mpol; ++m) {
                 for (int n = -ntor; n <= ntor; ++n) {
                     if(m==0 && n<=0) continue;
+                    tab.angle(k1, k2, m, n, c, s);
                     data(k1, k2, 0, counter) = 0;
                     data(k1, k2, 1, counter) = 0;
-                    data(k1, k2, 2, counter) = 2*M_PI*(-n*nfp)*cos(m*theta-n*nfp*phi);
+                    data(k1, k2, 2, counter) = 2*M_PI*(-n*nfp)*c;
                     counter++;
                 }
             }
@@ -214,16 +259,19 @@ void SurfaceRZFourier<Array>::dgammadash1_by_dcoeff_impl(Array& data) {
 
 template<class Array>
 void SurfaceRZFourier<Array>::dgammadash2_by_dcoeff_impl(Array& data) {
+    const FourierTables& tab = fourier_tables();
+    double c, s;
     for (int k1 = 0; k1 < numquadpoints_phi; ++k1) {
-        double phi  = 2*M_PI*quadpoints_phi[k1];
+        double cosphi = tab.cos_phi1[k1];
+        double sinphi = tab.sin_phi1[k1];
         for (int k2 = 0; k2 < numquadpoints_theta; ++k2) {
-            double theta  = 2*M_PI*quadpoints_theta[k2];
             int counter = 0;
             for (int m = 0; m <= mpol; ++m) {
                 for (int n = -ntor; n <= ntor; ++n) {
                     if(m==0 && n<0) continue;
-                    data(k1, k2, 0, counter) = 2*M_PI*(-m) * sin(m*theta-n*nfp*phi)*cos(phi);
-                    data(k1, k2, 1, counter) = 2*M_PI*(-m) * sin(m*theta-n*nfp*phi)*sin(phi);
+                    tab.angle(k1, k2, m, n, c, s);
+                    data(k1, k2, 0, counter) = 2*M_PI*(-m) * s*cosphi;
+                    data(k1, k2, 1, counter) = 2*M_PI*(-m) * s*sinphi;
                     data(k1, k2, 2, counter) = 0;
                     counter++;
                 }
@@ -232,8 +280,9 @@ void SurfaceRZFourier<Array>::dgammadash2_by_dcoeff_impl(Array& data) {
                 for (int m = 0; m <= mpol; ++m) {
                     for (int n = -ntor; n <= ntor; ++n) {
                         if(m==0 && n<=0) continue;
-                        data(k1, k2, 0, counter) = 2*M_PI*m * cos(m*theta-n*nfp*phi)*cos(phi);
-                        data(k1, k2, 1, counter) = 2*M_PI*m * cos(m*theta-n*nfp*phi)*sin(phi);
+                        tab.angle(k1, k2, m, n, c, s);
+                        data(k1, k2, 0, counter) = 2*M_PI*m * c*cosphi;
+                        data(k1, k2, 1, counter) = 2*M_PI*m * c*sinphi;
                         data(k1, k2, 2, counter) = 0;
                         counter++;
                     }
@@ -241,9 +290,10 @@ void SurfaceRZFourier<Array>::dgammadash2_by_dcoeff_impl(Array& data) {
                 for (int m = 0; m <= mpol; ++m) {
                     for (int n = -ntor; n <= ntor; ++n) {
                         if(m==0 && n<0) continue;
+                        tab.angle(k1, k2, m, n, c, s);
                         data(k1, k2, 0, counter) = 0;
                         data(k1, k2, 1, counter) = 0;
-                        data(k1, k2, 2, counter) = 2*M_PI*(-m) * sin(m*theta-n*nfp*phi);
+                        data(k1, k2, 2, counter) = 2*M_PI*(-m) * s;
                         counter++;
                     }
                 }
@@ -251,9 +301,10 @@ void SurfaceRZFourier<Array>::dgammadash2_by_dcoeff_impl(Array& data) {
             for (int m = 0; m <= mpol; ++m) {
                 for (int n = -ntor; n <= ntor; ++n) {
                     if(m==0 && n<=0) continue;
+                    tab.angle(k1, k2, m, n, c, s);
                     data(k1, k2, 0, counter) = 0;
                     data(k1, k2, 1, counter) = 0;
-                    data(k1, k2, 2, counter) = 2*M_PI*m * cos(m*theta-n*nfp*phi);
+                    data(k1, k2, 2, counter) = 2*M_PI*m * c;
                     counter++;
                 }
             }
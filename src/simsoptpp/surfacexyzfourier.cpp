@@ -2,54 +2,150 @@
 
 template<class Array>
 void SurfaceXYZFourier<Array>::gamma_impl(Array& data, Array& quadpoints_phi, Array& quadpoints_theta) {
-    int numquadpoints_phi = quadpoints_phi.size();
-    int numquadpoints_theta = quadpoints_theta.size();
+    // the cached tables can only be used when evaluating on the quadrature points of the surface
+    bool own_quadpoints = &quadpoints_phi == &this->quadpoints_phi && &quadpoints_theta == &this->quadpoints_theta;
+    FourierTables other_tables;
+    if(!own_quadpoints)
+        other_tables = FourierTables(quadpoints_phi, quadpoints_theta, mpol, ntor, nfp);
+    const FourierTables& tab = own_quadpoints ? fourier_tables() : other_tables;
+    evaluate(tab, xc, xs, yc, ys, zc, zs, data, 0);
+}
+
+template<class Array>
+void SurfaceXYZFourier<Array>::evaluate(const FourierTables& tab, const Array& _xc, const Array& _xs, const Array& _yc, const Array& _ys, const Array& _zc, const Array& _zs, Array& data, int deriv) {
+    vector<double> xP(mpol+1), xQ(mpol+1), xdP(mpol+1), xdQ(mpol+1);
+    vector<double> yP(mpol+1), yQ(mpol+1), ydP(mpol+1), ydQ(mpol+1);
+    vector<double> zP(mpol+1), zQ(mpol+1), zdP(mpol+1), zdQ(mpol+1);
+    for (int k1 = 0; k1 < tab.nphi; ++k1) {
+        double cosphi = tab.cos_phi1[k1];
+        double sinphi = tab.sin_phi1[k1];
+        tab.partial_sums(k1, &_xc, &_xs, xP.data(), xQ.data(), xdP.data(), xdQ.data());
+        tab.partial_sums(k1, &_yc, &_ys, yP.data(), yQ.data(), ydP.data(), ydQ.data());
+        tab.partial_sums(k1, &_zc, &_zs, zP.data(), zQ.data(), zdP.data(), zdQ.data());
+        for (int k2 = 0; k2 < tab.ntheta; ++k2) {
+            if(deriv == 0) {
+                double xhat = tab.sum(k2, xP.data(), xQ.data());
+                double yhat = tab.sum(k2, yP.data(), yQ.data());
+                data(k1, k2, 0) = xhat * cosphi - yhat * sinphi;
+                data(k1, k2, 1) = xhat * sinphi + yhat * cosphi;
+                data(k1, k2, 2) = tab.sum(k2, zP.data(), zQ.data());
+            } else if(deriv == 1) {
+                double xhat = tab.sum(k2, xP.data(), xQ.data());
+                double yhat = tab.sum(k2, yP.data(), yQ.data());
+                double xhatdash = tab.sum(k2, xdP.data(), xdQ.data());
+                double yhatdash = tab.sum(k2, ydP.data(), ydQ.data());
+                double xdash = xhatdash * cosphi - yhatdash * sinphi - xhat * sinphi - yhat * cosphi;
+                double ydash = xhatdash * sinphi + yhatdash * cosphi + xhat * cosphi - yhat * sinphi;
+                double zdash = tab.sum(k2, zdP.data(), zdQ.data());
+                data(k1, k2, 0) = 2*M_PI*xdash;
+                data(k1, k2, 1) = 2*M_PI*ydash;
+                data(k1, k2, 2) = 2*M_PI*zdash;
+            } else {
+                double xhatdash = tab.sum_dtheta(k2, xP.data(), xQ.data());
+                double yhatdash = tab.sum_dtheta(k2, yP.data(), yQ.data());
+                double zdash = tab.sum_dtheta(k2, zP.data(), zQ.data());
+                data(k1, k2, 0) = 2*M_PI*(xhatdash * cosphi - yhatdash * sinphi);
+                data(k1, k2, 1) = 2*M_PI*(xhatdash * sinphi + yhatdash * cosphi);
+                data(k1, k2, 2) = 2*M_PI*zdash;
+            }
+        }
+    }
+}
+
+template<class Array>
+Array SurfaceXYZFourier<Array>::evaluate_matvec(Array& v, int deriv) {
+    if(v.size() != num_dofs())
+        throw std::logic_error("v needs to have one entry per dof");
+    vector<double> dofs(v.size());
+    for (int i = 0; i < v.size(); ++i)
+        dofs[i] = v[i];
+    Array _xc = xt::zeros<double>({mpol+1, 2*ntor+1});
+    Array _xs = xt::zeros<double>({mpol+1, 2*ntor+1});
+    Array _yc = xt::zeros<double>({mpol+1, 2*ntor+1});
+    Array _ys = xt::zeros<double>({mpol+1, 2*ntor+1});
+    Array _zc = xt::zeros<double>({mpol+1, 2*ntor+1});
+    Array _zs = xt::zeros<double>({mpol+1, 2*ntor+1});
+    dofs_to_coefficients(dofs, _xc, _xs, _yc, _ys, _zc, _zs);
+    Array res = xt::zeros<double>({numquadpoints_phi, numquadpoints_theta, 3});
+    evaluate(fourier_tables(), _xc, _xs, _yc, _ys, _zc, _zs, res, deriv);
+    return res;
+}
+
+template<class Array>
+Array SurfaceXYZFourier<Array>::evaluate_vjp(Array& v, int deriv) {
+    const FourierTables& tab = fourier_tables();
+    Array gxc = xt::zeros<double>({mpol+1, 2*ntor+1});
+    Array gxs = xt::zeros<double>({mpol+1, 2*ntor+1});
+    Array gyc = xt::zeros<double>({mpol+1, 2*ntor+1});
+    Array gys = xt::zeros<double>({mpol+1, 2*ntor+1});
+    Array gzc = xt::zeros<double>({mpol+1, 2*ntor+1});
+    Array gzs = xt::zeros<double>({mpol+1, 2*ntor+1});
+    vector<double> xP(mpol+1), xQ(mpol+1), xdP(mpol+1), xdQ(mpol+1);
+    vector<double> yP(mpol+1), yQ(mpol+1), ydP(mpol+1), ydQ(mpol+1);
+    vector<double> zP(mpol+1), zQ(mpol+1), zdP(mpol+1), zdQ(mpol+1);
     for (int k1 = 0; k1 < numquadpoints_phi; ++k1) {
-        double phi  = 2*M_PI*quadpoints_phi[k1];
+        double cosphi = tab.cos_phi1[k1];
+        double sinphi = tab.sin_phi1[k1];
+        for (auto* P : {&xP, &xQ, &xdP, &xdQ, &yP, &yQ, &ydP, &ydQ, &zP, &zQ, &zdP, &zdQ})
+            std::fill(P->begin(), P->end(), 0.);
         for (int k2 = 0; k2 < numquadpoints_theta; ++k2) {
-            double theta  = 2*M_PI*quadpoints_theta[k2];
-            double x = 0;
-            double y = 0;
-            double z = 0;
-            for (int m = 0; m <= mpol; ++m) {
-                for (int i = 0; i < 2*ntor+1; ++i) {
-                    int n  = i - ntor;
-                    double xhat = get_coeff(0, true, m, i) * cos(m*theta-n*nfp*phi) + get_coeff(0, false, m, i) * sin(m*theta-n*nfp*phi);
-                    double yhat = get_coeff(1, true, m, i) * cos(m*theta-n*nfp*phi) + get_coeff(1, false, m, i) * sin(m*theta-n*nfp*phi);
-                    x += xhat * cos(phi) - yhat * sin(phi);
-                    y += xhat * sin(phi) + yhat * cos(phi);
-                    z += get_coeff(2, true , m, i) * cos(m*theta-n*nfp*phi) + get_coeff(2, false, m, i) * sin(m*theta-n*nfp*phi);
-                }
+            // v projected onto the directions in which xhat, yhat and z enter gamma
+            double vx = v(k1, k2, 0) * cosphi + v(k1, k2, 1) * sinphi;
+            double vy = -v(k1, k2, 0) * sinphi + v(k1, k2, 1) * cosphi;
+            double vz = v(k1, k2, 2);
+            if(deriv == 0) {
+                tab.sum_transpose(k2, vx, 0., xP.data(), xQ.data());
+                tab.sum_transpose(k2, vy, 0., yP.data(), yQ.data());
+                tab.sum_transpose(k2, vz, 0., zP.data(), zQ.data());
+            } else if(deriv == 1) {
+                tab.sum_transpose(k2, 2*M_PI*vy, 0., xP.data(), xQ.data());
+                tab.sum_transpose(k2, -2*M_PI*vx, 0., yP.data(), yQ.data());
+                tab.sum_transpose(k2, 2*M_PI*vx, 0., xdP.data(), xdQ.data());
+                tab.sum_transpose(k2, 2*M_PI*vy, 0., ydP.data(), ydQ.data());
+                tab.sum_transpose(k2, 2*M_PI*vz, 0., zdP.data(), zdQ.data());
+            } else {
+                tab.sum_transpose(k2, 0., 2*M_PI*vx, xP.data(), xQ.data());
+                tab.sum_transpose(k2, 0., 2*M_PI*vy, yP.data(), yQ.data());
+                tab.sum_transpose(k2, 0., 2*M_PI*vz, zP.data(), zQ.data());
             }
-            data(k1, k2, 0) = x;
-            data(k1, k2, 1) = y;
-            data(k1, k2, 2) = z;
         }
+        tab.partial_sums_transpose(k1, xP.data(), xQ.data(), xdP.data(), xdQ.data(), &gxc, &gxs);
+        tab.partial_sums_transpose(k1, yP.data(), yQ.data(), ydP.data(), ydQ.data(), &gyc, &gys);
+        tab.partial_sums_transpose(k1, zP.data(), zQ.data(), zdP.data(), zdQ.data(), &gzc, &gzs);
     }
+    vector<double> grad = coefficients_to_dofs(gxc, gxs, gyc, gys, gzc, gzs);
+    Array res = xt::zeros<double>({(int)grad.size()});
+    for (int i = 0; i < grad.size(); ++i)
+        res[i] = grad[i];
+    return res;
 }
 
 template<class Array>
 void SurfaceXYZFourier<Array>::gamma_lin(Array& data, Array& quadpoints_phi, Array& quadpoints_theta) {
     int numquadpoints = quadpoints_phi.size();
+    vector<double> cosm(mpol+1), sinm(mpol+1), cosn(ntor+1), sinn(ntor+1);
     data *= 0.;
     for (int k1 = 0; k1 < numquadpoints; ++k1) {
         double phi  = 2*M_PI*quadpoints_phi[k1];
         double theta  = 2*M_PI*quadpoints_theta[k1];
-        double x = 0;
-        double y = 0;
+        FourierTables::fill(theta, mpol, cosm.data(), sinm.data());
+        FourierTables::fill(nfp*phi, ntor, cosn.data(), sinn.data());
+        double xhat = 0;
+        double yhat = 0;
         double z = 0;
         for (int m = 0; m <= mpol; ++m) {
             for (int i = 0; i < 2*ntor+1; ++i) {
                 int n  = i - ntor;
-                double xhat = get_coeff(0, true, m, i) * cos(m*theta-n*nfp*phi) + get_coeff(0, false, m, i) * sin(m*theta-n*nfp*phi);
-                double yhat = get_coeff(1, true, m, i) * cos(m*theta-n*nfp*phi) + get_coeff(1, false, m, i) * sin(m*theta-n*nfp*phi);
-                x += xhat * cos(phi) - yhat * sin(phi);
-                y += xhat * sin(phi) + yhat * cos(phi);
-                z += get_coeff(2, true , m, i) * cos(m*theta-n*nfp*phi) + get_coeff(2, false, m, i) * sin(m*theta-n*nfp*phi);
+                double sn = n < 0 ? -sinn[-n] : sinn[n];
+                double c = cosm[m]*cosn[std::abs(n)] + sinm[m]*sn;
+                double s = sinm[m]*cosn[std::abs(n)] - cosm[m]*sn;
+                xhat += get_coeff(0, true, m, i) * c + get_coeff(0, false, m, i) * s;
+                yhat += get_coeff(1, true, m, i) * c + get_coeff(1, false, m, i) * s;
+                z += get_coeff(2, true , m, i) * c + get_coeff(2, false, m, i) * s;
             }
         }
-        data(k1, 0) = x;
-        data(k1, 1) = y;
+        data(k1, 0) = xhat * cos(phi) - yhat * sin(phi);
+        data(k1, 1) = xhat * sin(phi) + yhat * cos(phi);
         data(k1, 2) = z;
     }
 }
@@ -57,84 +153,41 @@ void SurfaceXYZFourier<Array>::gamma_lin(Array& data, Array& quadpoints_phi, Arr
 
 template<class Array>
 void SurfaceXYZFourier<Array>::gammadash1_impl(Array& data) {
-    data *= 0.;
-    for (int k1 = 0; k1 < numquadpoints_phi; ++k1) {
-        double phi  = 2*M_PI*quadpoints_phi[k1];
-        for (int k2 = 0; k2 < numquadpoints_theta; ++k2) {
-            double theta  = 2*M_PI*quadpoints_theta[k2];
-            double xdash = 0;
-            double ydash = 0;
-            double zdash = 0;
-            for (int m = 0; m <= mpol; ++m) {
-                for (int i = 0; i < 2*ntor+1; ++i) {
-                    int n  = i - ntor;
-                    double xhat = get_coeff(0, true, m, i) * cos(m*theta-n*nfp*phi) + get_coeff(0, false, m, i) * sin(m*theta-n*nfp*phi);
-                    double yhat = get_coeff(1, true, m, i) * cos(m*theta-n*nfp*phi) + get_coeff(1, false, m, i) * sin(m*theta-n*nfp*phi);
-                    double xhatdash = get_coeff(0, true, m, i) * (n*nfp)*sin(m*theta-n*nfp*phi) + get_coeff(0, false, m, i) * (-n*nfp)*cos(m*theta-n*nfp*phi);
-                    double yhatdash = get_coeff(1, true, m, i) * (n*nfp)*sin(m*theta-n*nfp*phi) + get_coeff(1, false, m, i) * (-n*nfp)*cos(m*theta-n*nfp*phi);
-                    xdash += xhatdash * cos(phi) - yhatdash * sin(phi) - xhat * sin(phi) - yhat * cos(phi);
-                    ydash += xhatdash * sin(phi) + yhatdash * cos(phi) + xhat * cos(phi) - yhat * sin(phi);
-                    zdash += get_coeff(2, true , m, i) * (n*nfp)*sin(m*theta-n*nfp*phi) + get_coeff(2, false, m, i) * (-n*nfp)*cos(m*theta-n*nfp*phi);
-                }
-            }
-            data(k1, k2, 0) = 2*M_PI*xdash;
-            data(k1, k2, 1) = 2*M_PI*ydash;
-            data(k1, k2, 2) = 2*M_PI*zdash;
-        }
-    }
+    evaluate(fourier_tables(), xc, xs, yc, ys, zc, zs, data, 1);
 }
 
 template<class Array>
 void SurfaceXYZFourier<Array>::gammadash2_impl(Array& data) {
-    data *= 0.;
-    for (int k1 = 0; k1 < numquadpoints_phi; ++k1) {
-        double phi  = 2*M_PI*quadpoints_phi[k1];
-        for (int k2 = 0; k2 < numquadpoints_theta; ++k2) {
-            double theta  = 2*M_PI*quadpoints_theta[k2];
-            double xdash = 0;
-            double ydash = 0;
-            double zdash = 0;
-            for (int m = 0; m <= mpol; ++m) {
-                for (int i = 0; i < 2*ntor+1; ++i) {
-                    int n  = i - ntor;
-                    double xhatdash = get_coeff(0, true, m, i) * (-m)* sin(m*theta-n*nfp*phi) + get_coeff(0, false, m, i) * m * cos(m*theta-n*nfp*phi);
-                    double yhatdash = get_coeff(1, true, m, i) * (-m)* sin(m*theta-n*nfp*phi) + get_coeff(1, false, m, i) * m * cos(m*theta-n*nfp*phi);
-                    xdash += xhatdash * cos(phi) - yhatdash * sin(phi);
-                    ydash += xhatdash * sin(phi) + yhatdash * cos(phi);
-                    zdash += get_coeff(2, true , m, i) * (-m) * sin(m*theta-n*nfp*phi) + get_coeff(2, false, m, i) * m * cos(m*theta-n*nfp*phi);
-                }
-            }
-            data(k1, k2, 0) = 2*M_PI*xdash;
-            data(k1, k2, 1) = 2*M_PI*ydash;
-            data(k1, k2, 2) = 2*M_PI*zdash;
-        }
-    }
+    evaluate(fourier_tables(), xc, xs, yc, ys, zc, zs, data, 2);
 }
 
 template<class Array>
 void SurfaceXYZFourier<Array>::dgamma_by_dcoeff_impl(Array& data) {
+    const FourierTables& tab = fourier_tables();
+    double c, s;
     for (int k1 = 0; k1 < numquadpoints_phi; ++k1) {
-        double phi  = 2*M_PI*quadpoints_phi[k1];
+        double cosphi = tab.cos_phi1[k1];
+        double sinphi = tab.sin_phi1[k1];
         for (int k2 = 0; k2 < numquadpoints_theta; ++k2) {
-            double theta  = 2*M_PI*quadpoints_theta[k2];
             int counter = 0;
             for (int d = 0; d < 3; ++d) {
                 for (int m = 0; m <= mpol; ++m) {
                     for (int n = -ntor; n <= ntor; ++n) {
                         if(m==0 && n<0) continue;
+                        tab.angle(k1, k2, m, n, c, s);
                         if(d == 0) {
-                            data(k1, k2, 0, counter) = cos(m*theta-n*nfp*phi) * cos(phi);
-                            data(k1, k2, 1, counter) = cos(m*theta-n*nfp*phi) * sin(phi);
+                            data(k1, k2, 0, counter) = c * cosphi;
+                            data(k1, k2, 1, counter) = c * sinphi;
                         }else if(d == 1) {
                             if(stellsym)
                                 continue;
-                            data(k1, k2, 0, counter) = -cos(m*theta-n*nfp*phi) * sin(phi);
-                            data(k1, k2, 1, counter) =  cos(m*theta-n*nfp*phi) * cos(phi);
+                            data(k1, k2, 0, counter) = -c * sinphi;
+                            data(k1, k2, 1, counter) =  c * cosphi;
                         }
                         else if(d == 2) {
                             if(stellsym)
                                 continue;
-                            data(k1, k2, 2, counter) =  cos(m*theta-n*nfp*phi);
+                            data(k1, k2, 2, counter) =  c;
                         }
                         counter++;
                     }
@@ -142,17 +195,18 @@ void SurfaceXYZFourier<Array>::dgamma_by_dcoeff_impl(Array& data) {
                 for (int m = 0; m <= mpol; ++m) {
                     for (int n = -ntor; n <= ntor; ++n) {
                         if(m==0 && n<=0) continue;
+                        tab.angle(k1, k2, m, n, c, s);
                         if(d == 0) {
                             if(stellsym)
                                 continue;
-                            data(k1, k2, 0, counter) = sin(m*theta-n*nfp*phi) * cos(phi);
-                            data(k1, k2, 1, counter) = sin(m*theta-n*nfp*phi) * sin(phi);
+                            data(k1, k2, 0, counter) = s * cosphi;
+                            data(k1, k2, 1, counter) = s * sinphi;
                         }else if(d == 1) {
-                            data(k1, k2, 0, counter) = -sin(m*theta-n*nfp*phi) * sin(phi);
-                            data(k1, k2, 1, counter) =  sin(m*theta-n*nfp*phi) * cos(phi);
+                            data(k1, k2, 0, counter) = -s * sinphi;
+                            data(k1, k2, 1, counter) =  s * cosphi;
                         }
                         else if(d == 2) {
-                            data(k1, k2, 2, counter) =  sin(m*theta-n*nfp*phi);
+                            data(k1, k2, 2, counter) =  s;
                         }
                         counter++;
                     }
@@ -164,28 +218,31 @@ void SurfaceXYZFourier<Array>::dgamma_by_dcoeff_impl(Array& data) {
 
 template<class Array>
 void SurfaceXYZFourier<Array>::dgammadash1_by_dcoeff_impl(Array& data) {
+    const FourierTables& tab = fourier_tables();
+    double c, s;
     for (int k1 = 0; k1 < numquadpoints_phi; ++k1) {
-        double phi  = 2*M_PI*quadpoints_phi[k1];
+        double cosphi = tab.cos_phi1[k1];
+        double sinphi = tab.sin_phi1[k1];
         for (int k2 = 0; k2 < numquadpoints_theta; ++k2) {
-            double theta  = 2*M_PI*quadpoints_theta[k2];
             int counter = 0;
             for (int d = 0; d < 3; ++d) {
                 for (int m = 0; m <= mpol; ++m) {
                     for (int n = -ntor; n <= ntor; ++n) {
                         if(m==0 && n<0) continue;
+                        tab.angle(k1, k2, m, n, c, s);
                         if(d == 0) {
-                            data(k1, k2, 0, counter) = (n*nfp)*sin(m*theta-n*nfp*phi) * cos(phi) - cos(m*theta-n*nfp*phi) * sin(phi);
-                            data(k1, k2, 1, counter) = (n*nfp)*sin(m*theta-n*nfp*phi) * sin(phi) + cos(m*theta-n*nfp*phi) * cos(phi);
+                            data(k1, k2, 0, counter) = (n*nfp)*s * cosphi - c * sinphi;
+                            data(k1, k2, 1, counter) = (n*nfp)*s * sinphi + c * cosphi;
                         }else if(d == 1) {
                             if(stellsym)
                                 continue;
-                            data(k1, k2, 0, counter) = -(n*nfp)*sin(m*theta-n*nfp*phi) * sin(phi) - cos(m*theta-n*nfp*phi) * cos(phi);
-                            data(k1, k2, 1, counter) =  (n*nfp)*sin(m*theta-n*nfp*phi) * cos(phi) - cos(m*theta-n*nfp*phi) * sin(phi);
+                            data(k1, k2, 0, counter) = -(n*nfp)*s * sinphi - c * cosphi;
+                            data(k1, k2, 1, counter) =  (n*nfp)*s * cosphi - c * sinphi;
                         }
                         else if(d == 2) {
                             if(stellsym)
                                 continue;
-                            data(k1, k2, 2, counter) =  (n*nfp)*sin(m*theta-n*nfp*phi);
+                            data(k1, k2, 2, counter) =  (n*nfp)*s;
                         }
                         counter++;
                     }
@@ -193,17 +250,18 @@ void SurfaceXYZFourier<Array>::dgammadash1_by_dcoeff_impl(Array& data) {
                 for (int m = 0; m <= mpol; ++m) {
                     for (int n = -ntor; n <= ntor; ++n) {
                         if(m==0 && n<=0) continue;
+                        tab.angle(k1, k2, m, n, c, s);
                         if(d == 0) {
                             if(stellsym)
                                 continue;
-                            data(k1, k2, 0, counter) = -(n*nfp)*cos(m*theta-n*nfp*phi) * cos(phi) - sin(m*theta-n*nfp*phi) * sin(phi);
-                            data(k1, k2, 1, counter) = -(n*nfp)*cos(m*theta-n*nfp*phi) * sin(phi) + sin(m*theta-n*nfp*phi) * cos(phi);
+                            data(k1, k2, 0, counter) = -(n*nfp)*c * cosphi - s * sinphi;
+                            data(k1, k2, 1, counter) = -(n*nfp)*c * sinphi + s * cosphi;
                         }else if(d == 1) {
-                            data(k1, k2, 0, counter) = (n*nfp)*cos(m*theta-n*nfp*phi) * sin(phi)  - sin(m*theta-n*nfp*phi) * cos(phi);
-                            data(k1, k2, 1, counter) = (-n*nfp)*cos(m*theta-n*nfp*phi) * cos(phi) - sin(m*theta-n*nfp*phi) * sin(phi);
+                            data(k1, k2, 0, counter) = (n*nfp)*c * sinphi  - s * cosphi;
+                            data(k1, k2, 1, counter) = (-n*nfp)*c * cosphi - s * sinphi;
                         }
                         else if(d == 2) {
-                            data(k1, k2, 2, counter) = (-n*nfp)*cos(m*theta-n*nfp*phi);
+                            data(k1, k2, 2, counter) = (-n*nfp)*c;
                         }
                         counter++;
                     }
@@ -216,28 +274,31 @@ void SurfaceXYZFourier<Array>::dgammadash1_by_dcoeff_impl(Array& data) {
 
 template<class Array>
 void SurfaceXYZFourier<Array>::dgammadash2_by_dcoeff_impl(Array& data) {
+    const FourierTables& tab = fourier_tables();
+    double c, s;
     for (int k1 = 0; k1 < numquadpoints_phi; ++k1) {
-        double phi  = 2*M_PI*quadpoints_phi[k1];
+        double cosphi = tab.cos_phi1[k1];
+        double sinphi = tab.sin_phi1[k1];
         for (int k2 = 0; k2 < numquadpoints_theta; ++k2) {
-            double theta  = 2*M_PI*quadpoints_theta[k2];
             int counter = 0;
             for (int d = 0; d < 3; ++d) {
                 for (int m = 0; m <= mpol; ++m) {
                     for (int n = -ntor; n <= ntor; ++n) {
                         if(m==0 && n<0) continue;
+                        tab.angle(k1, k2, m, n, c, s);
                         if(d == 0) {
-                            data(k1, k2, 0, counter) = (-m)* sin(m*theta-n*nfp*phi) * cos(phi);
-                            data(k1, k2, 1, counter) = (-m)* sin(m*theta-n*nfp*phi) * sin(phi);
+                            data(k1, k2, 0, counter) = (-m)* s * cosphi;
+                            data(k1, k2, 1, counter) = (-m)* s * sinphi;
                         }else if(d == 1) {
                             if(stellsym)
                                 continue;
-                            data(k1, k2, 0, counter) = (-m)* sin(m*theta-n*nfp*phi) * (-1) * sin(phi);
-                            data(k1, k2, 1, counter) = (-m)* sin(m*theta-n*nfp*phi) * cos(phi);
+                            data(k1, k2, 0, counter) = (-m)* s * (-1) * sinphi;
+                            data(k1, k2, 1, counter) = (-m)* s * cosphi;
                         }
                         else if(d == 2) {
                             if(stellsym)
                                 continue;
-                            data(k1, k2, 2, counter) = (-m) * sin(m*theta-n*nfp*phi);
+                            data(k1, k2, 2, counter) = (-m) * s;
                         }
                         counter++;
                     }
@@ -245,17 +306,18 @@ void SurfaceXYZFourier<Array>::dgammadash2_by_dcoeff_impl(Array& data) {
                 for (int m = 0; m <= mpol; ++m) {
                     for (int n = -ntor; n <= ntor; ++n) {
                         if(m==0 && n<=0) continue;
+                        tab.angle(k1, k2, m, n, c, s);
                         if(d == 0) {
                             if(stellsym)
                                 continue;
-                            data(k1, k2, 0, counter) = m * cos(m*theta-n*nfp*phi) * cos(phi);
-                            data(k1, k2, 1, counter) = m * cos(m*theta-n*nfp*phi) * sin(phi);
+                            data(k1, k2, 0, counter) = m * c * cosphi;
+                            data(k1, k2, 1, counter) = m * c * sinphi;
                         }else if(d == 1) {
-                            data(k1, k2, 0, counter) = m * cos(m*theta-n*nfp*phi) * (-1) * sin(phi);
-                            data(k1, k2, 1, counter) = m * cos(m*theta-n*nfp*phi) * cos(phi);
+                            data(k1, k2, 0, counter) = m * c * (-1) * sinphi;
+                            data(k1, k2, 1, counter) = m * c * cosphi;
                         }
                         else if(d == 2) {
-                            data(k1, k2, 2, counter) = m * cos(m*theta-n*nfp*phi);
+                            data(k1, k2, 2, counter) = m * c;
                         }
                         counter++;
                     }
@@ -1,6 +1,7 @@
 #pragma once
 
 #include "surface.h"
+#include "fouriertables.h"
 
 template<class Array>
 class SurfaceXYZFourier : public Surface<Array> {
@@ -51,6 +52,7 @@ class SurfaceXYZFourier : public Surface<Array> {
         int mpol;
         int ntor;
         bool stellsym;
+        FourierTables tables;
 
         SurfaceXYZFourier(int _mpol, int _ntor, int _nfp, bool _stellsym, vector<double> _quadpoints_phi, vector<double> _quadpoints_theta)
             : Surface<Array>(_quadpoints_phi, _quadpoints_theta), mpol(_mpol), ntor(_ntor), nfp(_nfp), stellsym(_stellsym) {
@@ -82,56 +84,64 @@ class SurfaceXYZFourier : public Surface<Array> {
         }
 
         void set_dofs_impl(const vector<double>& dofs) override {
+            dofs_to_coefficients(dofs, xc, xs, yc, ys, zc, zs);
+        }
+
+        vector<double> get_dofs() override {
+            return coefficients_to_dofs(xc, xs, yc, ys, zc, zs);
+        }
+
+        void dofs_to_coefficients(const vector<double>& dofs, Array& _xc, Array& _xs, Array& _yc, Array& _ys, Array& _zc, Array& _zs) {
             int shift = (mpol+1)*(2*ntor+1);
             int counter = 0;
             if(stellsym) {
                 for (int i = ntor; i < shift; ++i)
-                    xc.data()[i] = dofs[counter++];
+                    _xc.data()[i] = dofs[counter++];
                 for (int i = ntor+1; i < shift; ++i)
-                    ys.data()[i] = dofs[counter++];
+                    _ys.data()[i] = dofs[counter++];
                 for (int i = ntor+1; i < shift; ++i)
-                    zs.data()[i] = dofs[counter++];
+                    _zs.data()[i] = dofs[counter++];
 
             } else {
                 for (int i = ntor; i < shift; ++i)
-                    xc.data()[i] = dofs[counter++];
+                    _xc.data()[i] = dofs[counter++];
                 for (int i = ntor+1; i < shift; ++i)
-                    xs.data()[i] = dofs[counter++];
+                    _xs.data()[i] = dofs[counter++];
                 for (int i = ntor; i < shift; ++i)
-                    yc.data()[i] = dofs[counter++];
+                    _yc.data()[i] = dofs[counter++];
                 for (int i = ntor+1; i < shift; ++i)
-                    ys.data()[i] = dofs[counter++];
+                    _ys.data()[i] = dofs[counter++];
                 for (int i = ntor; i < shift; ++i)
-                    zc.data()[i] = dofs[counter++];
+                    _zc.data()[i] = dofs[counter++];
                 for (int i = ntor+1; i < shift; ++i)
-                    zs.data()[i] = dofs[counter++];
+                    _zs.data()[i] = dofs[counter++];
             }
         }
 
-        vector<double> get_dofs() override {
+        vector<double> coefficients_to_dofs(const Array& _xc, const Array& _xs, const Array& _yc, const Array& _ys, const Array& _zc, const Array& _zs) {
             auto res = vector<double>(num_dofs(), 0.);
             int shift = (mpol+1)*(2*ntor+1);
             int counter = 0;
             if(stellsym) {
                 for (int i = ntor; i < shift; ++i)
-                    res[counter++] = xc.data()[i];
+                    res[counter++] = _xc.data()[i];
                 for (int i = ntor+1; i < shift; ++i)
-                    res[counter++] = ys.data()[i];
+                    res[counter++] = _ys.data()[i];
                 for (int i = ntor+1; i < shift; ++i)
-                    res[counter++] = zs.data()[i];
+                    res[counter++] = _zs.data()[i];
             } else {
                 for (int i = ntor; i < shift; ++i)
-                    res[counter++] = xc.data()[i];
+                    res[counter++] = _xc.data()[i];
                 for (int i = ntor+1; i < shift; ++i)
-                    res[counter++] = xs.data()[i];
+                    res[counter++] = _xs.data()[i];
                 for (int i = ntor; i < shift; ++i)
-                    res[counter++] = yc.data()[i];
+                    res[counter++] = _yc.data()[i];
                 for (int i = ntor+1; i < shift; ++i)
-                    res[counter++] = ys.data()[i];
+                    res[counter++] = _ys.data()[i];
                 for (int i = ntor; i < shift; ++i)
-                    res[counter++] = zc.data()[i];
+                    res[counter++] = _zc.data()[i];
                 for (int i = ntor+1; i < shift; ++i)
-                    res[counter++] = zs.data()[i];
+                    res[counter++] = _zs.data()[i];
             }
             return res;
         }
@@ -151,6 +161,14 @@ class SurfaceXYZFourier : public Surface<Array> {
                 return zs(m, i);
         }
 
+        // Tables of the Fourier modes on the quadrature points, these are
+        // rebuilt whenever the resolution of the surface changes.
+        const FourierTables& fourier_tables() {
+            if(!tables.matches(mpol, ntor, nfp, numquadpoints_phi, numquadpoints_theta))
+                tables = FourierTables(quadpoints_phi, quadpoints_theta, mpol, ntor, nfp);
+            return tables;
+        }
+
         void gamma_impl(Array& data, Array& quadpoints_phi, Array& quadpoints_theta) override;
         void gamma_lin(Array& data, Array& quadpoints_phi, Array& quadpoints_theta) override;
         void gammadash1_impl(Array& data) override;
@@ -160,4 +178,21 @@ class SurfaceXYZFourier : public Surface<Array> {
         void dgammadash1_by_dcoeff_impl(Array& data) override;
         void dgammadash2_by_dcoeff_impl(Array& data) override;
 
+        // Evaluates gamma (deriv=0), gammadash1 (deriv=1) or gammadash2
+        // (deriv=2) on the grid of `tab` for the given coefficients.
+        void evaluate(const FourierTables& tab, const Array& _xc, const Array& _xs, const Array& _yc, const Array& _ys, const Array& _zc, const Array& _zs, Array& data, int deriv);
+        // Since the surface is linear in the dofs, the derivatives with
+        // respect to the dofs can be applied by evaluating the surface for
+        // other dofs, and their transpose is applied using the same
+        // separable sums as the evaluation.
+        Array evaluate_matvec(Array& v, int deriv);
+        Array evaluate_vjp(Array& v, int deriv);
+
+        Array dgamma_by_dcoeff_vjp(Array& v) override { return evaluate_vjp(v, 0); }
+        Array dgammadash1_by_dcoeff_vjp(Array& v) override { return evaluate_vjp(v, 1); }
+        Array dgammadash2_by_dcoeff_vjp(Array& v) override { return evaluate_vjp(v, 2); }
+        Array dgamma_by_dcoeff_matvec(Array& v) override { return evaluate_matvec(v, 0); }
+        Array dgammadash1_by_dcoeff_matvec(Array& v) override { return evaluate_matvec(v, 1); }
+        Array dgammadash2_by_dcoeff_matvec(Array& v) override { return evaluate_matvec(v, 2); }
+
 };
@@ -11,6 +11,10 @@ using std::tuple;
 using std::pair;
 using std::function;
 
+#ifdef _OPENMP
+#include <omp.h>
+#endif
+
 #include "xtensor-python/pyarray.hpp"     // Numpy bindings
 #include "xtensor-python/pytensor.hpp"     // Numpy bindings
 typedef xt::pyarray<double> Array;
@@ -23,6 +27,24 @@ typedef xt::pyarray<double> Array;
 using boost::math::tools::toms748_solve;
 using namespace boost::numeric::odeint;
 
+// Evaluates the vacuum guiding center equations (see GuidingCenterVacuumRHS)
+// given the field, its gradient and its strength at the location of the
+// particle.
+inline void guiding_center_vacuum_rhs(const double* B, const double* GradAbsB, double AbsB,
+        double m, double q, double mu, double v_par, double* dydt) {
+    double BcrossGradAbsB[3];
+    BcrossGradAbsB[0] = (B[1] * GradAbsB[2]) - (B[2] * GradAbsB[1]);
+    BcrossGradAbsB[1] = (B[2] * GradAbsB[0]) - (B[0] * GradAbsB[2]);
+    BcrossGradAbsB[2] = (B[0] * GradAbsB[1]) - (B[1] * GradAbsB[0]);
+    double v_perp2 = 2*mu*AbsB;
+    double fak1 = (v_par/AbsB);
+    double fak2 = (m/(q*pow(AbsB, 3)))*(0.5*v_perp2 + v_par*v_par);
+    dydt[0] = fak1*B[0] + fak2*BcrossGradAbsB[0];
+    dydt[1] = fak1*B[1] + fak2*BcrossGradAbsB[1];
+    dydt[2] = fak1*B[2] + fak2*BcrossGradAbsB[2];
+    dydt[3] = -mu*(B[0]*GradAbsB[0] + B[1]*GradAbsB[1] + B[2]*GradAbsB[2])/AbsB;
+}
+
 template<template<class, std::size_t, xt::layout_type> class T>
 class GuidingCenterVacuumRHS {
     /*
@@ -34,8 +56,6 @@ class GuidingCenterVacuumRHS {
      * where v_perp = 2*mu*|B|
      */
     private:
-        std::array<double, 3> BcrossGradAbsB = {0., 0., 0.};
-        typename MagneticField<T>::Tensor2 rphiz = xt::zeros<double>({1, 3});
         shared_ptr<MagneticField<T>> field;
         double m, q, mu;
     public:
@@ -48,33 +68,70 @@ class GuidingCenterVacuumRHS {
 
             }
 
+        void set_mu(double mu) {
+            this->mu = mu;
+        }
+
         void operator()(const State &ys, array<double, 4> &dydt,
                 const double t) {
-            double x = ys[0];
-            double y = ys[1];
-            double z = ys[2];
-            double v_par = ys[3];
+            double B[3], GradAbsB[3];
+            field->evaluate_point(ys[0], ys[1], ys[2], B, GradAbsB);
+            double AbsB = std::sqrt(B[0]*B[0] + B[1]*B[1] + B[2]*B[2]);
+            guiding_center_vacuum_rhs(B, GradAbsB, AbsB, m, q, mu, ys[3], dydt.data());
+        }
+};
+
+template<template<class, std::size_t, xt::layout_type> class T>
+class GuidingCenterVacuumPacketRHS {
+    // Same as GuidingCenterVacuumRHS, but evaluates the right hand side for a
+    // packet of particles with a single (batched) evaluation of the field.
+    // `mus` contains the magnetic moment of every particle, `idxs` passed to
+    // the call operator tell us which particle is in which lane.
+    private:
+        typename MagneticField<T>::Tensor2 rphiz;
+        shared_ptr<MagneticField<T>> field;
+        const double m, q;
+        const vector<double> mus;
+    public:
+        static constexpr int Size = 4;
+        using State = std::array<double, Size>;
 
-            rphiz(0, 0) = std::sqrt(x*x+y*y);
-            rphiz(0, 1) = std::atan2(y, x);
-            if(rphiz(0, 1) < 0)
-                rphiz(0, 1) += 2*M_PI;
-            rphiz(0, 2) = z;
+        GuidingCenterVacuumPacketRHS(shared_ptr<MagneticField<T>> field, double m, double q, vector<double> mus, int packet_size)
+            : rphiz(xt::zeros<double>({packet_size, 3})), field(field), m(m), q(q), mus(mus) {
 
+            }
+
+        int packet_size() const {
+            return rphiz.shape(0);
+        }
+
+        void operator()(const vector<State>& ys, vector<State>& dydts, const vector<int>& idxs) {
+            int n = rphiz.shape(0);
+            if(n == 1) {
+                // a single particle gains nothing from the batched evaluation,
+                // so evaluate the field as GuidingCenterVacuumRHS does, which
+                // doesn't go through the cache for most fields.
+                double B[3], GradAbsB[3];
+                field->evaluate_point(ys[0][0], ys[0][1], ys[0][2], B, GradAbsB);
+                double AbsB = std::sqrt(B[0]*B[0] + B[1]*B[1] + B[2]*B[2]);
+                guiding_center_vacuum_rhs(B, GradAbsB, AbsB, m, q, mus[idxs[0]], ys[0][3], dydts[0].data());
+                return;
+            }
+            for (int i = 0; i < n; ++i) {
+                double x = ys[i][0];
+                double y = ys[i][1];
+                rphiz(i, 0) = std::sqrt(x*x+y*y);
+                rphiz(i, 1) = std::atan2(y, x);
+                if(rphiz(i, 1) < 0)
+                    rphiz(i, 1) += 2*M_PI;
+                rphiz(i, 2) = ys[i][2];
+            }
             field->set_points_cyl(rphiz);
             auto& GradAbsB = field->GradAbsB_ref();
             auto& B = field->B_ref();
-            double AbsB = field->AbsB_ref()(0);
-            BcrossGradAbsB[0] = (B(0, 1) * GradAbsB(0, 2)) - (B(0, 2) * GradAbsB(0, 1));
-            BcrossGradAbsB[1] = (B(0, 2) * GradAbsB(0, 0)) - (B(0, 0) * GradAbsB(0, 2));
-            BcrossGradAbsB[2] = (B(0, 0) * GradAbsB(0, 1)) - (B(0, 1) * GradAbsB(0, 0));
-            double v_perp2 = 2*mu*AbsB;
-            double fak1 = (v_par/AbsB);
-            double fak2 = (m/(q*pow(AbsB, 3)))*(0.5*v_perp2 + v_par*v_par);
-            dydt[0] = fak1*B(0, 0) + fak2*BcrossGradAbsB[0];
-            dydt[1] = fak1*B(0, 1) + fak2*BcrossGradAbsB[1];
-            dydt[2] = fak1*B(0, 2) + fak2*BcrossGradAbsB[2];
-            dydt[3] = -mu*(B(0, 0)*GradAbsB(0, 0) + B(0, 1)*GradAbsB(0, 1) + B(0, 2)*GradAbsB(0, 2))/AbsB;
+            auto& AbsB = field->AbsB_ref();
+            for (int i = 0; i < n; ++i)
+                guiding_center_vacuum_rhs(&(B(i, 0)), &(GradAbsB(i, 0)), AbsB(i, 0), m, q, mus[idxs[i]], ys[i][3], dydts[i].data());
         }
 };
 
@@ -87,7 +144,6 @@ class FullorbitRHS {
     // and hence \dot\dot (x, y, z) = (q/m)* \dot(x,y,z) \cross B
     // where we used v = \dot (x,y,z)
     private:
-        typename MagneticField<T>::Tensor2 rphiz = xt::zeros<double>({1, 6});
         shared_ptr<MagneticField<T>> field;
         const double qoverm;
     public:
@@ -100,22 +156,14 @@ class FullorbitRHS {
             }
         void operator()(const array<double, 6> &ys, array<double, 6> &dydt,
                 const double t) {
-            double x = ys[0];
-            double y = ys[1];
-            double z = ys[2];
             double vx = ys[3];
             double vy = ys[4];
             double vz = ys[5];
-            rphiz(0, 0) = std::sqrt(x*x+y*y);
-            rphiz(0, 1) = std::atan2(y, x);
-            if(rphiz(0, 1) < 0)
-                rphiz(0, 1) += 2*M_PI;
-            rphiz(0, 2) = z;
-            field->set_points_cyl(rphiz);
-            auto& B = field->B_ref();
-            double Bx = B(0, 0);
-            double By = B(0, 1);
-            double Bz = B(0, 2);
+            double B[3];
+            field->evaluate_point(ys[0], ys[1], ys[2], B, nullptr);
+            double Bx = B[0];
+            double By = B[1];
+            double Bz = B[2];
             dydt[0] = vx;
             dydt[1] = vy;
             dydt[2] = vz;
@@ -127,7 +175,6 @@ class FullorbitRHS {
 template<template<class, std::size_t, xt::layout_type> class T>
 class FieldlineRHS {
     private:
-        typename MagneticField<T>::Tensor2 rphiz = xt::zeros<double>({1, 3});
         shared_ptr<MagneticField<T>> field;
     public:
         static constexpr int Size = 3;
@@ -139,19 +186,53 @@ class FieldlineRHS {
             }
         void operator()(const array<double, 3> &ys, array<double, 3> &dydt,
                 const double t) {
-            double x = ys[0];
-            double y = ys[1];
-            double z = ys[2];
-            rphiz(0, 0) = std::sqrt(x*x+y*y);
-            rphiz(0, 1) = std::atan2(y, x);
-            if(rphiz(0, 1) < 0)
-                rphiz(0, 1) += 2*M_PI;
-            rphiz(0, 2) = z;
+            field->evaluate_point(ys[0], ys[1], ys[2], dydt.data(), nullptr);
+        }
+};
+
+template<template<class, std::size_t, xt::layout_type> class T>
+class FieldlinePacketRHS {
+    // Same as FieldlineRHS, but evaluates the field for a packet of field lines
+    // at once.
+    private:
+        typename MagneticField<T>::Tensor2 rphiz;
+        shared_ptr<MagneticField<T>> field;
+    public:
+        static constexpr int Size = 3;
+        using State = std::array<double, Size>;
+
+        FieldlinePacketRHS(shared_ptr<MagneticField<T>> field, int packet_size)
+            : rphiz(xt::zeros<double>({packet_size, 3})), field(field) {
+
+            }
+
+        int packet_size() const {
+            return rphiz.shape(0);
+        }
+
+        void operator()(const vector<State>& ys, vector<State>& dydts, const vector<int>& idxs) {
+            int n = rphiz.shape(0);
+            if(n == 1) {
+                // see GuidingCenterVacuumPacketRHS
+                field->evaluate_point(ys[0][0], ys[0][1], ys[0][2], dydts[0].data(), nullptr);
+                return;
+            }
+            for (int i = 0; i < n; ++i) {
+                double x = ys[i][0];
+                double y = ys[i][1];
+                rphiz(i, 0) = std::sqrt(x*x+y*y);
+                rphiz(i, 1) = std::atan2(y, x);
+                if(rphiz(i, 1) < 0)
+                    rphiz(i, 1) += 2*M_PI;
+                rphiz(i, 2) = ys[i][2];
+            }
             field->set_points_cyl(rphiz);
             auto& B = field->B_ref();
-            dydt[0] = B(0, 0);
-            dydt[1] = B(0, 1);
-            dydt[2] = B(0, 2);
+            for (int i = 0; i < n; ++i) {
+                dydts[i][0] = B(i, 0);
+                dydts[i][1] = B(i, 1);
+                dydts[i][2] = B(i, 2);
+            }
         }
 };
 
@@ -187,11 +268,73 @@ std::array<double, m+n> join(const std::array<double, m>& a, const std::array<do
      return res;
 }
 
+template<std::size_t Size>
+class TrajectoryRecorder {
+    /*
+     * Stores the states of one trajectory in `res` as requested by the
+     * `RecordOptions`. The solvers call `step` after every accepted step that
+     * does not trigger a stopping criterion, `stopped` if a stopping
+     * criterion was triggered and `finish` once `tmax` is reached.
+     */
+    private:
+        const RecordOptions* options = nullptr;
+        vector<array<double, Size+1>>* res = nullptr;
+        array<double, Size+1> last;
+        bool last_saved = true;
+        long nintervals = 0;
+    public:
+        using State = array<double, Size>;
+
+        TrajectoryRecorder() {}
+
+        TrajectoryRecorder(const RecordOptions& options, vector<array<double, Size+1>>& res, double t, const State& y)
+            : options(&options), res(&res) {
+            res.push_back(join<1, Size>({t}, y));
+        }
+
+        // `calc_state(tau, y)` has to return the state at any time tau in [t_old, t].
+        template<class F>
+        void step(int iter, double t_old, double t, const State& y, double tmax, const F& calc_state) {
+            last = join<1, Size>({t}, y);
+            last_saved = false;
+            if(options->interval > 0) {
+                State temp;
+                double tau = (nintervals+1)*options->interval;
+                // the state at tmax is stored by `finish`, so ignore grid
+                // times that only differ from tmax by rounding errors
+                while(tau <= t && tau < tmax*(1-1e-12)) {
+                    calc_state(tau, temp);
+                    res->push_back(join<1, Size>({tau}, temp));
+                    last_saved = tau == t;
+                    nintervals++;
+                    tau = (nintervals+1)*options->interval;
+                }
+            } else if(t < tmax && options->every > 0 && iter % options->every == 0) {
+                res->push_back(last);
+                last_saved = true;
+            }
+        }
+
+        // Store the last state before the trajectory was stopped.
+        void stopped() {
+            if(!last_saved)
+                res->push_back(last);
+        }
+
+        template<class F>
+        void finish(double tmax, const F& calc_state) {
+            State temp;
+            calc_state(tmax, temp);
+            res->push_back(join<1, Size>({tmax}, temp));
+        }
+};
+
 
 
 template<class RHS>
 tuple<vector<array<double, RHS::Size+1>>, vector<array<double, RHS::Size+2>>>
-solve(RHS rhs, typename RHS::State y, double tmax, double dt, double dtmax, double tol, vector<double> phis, vector<shared_ptr<StoppingCriterion>> stopping_criteria)
+solve(RHS& rhs, typename RHS::State y, double tmax, double dt, double dtmax, double tol, vector<double> phis, vector<shared_ptr<StoppingCriterion>> stopping_criteria,
+        const RecordOptions& record=RecordOptions())
 {
     vector<array<double, RHS::Size+1>> res = {};
     vector<array<double, RHS::Size+2>> res_phi_hits = {};
@@ -207,9 +350,11 @@ solve(RHS rhs, typename RHS::State y, double tmax, double dt, double dtmax, doub
     boost::math::tools::eps_tolerance<double> roottol(-int(std::log2(tol)));
     uintmax_t rootmaxit = 200;
     State temp;
+    TrajectoryRecorder<RHS::Size> recorder(record, res, t, y);
+    auto calc_state = [&dense](double tau, State& out) { dense.calc_state(tau, out); };
     do {
-        res.push_back(join<1, RHS::Size>({t}, y));
-        tuple<double, double> step = dense.do_step(rhs);
+        // pass the rhs by reference, odeint would otherwise copy it in every step
+        tuple<double, double> step = dense.do_step(std::ref(rhs));
         iter++;
         t = dense.current_time();
         y = dense.current_state();
@@ -253,15 +398,316 @@ solve(RHS rhs, typename RHS::State y, double tmax, double dt, double dtmax, doub
                 break;
             }
         }
+        if(stop)
+            recorder.stopped();
+        else
+            recorder.step(iter, tlast, t, y, tmax, calc_state);
         phi_last = phi_current;
     } while(t < tmax && !stop);
-    if(!stop){
-        dense.calc_state(tmax, y);
-        res.push_back(join<1, RHS::Size>({tmax}, y));
-    }
+    if(!stop)
+        recorder.finish(tmax, calc_state);
     return std::make_tuple(res, res_phi_hits);
 }
 
+// Coefficients of the Dormand-Prince 5(4) method (the same method as odeint's
+// runge_kutta_dopri5), of its error estimate and of its dense output.
+namespace dopri5 {
+    const double a[7][6] = {
+        {0., 0., 0., 0., 0., 0.},
+        {1./5, 0., 0., 0., 0., 0.},
+        {3./40, 9./40, 0., 0., 0., 0.},
+        {44./45, -56./15, 32./9, 0., 0., 0.},
+        {19372./6561, -25360./2187, 64448./6561, -212./729, 0., 0.},
+        {9017./3168, -355./33, 46732./5247, 49./176, -5103./18656, 0.},
+        {35./384, 0., 500./1113, 125./192, -2187./6784, 11./84}
+    };
+    const double e[7] = {71./57600, 0., -71./16695, 71./1920, -17253./339200, 22./525, -1./40};
+    const double d[7] = {-12715105075./11282082432, 0., 87487479700./32700410799, -10690763975./1880347072,
+        701980252875./199316789632, -1453857185./822651844, 69997945./29380423};
+}
+
+template<std::size_t Size>
+struct PacketLane {
+    using State = array<double, Size>;
+    int idx = -1; // index of the trajectory in this lane, -1 if the lane is idle
+    bool has_deriv = false; // whether k[0] contains the derivative at y
+    int iter = 0;
+    int rejected = 0;
+    double t, dt, dtmax, phi_last;
+    State y;
+    array<State, 7> k;
+    // dense output on the last accepted step [t_old, t_old + h]
+    double t_old, h;
+    array<State, 5> rcont;
+    TrajectoryRecorder<Size> recorder;
+
+    void calc_state(double tau, State& out) const {
+        double theta = (tau - t_old)/h;
+        double theta1 = 1 - theta;
+        for (int i = 0; i < Size; ++i)
+            out[i] = rcont[0][i] + theta*(rcont[1][i] + theta1*(rcont[2][i] + theta*(rcont[3][i] + theta1*rcont[4][i])));
+    }
+};
+
+template<class RHS>
+void solve_packet(RHS& rhs, const vector<typename RHS::State>& y0s, const vector<double>& dts, const vector<double>& dtmaxs,
+        double tmax, double tol, const vector<double>& phis, const vector<shared_ptr<StoppingCriterion>>& stopping_criteria,
+        const std::function<int()>& next,
+        vector<tuple<vector<array<double, RHS::Size+1>>, vector<array<double, RHS::Size+2>>>>& res,
+        const RecordOptions& record)
+{
+    /*
+     * Integrates a packet of trajectories in lockstep using the Dormand-Prince
+     * 5(4) method. Every lane has its own time, step size and error control
+     * (identical to the one used by odeint's dense output stepper in `solve`),
+     * but the right hand side is evaluated for all lanes at once. Whenever a
+     * trajectory finishes, the lane picks up the next trajectory given by
+     * `next()`. Idle lanes (once `next()` has run out of trajectories) just
+     * duplicate an active lane, so that the packet passed to the right hand
+     * side always has the same size.
+     */
+    typedef typename RHS::State State;
+    typedef PacketLane<RHS::Size> Lane;
+    const int max_rejected = 500;
+    int packet_size = rhs.packet_size();
+    vector<Lane> lanes(packet_size);
+    vector<State> ys(packet_size);
+    vector<State> ks(packet_size);
+    vector<int> idxs(packet_size);
+    boost::math::tools::eps_tolerance<double> roottol(-int(std::log2(tol)));
+    State ynew, temp;
+
+    auto start = [&](Lane& lane) {
+        lane.idx = next();
+        if(lane.idx < 0)
+            return;
+        lane.y = y0s[lane.idx];
+        lane.t = 0.;
+        lane.dtmax = dtmaxs[lane.idx];
+        lane.dt = std::min(dts[lane.idx], lane.dtmax);
+        lane.iter = 0;
+        lane.rejected = 0;
+        lane.has_deriv = false;
+        lane.phi_last = get_phi(lane.y[0], lane.y[1], M_PI);
+        lane.recorder = TrajectoryRecorder<RHS::Size>(record, std::get<0>(res[lane.idx]), 0., lane.y);
+    };
+
+    auto evaluate = [&](const std::function<void(const Lane&, State&)>& state) {
+        int active = 0;
+        while(lanes[active].idx < 0)
+            active++;
+        for (int l = 0; l < packet_size; ++l) {
+            const Lane& lane = lanes[l].idx >= 0 ? lanes[l] : lanes[active];
+            state(lane, ys[l]);
+            idxs[l] = lane.idx;
+        }
+        rhs(ys, ks, idxs);
+    };
+
+    for (int l = 0; l < packet_size; ++l)
+        start(lanes[l]);
+
+    while(true) {
+        bool any_active = false;
+        bool need_deriv = false;
+        for (int l = 0; l < packet_size; ++l) {
+            any_active = any_active || lanes[l].idx >= 0;
+            need_deriv = need_deriv || (lanes[l].idx >= 0 && !lanes[l].has_deriv);
+        }
+        if(!any_active)
+            break;
+        if(need_deriv) {
+            evaluate([](const Lane& lane, State& y) { y = lane.y; });
+            for (int l = 0; l < packet_size; ++l) {
+                if(lanes[l].idx >= 0 && !lanes[l].has_deriv) {
+                    lanes[l].k[0] = ks[l];
+                    lanes[l].has_deriv = true;
+                }
+            }
+        }
+        for (int stage = 1; stage < 7; ++stage) {
+            evaluate([stage](const Lane& lane, State& y) {
+                for (int i = 0; i < RHS::Size; ++i) {
+                    double sum = 0.;
+                    for (int j = 0; j < stage; ++j)
+                        sum += dopri5::a[stage][j] * lane.k[j][i];
+                    y[i] = lane.y[i] + lane.dt * sum;
+                }
+            });
+            for (int l = 0; l < packet_size; ++l)
+                if(lanes[l].idx >= 0)
+                    lanes[l].k[stage] = ks[l];
+        }
+
+        for (int l = 0; l < packet_size; ++l) {
+            Lane& lane = lanes[l];
+            if(lane.idx < 0)
+                continue;
+            double dt = lane.dt;
+            double err = 0.;
+            for (int i = 0; i < RHS::Size; ++i) {
+                double sum = 0.;
+                for (int j = 0; j < 6; ++j)
+                    sum += dopri5::a[6][j] * lane.k[j][i];
+                double sumerr = 0.;
+                for (int j = 0; j < 7; ++j)
+                    sumerr += dopri5::e[j] * lane.k[j][i];
+                ynew[i] = lane.y[i] + dt * sum;
+                double sc = tol + tol * (std::abs(lane.y[i]) + dt * std::abs(lane.k[0][i]));
+                err = std::max(err, std::abs(dt * sumerr)/sc);
+            }
+            if(err > 1.) {
+                lane.dt = dt * std::max(0.9 * std::pow(err, -1./3), 0.2);
+                if(++lane.rejected > max_rejected)
+                    throw std::runtime_error(fmt::format("Step size adjustment failed for trajectory {} at t={}.", lane.idx, lane.t));
+                continue;
+            }
+            lane.rejected = 0;
+            for (int i = 0; i < RHS::Size; ++i) {
+                double ydiff = ynew[i] - lane.y[i];
+                double bspl = dt * lane.k[0][i] - ydiff;
+                double dsum = 0.;
+                for (int j = 0; j < 7; ++j)
+                    dsum += dopri5::d[j] * lane.k[j][i];
+                lane.rcont[0][i] = lane.y[i];
+                lane.rcont[1][i] = ydiff;
+                lane.rcont[2][i] = bspl;
+                lane.rcont[3][i] = ydiff - dt * lane.k[6][i] - bspl;
+                lane.rcont[4][i] = dt * dsum;
+            }
+            lane.t_old = lane.t;
+            lane.h = dt;
+            lane.t += dt;
+            lane.y = ynew;
+            lane.k[0] = lane.k[6];
+            lane.iter++;
+            if(err < 0.5) {
+                err = std::max(std::pow(5., -5.), err);
+                lane.dt = dt * 0.9 * std::pow(err, -1./5);
+            }
+            lane.dt = std::min(lane.dt, lane.dtmax);
+
+            auto& res_phi_hits = std::get<1>(res[lane.idx]);
+            double phi_current = get_phi(lane.y[0], lane.y[1], lane.phi_last);
+            // Now check whether we have hit any of the phi planes
+            for (int i = 0; i < phis.size(); ++i) {
+                double phi = phis[i];
+                if(std::floor((lane.phi_last-phi)/(2*M_PI)) != std::floor((phi_current-phi)/(2*M_PI))){
+                    int fak = std::round(((lane.phi_last+phi_current)/2-phi)/(2*M_PI));
+                    double phi_shift = fak*2*M_PI + phi;
+                    std::function<double(double)> rootfun = [&lane, &phi_shift, &temp](double t){
+                        lane.calc_state(t, temp);
+                        return get_phi(temp[0], temp[1], lane.phi_last)-phi_shift;
+                    };
+                    uintmax_t rootmaxit = 200;
+                    auto root = toms748_solve(rootfun, lane.t_old, lane.t, lane.phi_last - phi_shift, phi_current-phi_shift, roottol, rootmaxit);
+                    double f0 = rootfun(root.first);
+                    double f1 = rootfun(root.second);
+                    double troot = std::abs(f0) < std::abs(f1) ? root.first : root.second;
+                    lane.calc_state(troot, temp);
+                    res_phi_hits.push_back(join<2, RHS::Size>({troot, double(i)}, temp));
+                }
+            }
+            lane.phi_last = phi_current;
+            // check whether we have satisfied any of the extra stopping criteria (e.g. left a surface)
+            bool stop = false;
+            for (int i = 0; i < stopping_criteria.size(); ++i) {
+                if(stopping_criteria[i] && (*stopping_criteria[i])(lane.iter, lane.t, lane.y[0], lane.y[1], lane.y[2])){
+                    stop = true;
+                    res_phi_hits.push_back(join<2, RHS::Size>({lane.t, -1-double(i)}, lane.y));
+                    break;
+                }
+            }
+            auto calc_state = [&lane](double tau, State& out) { lane.calc_state(tau, out); };
+            if(stop) {
+                lane.recorder.stopped();
+                start(lane);
+            } else {
+                lane.recorder.step(lane.iter, lane.t_old, lane.t, lane.y, tmax, calc_state);
+                if(lane.t >= tmax) {
+                    lane.recorder.finish(tmax, calc_state);
+                    start(lane);
+                }
+            }
+        }
+    }
+}
+
+template<class PacketRHS>
+class SingleTrajectoryRHS {
+    // Wraps a packet right hand side of packet size one so that it can be
+    // used with odeint in `solve`.
+    private:
+        PacketRHS& rhs;
+        vector<typename PacketRHS::State> ys, dydts;
+        vector<int> idxs;
+    public:
+        static constexpr int Size = PacketRHS::Size;
+        using State = typename PacketRHS::State;
+
+        SingleTrajectoryRHS(PacketRHS& rhs, int idx) : rhs(rhs), ys(1), dydts(1), idxs(1, idx) { }
+
+        void operator()(const State &y, State &dydt, const double t) {
+            ys[0] = y;
+            rhs(ys, dydts, idxs);
+            dydt = dydts[0];
+        }
+};
+
+template<class RHS>
+vector<tuple<vector<array<double, RHS::Size+1>>, vector<array<double, RHS::Size+2>>>>
+solve_batch(vector<RHS>& rhss, const vector<typename RHS::State>& y0s, const vector<double>& dts, const vector<double>& dtmaxs,
+        double tmax, double tol, const vector<double>& phis, const vector<shared_ptr<StoppingCriterion>>& stopping_criteria,
+        const RecordOptions& record)
+{
+    /*
+     * Computes all trajectories starting at `y0s`, using one thread per
+     * element of `rhss`. If the packet size of the right hand sides is one,
+     * every trajectory is computed using `solve` (and the right hand sides
+     * evaluate the field with `evaluate_point`), otherwise the threads
+     * integrate packets of trajectories using `solve_packet`.
+     *
+     * All tensors used during the evaluation of the right hand sides have to
+     * exist already (e.g. by evaluating them once), since creating
+     * xtensor-python arrays from openmp threads isn't safe.
+     */
+    int ntrajectories = y0s.size();
+    vector<tuple<vector<array<double, RHS::Size+1>>, vector<array<double, RHS::Size+2>>>> res(ntrajectories);
+    int nthreads = rhss.size();
+    int counter = 0;
+    std::function<int()> next = [&counter, ntrajectories]() {
+        int idx;
+#pragma omp atomic capture
+        idx = counter++;
+        return idx < ntrajectories ? idx : -1;
+    };
+    std::exception_ptr error = nullptr;
+#pragma omp parallel num_threads(nthreads)
+    {
+        int tid = 0;
+#ifdef _OPENMP
+        tid = omp_get_thread_num();
+#endif
+        try {
+            if(rhss[tid].packet_size() == 1) {
+                for (int idx = next(); idx >= 0; idx = next()) {
+                    SingleTrajectoryRHS<RHS> rhs(rhss[tid], idx);
+                    res[idx] = solve(rhs, y0s[idx], tmax, dts[idx], dtmaxs[idx], tol, phis, stopping_criteria, record);
+                }
+            } else {
+                solve_packet(rhss[tid], y0s, dts, dtmaxs, tmax, tol, phis, stopping_criteria, next, res, record);
+            }
+        } catch(...) {
+#pragma omp critical
+            if(!error)
+                error = std::current_exception();
+        }
+    }
+    if(error)
+        std::rethrow_exception(error);
+    return res;
+}
+
 
 
 template<template<class, std::size_t, xt::layout_type> class T>
@@ -296,11 +742,63 @@ tuple<vector<array<double, 5>>, vector<array<double, 6>>> particle_guiding_cente
         vector<double> phis, vector<shared_ptr<StoppingCriterion>> stopping_criteria);
 
 
+template<template<class, std::size_t, xt::layout_type> class T>
+vector<tuple<vector<array<double, 5>>, vector<array<double, 6>>>>
+particle_guiding_center_tracing_batch(
+        shared_ptr<MagneticField<T>> field, typename MagneticField<T>::Tensor2& xyz_inits,
+        double m, double q, double vtotal, vector<double> vtangs, double tmax, double tol, bool vacuum,
+        vector<double> phis, vector<shared_ptr<StoppingCriterion>> stopping_criteria, int packet_size, RecordOptions record)
+{
+    if(!vacuum)
+        throw std::logic_error("Guiding center right hand side currently only implemented for vacuum fields.");
+    int nparticles = xyz_inits.shape(0);
+    if(vtangs.size() != nparticles)
+        throw std::logic_error("Need one parallel speed per particle.");
+    if(packet_size < 1)
+        throw std::logic_error("The packet size needs to be positive.");
+    if(nparticles == 0)
+        return {};
+
+    // compute the magnetic moments for all particles with a single field evaluation
+    field->set_points(xyz_inits);
+    auto& AbsB = field->AbsB_ref();
+    vector<double> mus(nparticles, 0.);
+    vector<array<double, 4>> y0s(nparticles);
+    vector<double> dts(nparticles, 0.);
+    vector<double> dtmaxs(nparticles, 0.);
+    for (int i = 0; i < nparticles; ++i) {
+        mus[i] = (vtotal*vtotal - vtangs[i]*vtangs[i])/(2*AbsB(i, 0));
+        y0s[i] = {xyz_inits(i, 0), xyz_inits(i, 1), xyz_inits(i, 2), vtangs[i]};
+        double r0 = std::sqrt(y0s[i][0]*y0s[i][0] + y0s[i][1]*y0s[i][1]);
+        dtmaxs[i] = r0*0.5*M_PI/vtotal; // can at most do quarter of a revolution per step
+        dts[i] = 1e-3 * dtmaxs[i]; // initial guess for first timestep, will be adjusted by adaptive timestepper
+    }
+
+    auto fields = get_fields_for_threads(field);
+    vector<GuidingCenterVacuumPacketRHS<T>> rhss;
+    rhss.reserve(fields.size());
+    vector<array<double, 4>> ys(packet_size, y0s[0]);
+    vector<array<double, 4>> dydts(packet_size);
+    vector<int> idxs(packet_size, 0);
+    for (int i = 0; i < fields.size(); ++i) {
+        rhss.push_back(GuidingCenterVacuumPacketRHS<T>(fields[i], m, q, mus, packet_size));
+        rhss[i](ys, dydts, idxs);
+    }
+    return solve_batch(rhss, y0s, dts, dtmaxs, tmax, tol, phis, stopping_criteria, record);
+}
+
+template
+vector<tuple<vector<array<double, 5>>, vector<array<double, 6>>>> particle_guiding_center_tracing_batch<xt::pytensor>(
+        shared_ptr<MagneticField<xt::pytensor>> field, typename MagneticField<xt::pytensor>::Tensor2& xyz_inits,
+        double m, double q, double vtotal, vector<double> vtangs, double tmax, double tol, bool vacuum,
+        vector<double> phis, vector<shared_ptr<StoppingCriterion>> stopping_criteria, int packet_size, RecordOptions record);
+
+
 template<template<class, std::size_t, xt::layout_type> class T>
 tuple<vector<array<double, 7>>, vector<array<double, 8>>>
 particle_fullorbit_tracing(
         shared_ptr<MagneticField<T>> field, array<double, 3> xyz_init, array<double, 3> v_init,
-        double m, double q, double tmax, double tol, vector<double> phis, vector<shared_ptr<StoppingCriterion>> stopping_criteria)
+        double m, double q, double tmax, double tol, vector<double> phis, vector<shared_ptr<StoppingCriterion>> stopping_criteria, RecordOptions record)
 {
 
     auto rhs_class = FullorbitRHS<T>(field, m, q);
@@ -311,13 +809,356 @@ particle_fullorbit_tracing(
     double dtmax = r0*0.5*M_PI/vtotal; // can at most do quarter of a revolution per step
     double dt = 1e-3 * dtmax; // initial guess for first timestep, will be adjusted by adaptive timestepper
 
-    return solve(rhs_class, y, tmax, dt, dtmax, tol, phis, stopping_criteria);
+    return solve(rhs_class, y, tmax, dt, dtmax, tol, phis, stopping_criteria, record);
 }
 
 template
 tuple<vector<array<double, 7>>, vector<array<double, 8>>> particle_fullorbit_tracing<xt::pytensor>(
         shared_ptr<MagneticField<xt::pytensor>> field, array<double, 3> xyz_init, array<double, 3> v_init,
-        double m, double q, double tmax, double tol, vector<double> phis, vector<shared_ptr<StoppingCriterion>> stopping_criteria);
+        double m, double q, double tmax, double tol, vector<double> phis, vector<shared_ptr<StoppingCriterion>> stopping_criteria, RecordOptions record);
+
+// Rotates the velocity `v` around `B` as in the Boris pusher, i.e.
+//   v <- v + (v + v x t) x s  with  t = (q/m) B dt/2  and  s = 2t/(1+|t|^2).
+// This is a rotation by the angle 2 atan(|t|), so |v| stays exactly the same.
+inline void boris_rotation(double* v, const double* B, double qoverm, double dt) {
+    double t[3], s[3], vprime[3];
+    double t2 = 0.;
+    for (int l = 0; l < 3; ++l) {
+        t[l] = 0.5*qoverm*dt*B[l];
+        t2 += t[l]*t[l];
+    }
+    for (int l = 0; l < 3; ++l)
+        s[l] = 2*t[l]/(1+t2);
+    vprime[0] = v[0] + (v[1]*t[2] - v[2]*t[1]);
+    vprime[1] = v[1] + (v[2]*t[0] - v[0]*t[2]);
+    vprime[2] = v[2] + (v[0]*t[1] - v[1]*t[0]);
+    v[0] += vprime[1]*s[2] - vprime[2]*s[1];
+    v[1] += vprime[2]*s[0] - vprime[0]*s[2];
+    v[2] += vprime[0]*s[1] - vprime[1]*s[0];
+}
+
+template<template<class, std::size_t, xt::layout_type> class T>
+tuple<vector<array<double, 7>>, vector<array<double, 8>>>
+solve_boris(shared_ptr<MagneticField<T>> field, const array<double, 6>& y0, double qoverm, double tmax, double dt,
+        const vector<double>& phis, const vector<shared_ptr<StoppingCriterion>>& stopping_criteria,
+        const RecordOptions& record)
+{
+    /*
+     * Integrates the full orbit equations with the Boris pusher, using the
+     * fixed time step `dt` (shortened slightly so that the last step ends at
+     * `tmax`). The pusher is volume preserving and conserves the kinetic
+     * energy exactly, so it does not drift over many gyrations. The step is
+     * deliberately not adapted to the field along the orbit: changing it
+     * breaks the time symmetry of the scheme, on which its long time
+     * accuracy relies.
+     *
+     * The velocity is staggered by half a time step with respect to the
+     * position. The returned states and phi hits contain the position and
+     * the velocity at the same time, obtained by rotating the staggered
+     * velocity in the field at that position. Between two steps the particle
+     * moves on a straight line, so the intersections with the phi planes are
+     * computed exactly for the discrete trajectory. States at times between
+     * two steps (for `record.interval > 0`) are interpolated linearly.
+     */
+    vector<array<double, 7>> res = {};
+    vector<array<double, 8>> res_phi_hits = {};
+    int nsteps = std::max(1, int(std::ceil(tmax/dt)));
+    dt = tmax/nsteps;
+    double x[3] = {y0[0], y0[1], y0[2]};
+    double v[3] = {y0[3], y0[4], y0[5]};
+    double B[3];
+    field->evaluate_point(x[0], x[1], x[2], B, nullptr);
+    // velocity half a step before the first position
+    double vhalf[3] = {v[0], v[1], v[2]};
+    boris_rotation(vhalf, B, qoverm, -0.5*dt);
+    double t = 0;
+    double phi_last = get_phi(x[0], x[1], M_PI);
+    array<double, 6> y = {x[0], x[1], x[2], v[0], v[1], v[2]};
+    array<double, 6> y_old;
+    TrajectoryRecorder<6> recorder(record, res, t, y);
+    auto calc_state = [&](double tau, array<double, 6>& out) {
+        double frac = (tau - (t-dt))/dt;
+        for (int l = 0; l < 6; ++l)
+            out[l] = (1-frac)*y_old[l] + frac*y[l];
+    };
+    for (int iter = 1; iter <= nsteps; ++iter) {
+        boris_rotation(vhalf, B, qoverm, dt);
+        double xnew[3];
+        for (int l = 0; l < 3; ++l)
+            xnew[l] = x[l] + dt*vhalf[l];
+        t = iter == nsteps ? tmax : iter*dt;
+        double phi_current = get_phi(xnew[0], xnew[1], phi_last);
+        // Now check whether we have hit any of the phi planes
+        for (int i = 0; i < phis.size(); ++i) {
+            double phi = phis[i];
+            if(std::floor((phi_last-phi)/(2*M_PI)) != std::floor((phi_current-phi)/(2*M_PI))){ // check whether phi+k*2pi for some k was crossed
+                // intersect the straight line from x to xnew with the plane
+                double nx = -std::sin(phi);
+                double ny = std::cos(phi);
+                double frac = -(nx*x[0] + ny*x[1])/(nx*(xnew[0]-x[0]) + ny*(xnew[1]-x[1]));
+                frac = std::max(0., std::min(1., frac));
+                double xhit[3], vhit[3], Bhit[3];
+                for (int l = 0; l < 3; ++l) {
+                    xhit[l] = x[l] + frac*(xnew[l]-x[l]);
+                    vhit[l] = vhalf[l];
+                }
+                // the staggered velocity belongs to the middle of the step,
+                // rotate it to the time of the hit
+                field->evaluate_point(xhit[0], xhit[1], xhit[2], Bhit, nullptr);
+                boris_rotation(vhit, Bhit, qoverm, (frac-0.5)*dt);
+                res_phi_hits.push_back({t - (1-frac)*dt, double(i),
+                        xhit[0], xhit[1], xhit[2], vhit[0], vhit[1], vhit[2]});
+            }
+        }
+        for (int l = 0; l < 3; ++l) {
+            x[l] = xnew[l];
+            v[l] = vhalf[l];
+        }
+        field->evaluate_point(x[0], x[1], x[2], B, nullptr);
+        boris_rotation(v, B, qoverm, 0.5*dt);
+        y_old = y;
+        y = {x[0], x[1], x[2], v[0], v[1], v[2]};
+        // check whether we have satisfied any of the extra stopping criteria (e.g. left a surface)
+        for (int i = 0; i < stopping_criteria.size(); ++i) {
+            if(stopping_criteria[i] && (*stopping_criteria[i])(iter, t, x[0], x[1], x[2])){
+                res_phi_hits.push_back(join<2, 6>({t, -1-double(i)}, y));
+                recorder.stopped();
+                return std::make_tuple(res, res_phi_hits);
+            }
+        }
+        recorder.step(iter, t-dt, t, y, tmax, calc_state);
+        phi_last = phi_current;
+    }
+    recorder.finish(tmax, calc_state);
+    return std::make_tuple(res, res_phi_hits);
+}
+
+template<template<class, std::size_t, xt::layout_type> class T>
+vector<tuple<vector<array<double, 7>>, vector<array<double, 8>>>>
+particle_fullorbit_boris_tracing_batch(
+        shared_ptr<MagneticField<T>> field, typename MagneticField<T>::Tensor2& xyz_inits, typename MagneticField<T>::Tensor2& v_inits,
+        double m, double q, double tmax, int steps_per_gyroperiod, vector<double> phis, vector<shared_ptr<StoppingCriterion>> stopping_criteria, RecordOptions record)
+{
+    int nparticles = xyz_inits.shape(0);
+    if(v_inits.shape(0) != nparticles)
+        throw std::logic_error("Need one initial velocity per particle.");
+    if(steps_per_gyroperiod < 1)
+        throw std::logic_error("The number of steps per gyro period needs to be positive.");
+    if(nparticles == 0)
+        return {};
+
+    // the time step of each particle resolves the gyro period at its initial
+    // position and stays fixed along the orbit, see `solve_boris`
+    field->set_points(xyz_inits);
+    auto& AbsB = field->AbsB_ref();
+    double qoverm = q/m;
+    vector<array<double, 6>> y0s(nparticles);
+    vector<double> dts(nparticles, 0.);
+    for (int i = 0; i < nparticles; ++i) {
+        y0s[i] = {xyz_inits(i, 0), xyz_inits(i, 1), xyz_inits(i, 2), v_inits(i, 0), v_inits(i, 1), v_inits(i, 2)};
+        double gyroperiod = 2*M_PI/(std::abs(qoverm)*AbsB(i, 0));
+        dts[i] = gyroperiod/steps_per_gyroperiod;
+    }
+
+    // evaluate every field once, so that all tensors exist before entering
+    // the parallel region
+    auto fields = get_fields_for_threads(field);
+    double B[3];
+    for (int i = 0; i < fields.size(); ++i)
+        fields[i]->evaluate_point(y0s[0][0], y0s[0][1], y0s[0][2], B, nullptr);
+
+    vector<tuple<vector<array<double, 7>>, vector<array<double, 8>>>> res(nparticles);
+    int nthreads = fields.size();
+    std::exception_ptr error = nullptr;
+#pragma omp parallel for schedule(dynamic, 1) num_threads(nthreads)
+    for (int idx = 0; idx < nparticles; ++idx) {
+        int tid = 0;
+#ifdef _OPENMP
+        tid = omp_get_thread_num();
+#endif
+        try {
+            res[idx] = solve_boris(fields[tid], y0s[idx], qoverm, tmax, dts[idx], phis, stopping_criteria, record);
+        } catch(...) {
+#pragma omp critical
+            if(!error)
+                error = std::current_exception();
+        }
+    }
+    if(error)
+        std::rethrow_exception(error);
+    return res;
+}
+
+template
+vector<tuple<vector<array<double, 7>>, vector<array<double, 8>>>> particle_fullorbit_boris_tracing_batch<xt::pytensor>(
+        shared_ptr<MagneticField<xt::pytensor>> field, typename MagneticField<xt::pytensor>::Tensor2& xyz_inits, typename MagneticField<xt::pytensor>::Tensor2& v_inits,
+        double m, double q, double tmax, int steps_per_gyroperiod, vector<double> phis, vector<shared_ptr<StoppingCriterion>> stopping_criteria, RecordOptions record);
+
+class GuidingCenterBoozerRHS {
+    /*
+     * Guiding center equations in Boozer coordinates, the state consists of
+     * :math:`[s, \theta, \zeta, v_{||}]`. With the toroidal flux
+     * :math:`\psi = \psi_0 s`, :math:`\rho = m v_{||}/|B|` and the Hamiltonian
+     * :math:`H = \rho^2|B|^2/(2m) + m\mu|B|`, they read (neglecting the
+     * radial covariant component of the field)
+     *
+     *   \dot\psi    &= -(G H_\theta - I H_\zeta)/D
+     *   \dot\theta  &= (G H_\psi - C H_\rho)/D
+     *   \dot\zeta   &= (A H_\rho - I H_\psi)/D
+     *   \dot\rho    &= -(A H_\zeta - C H_\theta)/D
+     *
+     * where A = q + \rho I', C = \rho G' - q \iota and D = AG - IC.
+     * These equations conserve the energy and, if |B| doesn't depend on
+     * zeta, the canonical momentum :math:`\rho G - q\psi_p`.
+     */
+    private:
+        shared_ptr<BoozerSpectralField> field;
+        BoozerSpectralField::Workspace ws;
+        double m, q, mu;
+    public:
+        static constexpr int Size = 4;
+        using State = std::array<double, Size>;
+
+        GuidingCenterBoozerRHS(shared_ptr<BoozerSpectralField> field, double m, double q, double mu)
+            : field(field), ws(field->workspace()), m(m), q(q), mu(mu) {
+
+            }
+
+        void operator()(const State &ys, array<double, 4> &dydt,
+                const double t) {
+            BoozerSpectralField::Point p;
+            field->evaluate(ws, ys[0], ys[1], ys[2], p);
+            double psi0 = field->psi0;
+            double v_par = ys[3];
+            double modB = p.modB;
+            double rho = m*v_par/modB;
+            double A = q + rho*p.dIds/psi0;
+            double C = rho*p.dGds/psi0 - q*p.iota;
+            double D = A*p.G - p.I*C;
+            // derivatives of the Hamiltonian at fixed rho
+            double fak = m*(v_par*v_par/modB + mu);
+            double Hpsi = fak*p.dmodBds/psi0;
+            double Htheta = fak*p.dmodBdtheta;
+            double Hzeta = fak*p.dmodBdzeta;
+            double Hrho = v_par*modB;
+            double psidot = -(p.G*Htheta - p.I*Hzeta)/D;
+            dydt[0] = psidot/psi0;
+            dydt[1] = (p.G*Hpsi - C*Hrho)/D;
+            dydt[2] = (A*Hrho - p.I*Hpsi)/D;
+            double rhodot = -(A*Hzeta - C*Htheta)/D;
+            double modBdot = p.dmodBds*dydt[0] + p.dmodBdtheta*dydt[1] + p.dmodBdzeta*dydt[2];
+            dydt[3] = (rhodot*modB + rho*modBdot)/m;
+        }
+};
+
+template<class RHS>
+tuple<vector<array<double, RHS::Size+1>>, vector<array<double, RHS::Size+2>>>
+solve_boozer(RHS& rhs, typename RHS::State y, double tmax, double dt, double dtmax, double tol,
+        const vector<double>& s_surfaces, const vector<shared_ptr<StoppingCriterion>>& stopping_criteria,
+        const RecordOptions& record)
+{
+    /*
+     * As `solve`, but for states whose first component is the radial
+     * coordinate s. Instead of the intersections with phi planes, we record
+     * the times at which the trajectory crosses the surfaces `s_surfaces`.
+     * The stopping criteria are called with (s, theta, zeta) in place of (x, y, z).
+     */
+    vector<array<double, RHS::Size+1>> res = {};
+    vector<array<double, RHS::Size+2>> res_s_hits = {};
+    typedef typename RHS::State State;
+    typedef typename boost::numeric::odeint::result_of::make_dense_output<runge_kutta_dopri5<State>>::type dense_stepper_type;
+    dense_stepper_type dense = make_dense_output(tol, tol, dtmax, runge_kutta_dopri5<State>());
+    double t = 0;
+    dense.initialize(y, t, dt);
+    int iter = 0;
+    bool stop = false;
+    double s_last = y[0];
+    boost::math::tools::eps_tolerance<double> roottol(-int(std::log2(tol)));
+    uintmax_t rootmaxit = 200;
+    State temp;
+    TrajectoryRecorder<RHS::Size> recorder(record, res, t, y);
+    auto calc_state = [&dense](double tau, State& out) { dense.calc_state(tau, out); };
+    do {
+        tuple<double, double> step = dense.do_step(std::ref(rhs));
+        iter++;
+        t = dense.current_time();
+        y = dense.current_state();
+        double s_current = y[0];
+        double tlast = std::get<0>(step);
+        double tcurrent = std::get<1>(step);
+        for (int i = 0; i < s_surfaces.size(); ++i) {
+            double s_hit = s_surfaces[i];
+            if((s_last - s_hit)*(s_current - s_hit) >= 0 && s_current != s_hit)
+                continue;
+            std::function<double(double)> rootfun = [&dense, &s_hit, &temp](double t){
+                dense.calc_state(t, temp);
+                return temp[0]-s_hit;
+            };
+            double troot = tcurrent;
+            if(s_current != s_hit) {
+                auto root = toms748_solve(rootfun, tlast, tcurrent, s_last - s_hit, s_current - s_hit, roottol, rootmaxit);
+                troot = std::abs(rootfun(root.first)) < std::abs(rootfun(root.second)) ? root.first : root.second;
+            }
+            dense.calc_state(troot, temp);
+            res_s_hits.push_back(join<2, RHS::Size>({troot, double(i)}, temp));
+        }
+        for (int i = 0; i < stopping_criteria.size(); ++i) {
+            if(stopping_criteria[i] && (*stopping_criteria[i])(iter, t, y[0], y[1], y[2])){
+                stop = true;
+                res_s_hits.push_back(join<2, RHS::Size>({t, -1-double(i)}, y));
+                break;
+            }
+        }
+        if(stop)
+            recorder.stopped();
+        else
+            recorder.step(iter, tlast, t, y, tmax, calc_state);
+        s_last = s_current;
+    } while(t < tmax && !stop);
+    if(!stop)
+        recorder.finish(tmax, calc_state);
+    return std::make_tuple(res, res_s_hits);
+}
+
+vector<tuple<vector<array<double, 5>>, vector<array<double, 6>>>>
+particle_guiding_center_boozer_tracing_batch(
+        shared_ptr<BoozerSpectralField> field, const vector<array<double, 3>>& stz_inits,
+        double m, double q, double vtotal, const vector<double>& vtangs, double tmax, double tol,
+        const vector<double>& s_surfaces, const vector<shared_ptr<StoppingCriterion>>& stopping_criteria,
+        const RecordOptions& record)
+{
+    int nparticles = stz_inits.size();
+    if(vtangs.size() != nparticles)
+        throw std::logic_error("Need one parallel speed per particle.");
+    if(nparticles == 0)
+        return {};
+
+    vector<tuple<vector<array<double, 5>>, vector<array<double, 6>>>> res(nparticles);
+    std::exception_ptr error = nullptr;
+#pragma omp parallel for schedule(dynamic, 1)
+    for (int idx = 0; idx < nparticles; ++idx) {
+        try {
+            auto ws = field->workspace();
+            BoozerSpectralField::Point p;
+            field->evaluate(ws, stz_inits[idx][0], stz_inits[idx][1], stz_inits[idx][2], p);
+            double mu = (vtotal*vtotal - vtangs[idx]*vtangs[idx])/(2*p.modB);
+            // the particle moves by about v_par |B|/G in zeta per time, it can
+            // do at most a quarter of a toroidal revolution per step
+            double dtmax = 0.5*M_PI*std::abs(p.G)/(vtotal*p.modB);
+            double dt = 1e-3*dtmax;
+            GuidingCenterBoozerRHS rhs(field, m, q, mu);
+            array<double, 4> y = {stz_inits[idx][0], stz_inits[idx][1], stz_inits[idx][2], vtangs[idx]};
+            res[idx] = solve_boozer(rhs, y, tmax, dt, dtmax, tol, s_surfaces, stopping_criteria, record);
+        } catch(...) {
+#pragma omp critical
+            if(!error)
+                error = std::current_exception();
+        }
+    }
+    if(error)
+        std::rethrow_exception(error);
+    return res;
+}
 
 template<template<class, std::size_t, xt::layout_type> class T>
 tuple<vector<array<double, 4>>, vector<array<double, 5>>>
@@ -340,3 +1181,45 @@ tuple<vector<array<double, 4>>, vector<array<double, 5>>>
 fieldline_tracing(
     shared_ptr<MagneticField<xt::pytensor>> field, array<double, 3> xyz_init,
     double tmax, double tol, vector<double> phis, vector<shared_ptr<StoppingCriterion>> stopping_criteria);
+
+template<template<class, std::size_t, xt::layout_type> class T>
+vector<tuple<vector<array<double, 4>>, vector<array<double, 5>>>>
+fieldline_tracing_batch(
+    shared_ptr<MagneticField<T>> field, typename MagneticField<T>::Tensor2& xyz_inits,
+    double tmax, double tol, vector<double> phis, vector<shared_ptr<StoppingCriterion>> stopping_criteria, int packet_size, RecordOptions record)
+{
+    if(packet_size < 1)
+        throw std::logic_error("The packet size needs to be positive.");
+    int nlines = xyz_inits.shape(0);
+    if(nlines == 0)
+        return {};
+    field->set_points(xyz_inits);
+    auto& AbsB = field->AbsB_ref();
+    vector<array<double, 3>> y0s(nlines);
+    vector<double> dts(nlines, 0.);
+    vector<double> dtmaxs(nlines, 0.);
+    for (int i = 0; i < nlines; ++i) {
+        y0s[i] = {xyz_inits(i, 0), xyz_inits(i, 1), xyz_inits(i, 2)};
+        double r0 = std::sqrt(y0s[i][0]*y0s[i][0] + y0s[i][1]*y0s[i][1]);
+        dtmaxs[i] = r0*0.5*M_PI/AbsB(i, 0); // can at most do quarter of a revolution per step
+        dts[i] = 1e-5 * dtmaxs[i]; // initial guess for first timestep, will be adjusted by adaptive timestepper
+    }
+
+    auto fields = get_fields_for_threads(field);
+    vector<FieldlinePacketRHS<T>> rhss;
+    rhss.reserve(fields.size());
+    vector<array<double, 3>> ys(packet_size, y0s[0]);
+    vector<array<double, 3>> dydts(packet_size);
+    vector<int> idxs(packet_size, 0);
+    for (int i = 0; i < fields.size(); ++i) {
+        rhss.push_back(FieldlinePacketRHS<T>(fields[i], packet_size));
+        rhss[i](ys, dydts, idxs);
+    }
+    return solve_batch(rhss, y0s, dts, dtmaxs, tmax, tol, phis, stopping_criteria, record);
+}
+
+template
+vector<tuple<vector<array<double, 4>>, vector<array<double, 5>>>>
+fieldline_tracing_batch(
+    shared_ptr<MagneticField<xt::pytensor>> field, typename MagneticField<xt::pytensor>::Tensor2& xyz_inits,
+    double tmax, double tol, vector<double> phis, vector<shared_ptr<StoppingCriterion>> stopping_criteria, int packet_size, RecordOptions record);
@@ -3,12 +3,29 @@
 #include <vector>
 #include "magneticfield.h"
 #include "regular_grid_interpolant_3d.h"
+#include "boozer_field.h"
 
 using std::shared_ptr;
 using std::vector;
 using std::tuple;
 
 
+// Which states of a trajectory are returned by the tracing functions. The
+// initial state, the last state (at tmax or before a stopping criterion was
+// satisfied) and all hits are always returned. In between, if `interval > 0`
+// the states at the times interval, 2*interval, ... are returned, otherwise
+// the state after every `every`-th step (so `every = 0` returns only the
+// first and last state).
+struct RecordOptions {
+    int every = 1;
+    double interval = 0.;
+    RecordOptions() {}
+    RecordOptions(int every, double interval) : every(every), interval(interval) {
+        if(every < 0)
+            throw std::logic_error("every needs to be non-negative.");
+    }
+};
+
 class StoppingCriterion {
     public:
         // Should return true if the Criterion is satisfied.
@@ -29,20 +46,46 @@ class IterationStoppingCriterion : public StoppingCriterion{
 template<class Array>
 class LevelsetStoppingCriterion : public StoppingCriterion{
     private:
-        shared_ptr<RegularGridInterpolant3D<Array>> levelset;
+        shared_ptr<Interpolant3D<Array>> levelset;
     public:
-        LevelsetStoppingCriterion(shared_ptr<RegularGridInterpolant3D<Array>> levelset) : levelset(levelset) { };
+        LevelsetStoppingCriterion(shared_ptr<Interpolant3D<Array>> levelset) : levelset(levelset) { };
         bool operator()(int iter, double t, double x, double y, double z) override {
             double r = std::sqrt(x*x + y*y);
             double phi = std::atan2(y, x);
             if(phi < 0)
                 phi += 2*M_PI;
+            // cells that were skipped when building the levelset lie outside
+            // of the domain
+            if(levelset->is_skipped(r, phi, z))
+                return true;
             double f = levelset->evaluate(r, phi, z)[0];
             //fmt::print("Levelset at xyz=({}, {}, {}), rphiz=({}, {}, {}), f={}\n", x, y, z, r, phi, z, f);
             return f<0;
         };
 };
 
+// Stopping criteria for the tracing in Boozer coordinates, where the
+// criteria are evaluated at (s, theta, zeta) instead of (x, y, z).
+class MinToroidalFluxStoppingCriterion : public StoppingCriterion{
+    private:
+        double smin;
+    public:
+        MinToroidalFluxStoppingCriterion(double smin) : smin(smin) { };
+        bool operator()(int iter, double t, double s, double theta, double zeta) override {
+            return s<smin;
+        };
+};
+
+class MaxToroidalFluxStoppingCriterion : public StoppingCriterion{
+    private:
+        double smax;
+    public:
+        MaxToroidalFluxStoppingCriterion(double smax) : smax(smax) { };
+        bool operator()(int iter, double t, double s, double theta, double zeta) override {
+            return s>=smax;
+        };
+};
+
 
 template<template<class, std::size_t, xt::layout_type> class T>
 tuple<vector<array<double, 5>>, vector<array<double, 6>>>
@@ -51,11 +94,38 @@ particle_guiding_center_tracing(
         double m, double q, double vtotal, double vtang, double tmax, double tol, bool vacuum,
         vector<double> phis, vector<shared_ptr<StoppingCriterion>> stopping_criteria);
 
+// Traces the guiding centers of all particles in `xyz_inits` (an array of
+// shape (nparticles, 3)) concurrently. If the field supports `clone()`, every
+// OpenMP thread evaluates its own copy of the field, otherwise the particles
+// are traced one after another. If `packet_size > 1`, every thread advances
+// `packet_size` particles in lockstep, so that the field is evaluated at
+// `packet_size` points at once.
+template<template<class, std::size_t, xt::layout_type> class T>
+vector<tuple<vector<array<double, 5>>, vector<array<double, 6>>>>
+particle_guiding_center_tracing_batch(
+        shared_ptr<MagneticField<T>> field, typename MagneticField<T>::Tensor2& xyz_inits,
+        double m, double q, double vtotal, vector<double> vtangs, double tmax, double tol, bool vacuum,
+        vector<double> phis, vector<shared_ptr<StoppingCriterion>> stopping_criteria, int packet_size, RecordOptions record=RecordOptions());
+
 template<template<class, std::size_t, xt::layout_type> class T>
 tuple<vector<array<double, 7>>, vector<array<double, 8>>>
 particle_fullorbit_tracing(
         shared_ptr<MagneticField<T>> field, array<double, 3> xyz_init, array<double, 3> v_init,
-        double m, double q, double tmax, double tol, vector<double> phis, vector<shared_ptr<StoppingCriterion>> stopping_criteria);
+        double m, double q, double tmax, double tol, vector<double> phis, vector<shared_ptr<StoppingCriterion>> stopping_criteria, RecordOptions record=RecordOptions());
+
+// Traces the full orbits of all particles in `xyz_inits` (with initial
+// velocities `v_inits`, both of shape (nparticles, 3)) concurrently, using the
+// Boris pusher with a fixed time step. The time step of each particle is
+// `1/steps_per_gyroperiod` times its gyro period at the initial position; it
+// is not adapted along the orbit, so where the field is stronger there are
+// fewer steps per gyro period.
+// Fields that support `clone()` are evaluated by all OpenMP threads in
+// parallel, otherwise the particles are traced one after another.
+template<template<class, std::size_t, xt::layout_type> class T>
+vector<tuple<vector<array<double, 7>>, vector<array<double, 8>>>>
+particle_fullorbit_boris_tracing_batch(
+        shared_ptr<MagneticField<T>> field, typename MagneticField<T>::Tensor2& xyz_inits, typename MagneticField<T>::Tensor2& v_inits,
+        double m, double q, double tmax, int steps_per_gyroperiod, vector<double> phis, vector<shared_ptr<StoppingCriterion>> stopping_criteria, RecordOptions record=RecordOptions());
 
 template<template<class, std::size_t, xt::layout_type> class T>
 tuple<vector<array<double, 4>>, vector<array<double, 5>>>
@@ -63,3 +133,22 @@ fieldline_tracing(
         shared_ptr<MagneticField<T>> field, array<double, 3> xyz_init,
         double tmax, double tol, vector<double> phis, vector<shared_ptr<StoppingCriterion>> stopping_criteria);
 
+// As `particle_guiding_center_tracing_batch`, but for field lines.
+template<template<class, std::size_t, xt::layout_type> class T>
+vector<tuple<vector<array<double, 4>>, vector<array<double, 5>>>>
+fieldline_tracing_batch(
+        shared_ptr<MagneticField<T>> field, typename MagneticField<T>::Tensor2& xyz_inits,
+        double tmax, double tol, vector<double> phis, vector<shared_ptr<StoppingCriterion>> stopping_criteria, int packet_size, RecordOptions record=RecordOptions());
+
+// Traces the guiding centers of all particles in Boozer coordinates, starting
+// at `stz_inits` (s, theta, zeta) with parallel speeds `vtangs`. The
+// trajectories contain the states [t, s, theta, zeta, v_par], and every
+// crossing of one of the surfaces `s_surfaces` or stopping criterion is
+// recorded as [t, idx, s, theta, zeta, v_par]. The particles are distributed
+// over the OpenMP threads.
+vector<tuple<vector<array<double, 5>>, vector<array<double, 6>>>>
+particle_guiding_center_boozer_tracing_batch(
+        shared_ptr<BoozerSpectralField> field, const vector<array<double, 3>>& stz_inits,
+        double m, double q, double vtotal, const vector<double>& vtangs, double tmax, double tol,
+        const vector<double>& s_surfaces, const vector<shared_ptr<StoppingCriterion>>& stopping_criteria,
+        const RecordOptions& record=RecordOptions());
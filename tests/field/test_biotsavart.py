@@ -1,9 +1,14 @@
+import os
+import subprocess
+import sys
+import tempfile
 import unittest
 
 import numpy as np
 
 from simsopt.geo.curvexyzfourier import CurveXYZFourier
-from simsopt.field.biotsavart import BiotSavart
+from simsopt.field.biotsavart import BiotSavart, SymmetricBiotSavart
+from simsopt.geo.coilcollection import CoilCollection
 
 
 def get_coil(num_quadrature_points=200, perturb=False):
@@ -31,6 +36,260 @@ class Testing(unittest.TestCase):
         assert np.linalg.norm(B1) > 1e-5
         assert np.allclose(B1, B2)
 
+    def test_biotsavart_treecode_matches_direct_sum(self):
+        coils = [get_coil(perturb=True) for i in range(4)]
+        currents = [1e4, -2e4, 3e4, 1.5e4]
+        np.random.seed(1)
+        points = np.random.uniform(low=-1.5, high=1.5, size=(500, 3))
+        bs = BiotSavart(coils, currents).set_points(points)
+        B = bs.B()
+        dB = bs.dB_by_dX()
+        errs_B = []
+        errs_dB = []
+        for theta in [0.6, 0.3, 0.15]:
+            bs_tree = BiotSavart(coils, currents, treecode_theta=theta, treecode_threshold=0).set_points(points)
+            errs_B.append(np.linalg.norm(bs_tree.B()-B)/np.linalg.norm(B))
+            errs_dB.append(np.linalg.norm(bs_tree.dB_by_dX()-dB)/np.linalg.norm(dB))
+        assert errs_B[-1] < 1e-3
+        assert errs_dB[-1] < 1e-2
+        assert errs_B[0] > errs_B[1] > errs_B[2]
+        assert errs_dB[0] > errs_dB[1] > errs_dB[2]
+        # below the threshold the direct sum is used
+        bs_direct = BiotSavart(coils, currents, treecode_theta=0.6, treecode_threshold=10**12).set_points(points)
+        assert np.allclose(bs_direct.B(), B)
+
+    def test_biotsavart_single_precision(self):
+        coils = [get_coil(perturb=True) for i in range(4)]
+        currents = [1e4, -2e4, 3e4, 1.5e4]
+        np.random.seed(1)
+        points = np.random.uniform(low=-1.5, high=1.5, size=(101, 3))
+        bs = BiotSavart(coils, currents).set_points(points)
+        B, dB, ddB = bs.B(), bs.dB_by_dX(), bs.d2B_by_dXdX()
+        bs_float = BiotSavart(coils, currents, precision="float").set_points(points)
+        assert bs_float.get_precision() == "float"
+        err_B = np.linalg.norm(bs_float.B()-B, axis=1)/np.linalg.norm(B, axis=1)
+        err_dB = np.linalg.norm(bs_float.dB_by_dX()-dB, axis=(1, 2))/np.linalg.norm(dB, axis=(1, 2))
+        print(np.max(err_B), np.max(err_dB))
+        assert np.max(err_B) < 1e-4
+        assert np.max(err_dB) < 1e-4
+        # the computation really happens in single precision
+        assert np.max(err_B) > 1e-12
+        # the hessian is always computed in double precision
+        assert np.allclose(bs_float.d2B_by_dXdX(), ddB)
+        assert bs_float.clone().get_precision() == "float"
+        bs_float.set_precision("double")
+        assert np.allclose(bs_float.set_points(points).B(), B)
+        with self.assertRaises(RuntimeError):
+            bs_float.set_precision("half")
+
+    def test_biotsavart_tiled_matches_untiled(self):
+        # with a single coil and many targets, the targets are split into
+        # blocks that are computed in parallel. Each point is computed in the
+        # same way as without blocks, so the result is bitwise identical.
+        coil = get_coil(perturb=True)
+        np.random.seed(1)
+        points = np.random.uniform(low=-1.5, high=1.5, size=(1001, 3))
+        bs = BiotSavart([coil], [1e4]).set_points(points)
+        B, dB = bs.B(), bs.dB_by_dX()
+        from simsoptpp import biot_savart
+        Bs, dBs, ddBs = [np.zeros((1001, 3))], [np.zeros((1001, 3, 3))], []
+        biot_savart(points, [coil.gamma()], [coil.gammadash()], Bs, dBs, ddBs)
+        assert np.array_equal(B, 1e4 * Bs[0])
+        assert np.array_equal(dB, 1e4 * dBs[0])
+
+    def test_biotsavart_reproducible_across_thread_counts(self):
+        # the block size of the tiles depends on the number of threads, but
+        # the result must not. OMP_NUM_THREADS is only read when the extension
+        # is loaded, so every thread count runs in its own interpreter.
+        script = """
+import sys
+import numpy as np
+sys.path.insert(0, sys.argv[2])
+from test_biotsavart import get_coil
+from simsopt.field.biotsavart import BiotSavart, SymmetricBiotSavart
+np.random.seed(1)
+coils = [get_coil(perturb=True) for i in range(5)]
+currents = [1e4, -2e4, 3e4, 1.5e4, -1e4]
+points = np.random.uniform(low=-1.5, high=1.5, size=(1001, 3))
+v = np.random.standard_normal(size=(len(points), 3))
+vgrad = np.random.standard_normal(size=(len(points), 3, 3))
+res = {}
+for name, bs in [("full", BiotSavart(coils, currents)),
+                 ("accumulated", BiotSavart(coils, currents, store_coil_fields=False)),
+                 ("symmetric", SymmetricBiotSavart(coils[:2], currents[:2], 2, True))]:
+    bs.set_points(points)
+    res[name + "_B"] = bs.B()
+    res[name + "_dB"] = bs.dB_by_dX()
+    res_B, res_dB = bs.B_and_dB_vjp(v, vgrad)
+    for i in range(len(res_B)):
+        res[f"{name}_vjp_B_{i}"] = res_B[i]
+        res[f"{name}_vjp_dB_{i}"] = res_dB[i]
+np.savez(sys.argv[1], **res)
+"""
+        testdir = os.path.dirname(os.path.abspath(__file__))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            results = []
+            for nthreads in [1, 2, 3, 7]:
+                fname = os.path.join(tmpdir, f"res_{nthreads}.npz")
+                env = dict(os.environ, OMP_NUM_THREADS=str(nthreads))
+                subprocess.run([sys.executable, "-c", script, fname, testdir], env=env, check=True)
+                with np.load(fname) as data:
+                    results.append({k: data[k] for k in data.files})
+        for res in results[1:]:
+            assert res.keys() == results[0].keys()
+            for k in res:
+                assert np.array_equal(res[k], results[0][k]), k
+
+    def test_biotsavart_clone(self):
+        coils = [get_coil(perturb=True) for i in range(2)]
+        currents = [1e4, -2e4]
+        bs = BiotSavart(coils, currents)
+        np.random.seed(1)
+        points = np.random.uniform(low=-1.5, high=1.5, size=(20, 3))
+        B = bs.set_points(points).B()
+        dB = bs.dB_by_dX()
+        bs_clone = bs.clone()
+        assert np.allclose(bs_clone.set_points(points).B(), B)
+        assert np.allclose(bs_clone.dB_by_dX(), dB)
+        # the clone has its own cache
+        bs_clone.set_points(points[:5, :])
+        assert bs.B().shape == (20, 3)
+        assert np.allclose(bs.B(), B)
+
+    def test_symmetric_biotsavart_matches_coilcollection(self):
+        np.random.seed(1)
+        points = np.random.uniform(low=-1.5, high=1.5, size=(50, 3))
+        for nfp, stellsym in [(1, True), (3, False), (2, True)]:
+            coils = [get_coil(perturb=True) for i in range(2)]
+            currents = [1e4, -2e4]
+            cc = CoilCollection(coils, currents, nfp, stellsym)
+            bs = BiotSavart(cc.coils, cc.currents).set_points(points)
+            bs_sym = SymmetricBiotSavart(coils, currents, nfp, stellsym).set_points(points)
+            assert np.allclose(bs_sym.B(), bs.B())
+            assert np.allclose(bs_sym.dB_by_dX(), bs.dB_by_dX())
+            assert np.allclose(bs_sym.d2B_by_dXdX(), bs.d2B_by_dXdX())
+            assert np.allclose(bs_sym.A(), bs.A())
+            assert np.allclose(bs_sym.dA_by_dX(), bs.dA_by_dX())
+            B_point, _ = bs_sym.evaluate_point(*points[0])
+            assert np.allclose(B_point, bs.B()[0])
+            # the per coil quantities contain all copies of a base coil
+            dB_by_dcoilcurrents = bs.dB_by_dcoilcurrents()
+            for i in range(len(coils)):
+                Bi = sum(cc.current_sign[j] * dB_by_dcoilcurrents[j] for j in range(len(cc.coils)) if cc.map[j] == i)
+                assert np.allclose(bs_sym.dB_by_dcoilcurrents()[i], Bi)
+            # the vector Jacobian products of the copies are summed up onto
+            # the dofs of the base coils
+            v = np.random.standard_normal(size=(len(points), 3))
+            vgrad = np.random.standard_normal(size=(len(points), 3, 3))
+            res_B, res_dB = bs.B_and_dB_vjp(v, vgrad)
+            res_B_sym, res_dB_sym = bs_sym.B_and_dB_vjp(v, vgrad)
+            for i in range(len(coils)):
+                assert np.allclose(res_B_sym[i], sum(res_B[j] for j in range(len(cc.coils)) if cc.map[j] == i))
+                assert np.allclose(res_dB_sym[i], sum(res_dB[j] for j in range(len(cc.coils)) if cc.map[j] == i))
+                assert np.allclose(bs_sym.B_vjp(v)[i], res_B_sym[i])
+            # the treecode includes the copies of the coils
+            bs_tree = SymmetricBiotSavart(coils, currents, nfp, stellsym, treecode_theta=0.15, treecode_threshold=0).set_points(points)
+            assert np.linalg.norm(bs_tree.B()-bs.B()) < 1e-3 * np.linalg.norm(bs.B())
+
+    def test_biotsavart_fused_vjp(self):
+        np.random.seed(1)
+        points = np.random.uniform(low=-1.5, high=1.5, size=(301, 3))
+        v = np.random.standard_normal(size=(len(points), 3))
+        vgrad = np.random.standard_normal(size=(len(points), 3, 3))
+        coils = [get_coil(perturb=True) for i in range(3)]
+        currents = [1e4, -2e4, 3e4]
+        for bs in [BiotSavart(coils, currents), SymmetricBiotSavart(coils, currents, 2, True)]:
+            bs.set_points(points)
+            B, dB = bs.B().copy(), bs.dB_by_dX().copy()
+            res_B, res_dB = bs.B_and_dB_vjp(v, vgrad)
+            bs.set_points(points)
+            B_fused, res_B_fused = bs.B_and_vjp(v)
+            assert np.allclose(B_fused, B)
+            for i in range(len(coils)):
+                assert np.allclose(res_B_fused[i], res_B[i])
+            bs.set_points(points)
+            B_fused, dB_fused, res_B_fused, res_dB_fused = bs.B_and_vjp(v, vgrad)
+            assert np.allclose(B_fused, B)
+            assert np.allclose(dB_fused, dB)
+            for i in range(len(coils)):
+                assert np.allclose(res_B_fused[i], res_B[i])
+                assert np.allclose(res_dB_fused[i], res_dB[i])
+
+    def test_biotsavart_without_coil_fields(self):
+        # summing up the coils directly into the total field gives the same
+        # result, and the per coil quantities are computed on demand.
+        np.random.seed(1)
+        points = np.random.uniform(low=-1.5, high=1.5, size=(1001, 3))
+        coils = [get_coil(perturb=True) for i in range(3)]
+        currents = [1e4, -2e4, 3e4]
+        for kwargs in [{}, {"nfp": 2, "stellarator_symmetry": True}]:
+            cls = SymmetricBiotSavart if kwargs else BiotSavart
+            bs = cls(coils, currents, **kwargs).set_points(points)
+            bs_acc = cls(coils, currents, store_coil_fields=False, **kwargs).set_points(points)
+            assert not bs_acc.get_store_coil_fields()
+            assert bs_acc.estimate_memory(2) < bs.estimate_memory(2)
+            assert np.allclose(bs_acc.B(), bs.B())
+            assert np.allclose(bs_acc.dB_by_dX(), bs.dB_by_dX())
+            assert np.allclose(bs_acc.d2B_by_dXdX(), bs.d2B_by_dXdX())
+            assert np.allclose(bs_acc.A(), bs.A())
+            assert np.allclose(bs_acc.dA_by_dX(), bs.dA_by_dX())
+            assert not bs_acc.fieldcache_get_status('B_0')
+            for i in range(len(coils)):
+                assert np.allclose(bs_acc.dB_by_dcoilcurrents()[i], bs.dB_by_dcoilcurrents()[i])
+                assert np.allclose(bs_acc.d2B_by_dXdcoilcurrents()[i], bs.d2B_by_dXdcoilcurrents()[i])
+        bs = BiotSavart(coils, currents).set_points(points)
+        bs_acc = BiotSavart(coils, currents, store_coil_fields=False).set_points(points)
+        # the coils are summed up in the same order
+        assert np.array_equal(bs_acc.B(), bs.B())
+        # the scratch arrays of the larger blocks are reused for fewer points
+        B_few = BiotSavart(coils, currents).set_points(points[:100]).B()
+        assert np.array_equal(bs_acc.set_points(points[:100]).B(), B_few)
+        # switching the mode invalidates the cached fields
+        bs.set_points(points[:100]).B()
+        assert bs.fieldcache_get_status('B_0')
+        bs.set_store_coil_fields(False)
+        assert not bs.fieldcache_get_status('B_0')
+        misses = bs.cache_statistics()["misses"]
+        assert np.array_equal(bs.B(), B_few)
+        assert bs.cache_statistics()["misses"] > misses
+
+    def test_biotsavart_cache_reuses_buffers(self):
+        coils = [get_coil(perturb=True) for i in range(3)]
+        currents = [1e4, -2e4, 3e4]
+        np.random.seed(1)
+        points_a = np.random.uniform(low=-1.5, high=1.5, size=(100, 3))
+        points_b = np.random.uniform(low=-1.5, high=1.5, size=(70, 3))
+        bs = BiotSavart(coils, currents)
+        B_a = bs.set_points(points_a).B().copy()
+        bs.set_points(points_b).B()
+        stats = bs.cache_statistics()
+        # alternating between the two point sets swaps the buffers instead of
+        # allocating new ones
+        for i in range(3):
+            assert np.allclose(bs.set_points(points_a).B(), B_a)
+            bs.set_points(points_b).B()
+        stats_after = bs.cache_statistics()
+        assert stats_after["reuses"] > stats["reuses"]
+        assert stats_after["misses"] > stats["misses"]
+        assert stats_after["allocations"] - stats["allocations"] < stats_after["reuses"] - stats["reuses"]
+        bs.B()
+        assert bs.cache_statistics()["hits"] > stats_after["hits"]
+        # fewer points use the first entries of the larger buffers
+        stats = bs.cache_statistics()
+        B_b = bs.set_points(points_b[:50]).B()
+        assert bs.cache_statistics()["reuses"] >= stats["reuses"] + len(coils)
+        assert np.allclose(B_b, BiotSavart(coils, currents).set_points(points_b[:50]).B())
+        assert np.allclose(bs.dB_by_dcoilcurrents()[1], BiotSavart([coils[1]], [1.]).set_points(points_b[:50]).B())
+        # with a budget, the per coil arrays are released even if they are
+        # still valid, and recomputed when they are needed again
+        bs.set_cache_budget(0)
+        assert bs.get_cache_budget() == 0
+        assert bs.cache_statistics()["evictions"] >= len(coils)
+        assert bs.cache_statistics()["bytes"] < stats_after["bytes"]
+        assert not bs.fieldcache_get_status('B_0')
+        assert np.allclose(bs.set_points(points_a).B(), B_a)
+        assert np.allclose(bs.dB_by_dcoilcurrents()[0], BiotSavart([coils[0]], [1.]).set_points(points_a).B())
+
     def test_biotsavart_exponential_convergence(self):
         coil = get_coil()
         from time import time
@@ -216,6 +475,33 @@ class Testing(unittest.TestCase):
         err = np.max(np.abs(curlA - B))
         assert err < 1e-14
 
+    def test_biotsavart_A_matches_direct_sum(self):
+        coils = [get_coil(perturb=True) for i in range(3)]
+        currents = [1e4, -2e4, 3e4]
+        bs = BiotSavart(coils, currents)
+        np.random.seed(1)
+        points = np.random.uniform(-1, 1, size=(17, 3))
+        bs.set_points(points)
+        A, dA, ddA = bs.A(), bs.dA_by_dX(), bs.d2A_by_dXdX()
+        A_ref = np.zeros((17, 3))
+        dA_ref = np.zeros((17, 3, 3))
+        ddA_ref = np.zeros((17, 3, 3, 3))
+        for coil, current in zip(coils, currents):
+            gamma, gammadash = coil.gamma(), coil.gammadash()
+            fak = current * 1e-7/gamma.shape[0]
+            diff = points[:, None, :] - gamma[None, :, :]
+            dist = np.linalg.norm(diff, axis=2)
+            A_ref += fak * np.einsum('ij,jl->il', 1/dist, gammadash)
+            dA_ref -= fak * np.einsum('ijk,ij,jl->ikl', diff, 1/dist**3, gammadash)
+            ddA_ref += fak * np.einsum('ijk,ijm,ij,jl->ikml', diff, diff, 3/dist**5, gammadash)
+            ddA_ref -= fak * np.einsum('km,ij,jl->ikml', np.eye(3), 1/dist**3, gammadash)
+        assert np.allclose(A, A_ref, rtol=1e-12, atol=1e-14*np.max(np.abs(A_ref)))
+        assert np.allclose(dA, dA_ref, rtol=1e-12, atol=1e-14*np.max(np.abs(dA_ref)))
+        assert np.allclose(ddA, ddA_ref, rtol=1e-12, atol=1e-14*np.max(np.abs(ddA_ref)))
+        # the per coil contributions are stored for unit current
+        A_coils = bs.dA_by_dcoilcurrents()
+        assert np.allclose(sum(c * Ai for c, Ai in zip(currents, A_coils)), A)
+
     def subtest_biotsavart_dAdX_taylortest(self, idx):
         coil = get_coil()
         bs = BiotSavart([coil], [1e4])
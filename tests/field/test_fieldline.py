@@ -72,6 +72,48 @@ class FieldlineTesting(unittest.TestCase):
         rtest = [[np.sqrt((np.sqrt(res_tys[i][j][1]**2+res_tys[i][j][2]**2)-R0test)**2+res_tys[i][j][3]**2)-R0[i]+R0test for j in range(len(res_tys[i]))] for i in range(len(res_tys))]
         assert [np.allclose(rtest[i], 0., rtol=1e-5, atol=1e-5) for i in range(nlines)]
 
+    def test_poincare_tokamak_packets(self):
+        # Tracing packets of field lines in lockstep should give the same
+        # result as tracing them one after another.
+        R0test = 1.0
+        B0test = 1.0
+        qtest = 3.2
+        Bfield = ToroidalField(R0test, B0test)+PoloidalField(R0test, B0test, qtest)
+        nlines = 5
+        R0 = [1.05 + i*0.02 for i in range(nlines)]
+        Z0 = [0 for i in range(nlines)]
+        nphis = 4
+        phis = np.linspace(0, 2*np.pi, nphis, endpoint=False)
+        res_tys, res_phi_hits = compute_fieldlines(
+            Bfield, R0, Z0, tmax=10, phis=phis, stopping_criteria=[])
+        res_tys_packet, res_phi_hits_packet = compute_fieldlines(
+            Bfield, R0, Z0, tmax=10, phis=phis, stopping_criteria=[], packet_size=3)
+        for i in range(nlines):
+            assert res_tys[i].shape == res_tys_packet[i].shape
+            assert np.allclose(res_tys[i], res_tys_packet[i], rtol=1e-6, atol=1e-6)
+            assert res_phi_hits[i].shape == res_phi_hits_packet[i].shape
+            assert np.allclose(res_phi_hits[i], res_phi_hits_packet[i], rtol=1e-6, atol=1e-6)
+
+    def test_fieldlines_packet_size_one(self):
+        # Without packets, the field is evaluated point by point as in
+        # `fieldline_tracing`, which doesn't use the batched evaluation and
+        # the cache of the field, so the results are bitwise identical.
+        coils, currents, ma = get_ncsx_data(Nt_coils=5)
+        stellarator = CoilCollection(coils, currents, 3, True)
+        bs = BiotSavart(stellarator.coils, stellarator.currents)
+        r0 = np.linalg.norm(ma.gamma()[0, :2])
+        z0 = ma.gamma()[0, 2]
+        R0 = [r0, r0 + 0.01]
+        Z0 = [z0, z0]
+        phis = np.linspace(0, 2*np.pi/3, 4, endpoint=False)
+        res_tys, res_phi_hits = compute_fieldlines(
+            bs, R0, Z0, tmax=20, phis=phis, stopping_criteria=[], packet_size=1)
+        for i in range(len(R0)):
+            res_ty, res_phi_hit = sopp.fieldline_tracing(
+                bs, [R0[i], 0., Z0[i]], tmax=20, tol=1e-7, phis=phis, stopping_criteria=[])
+            assert np.array_equal(res_tys[i], np.asarray(res_ty))
+            assert np.array_equal(res_phi_hits[i], np.asarray(res_phi_hit))
+
     def test_poincare_plot(self):
         coils, currents, ma = get_ncsx_data(Nt_coils=15)
         nfp = 3
@@ -114,6 +156,23 @@ class FieldlineTesting(unittest.TestCase):
         for i in range(len(phis)-1):
             assert np.linalg.norm(ma.gamma()[i+1, :] - res_phi_hits[0][i, 2:5]) < 1e-4
 
+    def test_fieldlines_biotsavart_threads(self):
+        # BiotSavart supports clone(), so the field lines are traced on
+        # several threads at once. This should not change the result.
+        coils, currents, ma = get_ncsx_data(Nt_coils=10)
+        stellarator = CoilCollection(coils, currents, 3, True)
+        bs = BiotSavart(stellarator.coils, stellarator.currents)
+        nlines = 4
+        xyz_inits = np.zeros((nlines, 3))
+        xyz_inits[:, 0] = [np.linalg.norm(ma.gamma()[0, :2]) + i*0.02 for i in range(nlines)]
+        xyz_inits[:, 2] = ma.gamma()[0, 2]
+        phis = [0., np.pi/3]
+        res_batch = sopp.fieldline_tracing_batch(bs, xyz_inits, 2, 1e-7, phis=phis)
+        for i in range(nlines):
+            res_ty, res_phi_hit = sopp.fieldline_tracing(bs, xyz_inits[i, :], 2, 1e-7, phis=phis)
+            assert np.allclose(np.asarray(res_batch[i][0]), np.asarray(res_ty))
+            assert np.allclose(np.asarray(res_batch[i][1]), np.asarray(res_phi_hit))
+
     def test_poincare_caryhanson(self):
         # Test with a known magnetic field - optimized Cary&Hanson configuration
         # with a magnetic axis at R=0.9413. Field created using the Biot-Savart
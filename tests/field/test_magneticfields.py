@@ -8,9 +8,13 @@ from simsopt.geo.curvehelical import CurveHelical
 from simsopt.field.biotsavart import BiotSavart
 from simsopt.geo.coilcollection import CoilCollection
 from simsopt.util.zoo import get_ncsx_data
+from simsopt.field.tracing import LevelsetStoppingCriterion
+import simsoptpp as sopp
 
 import numpy as np
 import unittest
+import tempfile
+import os
 
 try:
     import pyevtk
@@ -64,6 +68,26 @@ class Testing(unittest.TestCase):
         assert np.allclose(GradGradB1, transpGradGradB1)
         assert np.allclose(GradGradA1, transpGradGradA1)
 
+    def test_cache_budget(self):
+        np.random.seed(1)
+        points_a = np.random.uniform(low=0.5, high=1.5, size=(100, 3))
+        points_b = np.random.uniform(low=0.5, high=1.5, size=(20, 3))
+        Bfield = ToroidalField(1.3, 0.8)
+        assert Bfield.get_cache_budget() < 0
+        Bfield.set_points(points_a)
+        Bfield.B()
+        Bfield.dB_by_dX()
+        stats = Bfield.cache_statistics()
+        assert stats["evictions"] == 0
+        # the quantities at the old points are released when new points are set
+        Bfield.set_cache_budget(0)
+        assert Bfield.get_cache_budget() == 0
+        Bfield.set_points(points_b)
+        stats_after = Bfield.cache_statistics()
+        assert stats_after["evictions"] >= 2
+        assert stats_after["bytes"] < stats["bytes"]
+        assert np.allclose(Bfield.B(), ToroidalField(1.3, 0.8).set_points(points_b).B())
+
     def test_sum_Bfields(self):
         pointVar = 1e-1
         npoints = 20
@@ -463,6 +487,230 @@ class Testing(unittest.TestCase):
         assert np.allclose(Bc, Bhc, rtol=1e-2)
         assert np.allclose(dBc, dBhc, rtol=1e-2)
 
+    def test_interpolated_field_cache_dir(self):
+        coils, currents, _ = get_ncsx_data(Nt_coils=5, Nt_ma=10, ppp=5)
+        stellarator = CoilCollection(coils, currents, 3, True)
+        bs = BiotSavart(stellarator.coils, stellarator.currents)
+        rrange = [1.5, 1.7, 4]
+        phirange = [0, 2*np.pi/3, 8]
+        zrange = [0, 0.1, 4]
+        N = 100
+        points = np.random.uniform(size=(N, 3))
+        points[:, 0] = points[:, 0]*(rrange[1]-rrange[0]) + rrange[0]
+        points[:, 1] = points[:, 1]*(phirange[1]-phirange[0]) + phirange[0]
+        points[:, 2] = points[:, 2]*(zrange[1]-zrange[0]) + zrange[0]
+        with tempfile.TemporaryDirectory() as cache_dir:
+            bsh = InterpolatedField(bs, 2, rrange, phirange, zrange, True, nfp=3, stellsym=True)
+            bsh.set_points_cyl(points)
+            B = bsh.B()
+            dB = bsh.GradAbsB()
+            # the first field builds and stores the tables, the second one loads them
+            for i in range(2):
+                bsh_cached = InterpolatedField(bs, 2, rrange, phirange, zrange, True, nfp=3, stellsym=True, cache_dir=cache_dir)
+                assert len(os.listdir(cache_dir)) == 2
+                bsh_cached.set_points_cyl(points)
+                assert np.allclose(B, bsh_cached.B(), rtol=1e-14, atol=1e-14)
+                assert np.allclose(dB, bsh_cached.GradAbsB(), rtol=1e-14, atol=1e-14)
+            # a different grid or a different field must not reuse the tables
+            InterpolatedField(bs, 2, rrange, phirange, [0, 0.1, 5], True, nfp=3, stellsym=True, cache_dir=cache_dir)
+            assert len(os.listdir(cache_dir)) == 4
+            btotal = bs + ToroidalField(1.5, 0.8)
+            InterpolatedField(btotal, 2, rrange, phirange, zrange, True, nfp=3, stellsym=True, cache_dir=cache_dir)
+            assert len(os.listdir(cache_dir)) == 6
+            # a file that does not match the key is not loaded
+            key = InterpolatedField._cache_key(bs, 2, rrange, phirange, zrange, 3, True)
+            files = [os.path.join(cache_dir, f"interpolant_{key}_{s}.bin") for s in ["B", "GradAbsB"]]
+            assert bsh_cached.load(*files, key)
+            assert not bsh_cached.load(*files, "wrongkey")
+            # stray and truncated files are not loaded either, but rebuilt.
+            # The files are replaced rather than overwritten, since the tables
+            # of bsh_cached are memory mapped.
+            with open(files[1], "rb") as f:
+                truncated = f.read()[:os.path.getsize(files[1])//2]
+            for filename, content in zip(files, [b"not an interpolation table", truncated]):
+                with open(filename + ".new", "wb") as f:
+                    f.write(content)
+                os.replace(filename + ".new", filename)
+            assert not bsh_cached.load(*files, key)
+            bsh_rebuilt = InterpolatedField(bs, 2, rrange, phirange, zrange, True, nfp=3, stellsym=True, cache_dir=cache_dir)
+            bsh_rebuilt.set_points_cyl(points)
+            assert np.allclose(B, bsh_rebuilt.B(), rtol=1e-14, atol=1e-14)
+            assert bsh_cached.load(*files, key)
+
+    def test_interpolated_field_distributed_build(self):
+        # The interpolant of a BiotSavart field is built on several threads,
+        # building it from values computed elsewhere (e.g. on different MPI
+        # ranks) has to give the same result.
+        coils, currents, _ = get_ncsx_data(Nt_coils=5, Nt_ma=10, ppp=5)
+        stellarator = CoilCollection(coils, currents, 3, True)
+        bs = BiotSavart(stellarator.coils, stellarator.currents)
+        rrange = [1.5, 1.7, 4]
+        phirange = [0, 2*np.pi/3, 8]
+        zrange = [0, 0.1, 4]
+        bsh = InterpolatedField(bs, 2, rrange, phirange, zrange, True, nfp=3, stellsym=True)
+        bsh_manual = InterpolatedField(bs, 2, rrange, phirange, zrange, True, nfp=3, stellsym=True)
+        nodes = bsh_manual.interpolation_nodes()
+        assert nodes.shape == ((4*2+1)*(8*2+1)*(4*2+1), 3)
+        halves = [nodes[:100, :], nodes[100:, :]]
+        B = []
+        GradAbsB = []
+        for h in halves:
+            bs.set_points_cyl(np.ascontiguousarray(h))
+            B.append(bs.B_cyl().copy())
+            GradAbsB.append(bs.GradAbsB_cyl().copy())
+        bsh_manual.set_interpolation_values(np.concatenate(B), np.concatenate(GradAbsB))
+        fields = [bsh_manual]
+        try:
+            from mpi4py import MPI
+            fields.append(InterpolatedField(bs, 2, rrange, phirange, zrange, True, nfp=3, stellsym=True, comm=MPI.COMM_WORLD))
+        except ImportError:
+            pass
+
+        points = np.random.uniform(size=(100, 3))
+        points[:, 0] = points[:, 0]*(rrange[1]-rrange[0]) + rrange[0]
+        points[:, 1] = points[:, 1]*(phirange[1]-phirange[0]) + phirange[0]
+        points[:, 2] = points[:, 2]*(zrange[1]-zrange[0]) + zrange[0]
+        bsh.set_points_cyl(points)
+        for f in fields:
+            f.set_points_cyl(points)
+            assert np.allclose(bsh.B(), f.B(), rtol=1e-13, atol=1e-13)
+            assert np.allclose(bsh.GradAbsB(), f.GradAbsB(), rtol=1e-13, atol=1e-13)
+
+    def test_interpolated_field_adaptive(self):
+        coils, currents, _ = get_ncsx_data(Nt_coils=5, Nt_ma=10, ppp=5)
+        stellarator = CoilCollection(coils, currents, 3, True)
+        bs = BiotSavart(stellarator.coils, stellarator.currents)
+        rrange = [1.5, 1.8, 3]
+        phirange = [0, 2*np.pi/3, 4]
+        zrange = [0, 0.1, 2]
+        bsh = InterpolatedField(bs, 2, rrange, phirange, zrange, True, nfp=3, stellsym=True)
+        err_uniform = np.mean(bsh.estimate_error_B(1000))
+        bsh_adaptive = InterpolatedField(bs, 2, rrange, phirange, zrange, True, nfp=3, stellsym=True,
+                                         adaptive_tol=err_uniform/100, adaptive_max_level=4)
+        err_adaptive = np.mean(bsh_adaptive.estimate_error_B(1000))
+        print(err_uniform, err_adaptive)
+        assert err_adaptive < err_uniform/10
+
+        # cells outside of r=1.65 are skipped
+        def skip(rs, phis, zs):
+            return [r > 1.65 for r in rs]
+        bsh_skip = InterpolatedField(bs, 2, rrange, phirange, zrange, True, nfp=3, stellsym=True,
+                                     adaptive_tol=err_uniform/100, adaptive_max_level=4, skip=skip)
+        points = np.asarray([[1.55, 0.1, 0.05]])
+        bsh_adaptive.set_points_cyl(points)
+        bsh_skip.set_points_cyl(points)
+        assert np.allclose(bsh_adaptive.B(), bsh_skip.B())
+        bsh_skip.set_points_cyl(np.asarray([[1.75, 0.1, 0.05]]))
+        with self.assertRaises(RuntimeError):
+            bsh_skip.B()
+
+    def test_adaptive_interpolant_levelset(self):
+        def f(xs, ys, zs):
+            return list(0.5 - np.sqrt((np.asarray(xs)-1)**2 + np.asarray(zs)**2 + 0.01))
+        rule = sopp.UniformInterpolationRule(2)
+        interp = sopp.AdaptiveGridInterpolant3D(rule, [0.2, 1.8, 4], [0, 2*np.pi, 8], [-0.8, 0.8, 4], 1, True, 1e-6, 5)
+        interp.interpolate_batch(f)
+        assert interp.ncells() > 4*8*4
+        assert interp.nskipped() == 0
+        rs = np.random.uniform(0.2, 1.8, size=(100, ))
+        zs = np.random.uniform(-0.8, 0.8, size=(100, ))
+        for r, z in zip(rs, zs):
+            assert abs(interp.evaluate(r, 0.5, z)[0] - f([r], [0.5], [z])[0]) < 1e-4
+        # the adaptive interpolant can be used wherever the regular one is accepted
+        sc = LevelsetStoppingCriterion(interp)
+        assert isinstance(sc, sopp.StoppingCriterion)
+
+    def test_interpolated_field_single_precision(self):
+        coils, currents, _ = get_ncsx_data(Nt_coils=5, Nt_ma=10, ppp=5)
+        stellarator = CoilCollection(coils, currents, 3, True)
+        bs = BiotSavart(stellarator.coils, stellarator.currents)
+        rrange = [1.5, 1.8, 4]
+        phirange = [0, 2*np.pi/3, 6]
+        zrange = [0, 0.1, 2]
+        bsh = InterpolatedField(bs, 4, rrange, phirange, zrange, True, nfp=3, stellsym=True)
+        bsh_float = InterpolatedField(bs, 4, rrange, phirange, zrange, True, nfp=3, stellsym=True, precision="float")
+        assert bs.get_precision() == "double"
+        np.random.seed(1)
+        points = np.random.uniform(size=(20, 3)) * np.asarray([[0.3, 2*np.pi/3, 0.1]]) + np.asarray([[1.5, 0, 0]])
+        bsh.set_points_cyl(points)
+        bsh_float.set_points_cyl(points)
+        err = np.max(np.abs(bsh.B() - bsh_float.B()))/np.max(np.abs(bsh.B()))
+        assert err < 1e-5
+        with self.assertRaises(ValueError):
+            InterpolatedField(ToroidalField(1.0, 1.0), 2, rrange, phirange, zrange, True, precision="float")
+
+    def test_interpolated_field_skip(self):
+        coils, currents, _ = get_ncsx_data(Nt_coils=5, Nt_ma=10, ppp=5)
+        stellarator = CoilCollection(coils, currents, 3, True)
+        bs = BiotSavart(stellarator.coils, stellarator.currents)
+        rrange = [1.5, 1.8, 6]
+        phirange = [0, 2*np.pi/3, 4]
+        zrange = [0, 0.1, 2]
+
+        # cells outside of r=1.65 are skipped
+        def skip(rs, phis, zs):
+            return [r > 1.65 for r in rs]
+        bsh = InterpolatedField(bs, 2, rrange, phirange, zrange, True, nfp=3, stellsym=True)
+        bsh_skip = InterpolatedField(bs, 2, rrange, phirange, zrange, True, nfp=3, stellsym=True, skip=skip)
+        points = np.asarray([[1.55, 0.1, 0.05], [1.62, 1.0, 0.02]])
+        bsh.set_points_cyl(points)
+        bsh_skip.set_points_cyl(points)
+        assert np.allclose(bsh.B(), bsh_skip.B())
+        assert np.allclose(bsh.GradAbsB(), bsh_skip.GradAbsB())
+        bsh_skip.set_points_cyl(np.asarray([[1.75, 0.1, 0.05]]))
+        with self.assertRaises(RuntimeError):
+            bsh_skip.B()
+
+        # only the cells that are not skipped are stored, also in the cache
+        with tempfile.TemporaryDirectory() as cache_dir:
+            bsh_cached = InterpolatedField(bs, 2, rrange, phirange, zrange, True, nfp=3, stellsym=True,
+                                           skip=skip, cache_dir=cache_dir)
+            bsh_cached.set_points_cyl(points)
+            assert np.allclose(bsh.B(), bsh_cached.B())
+
+        def f(xs, ys, zs):
+            return list(np.asarray(xs)**2 + np.asarray(zs))
+        rule = sopp.UniformInterpolationRule(2)
+        interp = sopp.RegularGridInterpolant3D(rule, [0., 1., 10], [0., 1., 10], [0., 1., 10], 1, True)
+        interp.skip_cells(lambda xs, ys, zs: [x > 0.45 for x in xs])
+        interp.interpolate_batch(f)
+        assert interp.ncells() == 5*10*10
+        assert abs(interp.evaluate(0.3, 0.4, 0.5)[0] - f([0.3], [0.4], [0.5])[0]) < 1e-12
+        assert not interp.is_skipped(0.3, 0.4, 0.5)
+        assert interp.is_skipped(0.7, 0.4, 0.5)
+        with self.assertRaises(RuntimeError):
+            interp.evaluate(0.7, 0.4, 0.5)
+
+    def test_evaluate_point(self):
+        # the single point evaluation used by the tracers has to agree with the
+        # cached evaluation, for C++ fields, fields implemented in python and
+        # interpolated fields (including points that are mapped by symmetry).
+        coils, currents, _ = get_ncsx_data(Nt_coils=5, Nt_ma=10, ppp=5)
+        stellarator = CoilCollection(coils, currents, 3, True)
+        bs = BiotSavart(stellarator.coils, stellarator.currents)
+        bsh = InterpolatedField(bs, 2, [1.4, 1.8, 6], [0, 2*np.pi/3, 12], [0, 0.2, 4], True, nfp=3, stellsym=True)
+        fields = [
+            bs, bsh, ToroidalField(1.3, 0.8), PoloidalField(1.0, 1.0, 3.2),
+            Dommaschk(mn=[[10, 2], [15, 3]], coeffs=[[-2.18, -2.18], [25.8, -25.8]]),
+            Reiman(iota0=0.15, iota1=0.38, k=[6], epsilonk=[0.01])
+        ]
+        points_cyl = np.asarray([[1.55, 0.1, 0.05], [1.62, 2.5, -0.12], [1.71, 4.4, 0.02]])
+        points = np.stack((points_cyl[:, 0]*np.cos(points_cyl[:, 1]),
+                           points_cyl[:, 0]*np.sin(points_cyl[:, 1]),
+                           points_cyl[:, 2]), axis=1)
+        for field in fields:
+            field.set_points(points)
+            B = field.B()
+            GradAbsB = field.GradAbsB()
+            for i in range(points.shape[0]):
+                B_point, GradAbsB_point = field.evaluate_point(*points[i])
+                assert np.allclose(B_point, B[i], rtol=1e-12, atol=1e-14)
+                assert np.allclose(GradAbsB_point, GradAbsB[i], rtol=1e-12, atol=1e-14)
+        # for fields implemented in C++ the points are left untouched
+        bs.set_points(points)
+        bs.evaluate_point(1.0, 0.2, 0.1)
+        assert np.allclose(bs.get_points_cart(), points)
+
     def test_interpolated_field_convergence_rate(self):
         R0test = 1.5
         B0test = 0.8
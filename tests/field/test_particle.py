@@ -4,20 +4,31 @@ from simsopt.geo.curvexyzfourier import CurveXYZFourier
 from simsopt.util.zoo import get_ncsx_data
 from simsopt.field.tracing import trace_particles_starting_on_curve, SurfaceClassifier, \
     particles_to_vtk, LevelsetStoppingCriterion, compute_gc_radius, gc_to_fullorbit_initial_guesses, \
-    IterationStoppingCriterion, trace_particles_starting_on_surface
+    trace_particles_boozer, MaxToroidalFluxStoppingCriterion, MinToroidalFluxStoppingCriterion, \
+    CallbackSink, NpzSink, HDF5Sink, \
+    IterationStoppingCriterion, trace_particles_starting_on_surface, trace_particles, compute_fieldlines
 from simsopt.geo.surfacerzfourier import SurfaceRZFourier
+from simsopt.field.boozermagneticfield import BoozerSpectralField
 from simsopt.field.magneticfieldclasses import InterpolatedField, UniformInterpolationRule, ToroidalField, PoloidalField
-from simsopt.util.constants import PROTON_MASS, ELEMENTARY_CHARGE, ONE_EV
+from simsopt.util.constants import PROTON_MASS, ELEMENTARY_CHARGE, ONE_EV, ALPHA_PARTICLE_MASS, ALPHA_PARTICLE_CHARGE, \
+    FUSION_ALPHA_PARTICLE_ENERGY
 import simsoptpp as sopp
 import numpy as np
 import unittest
 import logging
+import os
+import tempfile
 logging.basicConfig()
 try:
     import pyevtk
     with_evtk = True
 except ImportError:
     with_evtk = False
+try:
+    import h5py
+    with_h5py = True
+except ImportError:
+    with_h5py = False
 
 
 def validate_phi_hits(phi_hits, bfield, nphis):
@@ -130,6 +141,91 @@ class ParticleTracingTesting(unittest.TestCase):
                 dist = np.linalg.norm(gc_xyzs[j, :] - fo_ty[jdx, 1:4])
                 assert dist < 8*r
 
+    def test_guidingcenter_batch_matches_single_particle(self):
+        bsh = self.bsh
+        ma = self.ma
+        nparticles = 4
+        m = PROTON_MASS
+        q = ELEMENTARY_CHARGE
+        Ekin = 1000*ONE_EV
+        speed_total = np.sqrt(2*Ekin/m)
+        np.random.seed(1)
+        xyz_inits = ma.gamma()[np.random.randint(0, ma.gamma().shape[0], size=(nparticles, ))]
+        speed_pars = speed_total * np.random.uniform(-0.75, 0.75, size=(nparticles, ))
+        phis = [(i/4)*(2*np.pi/ma.nfp) for i in range(4)]
+        res_batch = sopp.particle_guiding_center_tracing_batch(
+            bsh, xyz_inits, m, q, speed_total, speed_pars, 1e-5, 1e-9,
+            vacuum=True, phis=phis)
+        assert len(res_batch) == nparticles
+        for i in range(nparticles):
+            res_ty, res_phi_hit = sopp.particle_guiding_center_tracing(
+                bsh, xyz_inits[i, :], m, q, speed_total, speed_pars[i], 1e-5, 1e-9,
+                vacuum=True, phis=phis)
+            assert np.allclose(np.asarray(res_batch[i][0]), np.asarray(res_ty), rtol=1e-12, atol=1e-14)
+            assert np.allclose(np.asarray(res_batch[i][1]), np.asarray(res_phi_hit), rtol=1e-12, atol=1e-14)
+
+        # advancing the particles in packets uses the same method and step
+        # size control, only rounding and the dense output used for the last
+        # point and the phi hits differ
+        res_packet = sopp.particle_guiding_center_tracing_batch(
+            bsh, xyz_inits, m, q, speed_total, speed_pars, 1e-5, 1e-9,
+            vacuum=True, phis=phis, packet_size=3)
+        for i in range(nparticles):
+            res_ty = np.asarray(res_batch[i][0])
+            res_ty_packet = np.asarray(res_packet[i][0])
+            assert res_ty.shape == res_ty_packet.shape
+            assert np.allclose(res_ty[:-1, :], res_ty_packet[:-1, :], rtol=1e-8, atol=1e-12)
+            assert np.allclose(res_ty[-1, 1:4], res_ty_packet[-1, 1:4], rtol=1e-6)
+            assert len(res_batch[i][1]) == len(res_packet[i][1])
+
+    def test_boris_fullorbit(self):
+        bsh = self.bsh
+        ma = self.ma
+        nparticles = 2
+        m = PROTON_MASS
+        q = ELEMENTARY_CHARGE
+        Ekin = 1000*ONE_EV
+        tmax = 2e-5
+        phis = [(i/4)*(2*np.pi/ma.nfp) for i in range(4)]
+        fo_tys, fo_phi_hits = trace_particles_starting_on_curve(
+            ma, bsh, nparticles, tmax=tmax, seed=1, mass=m, charge=q,
+            Ekin=Ekin, umin=0.25, umax=0.75, phis=phis, mode='full')
+        bo_tys, bo_phi_hits = trace_particles_starting_on_curve(
+            ma, bsh, nparticles, tmax=tmax, seed=1, mass=m, charge=q,
+            Ekin=Ekin, umin=0.25, umax=0.75, phis=phis, mode='full_boris')
+        speed_total = np.sqrt(2*Ekin/m)
+        for i in range(nparticles):
+            bo_ty = bo_tys[i]
+            fo_ty = fo_tys[i]
+            assert abs(bo_ty[-1, 0] - tmax) < 1e-15
+            # the pusher conserves the energy up to rounding errors
+            speeds = np.linalg.norm(bo_ty[:, 4:], axis=1)
+            assert np.max(np.abs(speeds - speed_total)) < 1e-10 * speed_total
+            # fixed time steps
+            dts = np.diff(bo_ty[:, 0])
+            assert np.allclose(dts, dts[0])
+            # the trajectory stays within a few gyro radii of the adaptive full orbit solution
+            bsh.set_points(np.ascontiguousarray(bo_ty[:, 1:4]))
+            r = compute_gc_radius(m, speed_total, q, np.min(bsh.AbsB()))
+            idxs = np.linspace(0, bo_ty.shape[0]-1, 100, dtype=int)
+            for idx in idxs:
+                jdx = np.argmin(np.abs(bo_ty[idx, 0]-fo_ty[:, 0]))
+                assert np.linalg.norm(bo_ty[idx, 1:4] - fo_ty[jdx, 1:4]) < 8*r
+            # the particle crosses the same planes in the same order (up to a
+            # crossing close to tmax)
+            nhits = min(len(bo_phi_hits[i]), len(fo_phi_hits[i]))
+            assert nhits > 0
+            assert abs(len(bo_phi_hits[i]) - len(fo_phi_hits[i])) <= 1
+            assert np.all(bo_phi_hits[i][:nhits, 1] == fo_phi_hits[i][:nhits, 1])
+            for hit in bo_phi_hits[i]:
+                phi = np.arctan2(hit[3], hit[2]) % (2*np.pi)
+                assert min(abs(phi - phis[int(hit[1])]), 2*np.pi - abs(phi - phis[int(hit[1])])) < 1e-10
+                # the velocity at the time of the hit, not the staggered one
+                # of the step
+                v = [np.interp(hit[0], bo_ty[:, 0], bo_ty[:, 4+l]) for l in range(3)]
+                assert abs(np.linalg.norm(hit[5:]) - speed_total) < 1e-10 * speed_total
+                assert np.linalg.norm(hit[5:] - v) < 1e-2 * speed_total
+
     def test_guidingcenterphihits(self):
         bsh = self.bsh
         ma = self.ma
@@ -163,6 +259,84 @@ class ParticleTracingTesting(unittest.TestCase):
             assert gc_tys[i].shape[0] == 2
             assert validate_phi_hits(gc_phi_hits[i], bsh, nphis)
 
+    def test_record_options_and_sinks(self):
+        bsh = self.bsh
+        ma = self.ma
+        nparticles = 3
+        m = PROTON_MASS
+        q = ELEMENTARY_CHARGE
+        Ekin = 9000 * ONE_EV
+        tmax = 1e-5
+        kwargs = dict(tmax=tmax, seed=1, mass=m, charge=q, Ekin=Ekin, umin=-0.1, umax=+0.1,
+                      phis=[0.], mode='gc_vac')
+        tys, phi_hits = trace_particles_starting_on_curve(ma, bsh, nparticles, **kwargs)
+        tys3, phi_hits3 = trace_particles_starting_on_curve(ma, bsh, nparticles, record_every=3, **kwargs)
+        tys0, phi_hits0 = trace_particles_starting_on_curve(ma, bsh, nparticles, record_every=0, **kwargs)
+        tysi, _ = trace_particles_starting_on_curve(ma, bsh, nparticles, record_interval=tmax/10, **kwargs)
+        # forget_exact_path takes precedence over the record options
+        tysf, _ = trace_particles_starting_on_curve(
+            ma, bsh, nparticles, record_interval=tmax/10, forget_exact_path=True, **kwargs)
+        for i in range(nparticles):
+            # the trajectories are identical, only fewer states are stored
+            assert np.allclose(tys3[i][:-1], tys[i][:-1:3])
+            assert np.allclose(tys3[i][-1], tys[i][-1])
+            assert np.allclose(tys0[i], tys[i][[0, -1]])
+            assert np.allclose(phi_hits3[i], phi_hits[i])
+            assert np.allclose(phi_hits0[i], phi_hits[i])
+            assert np.allclose(tysi[i][:, 0], np.linspace(0, tmax, 11))
+            assert np.allclose(tysi[i][-1], tys[i][-1])
+            assert np.allclose(tysf[i], tys0[i])
+
+        # the trajectories can be passed to a callback ...
+        res = {}
+
+        def callback(idx, ty, hits):
+            res[idx] = (ty, hits)
+        sink = CallbackSink(callback, chunk_size=2)
+        trace_particles_starting_on_curve(ma, bsh, nparticles, sink=sink, **kwargs)
+        assert sink.ntrajectories == nparticles and sink.nlost == 0
+        for i in range(nparticles):
+            assert np.allclose(res[i][0], tys[i])
+            assert np.allclose(res[i][1], phi_hits[i])
+
+        # ... or written to disk
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filenames = trace_particles_starting_on_curve(
+                ma, bsh, nparticles, sink=NpzSink(os.path.join(tmpdir, 'particles'), chunk_size=2), **kwargs)
+            assert len(filenames) == 2
+            data = {}
+            for filename in filenames:
+                data.update(dict(np.load(filename)))
+            for i in range(nparticles):
+                assert np.allclose(data[f'ty_{i}'], tys[i])
+                assert np.allclose(data[f'hits_{i}'], phi_hits[i])
+            # without chunks, all trajectories end up in a single file
+            filenames = trace_particles_starting_on_curve(
+                ma, bsh, nparticles, sink=NpzSink(os.path.join(tmpdir, 'all'), chunk_size=None), **kwargs)
+            assert len(filenames) == 1
+            with np.load(filenames[0]) as data:
+                for i in range(nparticles):
+                    assert np.allclose(data[f'ty_{i}'], tys[i])
+                    assert np.allclose(data[f'hits_{i}'], phi_hits[i])
+
+    @unittest.skipIf(not with_h5py, "h5py not found")
+    def test_hdf5_sink(self):
+        bsh = self.bsh
+        ma = self.ma
+        nparticles = 3
+        kwargs = dict(tmax=1e-5, seed=1, mass=PROTON_MASS, charge=ELEMENTARY_CHARGE, Ekin=9000*ONE_EV,
+                      umin=-0.1, umax=+0.1, phis=[0.], mode='gc_vac')
+        tys, phi_hits = trace_particles_starting_on_curve(ma, bsh, nparticles, **kwargs)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for chunk_size in [2, None]:
+                sink = HDF5Sink(os.path.join(tmpdir, f'particles_{chunk_size}'), chunk_size=chunk_size)
+                filename = trace_particles_starting_on_curve(ma, bsh, nparticles, sink=sink, **kwargs)
+                assert sink.ntrajectories == nparticles
+                with h5py.File(filename, 'r') as f:
+                    for i in range(nparticles):
+                        assert np.allclose(f[f'ty/{i}'][()], tys[i])
+                        assert np.allclose(f[f'hits/{i}'][()], phi_hits[i])
+
     def test_gc_to_full(self):
         N = 100
         etas = np.linspace(0, 2*np.pi, N, endpoint=False)
@@ -392,3 +566,119 @@ class ParticleTracingTesting(unittest.TestCase):
             Ekin=Ekin, umin=-0.80, umax=-0.70,
             phis=[], mode='gc_vac', tol=1e-11, stopping_criteria=[IterationStoppingCriterion(10)])
         assert len(gc_tys[0]) == 11
+
+
+class BoozerTracingTesting(unittest.TestCase):
+
+    def get_field(self, helical=0.):
+        # a large aspect ratio tokamak with |B| = B0 (1 - r/R0 cos(theta)),
+        # optionally with an additional helical ripple
+        nfp = 3
+        self.B0, R0, a = 5.7, 6., 1.8
+        self.iota = 0.8
+        ss = (np.arange(50) + 0.5)/50
+        xm = [0, 1, 1]
+        xn = [0, 0, nfp]
+        bmnc = np.asarray([self.B0*np.ones_like(ss), -self.B0*a*np.sqrt(ss)/R0, helical*self.B0*np.sqrt(ss)])
+        G = self.B0*R0*(1 + 0.1*ss**2)
+        I = 0.5*ss
+        iotas = self.iota*np.ones_like(ss)
+        self.psi0 = self.B0*a**2/2
+        return BoozerSpectralField(ss, xm, xn, bmnc, G, I, iotas, self.psi0, nfp)
+
+    def test_boozer_field(self):
+        field = self.get_field(helical=0.02)
+        stz = np.asarray([[0.3, 0.4, 0.7], [0.77, 2.1, -1.3]])
+        s, theta, zeta = stz[:, 0], stz[:, 1], stz[:, 2]
+        exact = self.B0 - self.B0*0.3*np.sqrt(s)*np.cos(theta) + 0.02*self.B0*np.sqrt(s)*np.cos(theta-3*zeta)
+        modB = field.modB(stz)
+        assert np.allclose(modB[:, 0], exact, rtol=1e-13)
+        eps = 1e-6
+        for j in range(3):
+            h = np.zeros((1, 3))
+            h[0, j] = eps
+            fd = (field.modB(stz + h)[:, 0] - field.modB(stz - h)[:, 0])/(2*eps)
+            assert np.allclose(modB[:, 1+j], fd, rtol=1e-7)
+        profiles = field.profiles(s)
+        assert np.allclose(profiles[:, 2], 0.5*s)
+        assert np.allclose(profiles[:, 3], 0.5)
+        assert np.allclose(profiles[:, 4], self.iota)
+
+    def test_boozer_invariants(self):
+        # in an axisymmetric field, the energy and the canonical toroidal
+        # momentum are conserved
+        field = self.get_field()
+        m = ALPHA_PARTICLE_MASS
+        q = ALPHA_PARTICLE_CHARGE
+        Ekin = FUSION_ALPHA_PARTICLE_ENERGY
+        nparticles = 4
+        np.random.seed(1)
+        stz_inits = np.zeros((nparticles, 3))
+        stz_inits[:, 0] = np.random.uniform(0.2, 0.4, size=(nparticles, ))
+        stz_inits[:, 1] = np.random.uniform(0, 2*np.pi, size=(nparticles, ))
+        speed_total = np.sqrt(2*Ekin/m)
+        speed_par = np.random.uniform(-0.5, 0.5, size=(nparticles, ))*speed_total
+        s_surfaces = [0.25, 0.3]
+        res_tys, res_s_hits = trace_particles_boozer(
+            field, stz_inits, speed_par, tmax=1e-4, mass=m, charge=q, Ekin=Ekin, tol=1e-11,
+            s_surfaces=s_surfaces, stopping_criteria=[MinToroidalFluxStoppingCriterion(0.01)])
+        for i in range(nparticles):
+            ty = res_tys[i]
+            assert abs(ty[-1, 0] - 1e-4) < 1e-15
+            modB = field.modB(ty[:, 1:4])[:, 0]
+            profiles = field.profiles(ty[:, 1])
+            mu = (speed_total**2 - speed_par[i]**2)/(2*modB[0])
+            energy = 0.5*ty[:, 4]**2 + mu*modB
+            assert np.max(np.abs(energy/energy[0]-1)) < 1e-7
+            ptor = m*ty[:, 4]*profiles[:, 0]/modB - q*self.psi0*self.iota*ty[:, 1]
+            assert np.max(np.abs(ptor - ptor[0])) < 1e-6*q*self.psi0
+            for hit in res_s_hits[i]:
+                assert hit[1] >= 0
+                assert abs(hit[2] - s_surfaces[int(hit[1])]) < 1e-10
+
+    def test_boozer_losses(self):
+        field = self.get_field(helical=0.02)
+        m = ALPHA_PARTICLE_MASS
+        q = ALPHA_PARTICLE_CHARGE
+        Ekin = FUSION_ALPHA_PARTICLE_ENERGY
+        nparticles = 8
+        np.random.seed(1)
+        stz_inits = np.zeros((nparticles, 3))
+        stz_inits[:, 0] = 0.9
+        stz_inits[:, 1] = np.random.uniform(0, 2*np.pi, size=(nparticles, ))
+        stz_inits[:, 2] = np.random.uniform(0, 2*np.pi, size=(nparticles, ))
+        speed_total = np.sqrt(2*Ekin/m)
+        speed_par = np.random.uniform(-0.3, 0.3, size=(nparticles, ))*speed_total
+        tmax = 1e-4
+        res_tys, res_s_hits = trace_particles_boozer(
+            field, stz_inits, speed_par, tmax=tmax, mass=m, charge=q, Ekin=Ekin,
+            stopping_criteria=[MaxToroidalFluxStoppingCriterion(1.0)])
+        nlost = 0
+        for i in range(nparticles):
+            if res_tys[i][-1, 0] < tmax:
+                nlost += 1
+                loss = res_s_hits[i][-1]
+                assert loss[1] == -1
+                assert loss[2] >= 1.0
+                assert loss[0] == res_tys[i][-1, 0]
+            else:
+                assert np.all(res_tys[i][:, 1] < 1.0)
+        assert nlost > 0
+
+    def test_stopping_criteria_coordinates(self):
+        # the criteria get (s, theta, zeta) in Boozer coordinates and (x, y, z)
+        # otherwise, so criteria for the other system are rejected
+        field = self.get_field()
+        stz_inits = np.asarray([[0.5, 0., 0.]])
+        rule = sopp.UniformInterpolationRule(1)
+        interp = sopp.RegularGridInterpolant3D(rule, [0., 1., 2], [0., 1., 2], [0., 1., 2], 1, True)
+        interp.interpolate_batch(lambda xs, ys, zs: list(np.ones((len(xs), ))))
+        with self.assertRaises(ValueError):
+            trace_particles_boozer(field, stz_inits, [0.], tmax=1e-6,
+                                   stopping_criteria=[LevelsetStoppingCriterion(interp)])
+        bfield = ToroidalField(1.0, 1.0)
+        with self.assertRaises(ValueError):
+            trace_particles(bfield, np.asarray([[1., 0., 0.]]), np.asarray([0.]), tmax=1e-6,
+                            stopping_criteria=[MaxToroidalFluxStoppingCriterion(1.0)])
+        with self.assertRaises(ValueError):
+            compute_fieldlines(bfield, [1.], [0.], tmax=1., stopping_criteria=[MinToroidalFluxStoppingCriterion(0.1)])
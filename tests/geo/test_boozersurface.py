@@ -1,9 +1,10 @@
 import unittest
+from unittest import mock
 import numpy as np
 from simsopt.geo.coilcollection import CoilCollection
 from simsopt.geo.boozersurface import BoozerSurface
 from simsopt.field.biotsavart import BiotSavart
-from simsopt.geo.surfaceobjectives import ToroidalFlux
+from simsopt.geo.surfaceobjectives import ToroidalFlux, boozer_surface_residual
 from simsopt.geo.surfaceobjectives import Area
 from simsopt.util.zoo import get_ncsx_data
 from .surface_test_helpers import get_surface, get_exact_surface
@@ -146,6 +147,95 @@ class BoozerSurfaceTests(unittest.TestCase):
             assert err < err_old * 0.55
             err_old = err
 
+    def test_boozer_surface_residual_contracted_hessian(self):
+        """
+        Compare the Hessian of the Boozer residual contracted with the residual
+        with the contraction of the full Hessian.
+        """
+        coils, currents, ma = get_ncsx_data()
+        stellarator = CoilCollection(coils, currents, 3, True)
+        bs = BiotSavart(stellarator.coils, stellarator.currents)
+        for surfacetype in surfacetypes_list:
+            for stellsym in stellsym_list:
+                s = get_surface(surfacetype, stellsym)
+                s.fit_to_curve(ma, 0.1)
+                iota = -0.3
+                for G in [None, 2.*np.pi*np.sum(np.abs(bs.coil_currents))*(4*np.pi*10**(-7)/(2 * np.pi))]:
+                    with self.subTest(surfacetype=surfacetype, stellsym=stellsym, optimize_G=G is not None):
+                        r, J, H = boozer_surface_residual(s, iota, G, bs, derivatives=2)
+                        r1, J1, rH = boozer_surface_residual(s, iota, G, bs, derivatives=2, contract_hessian=True)
+                        rH_dense = np.sum(r[:, None, None] * H, axis=0)
+                        np.testing.assert_allclose(rH, rH_dense, atol=1e-10 * np.max(np.abs(rH_dense)))
+
+    def test_boozer_penalty_constraints_operators(self):
+        """
+        Compare the matrix free gradient and Hessian of the scalarized constrained
+        optimization problem's objective with the dense ones.
+        """
+        for surfacetype in surfacetypes_list:
+            for stellsym in stellsym_list:
+                for optimize_G in [True, False]:
+                    with self.subTest(surfacetype=surfacetype, stellsym=stellsym, optimize_G=optimize_G):
+                        self.subtest_boozer_penalty_constraints_operators(surfacetype, stellsym, optimize_G)
+
+    def subtest_boozer_penalty_constraints_operators(self, surfacetype, stellsym, optimize_G=False):
+        np.random.seed(1)
+        coils, currents, ma = get_ncsx_data()
+        stellarator = CoilCollection(coils, currents, 3, True)
+
+        bs = BiotSavart(stellarator.coils, stellarator.currents)
+        bs_tf = BiotSavart(stellarator.coils, stellarator.currents)
+
+        s = get_surface(surfacetype, stellsym)
+        s.fit_to_curve(ma, 0.1)
+
+        tf = ToroidalFlux(s, bs_tf)
+
+        tf_target = 0.1
+        boozer_surface = BoozerSurface(bs, s, tf, tf_target)
+
+        iota = -0.3
+        x = np.concatenate((s.get_dofs(), [iota]))
+        if optimize_G:
+            x = np.concatenate((x, [2.*np.pi*np.sum(np.abs(bs.coil_currents))*(4*np.pi*10**(-7)/(2 * np.pi))]))
+        weight = 11.1232
+        f0, J0, H0 = boozer_surface.boozer_penalty_constraints(
+            x, derivatives=2, constraint_weight=weight, optimize_G=optimize_G)
+        f1, J1, H1 = boozer_surface.boozer_penalty_constraints_operators(
+            x, constraint_weight=weight, optimize_G=optimize_G)
+
+        h = np.random.uniform(size=x.shape)-0.5
+        assert np.abs(f0-f1) < 1e-12 * np.abs(f0)
+        np.testing.assert_allclose(J1, J0, rtol=1e-10, atol=1e-10 * np.linalg.norm(J0))
+        np.testing.assert_allclose(H1 @ h, H0 @ h, rtol=1e-10, atol=1e-10 * np.linalg.norm(H0 @ h))
+
+    def test_boozer_penalty_constraints_newton_krylov_gmres_failure(self):
+        """
+        If GMRES does not converge, the Newton-Krylov iteration stops without
+        applying the step.
+        """
+        coils, currents, ma = get_ncsx_data()
+        stellarator = CoilCollection(coils, currents, 3, True)
+        bs = BiotSavart(stellarator.coils, stellarator.currents)
+
+        s = get_surface("SurfaceXYZFourier", True)
+        s.fit_to_curve(ma, 0.1)
+        ar = Area(s)
+        boozer_surface = BoozerSurface(bs, s, ar, ar.J())
+        dofs = s.get_dofs().copy()
+
+        def failed_gmres(A, b, **kwargs):
+            return np.full(b.shape, np.nan), 1
+
+        with mock.patch("simsopt.geo.boozersurface.gmres", failed_gmres):
+            res = boozer_surface.minimize_boozer_penalty_constraints_newton_krylov(
+                tol=1e-9, maxiter=10, constraint_weight=100., iota=-0.3)
+        assert not res['success']
+        assert res['gmres_info'] == 1
+        assert res['iter'] == 0
+        assert np.array_equal(s.get_dofs(), dofs)
+        assert res['iota'] == -0.3
+
     def test_boozer_constrained_jacobian(self):
         """
         Taylor test to verify the Jacobian of the first order optimality conditions of the exactly
@@ -196,6 +286,79 @@ class BoozerSurfaceTests(unittest.TestCase):
             err_old = err
         print("################################################################################")
 
+    def test_boozer_exact_constraints_newton_reuse_factorization(self):
+        """
+        Recompute a Boozer surface after a change of the target label, as in a
+        coil optimization, reusing the factorization of the first solve.
+        """
+        np.random.seed(1)
+        coils, currents, ma = get_ncsx_data()
+        stellarator = CoilCollection(coils, currents, 3, True)
+        bs = BiotSavart(stellarator.coils, stellarator.currents)
+
+        s = get_surface("SurfaceXYZTensorFourier", True)
+        s.fit_to_curve(ma, 0.1)
+        ar = Area(s)
+        ar_target = ar.J()
+        boozer_surface = BoozerSurface(bs, s, ar, ar_target)
+        G = 2.*np.pi*np.sum(np.abs(bs.coil_currents))*(4*np.pi*10**(-7)/(2 * np.pi))
+
+        res = boozer_surface.minimize_boozer_penalty_constraints_LBFGS(
+            tol=1e-9, maxiter=500, constraint_weight=100., iota=-0.3, G=G)
+        res = boozer_surface.minimize_boozer_exact_constraints_newton(
+            tol=1e-9, maxiter=10, iota=res['iota'], G=res['G'], reuse_factorization=True)
+        assert res['success']
+        state = boozer_surface.newton_state
+        nfactorizations = state.nfactorizations
+
+        boozer_surface.targetlabel = 1.0001 * ar_target
+        res = boozer_surface.minimize_boozer_exact_constraints_newton(
+            tol=1e-9, maxiter=30, iota=res['iota'], G=res['G'], lm=[res['lm'], 0.], reuse_factorization=True)
+        assert res['success']
+        assert np.abs(ar.J() - 1.0001 * ar_target) < 1e-9
+        # the chord iterations need fewer factorizations than Newton iterations
+        assert state.nfactorizations - nfactorizations < res['iter']
+
+        # adjoint solves use the Jacobian at the solution (the surface is
+        # stellarator symmetric, so the last constraint is dropped)
+        xl = np.concatenate((s.get_dofs(), [res['iota'], res['G'], res['lm'], 0.]))
+        _, dres = boozer_surface.boozer_exact_constraints(xl, derivatives=1, optimize_G=True)
+        J = dres[:-1, :-1]
+        b = np.random.standard_normal(J.shape[0])
+        np.testing.assert_allclose(J.T @ state.solve_adjoint(b), b, atol=1e-6*np.linalg.norm(b))
+
+    def test_boozer_exact_constraints_newton_stale_factorization(self):
+        """
+        A stored factorization that doesn't fit the problem at all (here the
+        one of the negated Jacobian) must not push the Newton iteration away
+        from the solution.
+        """
+        np.random.seed(1)
+        coils, currents, ma = get_ncsx_data()
+        stellarator = CoilCollection(coils, currents, 3, True)
+        bs = BiotSavart(stellarator.coils, stellarator.currents)
+
+        s = get_surface("SurfaceXYZTensorFourier", True)
+        s.fit_to_curve(ma, 0.1)
+        ar = Area(s)
+        ar_target = ar.J()
+        boozer_surface = BoozerSurface(bs, s, ar, ar_target)
+        G = 2.*np.pi*np.sum(np.abs(bs.coil_currents))*(4*np.pi*10**(-7)/(2 * np.pi))
+
+        res = boozer_surface.minimize_boozer_penalty_constraints_LBFGS(
+            tol=1e-9, maxiter=500, constraint_weight=100., iota=-0.3, G=G)
+        res = boozer_surface.minimize_boozer_exact_constraints_newton(
+            tol=1e-9, maxiter=10, iota=res['iota'], G=res['G'], reuse_factorization=True)
+        assert res['success']
+        state = boozer_surface.newton_state
+        state.update(state.key, -state.matrix, state.matrix_x)
+
+        boozer_surface.targetlabel = 1.0001 * ar_target
+        res = boozer_surface.minimize_boozer_exact_constraints_newton(
+            tol=1e-9, maxiter=30, iota=res['iota'], G=res['G'], lm=[res['lm'], 0.], reuse_factorization=True)
+        assert res['success']
+        assert np.abs(ar.J() - 1.0001 * ar_target) < 1e-9
+
     def test_boozer_surface_optimisation_convergence(self):
         """
         Test to verify the various optimization algorithms that compute
@@ -206,6 +369,7 @@ class BoozerSurfaceTests(unittest.TestCase):
             ("SurfaceXYZTensorFourier", True, True, 'residual_exact'),  # noqa
             ("SurfaceXYZTensorFourier", True, True, 'newton_exact'),  # noqa
             ("SurfaceXYZTensorFourier", True, True, 'newton'),  # noqa
+            ("SurfaceXYZTensorFourier", True, True, 'newton_krylov'),  # noqa
             ("SurfaceXYZTensorFourier", False, True, 'ls'),  # noqa
             ("SurfaceXYZFourier", True, False, 'ls'),  # noqa
         ]
@@ -258,6 +422,9 @@ class BoozerSurfaceTests(unittest.TestCase):
         elif second_stage == 'newton':
             res = boozer_surface.minimize_boozer_penalty_constraints_newton(
                 tol=1e-9, maxiter=10, constraint_weight=100., iota=res['iota'], G=res['G'], stab=1e-4)
+        elif second_stage == 'newton_krylov':
+            res = boozer_surface.minimize_boozer_penalty_constraints_newton_krylov(
+                tol=1e-9, maxiter=10, constraint_weight=100., iota=res['iota'], G=res['G'], stab=1e-4)
         elif second_stage == 'newton_exact':
             res = boozer_surface.minimize_boozer_exact_constraints_newton(
                 tol=1e-9, maxiter=10, iota=res['iota'], G=res['G'])
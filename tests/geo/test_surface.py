@@ -8,7 +8,7 @@ from simsopt._core.optimizable import make_optimizable
 from simsopt.geo.surfacerzfourier import SurfaceRZFourier
 from simsopt.geo.surfacegarabedian import SurfaceGarabedian
 from simsopt.geo.surfacexyzfourier import SurfaceXYZFourier
-from simsopt.geo.surface import signed_distance_from_surface
+from simsopt.geo.surface import signed_distance_from_surface, surface_distance
 from simsopt.geo.curverzfourier import CurveRZFourier
 from .surface_test_helpers import get_surface, get_exact_surface
 
@@ -25,6 +25,69 @@ except ImportError:
 # logging.basicConfig(level=logging.DEBUG)
 
 
+def check_tensor_grid_evaluation(s):
+    """
+    Compare the evaluation of the surface on its tensor product grid of
+    quadrature points with the pointwise evaluation in ``gamma_lin``.
+    """
+    np.random.seed(1)
+    x0 = s.get_dofs()
+    s.set_dofs(x0 + 0.1 * (np.random.rand(len(x0)) - 0.5))
+    phis, thetas = np.meshgrid(s.quadpoints_phi, s.quadpoints_theta, indexing='ij')
+    gamma = np.zeros((phis.size, 3))
+    s.gamma_lin(gamma, phis.flatten(), thetas.flatten())
+    np.testing.assert_allclose(s.gamma().reshape((-1, 3)), gamma, atol=1e-13)
+
+    h = 1e-6
+    for dphi, dtheta, dash in [(h, 0, s.gammadash1()), (0, h, s.gammadash2())]:
+        gammap = np.zeros((phis.size, 3))
+        gammam = np.zeros((phis.size, 3))
+        s.gamma_lin(gammap, phis.flatten() + dphi, thetas.flatten() + dtheta)
+        s.gamma_lin(gammam, phis.flatten() - dphi, thetas.flatten() - dtheta)
+        np.testing.assert_allclose(dash.reshape((-1, 3)), (gammap - gammam) / (2 * h), atol=1e-7)
+
+    # the dcoeff tensors are linear in the dofs
+    for fun, dfun in [(s.gamma, s.dgamma_by_dcoeff), (s.gammadash1, s.dgammadash1_by_dcoeff),
+                      (s.gammadash2, s.dgammadash2_by_dcoeff)]:
+        np.testing.assert_allclose(dfun() @ s.get_dofs(), fun(), atol=1e-12)
+
+    # evaluation on points other than the quadrature points
+    qp_phi = np.linspace(0, 1, 5)
+    qp_theta = np.linspace(0, 1, 7)
+    gamma = np.zeros((5, 7, 3))
+    s.gamma_impl(gamma, qp_phi, qp_theta)
+    phis, thetas = np.meshgrid(qp_phi, qp_theta, indexing='ij')
+    gamma_lin = np.zeros((phis.size, 3))
+    s.gamma_lin(gamma_lin, phis.flatten(), thetas.flatten())
+    np.testing.assert_allclose(gamma.reshape((-1, 3)), gamma_lin, atol=1e-13)
+
+
+def check_dcoeff_products(s):
+    """
+    Compare the products with the derivatives of the surface with respect to
+    its dofs, which are computed without forming the derivatives, with the
+    products with the dense arrays.
+    """
+    np.random.seed(2)
+    ndofs = len(s.get_dofs())
+    v = np.random.standard_normal((ndofs, ))
+    w = np.random.standard_normal(s.gamma().shape)
+    for dfun, vjp, matvec in [
+            (s.dgamma_by_dcoeff, s.dgamma_by_dcoeff_vjp, s.dgamma_by_dcoeff_matvec),
+            (s.dgammadash1_by_dcoeff, s.dgammadash1_by_dcoeff_vjp, s.dgammadash1_by_dcoeff_matvec),
+            (s.dgammadash2_by_dcoeff, s.dgammadash2_by_dcoeff_vjp, s.dgammadash2_by_dcoeff_matvec)]:
+        np.testing.assert_allclose(vjp(w), np.einsum('ijk,ijkl->l', w, dfun()), atol=1e-11)
+        np.testing.assert_allclose(matvec(v), dfun() @ v, atol=1e-11)
+
+    np.testing.assert_allclose(s.dnormal_by_dcoeff_matvec(v), s.dnormal_by_dcoeff() @ v, atol=1e-11)
+    np.testing.assert_allclose(s.d2normal_by_dcoeffdcoeff_vjp(w),
+                               np.einsum('ijk,ijklm->lm', w, s.d2normal_by_dcoeffdcoeff()), atol=1e-11)
+    # area and volume hessians are assembled from these products
+    for d2fun in [s.d2area_by_dcoeffdcoeff, s.d2volume_by_dcoeffdcoeff]:
+        H = d2fun()
+        np.testing.assert_allclose(H, H.T, atol=1e-12)
+
+
 class SurfaceXYZFourierTests(unittest.TestCase):
     def test_toRZFourier_perfect_torus(self):
         """
@@ -282,6 +345,13 @@ class SurfaceXYZFourierTests(unittest.TestCase):
         print("AR rel error is:", rel_err)
         assert rel_err < 1e-5
 
+    def test_tensor_grid_evaluation(self):
+        for stellsym in stellsym_list:
+            s = SurfaceXYZFourier(nfp=3, stellsym=stellsym, mpol=3, ntor=2,
+                                  quadpoints_phi=9, quadpoints_theta=11)
+            check_tensor_grid_evaluation(s)
+            check_dcoeff_products(s)
+
     @unittest.skipIf(not pyevtk_found, "pyevtk not found")
     def test_to_vtk(self):
         mpol = 4
@@ -628,6 +698,22 @@ class SurfaceRZFourierTests(unittest.TestCase):
                     print('difference for surface test_derivatives:', jac - fd_jac)
                     np.testing.assert_allclose(jac, fd_jac, rtol=1e-4, atol=1e-4)
 
+    def test_tensor_grid_evaluation(self):
+        for stellsym in stellsym_list:
+            s = SurfaceRZFourier(nfp=3, stellsym=stellsym, mpol=3, ntor=2,
+                                 quadpoints_phi=9, quadpoints_theta=11)
+            s.set_rc(0, 0, 1.0)
+            check_tensor_grid_evaluation(s)
+            check_dcoeff_products(s)
+            # the tables of the Fourier modes follow a change of resolution
+            s.change_resolution(4, 3)
+            s.set_zs(4, 3, 0.01)
+            s.invalidate_cache()
+            phis, thetas = np.meshgrid(s.quadpoints_phi, s.quadpoints_theta, indexing='ij')
+            gamma = np.zeros((phis.size, 3))
+            s.gamma_lin(gamma, phis.flatten(), thetas.flatten())
+            np.testing.assert_allclose(s.gamma().reshape((-1, 3)), gamma, atol=1e-13)
+
     def test_change_resolution(self):
         """
         Check that we can change mpol and ntor.
@@ -743,6 +829,45 @@ class SurfaceDistanceTests(unittest.TestCase):
         d = signed_distance_from_surface(xyz, s)
         assert np.allclose(d, [-0.8, 0.2, -0.8])
 
+    def test_distance_is_exact(self):
+        # for a circular torus the distance is known in closed form
+        s = SurfaceRZFourier(nfp=2, mpol=1, ntor=1)
+        s.set_rc(0, 0, 1.0)
+        s.set_rc(1, 0, 0.2)
+        s.set_zs(1, 0, 0.2)
+        np.random.seed(1)
+        n = 1000
+        phis = 2*np.pi*np.random.uniform(size=n)
+        rs = 1 + 0.5*np.random.uniform(-1, 1, size=n)
+        zs = 0.5*np.random.uniform(-1, 1, size=n)
+        xyz = np.stack((rs*np.cos(phis), rs*np.sin(phis), zs), axis=1)
+        d = signed_distance_from_surface(xyz, s)
+        np.testing.assert_allclose(d, 0.2 - np.sqrt((rs-1)**2 + zs**2), atol=1e-12)
+
+        # for a rotating ellipse, compare with the closest point on a fine grid
+        s.set_rc(1, 1, 0.1)
+        s.set_zs(1, 1, -0.1)
+        sdist = surface_distance(s)
+        xyz = xyz[:200]
+        d = sdist.signed_distance(xyz)
+        params = sdist.closest_point(xyz)
+        gamma = np.zeros((len(xyz), 3))
+        s.gamma_lin(gamma, params[:, 0], params[:, 1])
+        np.testing.assert_allclose(np.linalg.norm(xyz-gamma, axis=1), np.abs(d), atol=1e-12)
+        fine = SurfaceRZFourier(nfp=2, mpol=1, ntor=1, quadpoints_phi=np.linspace(0, 1, 1000, endpoint=False),
+                                quadpoints_theta=np.linspace(0, 1, 200, endpoint=False))
+        fine.set_dofs(s.get_dofs())
+        gammas = fine.gamma().reshape((-1, 3))
+        dmin = np.asarray([np.min(np.linalg.norm(gammas - x, axis=1)) for x in xyz])
+        assert np.all(np.abs(d) <= dmin + 1e-12)
+        assert np.all(dmin - np.abs(d) < 1e-3)
+        # the sign agrees with the classifier based on the tangent planes at the closest grid points
+        idx = np.asarray([np.argmin(np.linalg.norm(gammas - x, axis=1)) for x in xyz])
+        normals = fine.unitnormal().reshape((-1, 3))[idx]
+        inside = np.sum((gammas[idx] - xyz) * normals, axis=1) * np.sign(fine.volume()) > 0
+        far = dmin > 1e-2
+        assert np.all((d[far] > 0) == inside[far])
+
 
 if __name__ == "__main__":
     unittest.main()